@@ -0,0 +1,239 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import yaml
+import click
+import tempfile
+import tracemalloc
+import pkg_resources
+from contextlib import contextmanager, redirect_stdout
+
+from Xclusion_criteria import __version__
+from Xclusion_criteria.xclusion_trace import get_peak_rss
+from Xclusion_criteria.benchmarks.bench_pipeline import (
+    STAGES,
+    run_stages,
+    get_dataset,
+    read_results,
+    compare_results,
+    show_regressions
+)
+from Xclusion_criteria.benchmarks.synthetic_metadata import (
+    write_metadata,
+    write_criteria,
+    write_plot_groups
+)
+
+BENCHMARKS = pkg_resources.resource_filename(
+    'Xclusion_criteria', 'benchmarks')
+
+# standard synthetic datasets: (samples, variables)
+DATASETS = {
+    'small': (10000, 50),
+    'tall': (100000, 50),
+    'wide': (10000, 1000)
+}
+
+
+def get_memory_hook(memory: dict):
+    """Get a context manager that measures the memory of a stage.
+
+    Parameters
+    ----------
+    memory : dict
+        To fill with, for each stage:
+            peak        = peak of the memory allocated during the stage.
+            retained    = memory allocated during the stage, still in use.
+            peak_rss    = increase of the peak resident set size.
+
+    Returns
+    -------
+    memory_hook : callable
+        Context manager factory called with the stage name.
+    """
+    @contextmanager
+    def memory_hook(stage: str):
+        rss_start = get_peak_rss()
+        # only the allocations made during the stage are traced
+        tracemalloc.start()
+        try:
+            yield
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        rss_end = get_peak_rss()
+        memory[stage] = {
+            'peak': peak,
+            'retained': retained,
+            'peak_rss': None if rss_start is None else int(
+                (rss_end - rss_start) * 1024 ** 2)
+        }
+    return memory_hook
+
+
+def get_bytes_per_sample(memory: dict, n_samples: int) -> dict:
+    """Get the memory of each stage per sample of the metadata.
+
+    Parameters
+    ----------
+    memory : dict
+        Peak, retained and peak RSS memory (bytes) per stage.
+    n_samples : int
+        Number of samples in the metadata.
+
+    Returns
+    -------
+    bytes_per_sample : dict
+        Key     = stage.
+        Value   = Key: measure, Value: bytes per sample.
+    """
+    bytes_per_sample = {}
+    for stage, measures in memory.items():
+        bytes_per_sample[stage] = dict(
+            (measure, None if value is None else round(value / n_samples, 2))
+            for measure, value in measures.items())
+    return bytes_per_sample
+
+
+def read_budgets(i_budgets: str) -> dict:
+    """Read the maximum peak memory allowed per stage.
+
+    Parameters
+    ----------
+    i_budgets : str
+        Path to the yaml file of the budgets, e.g.:
+            small:
+              read_meta_pd: 2000
+            default:
+              apply_criteria: 500
+        in bytes per sample, per dataset (or "default" for all datasets).
+
+    Returns
+    -------
+    budgets : dict
+        Key     = dataset name (or "default").
+        Value   = Key: stage, Value: bytes per sample.
+    """
+    with open(i_budgets) as handle:
+        budgets = yaml.load(handle, Loader=yaml.FullLoader)
+    return budgets or {}
+
+
+def check_budgets(dataset: str, bytes_per_sample: dict,
+                  budgets: dict) -> list:
+    """Get the stages which peak memory exceeds the budget.
+
+    Parameters
+    ----------
+    dataset : str
+        Dataset name.
+    bytes_per_sample : dict
+        Memory of each stage per sample.
+    budgets : dict
+        Maximum peak bytes per sample, per dataset and stage.
+
+    Returns
+    -------
+    exceeded : list
+        (dataset, stage, peak bytes per sample, budget).
+    """
+    exceeded = []
+    dataset_budgets = dict(budgets.get('default', {}))
+    dataset_budgets.update(budgets.get(dataset, {}))
+    for stage, budget in dataset_budgets.items():
+        if stage not in bytes_per_sample:
+            continue
+        peak = bytes_per_sample[stage]['peak']
+        if peak > budget:
+            exceeded.append((dataset, stage, peak, budget))
+    return exceeded
+
+
+@click.command()
+@click.option(
+    "-d", "--p-datasets", multiple=True, default=['small'],
+    type=click.Choice(list(DATASETS)), show_default=True,
+    help="Standard synthetic datasets (%s)." % ', '.join(
+        '%s: %s samples x %s variables' % (x, y[0], y[1])
+        for x, y in DATASETS.items()))
+@click.option(
+    "--p-random", type=int, default=1000, show_default=True,
+    help="Number of random samples for the visualization.")
+@click.option(
+    "-b", "--i-budgets", default='%s/memory_budgets.yml' % BENCHMARKS,
+    show_default=True,
+    help="Maximum peak bytes per sample, per dataset and stage (yaml).")
+@click.option(
+    "-o", "--o-results", default='xclusion_memory.json',
+    show_default=True, help="Memory results (json) for all versions.")
+@click.option(
+    "-l", "--p-label", default=__version__, show_default=True,
+    help="Version (or label) under which the results are stored.")
+@click.option(
+    "--compare-to", default=None,
+    help="Version (or label) to compare the peak memory to.")
+@click.option(
+    "--p-threshold", type=float, default=1.2, show_default=True,
+    help="Peak memory ratio above which a stage is a regression.")
+def bench_memory(p_datasets, p_random, i_budgets, o_results,
+                 p_label, compare_to, p_threshold):
+    """Measure the peak memory of each stage of the pipeline on
+    standard synthetic metadata tables."""
+    budgets = read_budgets(i_budgets) if i_budgets else {}
+    results = read_results(o_results)
+    version_results = results.setdefault(p_label, {})
+    exceeded = []
+    with tempfile.TemporaryDirectory() as tmp:
+        i_criteria = '%s/criteria.yml' % tmp
+        i_plot_groups = '%s/plot.yml' % tmp
+        write_criteria(i_criteria)
+        write_plot_groups(i_plot_groups)
+        for p_dataset in p_datasets:
+            n_samples, n_columns = DATASETS[p_dataset]
+            print('- %s (%s)...' % (p_dataset, get_dataset(
+                n_samples, n_columns, 0.3, 0.5)), end=' ')
+            m_metadata_file = '%s/%s.tsv' % (tmp, p_dataset)
+            write_metadata(m_metadata_file, n_samples, n_columns)
+            memory = {}
+            with open(os.devnull, 'w') as null, redirect_stdout(null):
+                run_stages(m_metadata_file, i_criteria, i_plot_groups,
+                           tmp, p_random, get_memory_hook(memory))
+            os.remove(m_metadata_file)
+            bytes_per_sample = get_bytes_per_sample(memory, n_samples)
+            version_results[p_dataset] = dict(
+                (stage, bytes_per_sample[stage]['peak']) for stage in STAGES)
+            print('Done.')
+            print('  stage\tpeak\tretained\tpeak_rss (bytes per sample)')
+            for stage in STAGES:
+                print('  %s\t%s\t%s\t%s' % (
+                    stage, bytes_per_sample[stage]['peak'],
+                    bytes_per_sample[stage]['retained'],
+                    bytes_per_sample[stage]['peak_rss']))
+            exceeded.extend(check_budgets(
+                p_dataset, bytes_per_sample, budgets))
+    with open(o_results, 'w') as o:
+        json.dump(results, o, indent=1)
+    regressions = []
+    if compare_to:
+        regressions = compare_results(
+            results, p_label, compare_to, p_threshold)
+        show_regressions(regressions, p_label, compare_to, 'bytes/sample')
+    if exceeded:
+        print('Memory budgets exceeded:')
+        for dataset, stage, peak, budget in exceeded:
+            print('  %s\t%s\t%s > %s bytes per sample' % (
+                dataset, stage, peak, budget))
+    if exceeded or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    bench_memory()
@@ -0,0 +1,294 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import click
+import tempfile
+import pkg_resources
+from os.path import isfile
+from contextlib import redirect_stdout
+
+from Xclusion_criteria import __version__
+from Xclusion_criteria.xclusion_io import read_meta_pd, parse_plot_groups
+from Xclusion_criteria.xclusion_dtypes import get_dtypes, split_variables_types
+from Xclusion_criteria.xclusion_crits import get_criteria, apply_criteria
+from Xclusion_criteria.xclusion_factors import get_md_factors
+from Xclusion_criteria.xclusion_plot import (
+    get_included_num,
+    get_included_us,
+    make_user_chart
+)
+from Xclusion_criteria.benchmarks.synthetic_metadata import (
+    write_metadata,
+    write_criteria,
+    write_plot_groups
+)
+
+RESOURCES = pkg_resources.resource_filename('Xclusion_criteria', 'resources')
+
+STAGES = ['read_meta_pd', 'get_dtypes', 'get_criteria', 'apply_criteria',
+          'write_included', 'write_excluded', 'get_included_us',
+          'make_user_chart']
+
+
+def run_stages(m_metadata_file: str, i_criteria: str, i_plot_groups: str,
+               o_dir: str, p_random: int, stage_hook=None,
+               arrow: bool = False) -> dict:
+    """Run every stage of the pipeline once on a metadata table.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    i_plot_groups : str
+        Path to yml config file for the different groups to visualize.
+    o_dir : str
+        Folder for the outputs of the pipeline.
+    p_random : int
+        Number of random samples for the visualization.
+    stage_hook : callable
+        Context manager factory called with each stage name, to measure it.
+    arrow : bool
+        Whether to check the dtypes using Arrow kernels.
+
+    Returns
+    -------
+    timings : dict
+        Key     = stage.
+        Value   = wall time (seconds).
+    """
+    timings = {}
+    nulls = [x.strip() for x in open('%s/nulls.txt' % RESOURCES).readlines()]
+    messages = []
+
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        if stage_hook is None:
+            out = func(*args)
+        else:
+            with stage_hook(name):
+                out = func(*args)
+        timings[name] = time.perf_counter() - start
+        return out
+
+    metadata = stage('read_meta_pd', read_meta_pd, m_metadata_file)
+    dtypes = stage('get_dtypes', get_dtypes, metadata, nulls, arrow)
+    numerical, categorical = [], []
+    split_variables_types(dtypes, numerical, categorical)
+    md_factors = get_md_factors(metadata)
+    criteria = stage('get_criteria', get_criteria, i_criteria,
+                     metadata, nulls, messages, md_factors)
+    flowcharts, included = stage('apply_criteria', apply_criteria, metadata,
+                                 criteria, numerical, messages, md_factors)
+
+    def write_included():
+        included.reset_index().to_csv(
+            '%s/included.tsv' % o_dir, index=False, sep='\t')
+
+    def write_excluded():
+        excluded = metadata.loc[
+            [x for x in metadata.index if x not in included.index], :].copy()
+        excluded.reset_index().to_csv(
+            '%s/excluded.tsv' % o_dir, index=False, sep='\t')
+
+    stage('write_included', write_included)
+    stage('write_excluded', write_excluded)
+
+    plot_groups = parse_plot_groups(i_plot_groups)
+    included_num = get_included_num(
+        'numerical', [x for x in numerical if x in included.columns],
+        included, plot_groups)
+    included_cat = get_included_num(
+        'categorical', [x for x in categorical if x in included.columns],
+        included, plot_groups)
+
+    def get_melted():
+        get_included_us('numerical', included_num)
+        get_included_us('categorical', included_cat)
+
+    stage('get_included_us', get_melted)
+    stage('make_user_chart', make_user_chart, included_num, included_cat,
+          flowcharts, '%s/visualization.html' % o_dir, p_random)
+    return timings
+
+
+def get_dataset(n_samples: int, n_columns: int,
+                p_numerical: float, p_nulls: float) -> str:
+    """Get the name of a synthetic dataset.
+
+    Returns
+    -------
+    dataset : str
+        e.g. "10000s_50c_0.3num_0.5nulls".
+    """
+    return '%ss_%sc_%snum_%snulls' % (n_samples, n_columns,
+                                      p_numerical, p_nulls)
+
+
+def read_results(o_results: str) -> dict:
+    """Read the benchmark results of the previous versions.
+
+    Parameters
+    ----------
+    o_results : str
+        Path to the benchmark results json file.
+
+    Returns
+    -------
+    results : dict
+        Key     = version (or label).
+        Value   = Key: dataset, Value: Key: stage, Value: measure.
+    """
+    results = {}
+    if isfile(o_results):
+        with open(o_results) as handle:
+            results = json.load(handle)
+    return results
+
+
+def compare_results(results: dict, version: str, reference: str,
+                    threshold: float) -> list:
+    """Compare the measures of two versions for the datasets they share.
+
+    Parameters
+    ----------
+    results : dict
+        Benchmark results per version.
+    version : str
+        Version that is compared.
+    reference : str
+        Version compared to.
+    threshold : float
+        Ratio above which a measure is a regression (e.g. 1.2 for +20%).
+
+    Returns
+    -------
+    regressions : list
+        (dataset, stage, reference measure, measure, ratio).
+    """
+    regressions = []
+    for dataset, stages in results.get(version, {}).items():
+        ref_stages = results.get(reference, {}).get(dataset, {})
+        for stage, measure in stages.items():
+            ref_measure = ref_stages.get(stage)
+            if not ref_measure or measure is None:
+                continue
+            ratio = measure / ref_measure
+            if ratio > threshold:
+                regressions.append(
+                    (dataset, stage, ref_measure, measure, ratio))
+    return regressions
+
+
+def show_regressions(regressions: list, version: str,
+                     reference: str, unit: str) -> None:
+    """Print the measures that regressed compared to a reference version.
+
+    Parameters
+    ----------
+    regressions : list
+        (dataset, stage, reference measure, measure, ratio).
+    version : str
+        Version that is compared.
+    reference : str
+        Version compared to.
+    unit : str
+        Unit of the measures.
+    """
+    if not regressions:
+        print('No regression compared to %s' % reference)
+        return
+    print('Regressions of %s compared to %s:' % (version, reference))
+    for dataset, stage, ref_measure, measure, ratio in regressions:
+        print('  %s\t%s\t%.4g -> %.4g %s (x%.2f)' % (
+            dataset, stage, ref_measure, measure, unit, ratio))
+
+
+@click.command()
+@click.option(
+    "-n", "--n-samples", multiple=True, type=int, default=[10000],
+    show_default=True, help="Number of samples (from 10k to 10M).")
+@click.option(
+    "-c", "--n-columns", multiple=True, type=int, default=[50],
+    show_default=True, help="Number of metadata variables (from 50 to 20k).")
+@click.option(
+    "--p-numerical", type=float, default=0.3, show_default=True,
+    help="Fraction of numerical variables (the rest is categorical).")
+@click.option(
+    "--p-nulls", type=float, default=0.5, show_default=True,
+    help="Fraction of variables polluted with null values.")
+@click.option(
+    "-r", "--p-repeats", type=int, default=3, show_default=True,
+    help="Number of runs per dataset (the fastest is kept).")
+@click.option(
+    "--p-random", type=int, default=1000, show_default=True,
+    help="Number of random samples for the visualization.")
+@click.option(
+    "--arrow/--no-arrow", default=False, show_default=True,
+    help="Check the dtypes using Arrow kernels.")
+@click.option(
+    "-o", "--o-results", default='xclusion_benchmarks.json',
+    show_default=True, help="Benchmark results (json) for all versions.")
+@click.option(
+    "-l", "--p-label", default=__version__, show_default=True,
+    help="Version (or label) under which the results are stored.")
+@click.option(
+    "--compare-to", default=None,
+    help="Version (or label) to compare the timings to.")
+@click.option(
+    "--p-threshold", type=float, default=1.2, show_default=True,
+    help="Timing ratio above which a stage is a regression.")
+def bench_pipeline(n_samples, n_columns, p_numerical, p_nulls, p_repeats,
+                   p_random, arrow, o_results, p_label, compare_to,
+                   p_threshold):
+    """Time each stage of the pipeline on synthetic metadata tables."""
+    results = read_results(o_results)
+    version_results = results.setdefault(p_label, {})
+    with tempfile.TemporaryDirectory() as tmp:
+        i_criteria = '%s/criteria.yml' % tmp
+        i_plot_groups = '%s/plot.yml' % tmp
+        write_criteria(i_criteria)
+        write_plot_groups(i_plot_groups)
+        for n_sample in n_samples:
+            for n_column in n_columns:
+                dataset = get_dataset(n_sample, n_column, p_numerical, p_nulls)
+                print('- %s...' % dataset, end=' ')
+                m_metadata_file = '%s/%s.tsv' % (tmp, dataset)
+                write_metadata(m_metadata_file, n_sample, n_column,
+                               p_numerical, p_nulls)
+                timings = {}
+                for _ in range(p_repeats):
+                    with open(os.devnull, 'w') as null, redirect_stdout(null):
+                        cur_timings = run_stages(
+                            m_metadata_file, i_criteria,
+                            i_plot_groups, tmp, p_random, arrow=arrow)
+                    for stage, seconds in cur_timings.items():
+                        timings[stage] = min(timings.get(stage, seconds),
+                                             seconds)
+                os.remove(m_metadata_file)
+                version_results[dataset] = timings
+                print('Done.')
+                for stage in STAGES:
+                    print('  %s\t%.4f s' % (stage, timings[stage]))
+    with open(o_results, 'w') as o:
+        json.dump(results, o, indent=1)
+    if compare_to:
+        regressions = compare_results(
+            results, p_label, compare_to, p_threshold)
+        show_regressions(regressions, p_label, compare_to, 's')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    bench_pipeline()
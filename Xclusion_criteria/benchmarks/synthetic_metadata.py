@@ -0,0 +1,224 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import yaml
+import numpy as np
+import pandas as pd
+
+# null values as listed in resources/nulls.txt
+NULLS = ['not provided', 'not applicable', 'unspecified',
+         'missing', 'unknown']
+
+# American Gut-like variables used by the benchmark criteria and plots
+AG_CATEGORICAL = {
+    'age_cat': ['baby', 'child', 'teen', '20s', '30s',
+                '40s', '50s', '60s', '70+'],
+    'bmi_cat': ['Underweight', 'Normal', 'Overweight', 'Obese'],
+    'sex': ['female', 'male', 'other'],
+    'country': ['USA', 'United Kingdom', 'Australia', 'Canada', 'Germany'],
+    'antibiotic_history': [
+        'I have not taken antibiotics in the past year.', 'Year',
+        '6 months', 'Month', 'Week'],
+    'ibd': ['I do not have this condition',
+            'Diagnosed by a medical professional (doctor, physician '
+            'assistant)', 'Self-diagnosed'],
+    'alcohol_consumption': ['Yes', 'No'],
+    'alcohol_types_red_wine': ['Yes', 'No'],
+    'diet_type': ['Omnivore', 'Vegetarian', 'Vegan',
+                  'Omnivore but do not eat red meat']
+}
+AG_NUMERICAL = {
+    'age_years': (5., 90.),
+    'bmi': (15., 45.)
+}
+
+
+def get_columns(n_columns: int, p_numerical: float, p_nulls: float,
+                seed: int = 0) -> list:
+    """Get the name and type of the synthetic metadata variables.
+
+    Parameters
+    ----------
+    n_columns : int
+        Number of metadata variables (at least the American Gut-like ones).
+    p_numerical : float
+        Fraction of numerical variables (the rest is categorical).
+    p_nulls : float
+        Fraction of variables polluted with null values.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    columns : list
+        (variable, "numerical" or "categorical", whether null-polluted).
+    """
+    rng = np.random.default_rng(seed)
+    columns = [('host_subject_id', 'host', False)]
+    columns.extend((x, 'numerical', True) for x in AG_NUMERICAL)
+    columns.extend((x, 'categorical', True) for x in AG_CATEGORICAL)
+    n_other = max(0, n_columns - len(columns))
+    numericals = rng.random(n_other) < p_numerical
+    nulls = rng.random(n_other) < p_nulls
+    for idx in range(n_other):
+        if numericals[idx]:
+            columns.append(('num_%s' % idx, 'numerical', bool(nulls[idx])))
+        else:
+            columns.append(('cat_%s' % idx, 'categorical', bool(nulls[idx])))
+    return columns
+
+
+def make_column(column: tuple, n_rows: int,
+                rng: np.random.Generator) -> np.ndarray:
+    """Draw the values of a synthetic metadata variable.
+
+    Parameters
+    ----------
+    column : tuple
+        (variable, "numerical" or "categorical", whether null-polluted).
+    n_rows : int
+        Number of samples.
+    rng : np.random.Generator
+        Random numbers generator.
+
+    Returns
+    -------
+    values : np.ndarray
+        Values of the variable for each sample.
+    """
+    var, var_type, nulls = column
+    if var_type == 'host':
+        return np.char.add('host.', rng.integers(
+            0, max(1, n_rows // 2), n_rows).astype(str))
+    if var_type == 'numerical':
+        low, high = AG_NUMERICAL.get(var, (0., 1000.))
+        values = np.round(rng.uniform(low, high, n_rows), 2)
+    else:
+        factors = AG_CATEGORICAL.get(var)
+        if factors is None:
+            # cardinality from binary to free text-like variables
+            n_factors = int(2 ** rng.integers(1, 10))
+            factors = ['%s_%s' % (var, x) for x in range(n_factors)]
+        values = np.array(factors, dtype=object)[
+            rng.integers(0, len(factors), n_rows)]
+    if nulls:
+        values = values.astype(object)
+        is_null = rng.random(n_rows) < rng.uniform(0.01, 0.3)
+        values[is_null] = np.array(NULLS, dtype=object)[
+            rng.integers(0, len(NULLS), int(is_null.sum()))]
+    return values
+
+
+def make_metadata(n_samples: int, n_columns: int, p_numerical: float = 0.3,
+                  p_nulls: float = 0.5, seed: int = 0,
+                  start: int = 0) -> pd.DataFrame:
+    """Make an American Gut-like metadata table.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples (rows).
+    n_columns : int
+        Number of metadata variables (columns).
+    p_numerical : float
+        Fraction of numerical variables (the rest is categorical).
+    p_nulls : float
+        Fraction of variables polluted with null values.
+    seed : int
+        Random seed.
+    start : int
+        Number of the first sample (to write the table in chunks).
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Metadata table.
+    """
+    columns = get_columns(n_columns, p_numerical, p_nulls, seed)
+    rng = np.random.default_rng([seed, start])
+    metadata = pd.DataFrame(dict(
+        (column[0], make_column(column, n_samples, rng)) for column in columns
+    ), index=pd.Index(['10317.%s' % x for x in range(
+        start, start + n_samples)], name='sample_name'))
+    return metadata
+
+
+def write_metadata(o_metadata: str, n_samples: int, n_columns: int,
+                   p_numerical: float = 0.3, p_nulls: float = 0.5,
+                   seed: int = 0, chunk_size: int = 100000) -> None:
+    """Write an American Gut-like metadata table by chunks of
+    samples, so that the table never has to fit in memory.
+
+    Parameters
+    ----------
+    o_metadata : str
+        Path to the output metadata table.
+    n_samples : int
+        Number of samples (rows).
+    n_columns : int
+        Number of metadata variables (columns).
+    p_numerical : float
+        Fraction of numerical variables (the rest is categorical).
+    p_nulls : float
+        Fraction of variables polluted with null values.
+    seed : int
+        Random seed.
+    chunk_size : int
+        Number of samples generated at once.
+    """
+    # keep the chunks under ~10M cells for the wide tables
+    chunk_size = max(1, min(chunk_size, 10000000 // max(1, n_columns)))
+    for start in range(0, n_samples, chunk_size):
+        chunk = make_metadata(min(chunk_size, n_samples - start), n_columns,
+                              p_numerical, p_nulls, seed, start)
+        chunk.to_csv(o_metadata, sep='\t', mode='a' if start else 'w',
+                     header=not start)
+
+
+def write_criteria(o_criteria: str) -> None:
+    """Write the criteria applied on the American Gut-like variables.
+
+    Parameters
+    ----------
+    o_criteria : str
+        Path to the output criteria yaml file.
+    """
+    criteria = {
+        'init': {
+            'antibiotic_history,1': [
+                'I have not taken antibiotics in the past year.', 'Year'],
+            'ibd,1': ['I do not have this condition'],
+            'age_cat,0': ['NULLS', 'baby', 'child', 'teen'],
+            'age_years,2': [[18, 70]]
+        },
+        'add': {
+            'alcohol_consumption,1': ['No']
+        },
+        'filter': {
+            'alcohol_types_red_wine,1': ['Yes']
+        },
+        'no_nan': ['bmi']
+    }
+    with open(o_criteria, 'w') as o:
+        yaml.dump(criteria, o, default_flow_style=False, sort_keys=False)
+
+
+def write_plot_groups(o_plot_groups: str) -> None:
+    """Write the plotted American Gut-like variables.
+
+    Parameters
+    ----------
+    o_plot_groups : str
+        Path to the output plot groups yaml file.
+    """
+    plot_groups = {
+        'numerical': list(AG_NUMERICAL),
+        'categorical': ['age_cat', 'bmi_cat', 'sex', 'country', 'diet_type']
+    }
+    with open(o_plot_groups, 'w') as o:
+        yaml.dump(plot_groups, o, default_flow_style=False, sort_keys=False)
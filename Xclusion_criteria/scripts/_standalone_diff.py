@@ -0,0 +1,56 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import click
+
+from Xclusion_criteria.xclusion_diff import xclusion_diff
+from Xclusion_criteria import __version__
+
+
+@click.command()
+@click.option(
+    "-a", "--i-run-a", required=True,
+    help="State file (--p-state) or metadata of the included samples (-in) "
+         "of the first run."
+)
+@click.option(
+    "-b", "--i-run-b", required=True,
+    help="State file (--p-state) or metadata of the included samples (-in) "
+         "of the second run."
+)
+@click.option(
+    "-o", "--o-samples-diff", required=True,
+    help="Output table of the samples added to or removed from the included "
+         "samples, with the first criterion they fail in each run (if the "
+         "runs are state files)."
+)
+@click.option(
+    "-f", "--o-flowcharts-diff", required=False, default=None,
+    help="Output table of the samples counts of each step in both runs and "
+         "their difference (needs the state files)."
+)
+@click.version_option(__version__, prog_name="Xclusion_criteria")
+
+
+def standalone_diff(
+        i_run_a,
+        i_run_b,
+        o_samples_diff,
+        o_flowcharts_diff
+):
+
+    xclusion_diff(
+        i_run_a,
+        i_run_b,
+        o_samples_diff,
+        o_flowcharts_diff
+    )
+
+
+if __name__ == "__main__":
+    standalone_diff()
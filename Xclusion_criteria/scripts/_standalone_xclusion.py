@@ -14,9 +14,20 @@ from Xclusion_criteria import __version__
 
 @click.command()
 @click.option(
-    "-m", "--m-metadata-file", required=True,
+    "-m", "--m-metadata-file", required=False, default=None,
     help="Metadata file on which to apply included/exclusion criteria."
 )
+@click.option(
+    "-d", "--m-database", required=False, default=None,
+    help="SQLite (or DuckDB, if '.duckdb' extension) database file with "
+         "the metadata table, instead of '-m' (criteria applied in the "
+         "database)."
+)
+@click.option(
+    "--p-table", required=False, default='metadata', show_default=True,
+    help="[if -d] Name of the metadata table in the database (first "
+         "column: sample names)."
+)
 @click.option(
     "-c", "--i-criteria", required=True,
     help="Must be a yaml file (see README or 'examples/criteria_nonempty_output.yml')."
@@ -26,8 +37,9 @@ from Xclusion_criteria import __version__
     help="Must be a yaml file (see README or 'examples/plot.yml')."
 )
 @click.option(
-    "-in", "--o-included", required=True,
-    help="Output metadata for the included samples only."
+    "-in", "--o-included", required=False, default=None,
+    help="Output metadata for the included samples only (required, "
+         "unless --estimate)."
 )
 @click.option(
     "-ex", "--o-excluded", required=False, default=None, show_default=True,
@@ -82,11 +94,118 @@ from Xclusion_criteria import __version__
     help="[if --fetch] Add the number of samples in the final biom file name before "
          "extension (e.g. for '-b out.biom' it becomes 'out_1000s.biom')."
 )
+@click.option(
+    "-t", "--o-trace", "--trace", required=False, default=None,
+    help="Output JSON file with the time, CPU, peak memory and rows/columns "
+         "counts of each phase and criterion (Chrome trace format)."
+)
+@click.option(
+    "--arrow/--no-arrow", default=False, show_default=True,
+    help="Check the dtypes of the metadata variables using Arrow kernels "
+         "(needs pyarrow)."
+)
+@click.option(
+    "-n", "--p-shards", default=1, show_default=True, type=int,
+    help="[if -m] Number of row shards of the metadata on which the "
+         "criteria are applied in parallel processes."
+)
+@click.option(
+    "--p-cache-dir", required=False, default=None,
+    help="Folder of the run cache: the outputs are restored from it when "
+         "the metadata, criteria, plot groups, options and version are "
+         "unchanged (not used with --fetch or --p-state)."
+)
+@click.option(
+    "--p-cache-days", default=30, show_default=True, type=float,
+    help="[if --p-cache-dir] Number of days after which an unused cache "
+         "entry is removed."
+)
+@click.option(
+    "--p-cache-size", default=1024, show_default=True, type=float,
+    help="[if --p-cache-dir] Maximum size of the cache (in megabytes), "
+         "above which the least recently used entries are removed."
+)
+@click.option(
+    "--force/--no-force", default=False, show_default=True,
+    help="[if --p-cache-dir] Run even if the outputs are in the cache "
+         "(and replace them)."
+)
+@click.option(
+    "--p-state", required=False, default=None,
+    help="[if -m] State file of the last run: if the metadata only has new "
+         "rows appended since this run, the criteria are applied on these "
+         "rows only and they are appended to the outputs (full run and new "
+         "state otherwise, e.g. if the criteria or the columns changed)."
+)
+@click.option(
+    "--o-sensitivity", "--sensitivity", required=False, default=None,
+    help="[if -m] Output table of the number of samples kept by each "
+         "criterion alone, and of the included samples if the criterion "
+         "was dropped (leave-one-out)."
+)
+@click.option(
+    "--o-overlaps", required=False, default=None,
+    help="[if -m] Output table of the number of samples per pattern of "
+         "failed criteria, across all steps (Parquet if '.parquet' "
+         "extension, needs pyarrow)."
+)
+@click.option(
+    "--overlaps-panel/--no-overlaps-panel", default=False, show_default=True,
+    help="[if --o-overlaps] Show the most frequent patterns of failed "
+         "criteria below the flowchart in the visualization."
+)
+@click.option(
+    "--stratify-by", "stratify_by", multiple=True, required=False,
+    help="[if -m] Metadata variable for which to count the samples of each "
+         "step of the flowchart per stratum (per value of the variable), "
+         "written next to the -in table and drawn as one line per stratum "
+         "(can be used multiple times)."
+)
+@click.option(
+    "--p-catalog", required=False, default=None,
+    help="[if -m] Statistics catalog of the metadata columns (value "
+         "frequencies, quantiles and missing values), made by a run if the "
+         "metadata changed since, and used to estimate the samples counts "
+         "(their accuracy is shown after the run)."
+)
+@click.option(
+    "--estimate", is_flag=True, default=False,
+    help="[if --p-catalog] Only estimate the samples counts of each step "
+         "from the catalog, without reading the metadata table."
+)
+@click.option(
+    "--approx", required=False, default=None,
+    type=click.FloatRange(0, 1, min_open=True), metavar='FRACTION',
+    help="[if -m] Apply the criteria on a random sample of this fraction "
+         "of the metadata rows (streamed from the file), and estimate the "
+         "samples counts with 95% confidence intervals (the outputs are "
+         "marked with '_approx<FRACTION>')."
+)
+@click.option(
+    "--o-no-nan-plan", required=False, default=None,
+    help="[if -m] Output table of the \"no_nan\" lists of candidate "
+         "variables that retain the most samples, for each number of "
+         "variables (given the other criteria)."
+)
+@click.option(
+    "--p-no-nan-target", required=False, default=None, type=int,
+    help="[if --o-no-nan-plan] Number of included samples to retain: "
+         "suggest the longest \"no_nan\" list retaining at least as many."
+)
+@click.option(
+    "--p-no-nan-candidates", "no_nan_candidates", multiple=True,
+    required=False,
+    help="[if --o-no-nan-plan] Candidate variable for the \"no_nan\" list "
+         "(can be used multiple times) [default: all the variables missing "
+         "for some samples]."
+)
 @click.version_option(__version__, prog_name="Xclusion_criteria")
 
 
 def standalone_xclusion(
         m_metadata_file,
+        m_database,
+        p_table,
         i_criteria,
         i_plot_groups,
         o_included,
@@ -101,9 +220,38 @@ def standalone_xclusion(
         p_reads_filter,
         unique,
         update,
-        dim
+        dim,
+        o_trace,
+        arrow,
+        p_shards,
+        p_cache_dir,
+        p_cache_days,
+        p_cache_size,
+        force,
+        p_state,
+        o_sensitivity,
+        o_overlaps,
+        overlaps_panel,
+        stratify_by,
+        p_catalog,
+        estimate,
+        approx,
+        o_no_nan_plan,
+        p_no_nan_target,
+        no_nan_candidates
 ):
 
+    if not m_metadata_file and not m_database:
+        raise click.UsageError(
+            'A metadata file (-m) or a database file (-d) is required.')
+    if estimate and (not p_catalog or not m_metadata_file):
+        raise click.UsageError(
+            'The estimate (--estimate) needs a catalog (--p-catalog) of the '
+            'metadata file (-m).')
+    if not o_included and not estimate:
+        raise click.UsageError(
+            'An output for the included samples (-in) is required.')
+
     xclusion_criteria(
         m_metadata_file,
         i_criteria,
@@ -120,7 +268,27 @@ def standalone_xclusion(
         p_reads_filter,
         unique,
         update,
-        dim
+        dim,
+        o_trace,
+        m_database,
+        p_table,
+        arrow,
+        p_shards,
+        p_cache_dir,
+        p_cache_days,
+        p_cache_size,
+        force,
+        p_state,
+        o_sensitivity,
+        o_overlaps,
+        overlaps_panel,
+        stratify_by,
+        p_catalog,
+        estimate,
+        approx,
+        o_no_nan_plan,
+        p_no_nan_target,
+        no_nan_candidates
     )
 
 
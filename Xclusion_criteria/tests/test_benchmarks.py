@@ -0,0 +1,101 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tempfile
+import pkg_resources
+
+from Xclusion_criteria.xclusion_io import read_meta_pd
+from Xclusion_criteria.xclusion_dtypes import get_dtypes, split_variables_types
+from Xclusion_criteria.benchmarks.synthetic_metadata import (
+    get_columns,
+    make_metadata,
+    write_metadata
+)
+from Xclusion_criteria.benchmarks.bench_pipeline import compare_results
+from Xclusion_criteria.benchmarks.bench_memory import (
+    get_memory_hook,
+    get_bytes_per_sample,
+    read_budgets,
+    check_budgets
+)
+
+RESOURCES = pkg_resources.resource_filename('Xclusion_criteria', 'resources')
+BENCHMARKS = pkg_resources.resource_filename(
+    'Xclusion_criteria', 'benchmarks')
+
+
+class TestSyntheticMetadata(unittest.TestCase):
+
+    def test_get_columns(self):
+        columns = get_columns(100, 1., 0.)
+        self.assertEqual(len(columns), 100)
+        self.assertEqual(columns[0], ('host_subject_id', 'host', False))
+        self.assertTrue(all(x[1] == 'numerical' and not x[2]
+                            for x in columns if x[0].startswith('num_')))
+        self.assertFalse([x for x in columns if x[0].startswith('cat_')])
+        self.assertEqual(get_columns(100, 0.3, 0.5, 1),
+                         get_columns(100, 0.3, 0.5, 1))
+
+    def test_write_metadata(self):
+        with tempfile.NamedTemporaryFile(suffix='.tsv') as handle:
+            write_metadata(handle.name, 250, 30, chunk_size=100)
+            metadata = read_meta_pd(handle.name)
+        self.assertEqual(metadata.shape, (250, 30))
+        self.assertTrue(metadata.index.is_unique)
+        nulls = [x.strip() for x in open('%s/nulls.txt' % RESOURCES)]
+        numerical, categorical = [], []
+        split_variables_types(get_dtypes(metadata, nulls),
+                              numerical, categorical)
+        self.assertIn('age_years', numerical)
+        self.assertIn('age_cat', categorical)
+        self.assertTrue(make_metadata(10, 20, seed=3).equals(
+            make_metadata(10, 20, seed=3)))
+
+
+class TestBenchPipeline(unittest.TestCase):
+
+    def test_compare_results(self):
+        results = {
+            'v1': {'d1': {'read_meta_pd': 1., 'apply_criteria': 2.}},
+            'v2': {'d1': {'read_meta_pd': 1.1, 'apply_criteria': 3.},
+                   'd2': {'read_meta_pd': 5.}}
+        }
+        self.assertEqual(compare_results(results, 'v2', 'v1', 1.2),
+                         [('d1', 'apply_criteria', 2., 3., 1.5)])
+        self.assertEqual(compare_results(results, 'v1', 'v2', 1.2), [])
+
+
+class TestBenchMemory(unittest.TestCase):
+
+    def test_memory_hook(self):
+        memory = {}
+        with get_memory_hook(memory)('stage'):
+            data = bytearray(1000000)
+        self.assertGreaterEqual(memory['stage']['peak'], 1000000)
+        self.assertGreaterEqual(memory['stage']['retained'], 1000000)
+        self.assertEqual(get_bytes_per_sample(memory, 1000)['stage']['peak'],
+                         round(memory['stage']['peak'] / 1000, 2))
+        del data
+
+    def test_check_budgets(self):
+        budgets = read_budgets('%s/memory_budgets.yml' % BENCHMARKS)
+        self.assertIn('default', budgets)
+        budgets = {'default': {'read_meta_pd': 100, 'get_dtypes': 10},
+                   'small': {'read_meta_pd': 1000}}
+        bytes_per_sample = {'read_meta_pd': {'peak': 500.},
+                            'get_dtypes': {'peak': 50.}}
+        self.assertEqual(check_budgets('small', bytes_per_sample, budgets),
+                         [('small', 'get_dtypes', 50., 10)])
+        self.assertEqual(check_budgets('tall', bytes_per_sample, budgets),
+                         [('tall', 'read_meta_pd', 500., 100),
+                          ('tall', 'get_dtypes', 50., 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tempfile
+import numpy as np
+
+from Xclusion_criteria.xclusion_approx import (
+    get_approx_path,
+    read_meta_sample,
+    get_wilson_interval,
+    get_approx_flowcharts
+)
+
+
+class TestApprox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.m_metadata_file = '%s/md.tsv' % self.tmp.name
+        with open(self.m_metadata_file, 'w') as o:
+            o.write('#SampleID\tsex\tage\n')
+            for x in range(1000):
+                o.write('%03d\t%s\t%s\n' % (x, ['female', 'male'][x % 2], x))
+            # last line without newline
+            o.write('1000\tfemale\t1000')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_approx_path(self):
+        self.assertEqual(get_approx_path('out/in.tsv', 0.1),
+                         'out/in_approx0.1.tsv')
+        self.assertIsNone(get_approx_path(None, 0.1))
+
+    def test_read_meta_sample(self):
+        metadata, n_rows = read_meta_sample(self.m_metadata_file, 1.)
+        self.assertEqual(n_rows, 1001)
+        self.assertEqual(metadata.shape, (1001, 2))
+        self.assertEqual(metadata.index.name, 'sample_name')
+        self.assertEqual(metadata.index[:2].tolist(), ['000', '001'])
+        metadata, n_rows = read_meta_sample(self.m_metadata_file, 0.1)
+        self.assertEqual(n_rows, 1001)
+        self.assertTrue(50 < metadata.shape[0] < 150)
+        self.assertTrue(metadata.index.is_monotonic_increasing)
+        # same sample for the same fraction
+        metadata_bis, _ = read_meta_sample(self.m_metadata_file, 0.1)
+        self.assertEqual(metadata.index.tolist(), metadata_bis.index.tolist())
+
+    def test_get_wilson_interval(self):
+        low, high = get_wilson_interval(np.array([5, 0, 10]), 10)
+        np.testing.assert_array_almost_equal(low, [0.2366, 0., 0.7225], 4)
+        np.testing.assert_array_almost_equal(high, [0.7634, 0.2775, 1.], 4)
+
+    def test_get_approx_flowcharts(self):
+        flowcharts = {'init': [['init metadata', 100, None, None, None],
+                               ['sex', 50, 'sex', 'female', '1']]}
+        approx_flowcharts, approx_pd = get_approx_flowcharts(
+            flowcharts, 100, 1000)
+        self.assertEqual(approx_flowcharts['init'][1][1], 500)
+        self.assertEqual(flowcharts['init'][1][1], 50)
+        self.assertEqual(approx_pd.columns.tolist(), [
+            'step', 'criterion', 'sampled', 'estimate', 'ci_low', 'ci_high'])
+        self.assertEqual(approx_pd['estimate'].tolist(), [1000, 500])
+        # all the rows: known exactly
+        self.assertEqual(approx_pd['ci_low'].tolist()[0], 1000)
+        self.assertEqual(approx_pd['ci_high'].tolist()[0], 1000)
+        self.assertTrue(approx_pd['ci_low'][1] < 500 < approx_pd['ci_high'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_dtypes import check_dtype_object, get_dtypes
+from Xclusion_criteria.xclusion_arrow import (
+    check_arrow,
+    check_dtype_arrow,
+    get_arrow_nulls_mask,
+    get_arrow_floats
+)
+
+
+@unittest.skipUnless(check_arrow(), 'pyarrow not installed')
+class TestArrow(unittest.TestCase):
+
+    def setUp(self):
+        self.nulls = ['missing', 'not applicable']
+        self.md = pd.DataFrame({
+            'col0': ['a', 'b', 'c', 'd'],
+            'col1': ['1.5', 'missing', np.nan, '2'],
+            'col2': ['x', 'missing', '3', '4'],
+            'col3': ['1', '2.5', '1e3', np.nan],
+            'col4': ['True', 'False', np.nan, 'True'],
+            'col5': [' 1', 'inf', '-3', '1_000'],
+            'col6': [True, False, True, np.nan],
+            'col7': [1.3, 1, 'missing', np.nan]
+        })
+
+    def test_check_dtype_arrow(self):
+        for col in self.md.columns[:-1]:
+            self.assertEqual(check_dtype_arrow(self.md[col]),
+                             check_dtype_object(self.md[col]))
+        # mixed types are left to check_dtype_object
+        self.assertIsNone(check_dtype_arrow(self.md['col7']))
+
+    def test_get_arrow_nulls_mask(self):
+        np.testing.assert_array_equal(
+            get_arrow_nulls_mask(self.md['col1'], self.nulls),
+            [False, True, False, False])
+
+    def test_get_arrow_floats(self):
+        nan_tf = np.array([False, True, False, False])
+        np.testing.assert_array_equal(
+            get_arrow_floats(self.md['col1'], nan_tf),
+            [1.5, np.nan, np.nan, 2.])
+        self.assertIsNone(get_arrow_floats(self.md['col2'], nan_tf))
+
+    def test_get_dtypes(self):
+        md = self.md.copy()
+        md_arrow = self.md.copy()
+        self.assertEqual(get_dtypes(md, self.nulls),
+                         get_dtypes(md_arrow, self.nulls, True))
+        pd.testing.assert_frame_equal(md, md_arrow)
+
+
+if __name__ == '__main__':
+    unittest.main()
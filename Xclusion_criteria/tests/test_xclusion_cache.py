@@ -0,0 +1,139 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import time
+import unittest
+import tempfile
+
+from Xclusion_criteria.xclusion_cache import (
+    get_ids_files,
+    get_cache_key,
+    get_cache_outputs,
+    restore_cache,
+    unlink_outputs,
+    store_cache,
+    evict_cache
+)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.md = '%s/md.tsv' % self.dir
+        with open(self.md, 'w') as o:
+            o.write('sample_name\tsex\ns1\tmale\ns2\tfemale\n')
+        self.criteria = '%s/criteria.yml' % self.dir
+        with open(self.criteria, 'w') as o:
+            o.write('init:\n  sex,1:\n  - male\n')
+        self.cache = '%s/cache' % self.dir
+        os.makedirs(self.cache)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_ids_files(self):
+        self.assertEqual(get_ids_files({
+            'init': {'sample_name,5': ['a.txt'], 'sex,1': ['male']},
+            'predicates': {'p': {'host,6': ['b.txt', 'c.txt']}}
+        }), ['a.txt', 'b.txt', 'c.txt'])
+
+    def test_get_cache_key(self):
+        key = get_cache_key(self.md, self.criteria, None, ['nan'], {})
+        # same criteria written differently
+        with open(self.criteria, 'w') as o:
+            o.write('# comment\ninit: {"sex,1": ["male"]}\n')
+        self.assertEqual(
+            get_cache_key(self.md, self.criteria, None, ['nan'], {}), key)
+        self.assertNotEqual(
+            get_cache_key(self.md, self.criteria, None, ['nan'],
+                          {'p_random': 10}), key)
+        self.assertNotEqual(
+            get_cache_key(self.md, self.criteria, None, [], {}), key)
+        with open(self.md, 'a') as o:
+            o.write('s3\tmale\n')
+        self.assertNotEqual(
+            get_cache_key(self.md, self.criteria, None, ['nan'], {}), key)
+
+    def test_get_cache_outputs(self):
+        self.assertEqual(get_cache_outputs('in.tsv', None, 'viz'), {
+            'included': 'in.tsv', 'visualization': 'viz.html',
+            'visualization_empty': 'viz_emptySelection.html'})
+
+    def test_store_restore_cache(self):
+        outputs = {'included': '%s/in.tsv' % self.dir,
+                   'excluded': '%s/ex.tsv' % self.dir}
+        self.assertFalse(restore_cache(self.cache, 'key', outputs))
+        with open(outputs['included'], 'w') as o:
+            o.write('included')
+        store_cache(self.cache, 'key', outputs)
+        os.remove(outputs['included'])
+
+        self.assertTrue(restore_cache(self.cache, 'key', outputs))
+        with open(outputs['included']) as handle:
+            self.assertEqual(handle.read(), 'included')
+        self.assertFalse(os.path.isfile(outputs['excluded']))
+
+        # the next run does not write into the cached file
+        unlink_outputs(outputs)
+        self.assertFalse(os.path.isfile(outputs['included']))
+        self.assertTrue(os.path.isfile('%s/key/included' % self.cache))
+
+    def test_restore_cache_changed(self):
+        outputs = {'included': '%s/in.tsv' % self.dir}
+        with open(outputs['included'], 'w') as o:
+            o.write('included')
+        store_cache(self.cache, 'key', outputs)
+        cached = '%s/key/included' % self.cache
+        self.assertEqual(os.stat(cached).st_mode & 0o777, 0o444)
+        self.assertTrue(restore_cache(self.cache, 'key', outputs))
+        # the cached file rewritten through the restored output
+        os.chmod(outputs['included'], 0o644)
+        with open(outputs['included'], 'w') as o:
+            o.write('in')
+        self.assertFalse(restore_cache(self.cache, 'key', outputs))
+        self.assertFalse(os.path.isdir('%s/key' % self.cache))
+
+    def test_store_restore_cache_empty_selection(self):
+        # only the visualization written by the run is cached
+        outputs = get_cache_outputs('%s/in.tsv' % self.dir, None,
+                                    '%s/viz' % self.dir)
+        for output in ['included', 'visualization']:
+            with open(outputs[output], 'w') as o:
+                o.write(output)
+        unlink_outputs(outputs)
+        self.assertTrue(os.path.isfile(outputs['included']))
+        self.assertFalse(os.path.isfile(outputs['visualization']))
+        with open(outputs['visualization_empty'], 'w') as o:
+            o.write('empty')
+        store_cache(self.cache, 'key', outputs)
+        os.remove(outputs['visualization_empty'])
+        self.assertTrue(restore_cache(self.cache, 'key', outputs))
+        self.assertTrue(os.path.isfile(outputs['visualization_empty']))
+        self.assertFalse(os.path.isfile(outputs['visualization']))
+
+    def test_evict_cache(self):
+        outputs = {'included': '%s/in.tsv' % self.dir}
+        with open(outputs['included'], 'w') as o:
+            o.write('x' * 1000)
+        for key in ['old', 'used', 'new']:
+            store_cache(self.cache, key, outputs)
+        now = time.time()
+        os.utime('%s/old' % self.cache, (now - 3 * 86400, now - 3 * 86400))
+        os.utime('%s/used' % self.cache, (now - 60, now - 60))
+        self.assertEqual(evict_cache(self.cache, 2, 1), ['old'])
+        # keep ~1 entry: the least recently used goes first
+        self.assertEqual(evict_cache(self.cache, 2, 1500 / 1024 ** 2),
+                         ['used'])
+        self.assertEqual(os.listdir(self.cache), ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import pickle
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import check_criteria, apply_criteria
+from Xclusion_criteria.xclusion_factors import get_md_factors
+from Xclusion_criteria.xclusion_catalog import (
+    get_column_stats,
+    get_catalog,
+    read_catalog,
+    write_catalog,
+    check_catalog,
+    get_catalog_factors,
+    get_range_fraction,
+    get_outliers_fraction,
+    estimate_flowcharts,
+    get_estimate_accuracy
+)
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA', 'UK',
+                        'USA'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male',
+                    'female', 'female'],
+            'age': [25., 40., np.nan, 70., 33., 18., 45., 60.],
+        }, index=pd.Index(['s%s' % x for x in range(8)], name='sample_name'))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.m_metadata_file = '%s/md.tsv' % self.tmp.name
+        self.md.to_csv(self.m_metadata_file, sep='\t')
+        self.catalog = get_catalog(
+            self.m_metadata_file, self.md, get_md_factors(self.md),
+            ['age'], ['country', 'sex'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_column_stats(self):
+        counts, nans, distinct = get_column_stats(self.md['country'])
+        self.assertEqual(counts, {'USA': 4, 'UK': 2, 'Canada': 1})
+        self.assertEqual((nans, distinct), (1, 3))
+        column = pd.Series(['id%s' % x for x in range(10001)] + ['id0'])
+        counts, nans, distinct = get_column_stats(column)
+        self.assertEqual(len(counts), 100)
+        self.assertEqual(counts['id0'], 2)
+        self.assertEqual(distinct, 10001)
+
+    def test_read_write_check_catalog(self):
+        p_catalog = '%s/md.catalog' % self.tmp.name
+        self.assertIsNone(read_catalog(p_catalog))
+        write_catalog(p_catalog, self.catalog)
+        catalog = read_catalog(p_catalog)
+        self.assertEqual(catalog['factors'], self.catalog['factors'])
+        self.assertTrue(check_catalog(catalog, self.m_metadata_file))
+        with open(self.m_metadata_file, 'a') as o:
+            o.write('s8\tUSA\tmale\t30\n')
+        self.assertFalse(check_catalog(catalog, self.m_metadata_file))
+        # a pickle is not loaded
+        with open(p_catalog, 'wb') as o:
+            pickle.dump(self.catalog, o)
+        self.assertIsNone(read_catalog(p_catalog))
+
+    def test_get_catalog_factors(self):
+        metadata, md_factors = get_catalog_factors(self.catalog)
+        self.assertEqual(metadata.shape, (0, 3))
+        self.assertEqual(metadata.index.name, 'sample_name')
+        self.assertEqual(md_factors['factors']['sex']['counts'],
+                         {'female': 4, 'male': 3, 'missing': 1})
+
+    def test_get_range_fraction(self):
+        # frequencies of all the values: exact
+        self.assertEqual(get_range_fraction(
+            'age', [(18, 50, True, False)], self.catalog), 5 / 8)
+        # quantiles of the values: interpolated
+        self.catalog['quantiles']['age'] = [0., 50., 100.]
+        self.assertAlmostEqual(get_range_fraction(
+            'age', [(0, 25, True, False)], self.catalog), 0.25 * 7 / 8)
+
+    def test_get_outliers_fraction(self):
+        # the 4 samples up to the median and the missing value
+        self.assertEqual(get_outliers_fraction(
+            'age', ['percentile', 0, 50], self.catalog), 5 / 8)
+        self.assertEqual(get_outliers_fraction(
+            'age', ['iqr'], self.catalog), 1.)
+        self.assertIsNone(get_outliers_fraction(
+            'age', ['zscore', 2, 'sex'], self.catalog))
+
+    def test_estimate_flowcharts(self):
+        criteria = check_criteria({
+            'init': {'country,1': ['USA', 'UK']},
+            'filter': {'sex,1': ['female']}
+        }, self.md, ['missing', 'nan'], [])
+        estimates = estimate_flowcharts(criteria, self.catalog)
+        self.assertEqual(estimates, {
+            'init': [['init metadata', 8, None, None, None],
+                     ['country', 6, 'country', 'UK\nUSA', '1']],
+            'filter': [['filter metadata', 6, None, None, None],
+                       ['sex', 3, 'sex', 'female', '1']]})
+
+    def test_get_estimate_accuracy(self):
+        criteria = check_criteria({
+            'init': {'country,1': ['USA', 'UK']},
+            'filter': {'sex,1': ['female']}
+        }, self.md, ['missing', 'nan'], [])
+        estimates = estimate_flowcharts(criteria, self.catalog)
+        flowcharts, _ = apply_criteria(self.md, criteria, ['age'], [])
+        accuracy = get_estimate_accuracy(estimates, flowcharts)
+        self.assertEqual(accuracy['samples'].tolist(), [8, 6, 6, 3])
+        self.assertEqual(accuracy['estimate'].tolist(), [8, 6, 6, 3])
+        self.assertEqual(accuracy['error'].tolist(), [0., 0., 0., 0.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,9 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import re
 import unittest
+import numpy as np
 import pandas as pd
 import pkg_resources
 
@@ -21,8 +23,16 @@ from Xclusion_criteria.xclusion_crits import (
     check_key,
     check_numeric_indicator,
     check_var_in_md,
+    drop_ids_criteria,
     get_criteria,
-    do_filtering
+    get_intervals,
+    get_range_mask,
+    get_patterns_regex,
+    get_criterion_mask,
+    get_included,
+    do_filtering,
+    check_criteria,
+    apply_criteria
 )
 
 ROOT = pkg_resources.resource_filename('Xclusion_criteria', 'tests')
@@ -74,6 +84,18 @@ class TestCrits(unittest.TestCase):
         self.assertEqual(test_boolean, False)
         self.assertEqual(test_values, ['f1', 'f2'])
         self.assertEqual(test_message, ['[Warning] Subset values for variable col not in table\n - f3'])
+        test_message = []
+        test_boolean, test_values = check_factors('col', '3', ['prefix:f', 'x'], self.nulls, pd.DataFrame({'col': ['f1', 'f2']}), test_message)
+        self.assertEqual(test_boolean, False)
+        self.assertEqual(test_values, ['prefix:f', 'x'])
+        self.assertEqual(test_message, [])
+        test_boolean, test_values = check_factors('col', '4', ['x'], self.nulls, pd.DataFrame({'col': ['f1', 'f2']}), test_message)
+        self.assertEqual(test_boolean, True)
+        self.assertEqual(test_message, ['Subset patterns for variable col match no value in table (skipped)'])
+        test_message = []
+        test_boolean, test_values = check_factors('col', '3', ['regex:f(1'], self.nulls, pd.DataFrame({'col': ['f1', 'f2']}), test_message)
+        self.assertEqual(test_boolean, True)
+        self.assertTrue(test_message[0].startswith('Patterns for variable col are not valid'))
 
     def test_check_index(self):
         test_boolean = check_index('0', ['f1', 'f2', 'f3'], [])
@@ -89,6 +111,63 @@ class TestCrits(unittest.TestCase):
         self.assertEqual(test_message,
                          ['For min-max subsetting, two-items list need: no min (or no max) should be "None"'])
 
+    def test_get_intervals(self):
+        self.assertEqual(get_intervals(['18', 'None']),
+                         [(18., np.inf, False, False)])
+        self.assertEqual(get_intervals([[18.5, 25], [30, 40]]),
+                         [(18.5, 25., True, True), (30., 40., True, True)])
+        self.assertEqual(get_intervals(['[18.5,25)', '(30, None]']),
+                         [(18.5, 25., True, False), (30., np.inf, False, True)])
+        self.assertIsNone(get_intervals(['None', 0, 10]))
+        self.assertIsNone(get_intervals([[18.5, 25, 30]]))
+        self.assertIsNone(get_intervals(['[18.5;25)']))
+        self.assertIsNone(get_intervals(['a', 'b']))
+
+    def test_get_range_mask(self):
+        column = np.array([17., 18.5, np.nan, 25., 30., 35., 40., 41.])
+        intervals = get_intervals(['[18.5,25)', [30, 40]])
+        mask = np.array([False, True, False, False, True, True, True, False])
+        np.testing.assert_array_equal(
+            get_range_mask(column, intervals), mask)
+        order = np.argsort(column, kind='stable')
+        np.testing.assert_array_equal(
+            get_range_mask(column, intervals, (order, column[order])), mask)
+        intervals = get_intervals(['None', '30'])
+        mask = np.array([True, True, False, True, False, False, False, False])
+        np.testing.assert_array_equal(
+            get_range_mask(column, intervals), mask)
+        np.testing.assert_array_equal(
+            get_range_mask(column, intervals, (order, column[order])), mask)
+
+    def test_get_patterns_regex(self):
+        self.assertEqual(get_patterns_regex(['statin']), 'statin')
+        self.assertEqual(get_patterns_regex(['ibuprofen', 'ibuprophen', 'ibu']), 'ibu')
+        self.assertEqual(get_patterns_regex(['contains:abc', 'abd', 'prefix:x']), '^x|ab(?:c|d)')
+        self.assertEqual(get_patterns_regex(['regex:^a.c$', 'prefix:a b']), '(?:^a.c$)|^a\\ b')
+        # long literals and deeply nested tries compile
+        regex = get_patterns_regex(['prefix:' + 'a' * 5000])
+        self.assertEqual(regex, '^' + 'a' * 5000)
+        words = ['x' * x + 'y' for x in range(1000)]
+        pattern = re.compile(get_patterns_regex(words))
+        self.assertTrue(all(pattern.search(x) for x in words))
+        self.assertIsNone(pattern.search('x' * 1000))
+        for values in [[], ['prefix:'], ['contains:'], [''], ['regex:']]:
+            with self.assertRaises(re.error):
+                get_patterns_regex(values)
+
+    def test_check_criteria_patterns(self):
+        metadata = pd.DataFrame({'drug': ['statin', 'aspirin', 'a' * 600]},
+                                index=pd.Index(['s1', 's2', 's3'],
+                                               name='sample_name'))
+        messages = []
+        criteria = check_criteria({'init': {'drug,3': ['prefix:' + 'a' * 600],
+                                            'drug,4': ['prefix:', 'stat']}},
+                                  metadata, [], messages)
+        self.assertEqual(list(criteria['init']), [('drug', '3')])
+        self.assertEqual(messages, ['Patterns for variable drug are not '
+                                    'valid: empty pattern "prefix:" '
+                                    '(skipped)'])
+
     def check_is_list(self):
         test_messages = []
         test_boolean = check_islist('var', ['f1', 'f2', 'f3'], test_messages)
@@ -163,6 +242,28 @@ class TestCrits(unittest.TestCase):
         self.assertEqual(test_boolean, True)
         self.assertEqual(test_messages, ['Must have a metadata variable and a numeric separated by a comma (",")'])
 
+    def test_drop_ids_criteria(self):
+        messages = []
+        criteria_dict = {
+            'init': {'sample_name,6': ['ids.txt'], 'sex,1': ['male']},
+            'filter': {'host,8': ['count >= 3']},
+            'predicates': {'p': {'host,5': ['ids.txt']}}
+        }
+        obs = drop_ids_criteria(criteria_dict, messages, 'not estimated')
+        self.assertEqual(obs, {'init': {'sex,1': ['male']}, 'filter': {},
+                               'predicates': {'p': {}}})
+        self.assertEqual(messages, [
+            'IDs files criteria for variable sample_name are not '
+            'estimated (skipped)',
+            'Host criteria for variable host are not estimated (skipped)',
+            'IDs files criteria for variable host are not estimated '
+            '(skipped)'])
+        # the criteria file content is left as read
+        self.assertEqual(criteria_dict['init'], {
+            'sample_name,6': ['ids.txt'], 'sex,1': ['male']})
+        self.assertEqual(criteria_dict['predicates'], {
+            'p': {'host,5': ['ids.txt']}})
+
     def test_get_criteria(self):
 
         no_comma = '%s/criteria/criteria_no_comma.yml' % ROOT
@@ -175,7 +276,7 @@ class TestCrits(unittest.TestCase):
         test_messages = []
         test_criteria = get_criteria(no_correct_index, self.md, self.nulls, test_messages)
         self.assertEqual(test_criteria, {})
-        self.assertEqual(test_messages, ['Numeric indicator not "0", "1" or "2" (9) (antibiotic_history skipped)'])
+        self.assertEqual(test_messages, ['Numeric indicator not "0", "1", "2", "3", "4", "5", "6", "7" or "8" (9) (antibiotic_history skipped)'])
 
         no_index = '%s/criteria/criteria_no_index.yml' % ROOT
         test_messages = []
@@ -195,6 +296,15 @@ class TestCrits(unittest.TestCase):
         self.assertEqual(test_criteria, {})
         self.assertEqual(test_messages, ['Values to subset for must be in a list format (antibiotic_history skipped)'])
 
+        expression = '%s/criteria/criteria_expression.yml' % ROOT
+        test_messages = []
+        test_criteria = get_criteria(expression, self.md, self.nulls, test_messages)
+        self.assertEqual(test_messages, [])
+        self.assertEqual(list(test_criteria['filter']), [('abx or high', 'expression'), ('not low', 'expression')])
+        masks = [get_criterion_mask(self.md, var, index, values, ['col2'], test_messages)[2]
+                 for (var, index), values in test_criteria['filter'].items()]
+        self.assertEqual([x.tolist() for x in masks], [[True, False, True], [False, True, True]])
+
         wrong_minmax = '%s/criteria/criteria_wrong_minmax.yml' % ROOT
         test_messages = []
         test_criteria = get_criteria(wrong_minmax, self.md, self.nulls, test_messages)
@@ -263,6 +373,63 @@ class TestCrits(unittest.TestCase):
         self.assertEqual(test_boolean, True)
         self.assertEqual(test_messages, ['[Warning] Both numerical bounds for col2 are "None" (skipping)'])
 
+        md_pattern = pd.DataFrame({'med': ['Ibuprofen 200mg', 'aspirin', 'ibuprofen', np.nan, 'none']})
+        test_name, test_boolean, test_md = do_filtering(md_pattern, 'med', '3', ['prefix:ibu', 'regex:(?i:^ibu)', 'pirin'], [], [])
+        self.assertEqual(test_name, 'Match_med')
+        self.assertEqual(test_md.index.tolist(), [0, 1, 2])
+        test_name, test_boolean, test_md = do_filtering(md_pattern, 'med', '4', ['Ibu', 'spi'], [], [])
+        self.assertEqual(test_name, 'No_match_med')
+        self.assertEqual(test_md.index.tolist(), [2, 3, 4])
+
+        md_ids = pd.DataFrame({'host': ['A', 'B', 'C', 'D']}, index=pd.Index(['a', 'b', 'c', 'd'], name='sample_name'))
+        ids_fp = '%s/ids/ids.txt' % ROOT
+        test_name, test_boolean, test_md = do_filtering(md_ids, 'host', '5', [ids_fp], [], [])
+        self.assertEqual(test_name, 'In_host_list')
+        self.assertEqual(test_md.index.tolist(), ['b', 'c'])
+        test_name, test_boolean, test_md = do_filtering(md_ids.set_index('host', drop=False).rename_axis('sample_name'), 'sample_name', '6', [ids_fp], [], [])
+        self.assertEqual(test_name, 'Not_in_sample_name_list')
+        self.assertEqual(test_md.index.tolist(), ['A', 'D'])
+
+        test_name, test_boolean, test_md_abx_mm = do_filtering(self.md, 'col2', '2', [[1, 1], '(1.5,3]'], ['col2'], [])
+        self.assertEqual(test_name, 'Range_col2')
+        self.assertEqual(test_boolean, False)
+        self.assertEqual(test_md_abx_mm.col2.tolist(), [1., 2., 3.])
+
+    def test_get_included(self):
+        messages = []
+        flowcharts = {'filter': []}
+        included = get_included(
+            self.md, flowcharts, np.array([True, True, False]),
+            np.array([False, True, True]), messages)
+        # the sample both included and re-added is not duplicated
+        assert_frame_equal(included, self.md)
+        self.assertEqual(flowcharts, {'filter': [[
+            '"add" samples', 3, 'adding 1 samples',
+            '(see "add" criteria)', None]]})
+        self.assertEqual(messages, [
+            '1 samples not removed by criteria of "init"/"filter" steps '
+            're-added by criteria of "add" step (not to worry: duplicates '
+            'are dropped).'])
+
+        flowcharts = {'filter': []}
+        included = get_included(
+            self.md, flowcharts, np.array([True, False, False]),
+            np.zeros(3, dtype=bool), [])
+        assert_frame_equal(included, self.md.iloc[:1])
+        self.assertEqual(flowcharts, {'filter': []})
+
+    def test_apply_criteria_add_only(self):
+        # an "add" step without "filter" step
+        criteria = check_criteria({
+            'init': {'antibiotic_history,1': ['Yes']},
+            'add': {'col2,2': ['[1,2]']}}, self.md, self.nulls, [])
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['col2'], [])
+        self.assertEqual(flowcharts['filter'], [[
+            '"add" samples', 1, 'adding 0 samples',
+            '(see "add" criteria)', None]])
+        assert_frame_equal(included, self.md.iloc[:1])
+
 
 if __name__ == '__main__':
     unittest.main()
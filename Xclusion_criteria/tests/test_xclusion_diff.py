@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+
+from pandas.testing import assert_frame_equal
+
+from Xclusion_criteria.xclusion_diff import (
+    read_run,
+    get_run_failed,
+    get_samples_diff,
+    get_flowcharts_diff
+)
+from Xclusion_criteria.xclusion_incremental import write_state
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.run_a = {
+            'samples': np.array(['s0', 's1', 's2', 's3'], dtype=object),
+            'included': np.array([True, True, False, False]),
+            'codes': np.array([-1, -1, 0, 1], dtype=np.int32),
+            'names': ['init: country', 'filter: Range_age']
+        }
+        self.run_b = {
+            'samples': np.array(['s0', 's1', 's2', 's3', 's4'],
+                                dtype=object),
+            'included': np.array([True, False, False, True, True]),
+            'codes': np.array([-1, 1, 0, -1, -1], dtype=np.int32),
+            'names': ['init: country', 'filter: Range_age']
+        }
+
+    def test_read_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            i_run = '%s/in.tsv' % tmp
+            with open(i_run, 'w') as o:
+                o.write('sample_name\tage\n001\t25\ns1\t40\n')
+            run = read_run(i_run)
+        self.assertEqual(run['samples'].tolist(), ['001', 's1'])
+        self.assertTrue(run['included'].all())
+        self.assertIsNone(run['codes'])
+        self.assertIsNone(run['flowcharts'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            i_run = '%s/state.npz' % tmp
+            write_state(i_run, {
+                'masks': self.run_a, 'counts': {
+                    'filter': 2, 'add': 0, 'common': 0},
+                'flowcharts': {'init': [['init metadata', 4, None, None,
+                                         None]]}})
+            run = read_run(i_run)
+        self.assertEqual(run['samples'].tolist(), ['s0', 's1', 's2', 's3'])
+        self.assertEqual(run['codes'].tolist(), [-1, -1, 0, 1])
+        self.assertEqual(run['names'], self.run_a['names'])
+
+    def test_get_run_failed(self):
+        samples = np.array(['s2', 's9', 's0'], dtype=object)
+        self.assertEqual(get_run_failed(self.run_a, samples).tolist(),
+                         ['init: country', 'not in metadata', ''])
+        self.run_a['codes'] = None
+        self.assertEqual(get_run_failed(self.run_a, samples).tolist(),
+                         [None, None, None])
+
+    def test_get_samples_diff(self):
+        exp = pd.DataFrame({
+            'sample_name': ['s3', 's4', 's1'],
+            'change': ['added', 'added', 'removed'],
+            'criterion_a': ['filter: Range_age', 'not in metadata', ''],
+            'criterion_b': ['', '', 'filter: Range_age']
+        })
+        obs = get_samples_diff(self.run_a, self.run_b)
+        assert_frame_equal(obs, exp, check_dtype=False)
+
+    def test_get_flowcharts_diff(self):
+        flowcharts_a = {'init': [['init metadata', 4, None, None, None],
+                                 ['country', 2, 'country', 'USA', '1'],
+                                 ['diet', 3, 'diet', 'Vegan', '1']]}
+        flowcharts_b = {'init': [['init metadata', 5, None, None, None],
+                                 ['Range_age', 3, 'age', '[18, 60]', '2'],
+                                 ['diet', 1, 'diet', 'Vegetarian', '1']]}
+        exp = pd.DataFrame({
+            'step': ['init'] * 5,
+            'criterion': ['init metadata', 'Range_age', 'diet', 'country',
+                          'diet'],
+            'variable': [None, 'age', 'diet', 'country', 'diet'],
+            'values': [None, '[18, 60]', 'Vegetarian', 'USA', 'Vegan'],
+            'indicator': [None, '2', '1', '1', '1'],
+            'count_a': pd.array([4, None, None, 2, 3], dtype='Int64'),
+            'count_b': pd.array([5, 3, 1, None, None], dtype='Int64'),
+            'delta': pd.array([1, None, None, None, None], dtype='Int64')
+        })
+        obs = get_flowcharts_diff(flowcharts_a, flowcharts_b)
+        assert_frame_equal(obs, exp)
+
+if __name__ == '__main__':
+    unittest.main()
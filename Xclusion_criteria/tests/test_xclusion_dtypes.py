@@ -7,6 +7,7 @@
 # ----------------------------------------------------------------------------
 
 import unittest
+import tempfile
 import numpy as np
 import pandas as pd
 
@@ -16,8 +17,10 @@ from Xclusion_criteria.xclusion_dtypes import (
     get_dtypes_final,
     check_dtype_object,
     split_variables_types,
-    check_num_cat_lists
+    check_num_cat_lists,
+    replace_tf
 )
+from Xclusion_criteria.xclusion_io import read_meta_pd
 
 
 class TestDtypes(unittest.TestCase):
@@ -156,6 +159,23 @@ class TestDtypes(unittest.TestCase):
         self.assertEqual(boolean, False)
         self.assertEqual(test_message, '')
 
+    def test_replace_tf(self):
+        # True/False are parsed as booleans when read from file
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as tmp:
+            tmp.write('sample_name\tfirst\tdog\tcat\tnum\n'
+                      'sam_1\ta\tTrue\ttrue\t1\n'
+                      'sam_2\tb\tFalse\tfalse\t2\n'
+                      'sam_3\tc\t\tmissing\t3\n')
+            tmp.flush()
+            metadata = read_meta_pd(tmp.name)
+        numerical, categorical = [], []
+        split_variables_types(get_dtypes(metadata, self.nulls),
+                              numerical, categorical)
+        replace_tf(metadata, categorical)
+        self.assertEqual(metadata['dog'].fillna('').tolist(),
+                         ['Yes', 'No', ''])
+        self.assertEqual(metadata['cat'].tolist(), ['Yes', 'No', 'missing'])
+        self.assertEqual(metadata['num'].tolist(), [1, 2, 3])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+from Xclusion_criteria.xclusion_expr import (
+    parse_expression,
+    get_expression_names,
+    get_expression_text,
+    get_clauses
+)
+
+
+class TestExpr(unittest.TestCase):
+
+    def test_parse_expression(self):
+        node = parse_expression('(ibd OR ibs) AND NOT abx')
+        self.assertEqual(get_expression_text(node), '(ibd or ibs) and not abx')
+        self.assertEqual(get_expression_names(node), ['ibd', 'ibs', 'abx'])
+        node = parse_expression('a and (b or not c) and d or a')
+        self.assertEqual(get_expression_names(node), ['a', 'b', 'c', 'd'])
+        with self.assertRaises(ValueError):
+            parse_expression('ibd or')
+        with self.assertRaises(ValueError):
+            parse_expression('ibd + ibs')
+        with self.assertRaises(ValueError):
+            parse_expression('__import__("os")')
+
+    def test_get_clauses(self):
+        node = parse_expression('(ibd or ibs) and not abx and not (a and b)')
+        self.assertEqual([get_expression_text(x) for x in get_clauses(node)],
+                         ['ibd or ibs', 'not abx', 'not (a and b)'])
+        node = parse_expression('ibd or ibs')
+        self.assertEqual([get_expression_text(x) for x in get_clauses(node)],
+                         ['ibd or ibs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_factors import (
+    get_md_factors,
+    get_factors,
+    get_factors_mask,
+    get_rows,
+    get_counts
+)
+
+
+class TestFactors(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'col1': ['a', 'b', np.nan, 'a', 'c'],
+            'col2': [1., 2., 3., 4., 5.]
+        }, index=['s1', 's2', 's3', 's4', 's5'])
+
+    def test_get_md_factors(self):
+        md_factors = get_md_factors(self.md)
+        self.assertEqual(md_factors, {
+            'positions': {'col1': 0, 'col2': 1}, 'factors': {}})
+
+    def test_get_factors(self):
+        md_factors = get_md_factors(self.md)
+        var_factors = get_factors('col1', self.md, md_factors)
+        np.testing.assert_array_equal(var_factors['codes'], [0, 1, -1, 0, 2])
+        self.assertEqual(var_factors['counts'], {'a': 2, 'b': 1, 'c': 1})
+        self.assertEqual(var_factors['nans'], 1)
+        self.assertEqual(list(md_factors['factors']), ['col1'])
+        self.assertIs(get_factors('col1', self.md, md_factors), var_factors)
+
+    def test_get_factors_mask(self):
+        var_factors = get_factors('col1', self.md, get_md_factors(self.md))
+        np.testing.assert_array_equal(
+            get_factors_mask(var_factors, ['a', 'c'], False),
+            [True, False, False, True, True])
+        np.testing.assert_array_equal(
+            get_factors_mask(var_factors, ['b', 'nan'], True),
+            [False, True, True, False, False])
+
+    def test_get_counts(self):
+        md_factors = get_md_factors(self.md)
+        included = self.md.loc[['s1', 's3', 's4', 's5']]
+        rows = get_rows(included, self.md)
+        np.testing.assert_array_equal(rows, [0, 2, 3, 4])
+        self.assertEqual(
+            get_counts('col1', included, self.md, md_factors, rows),
+            included['col1'].value_counts().to_dict())
+        self.assertIsNone(get_rows(pd.DataFrame(index=['s6']), self.md))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+from os.path import isfile
+
+from Xclusion_criteria.xclusion import run_criteria
+from Xclusion_criteria.xclusion_crits import check_criteria, apply_criteria
+from Xclusion_criteria.xclusion_hosts import (
+    get_host_condition,
+    get_hosts_conditions,
+    get_hosts_variables,
+    has_hosts_criteria,
+    get_hosts_groupings,
+    get_sort_codes,
+    get_condition_mask,
+    get_hosts_mask
+)
+
+
+class TestHosts(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'host_subject_id': ['A', 'A', 'A', 'B', 'B', 'C', 'C', 'C',
+                                np.nan],
+            'body_site': ['stool', 'stool', 'stool', 'stool', 'skin',
+                          'stool', 'stool', 'skin', 'stool'],
+            'bmi': [25., 28., 29., 22., 35., 31., np.nan, 24., 20.],
+            'collection_timestamp': [
+                '2019-03-01', '2019-01-01', '2019-02-01', '2018-05-01',
+                '2018-04-01', np.nan, '2020-01-01', '2020-01-01',
+                '2017-01-01'],
+        }, index=pd.Index(['s%s' % x for x in range(9)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+
+    def test_get_host_condition(self):
+        self.assertEqual(get_host_condition('count >= 3'),
+                         ('count', None, '>=', 3.))
+        self.assertEqual(get_host_condition('max(bmi)<=30'),
+                         ('max', 'bmi', '<=', 30.))
+        self.assertEqual(get_host_condition('nunique(body_site) == 1'),
+                         ('nunique', 'body_site', '==', 1.))
+        self.assertEqual(get_host_condition('first(collection_timestamp)'),
+                         ('first', 'collection_timestamp', None, None))
+        for value in ['count', 'max(bmi)', 'median(bmi) > 1', 'first',
+                      'last(bmi) > 1', 'count >= x', 'count => 3']:
+            self.assertIsNone(get_host_condition(value))
+
+    def test_get_hosts_conditions(self):
+        self.assertEqual(len(get_hosts_conditions(
+            ['count >= 3', 'max(bmi) <= 30'])), 2)
+        self.assertIsNone(get_hosts_conditions(['count >= 3', 'foo']))
+        self.assertIsNone(get_hosts_conditions([]))
+
+    def test_get_hosts_variables(self):
+        self.assertEqual(get_hosts_variables('8', [
+            'count >= 3', 'max(bmi) <= 30', 'min(bmi) > 18']), ['bmi'])
+        self.assertEqual(get_hosts_variables('1', ['max(bmi) <= 30']), [])
+        self.assertEqual(get_hosts_variables('8', ['foo']), [])
+
+    def test_has_hosts_criteria(self):
+        criteria = {'init': {('sex', '1'): ['male']}}
+        self.assertFalse(has_hosts_criteria(criteria))
+        self.assertEqual(get_hosts_groupings(criteria), [])
+        criteria['filter'] = {('host_subject_id', '8'): ['count >= 3']}
+        self.assertTrue(has_hosts_criteria(criteria))
+        self.assertEqual(get_hosts_groupings(criteria), ['host_subject_id'])
+
+    def test_get_sort_codes(self):
+        codes = get_sort_codes(self.md['collection_timestamp'], False)
+        self.assertEqual(codes[:5].tolist(), [5., 3., 4., 2., 1.])
+        self.assertTrue(np.isnan(codes[5]))
+        codes = get_sort_codes(self.md['bmi'], True)
+        self.assertEqual(codes[:2].tolist(), [25., 28.])
+
+    def test_get_condition_mask(self):
+        rows = np.arange(8)
+        groups = np.array([0, 0, 0, 1, 1, 2, 2, 2])
+        mask = get_condition_mask(self.md, groups, rows,
+                                  ('count', None, '>=', 3.), [])
+        self.assertEqual(np.flatnonzero(mask).tolist(), [0, 1, 2, 5, 6, 7])
+        # the missing values are not aggregated
+        mask = get_condition_mask(self.md, groups, rows,
+                                  ('max', 'bmi', '<=', 30.), ['bmi'])
+        self.assertEqual(np.flatnonzero(mask).tolist(), [0, 1, 2])
+        mask = get_condition_mask(self.md, groups, rows,
+                                  ('count', 'bmi', '==', 2.), ['bmi'])
+        self.assertEqual(np.flatnonzero(mask).tolist(), [3, 4, 5, 6, 7])
+        # first sample per host, the first in table order for ties
+        mask = get_condition_mask(
+            self.md, groups, rows, ('first', 'collection_timestamp',
+                                    None, None), [])
+        self.assertEqual(np.flatnonzero(mask).tolist(), [1, 4, 6])
+        mask = get_condition_mask(self.md, groups, rows,
+                                  ('last', 'bmi', None, None), ['bmi'])
+        self.assertEqual(np.flatnonzero(mask).tolist(), [2, 4, 5])
+
+    def test_get_hosts_mask(self):
+        messages = []
+        mask = get_hosts_mask(self.md, 'host_subject_id', ['count >= 2'],
+                              ['bmi'], messages)
+        # the sample without host never passes
+        self.assertEqual(np.flatnonzero(mask).tolist(), list(range(8)))
+        # the hosts with >= 3 stool samples
+        stool = (self.md['body_site'] == 'stool').values
+        mask = get_hosts_mask(self.md, 'host_subject_id', ['count >= 3'],
+                              ['bmi'], messages, input_mask=stool)
+        self.assertEqual(np.flatnonzero(mask).tolist(), [0, 1, 2])
+        mask = get_hosts_mask(self.md, 'host_subject_id', [
+            'count >= 2', 'mean(body_site) > 1'], ['bmi'], messages)
+        self.assertEqual(mask.sum(), 8)
+        self.assertEqual(messages, [
+            'Metadata variable body_site is not numerical (host_subject_id '
+            'condition skipped)'])
+
+    def test_apply_criteria(self):
+        messages = []
+        criteria = check_criteria({
+            'init': {'body_site,1': ['stool']},
+            'filter': {'host_subject_id,8': ['count >= 2', 'max(bmi) <= 30'],
+                       'sex,8': ['count >= 2'],
+                       'bmi,8': ['max(foo) > 1']},
+        }, self.md, self.nulls, messages)
+        self.assertEqual(list(criteria['filter']), [('host_subject_id', '8')])
+        self.assertEqual(messages[1], 'Aggregated variable(s) for variable '
+                                      'bmi not in metadata (skipped)\n - foo')
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['bmi'], messages)
+        self.assertEqual(flowcharts['filter'][1], [
+            'Per_host_subject_id', 3, 'host_subject_id',
+            'count >= 2\nmax(bmi) <= 30', '8'])
+        self.assertEqual(included.index.tolist(), ['s0', 's1', 's2'])
+
+    def test_run_criteria(self):
+        # the tables varying the criteria are not made, the strata are
+        with tempfile.TemporaryDirectory() as tmp:
+            md = '%s/md.tsv' % tmp
+            self.md.to_csv(md, sep='\t')
+            criteria = '%s/criteria.yml' % tmp
+            with open(criteria, 'w') as o:
+                o.write('init:\n  body_site,1:\n  - stool\n'
+                        'filter:\n  host_subject_id,8:\n  - count >= 2\n')
+            o_sensitivity = '%s/sensitivity.tsv' % tmp
+            _, _, flowcharts, included, _, _ = run_criteria(
+                md, criteria, self.nulls, '%s/in.tsv' % tmp, None, None,
+                o_sensitivity=o_sensitivity, o_overlaps='%s/ov.tsv' % tmp,
+                stratify_by=('body_site',))
+            self.assertFalse(isfile(o_sensitivity))
+            self.assertFalse(isfile('%s/ov.tsv' % tmp))
+            self.assertEqual(included.index.tolist(),
+                             ['s0', 's1', 's2', 's5', 's6'])
+            strata = pd.read_csv('%s/in_flowchart_by_body_site.tsv' % tmp,
+                                 sep='\t')
+            self.assertEqual(strata[['skin', 'stool']].sum(1).tolist(), [
+                x[1] for step in ['init', 'filter'] for x in flowcharts[step]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import pickle
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion import run_criteria
+from Xclusion_criteria.xclusion_trace import get_trace
+from Xclusion_criteria.xclusion_incremental import (
+    get_md_flags,
+    get_state,
+    read_state,
+    write_state,
+    run_incremental,
+    append_outputs,
+    read_included
+)
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.nulls = ['missing', 'nan']
+        self.md = '%s/md.tsv' % self.dir
+        self.header = 'sample_name\tcountry\tsex\tage\tbmi\n'
+        self.rows = [
+            's0\tUSA\tfemale\t25\t20.5\n',
+            's1\tUK\tmale\t40\tmissing\n',
+            's2\tUSA\tmale\t33\t22\n',
+            's3\tCanada\tfemale\t70\t30.5\n'
+        ]
+        self.new_rows = [
+            's4\tUK\tfemale\t45\t25\n',
+            's5\tUK\tmale\t19\tmissing\n',
+            's6\tUSA\tfemale\t52\t21.5\n'
+        ]
+        self.criteria = '%s/criteria.yml' % self.dir
+        with open(self.criteria, 'w') as o:
+            o.write('init:\n  country,1:\n  - USA\n  - UK\n'
+                    '  - Spain\n  bmi,2:\n  - [18, 31]\n'
+                    'add:\n  sex,1:\n  - male\n'
+                    'filter:\n  age,2:\n  - [20, 60]\n')
+        self.outputs = {'included': '%s/in.tsv' % self.dir,
+                        'excluded': '%s/ex.tsv' % self.dir}
+        self.state = '%s/state.npz' % self.dir
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_md(self, rows):
+        with open(self.md, 'w') as o:
+            o.write(self.header + ''.join(rows))
+
+    def run_full(self, outputs, trace=None, p_shards=1):
+        md_flags, state_masks = {}, {}
+        metadata, md_factors, flowcharts, included, numerical, categorical = \
+            run_criteria(self.md, self.criteria, self.nulls,
+                         outputs['included'], outputs['excluded'], trace,
+                         p_shards=p_shards, md_flags=md_flags,
+                         state_masks=state_masks)
+        state = get_state(self.md, metadata, md_factors, md_flags,
+                          self.criteria, self.nulls, numerical, categorical,
+                          outputs, state_masks)
+        return flowcharts, state
+
+    def run_incremental(self):
+        return run_incremental(self.md, self.criteria, self.nulls,
+                               self.outputs, self.state, [])
+
+    def test_get_md_flags(self):
+        metadata = pd.DataFrame({
+            'country': ['USA', 'UK'], 'bmi': ['20.5', 'missing'],
+            'age': [25, 40], 'tf': ['True', np.nan]})
+        self.assertEqual(get_md_flags(metadata), {
+            'country': {'dtype': 'object', 'flags': None},
+            'bmi': {'dtype': 'object', 'flags': {
+                'nan': False, 'tf': False, 'float': True,
+                'non_float': True}},
+            'age': {'dtype': 'int64', 'flags': None},
+            'tf': {'dtype': 'object', 'flags': {
+                'nan': True, 'tf': True, 'float': False,
+                'non_float': False}}})
+
+    def test_run_incremental(self):
+        self.write_md(self.rows)
+        _, state = self.run_full(self.outputs)
+        write_state(self.state, state)
+        self.write_md(self.rows + self.new_rows)
+        reason, flowcharts, state, tail_included, tail_excluded = \
+            self.run_incremental()
+        self.assertIsNone(reason)
+        self.assertEqual(tail_included.index.tolist(), ['s4', 's6'])
+        self.assertEqual(tail_excluded.index.tolist(), ['s5'])
+        append_outputs(tail_included, tail_excluded, self.outputs, state)
+        write_state(self.state, state)
+
+        # same outputs and flowchart as a run on the whole metadata
+        full_outputs = {'included': '%s/full_in.tsv' % self.dir,
+                        'excluded': '%s/full_ex.tsv' % self.dir}
+        trace = get_trace('trace.json')
+        full_flowcharts, full_state = self.run_full(full_outputs, trace)
+        # each criterion is evaluated once for the outputs and the state
+        self.assertEqual(len([x for x in trace['traceEvents']
+                              if x.get('cat') == 'criterion']), 4)
+        self.assertEqual(flowcharts, full_flowcharts)
+        self.assertEqual(state['counts'], full_state['counts'])
+        for mask in ['samples', 'included', 'codes']:
+            np.testing.assert_array_equal(state['masks'][mask],
+                                          full_state['masks'][mask])
+        self.assertEqual(state['masks']['names'],
+                         ['init: country', 'init: Range_bmi',
+                          'filter: Range_age'])
+        for output, path in self.outputs.items():
+            with open(path) as handle, open(full_outputs[output]) as full:
+                self.assertEqual(handle.read(), full.read())
+        _, shards_state = self.run_full(full_outputs, p_shards=2)
+        for mask in ['samples', 'included', 'codes']:
+            np.testing.assert_array_equal(shards_state['masks'][mask],
+                                          full_state['masks'][mask])
+        self.assertEqual(shards_state['masks']['names'],
+                         full_state['masks']['names'])
+        self.assertEqual(shards_state['flowcharts'],
+                         full_state['flowcharts'])
+        included = read_included(self.outputs['included'], state)
+        self.assertEqual(included['bmi'].dtype, 'float64')
+        self.assertEqual(included.index.tolist(),
+                         ['s0', 's2', 's4', 's6'])
+
+        # nothing appended since the last run
+        reason, flowcharts, state, tail_included, _ = self.run_incremental()
+        self.assertIsNone(reason)
+        self.assertEqual(flowcharts, full_flowcharts)
+        self.assertEqual(tail_included.shape[0], 0)
+
+    def test_run_incremental_booleans(self):
+        # True/False replaced as in the whole table (here with np.nan)
+        for true, false in [('True', 'False'), ('true', 'false')]:
+            self.header = 'sample_name\tcountry\tsex\tage\tbmi\tdog\n'
+            rows = [row.replace('\n', '\t%s\n' % dog) for row, dog in zip(
+                self.rows, [true, '', false, true])]
+            new_rows = [row.replace('\n', '\t%s\n' % dog) for row, dog in
+                        zip(self.new_rows, [true, false, true])]
+            self.write_md(rows)
+            _, state = self.run_full(self.outputs)
+            write_state(self.state, state)
+            self.write_md(rows + new_rows)
+            reason, _, state, tail_included, tail_excluded = \
+                self.run_incremental()
+            self.assertIsNone(reason)
+            append_outputs(tail_included, tail_excluded, self.outputs, state)
+            full_outputs = {'included': '%s/full_in.tsv' % self.dir,
+                            'excluded': '%s/full_ex.tsv' % self.dir}
+            self.run_full(full_outputs)
+            for output, path in self.outputs.items():
+                with open(path) as handle, open(full_outputs[output]) as full:
+                    self.assertEqual(handle.read(), full.read())
+            included = read_included(self.outputs['included'], state)
+            self.assertEqual(included['dog'].tolist(),
+                             ['Yes', 'No', 'Yes', 'Yes'])
+
+    def test_read_write_state(self):
+        self.write_md(self.rows)
+        _, state = self.run_full(self.outputs)
+        write_state(self.state, state)
+        read = read_state(self.state)
+        for mask in ['samples', 'included', 'codes']:
+            np.testing.assert_array_equal(read['masks'][mask],
+                                          state['masks'][mask])
+        self.assertEqual(read['masks']['samples'].dtype, object)
+        # e.g. the (variable, index) keys of the criteria
+        self.assertEqual(dict((x, y) for x, y in read.items() if x != 'masks'),
+                         dict((x, y) for x, y in state.items() if x != 'masks'))
+        # a pickle is not loaded
+        with open(self.state, 'wb') as o:
+            pickle.dump(state, o)
+        self.assertIsNone(read_state(self.state))
+
+    def test_run_incremental_full_run(self):
+        self.assertEqual(self.run_incremental()[0],
+                         'no state of a previous run')
+        self.write_md(self.rows)
+        _, state = self.run_full(self.outputs)
+        write_state(self.state, state)
+        self.assertEqual(read_state(self.state)['offset'], state['offset'])
+        for rows, reason in [
+            (self.rows[:3] + self.new_rows, 'metadata rows changed'),
+            (self.rows + ['s4\tUK\tfemale\tforty\t25\n'],
+             'dtype of age changed'),
+            (self.rows + ['s4\tUK\tfemale\t45\tthin\n'],
+             'dtype of bmi changed'),
+            # a value of the criteria is now in the metadata
+            (self.rows + ['s4\tSpain\tmale\t41\t25\n'],
+             'criteria checks changed')
+        ]:
+            self.write_md(rows)
+            self.assertEqual(self.run_incremental()[0], reason)
+        self.write_md(self.rows + self.new_rows)
+        with open(self.criteria, 'a') as o:
+            o.write('no_nan:\n- sex\n')
+        self.assertEqual(self.run_incremental()[0],
+                         'criteria or outputs changed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,12 +6,15 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import gzip
 import unittest
+import tempfile
 import pkg_resources
 import pandas as pd
 
 from pandas.testing import assert_frame_equal
-from Xclusion_criteria.xclusion_io import read_meta_pd, read_i_criteria
+from Xclusion_criteria.xclusion_io import (
+    read_meta_pd, read_i_criteria, read_ids, encode_json, decode_json)
 
 ROOT = pkg_resources.resource_filename('Xclusion_criteria', 'tests')
 
@@ -46,5 +49,21 @@ class TestMd(unittest.TestCase):
     def test_read_i_criteria(self):
         pass
 
+    def test_read_ids(self):
+        ids_fp = '%s/ids/ids.txt' % ROOT
+        self.assertEqual(read_ids(ids_fp), {'B', 'C', 'Z'})
+        with tempfile.NamedTemporaryFile(suffix='.txt.gz') as handle:
+            with gzip.open(handle.name, 'wt') as gz:
+                gz.write(open(ids_fp).read())
+            self.assertEqual(read_ids(handle.name), {'B', 'C', 'Z'})
+
+    def test_encode_decode_json(self):
+        content = {'criteria': {('age', '2'): [[18, 60]],
+                                ('a and b', 'expression'): {
+                                    'a': {('sex', '1'): ['male']}}},
+                   'counts': {'x': 1, 2.5: 3, True: 1},
+                   'flowchart': [['init metadata', 4, None, None, None]]}
+        self.assertEqual(decode_json(encode_json(content)), content)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
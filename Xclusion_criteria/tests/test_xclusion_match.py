@@ -0,0 +1,130 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_match import (
+    check_scipy,
+    get_matched_path,
+    check_match,
+    get_match_pairs,
+    get_match_columns,
+    match_samples
+)
+
+
+@unittest.skipUnless(check_scipy(), 'scipy not installed')
+class TestMatch(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'ibd': ['yes', 'no', 'no', 'no', 'yes', 'no', 'no', 'no', 'yes'],
+            'sex': ['female', 'female', 'female', 'male', 'male', 'male',
+                    'male', 'female', 'missing'],
+            'age': [30., 31., 50., 40., 60., 58., 20., 29., 45.],
+            'bmi': [20., 21., 20., 25., 30., 29., 22., np.nan, 25.],
+        }, index=pd.Index(['s%s' % x for x in range(9)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+        self.match_dict = {'cases': {'ibd,1': ['yes']}, 'exact': ['sex'],
+                           'nearest': ['age', 'bmi']}
+
+    def test_get_matched_path(self):
+        self.assertEqual(get_matched_path('out/in.tsv'),
+                         'out/in_matched.tsv')
+
+    def test_check_match(self):
+        messages = []
+        match = check_match(self.match_dict, self.md, ['age', 'bmi'],
+                            self.nulls, messages)
+        self.assertEqual(messages, [])
+        self.assertEqual(match['cases'], {'init': {('ibd', '1'): ['yes']}})
+        self.assertEqual((match['exact'], match['nearest']),
+                         (['sex'], ['age', 'bmi']))
+        self.assertEqual((match['ratio'], match['caliper']), (1, np.inf))
+        match = check_match(dict(self.match_dict, nearest=['sex', 'foo']),
+                            self.md, ['age', 'bmi'], self.nulls, messages)
+        self.assertEqual(match['nearest'], [])
+        self.assertEqual(len(messages), 2)
+        messages = []
+        self.assertIsNone(check_match({'exact': ['sex']}, self.md, [],
+                                      self.nulls, messages))
+        self.assertIsNone(check_match(dict(self.match_dict, ratio=0),
+                                      self.md, ['age', 'bmi'], self.nulls,
+                                      messages))
+        self.assertIsNone(check_match(dict(self.match_dict, caliper='x'),
+                                      self.md, ['age', 'bmi'], self.nulls,
+                                      messages))
+        self.assertEqual(len(messages), 3)
+
+    def test_get_match_pairs(self):
+        case_x = np.array([[0.], [1.], [10.]])
+        control_x = np.array([[0.9], [0.2], [3.], [1.1], [20.]])
+        # case 1 is closer to control 0 than to control 3 (taken first)
+        case_pos, control_pos, distance = get_match_pairs(
+            case_x, control_x, 1, np.inf)
+        self.assertEqual(case_pos.tolist(), [0, 1, 2])
+        self.assertEqual(control_pos.tolist(), [1, 0, 2])
+        np.testing.assert_array_almost_equal(distance, [0.2, 0.1, 7.])
+        # two controls per case within the caliper: control 3 goes to
+        # case 1 and control 2 is too far from case 0
+        case_pos, control_pos, distance = get_match_pairs(
+            case_x, control_x, 2, 2.5)
+        self.assertEqual(sorted(zip(case_pos.tolist(),
+                                    control_pos.tolist())),
+                         [(0, 1), (1, 0), (1, 3)])
+        case_pos, _, _ = get_match_pairs(case_x, control_x[:0], 1, np.inf)
+        self.assertEqual(case_pos.size, 0)
+
+    def test_get_match_pairs_many(self):
+        rng = np.random.RandomState(0)
+        case_x = rng.normal(size=(300, 2))
+        control_x = rng.normal(size=(400, 2))
+        case_pos, control_pos, distance = get_match_pairs(
+            case_x, control_x, 1, np.inf)
+        # all the cases matched, each control once
+        self.assertEqual(sorted(case_pos.tolist()), list(range(300)))
+        self.assertEqual(len(set(control_pos.tolist())), 300)
+        np.testing.assert_array_almost_equal(distance, np.sqrt((
+            (case_x[case_pos] - control_x[control_pos]) ** 2).sum(axis=1)))
+
+    def test_get_match_columns(self):
+        match = check_match(self.match_dict, self.md, ['age', 'bmi'],
+                            self.nulls, [])
+        complete, strata, x = get_match_columns(self.md, match, self.nulls)
+        self.assertEqual(complete.tolist(), [True] * 7 + [False, False])
+        self.assertEqual(strata.tolist(), [0, 0, 0, 1, 1, 1, 1])
+        np.testing.assert_array_almost_equal(x.mean(axis=0), [0, 0])
+        np.testing.assert_array_almost_equal(x.std(axis=0), [1, 1])
+        match['exact'], match['nearest'] = ['sex'], []
+        complete, strata, x = get_match_columns(self.md, match, self.nulls)
+        self.assertEqual(complete.sum(), 8)
+        self.assertEqual(x.shape, (8, 1))
+
+    def test_match_samples(self):
+        match = check_match(self.match_dict, self.md, ['age', 'bmi'],
+                            self.nulls, [])
+        matched, flowchart = match_samples(
+            self.md, match, ['age', 'bmi'], self.nulls, [])
+        self.assertEqual(matched.index.tolist(), ['s0', 's1', 's4', 's5'])
+        self.assertEqual(matched['match_id'].tolist(),
+                         ['s0', 's0', 's4', 's4'])
+        self.assertEqual(matched['match_role'].tolist(),
+                         ['case', 'control', 'case', 'control'])
+        self.assertEqual(matched['match_distance'].tolist()[0], 0)
+        self.assertEqual(flowchart, [
+            ['match metadata', 9, None, None, None],
+            ['cases: ibd', 3, 'ibd', 'yes', '1'],
+            ['complete cases', 2, 'sex\nage\nbmi', None, None],
+            ['matched cases', 2, 'sex\nage\nbmi', '1:1', None],
+            ['matched samples', 4, 'sex\nage\nbmi', '1:1', None]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import check_criteria, apply_criteria
+from Xclusion_criteria.xclusion_factors import get_md_factors, get_factors
+from Xclusion_criteria.xclusion_overlaps import get_failures_bits
+from Xclusion_criteria.xclusion_no_nan import (
+    get_plan_masks,
+    get_nulls_mask,
+    get_no_nan_candidates,
+    get_popcounts,
+    get_exhaustive_plan,
+    get_greedy_plan,
+    get_no_nan_plan,
+    get_plan_suggestion
+)
+
+
+class TestNoNan(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'sex': ['female', 'male', 'missing', 'female', np.nan, 'male',
+                    'female', 'male'],
+            'bmi': [20., np.nan, 25., np.nan, 30., 22., np.nan, 27.],
+            'diet': ['Omnivore', 'Vegan', 'nan', 'Vegan', 'Omnivore',
+                     np.nan, 'Omnivore', 'Vegan'],
+            'age': [25., 40., 35., 70., 33., 18., 45., 60.],
+        }, index=pd.Index(['s%s' % x for x in range(8)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+        self.md_factors = get_md_factors(self.md)
+        self.all_mask = np.ones(8, dtype=bool)
+
+    def test_get_plan_masks(self):
+        criteria_masks = [
+            ('init', 'age', np.array([1, 1, 1, 0, 1, 1, 1, 1], dtype=bool)),
+            ('add', 'sex', np.array([0, 0, 0, 1, 0, 1, 0, 0], dtype=bool)),
+            ('no_nan', 'bmi', np.array([1, 0, 1, 0, 1, 1, 0, 1], dtype=bool)),
+            ('filter', 'diet',
+             np.array([1, 1, 1, 1, 0, 1, 1, 1], dtype=bool))]
+        base_mask, add_count = get_plan_masks(criteria_masks, 8)
+        # s3 fails "init", s4 fails "filter", s5 is re-added
+        self.assertEqual(base_mask.tolist(), [
+            True, True, True, False, False, False, True, True])
+        self.assertEqual(add_count, 1)
+
+    def test_get_nulls_mask(self):
+        # factors already known, or compared on the column
+        get_factors('sex', self.md, self.md_factors)
+        for md_factors in [self.md_factors, get_md_factors(self.md)]:
+            self.assertEqual(get_nulls_mask(
+                'sex', self.md, md_factors, self.nulls,
+                self.all_mask).tolist(), [
+                False, False, True, False, True, False, False, False])
+        self.assertEqual(get_nulls_mask(
+            'diet', self.md, self.md_factors, self.nulls,
+            self.all_mask).tolist(), [
+            False, False, True, False, False, True, False, False])
+        # only for the passed samples, np.nan only if "nan" is a null
+        base_mask = np.array([1, 1, 1, 1, 0, 0, 0, 0], dtype=bool)
+        self.assertEqual(get_nulls_mask(
+            'sex', self.md, self.md_factors, self.nulls,
+            base_mask).tolist(), [False, False, True, False])
+        self.assertEqual(get_nulls_mask(
+            'bmi', self.md, self.md_factors, ['missing'],
+            base_mask).tolist(), [False] * 4)
+
+    def test_get_no_nan_candidates(self):
+        messages = []
+        self.assertEqual(get_no_nan_candidates(
+            self.md, (), self.md_factors, self.nulls, self.all_mask,
+            messages), ['sex', 'bmi', 'diet'])
+        self.assertEqual(get_no_nan_candidates(
+            self.md, ('age', 'bmi', 'age', 'foo'), self.md_factors,
+            self.nulls, self.all_mask, messages), ['age', 'bmi'])
+        self.assertEqual(len(messages), 1)
+
+    def test_get_popcounts(self):
+        self.assertEqual(get_popcounts(np.array([0, 1, 6, 255, 256, 1 << 20,
+                                                 (1 << 21) - 1])).tolist(),
+                         [0, 1, 2, 8, 1, 1, 21])
+
+    def test_get_exhaustive_plan(self):
+        patterns = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 1], [0, 0, 1]],
+                            dtype=bool)
+        weights = np.array([4, 1, 2, 3])
+        plan = get_exhaustive_plan(patterns, weights, ['a', 'b', 'c'])
+        self.assertEqual(plan, [(0, 10, []), (1, 9, ['a']),
+                                (2, 7, ['a', 'b']), (3, 4, ['a', 'b', 'c'])])
+
+    def test_get_greedy_plan(self):
+        # greedy path can be worse than the best list: "a" and "b" miss
+        # 3 samples each, "c" misses 2, all different from those of "a|b"
+        masks = [(None, 'a', np.array([0, 0, 0, 1, 1, 1, 1, 1, 1, 1])),
+                 (None, 'b', np.array([0, 0, 0, 1, 1, 1, 1, 1, 1, 1])),
+                 (None, 'c', np.array([1, 1, 1, 0, 0, 1, 1, 1, 1, 1]))]
+        masks = [(s, v, m.astype(bool)) for s, v, m in masks]
+        bits = get_failures_bits(masks, 10)
+        plan = get_greedy_plan(bits, np.ones(10, dtype=int),
+                               ['a', 'b', 'c'])
+        self.assertEqual(plan, [(0, 10, []), (1, 8, ['c']),
+                                (2, 5, ['c', 'a']), (3, 5, ['c', 'a', 'b'])])
+        patterns = np.unpackbits(bits, axis=1, count=3).astype(bool)
+        plan = get_exhaustive_plan(patterns, np.ones(10), ['a', 'b', 'c'])
+        self.assertEqual(plan[2], (2, 7, ['a', 'b']))
+
+    def test_get_greedy_plan_many(self):
+        # same counts as the exhaustive plan for nested missing values
+        rng = np.random.RandomState(0)
+        n_cands = 24
+        names = ['v%s' % x for x in range(n_cands)]
+        levels = rng.random_sample(1000)
+        masks = [(None, names[x], levels > (x + 1) / 100.)
+                 for x in range(n_cands)]
+        bits = get_failures_bits(masks, 1000)
+        plan = get_greedy_plan(bits, np.ones(1000, dtype=int), names)
+        self.assertEqual([x[1] for x in plan], [1000] + [
+            int((levels > (x + 1) / 100.).sum()) for x in range(n_cands)])
+        self.assertEqual(plan[3][2], ['v0', 'v1', 'v2'])
+
+    def test_get_no_nan_plan(self):
+        criteria = check_criteria({
+            'init': {'age,2': [['18', '65']]},
+            'no_nan': ['bmi', 'sex']
+        }, self.md, self.nulls, ['bmi', 'age'])
+        criteria_masks = []
+        apply_criteria(self.md, criteria, ['bmi', 'age'], [],
+                       self.md_factors, None, criteria_masks)
+        base_mask, add_count = get_plan_masks(criteria_masks, 8)
+        plan = get_no_nan_plan(self.md, ['sex', 'bmi', 'diet'],
+                               self.md_factors, self.nulls, base_mask,
+                               add_count)
+        self.assertEqual(plan.columns.tolist(), [
+            'variables', 'retained', 'method', 'no_nan'])
+        self.assertEqual(plan['retained'].tolist(), [7, 5, 4, 2])
+        self.assertEqual(plan['no_nan'].tolist(), [
+            '', 'sex', 'sex,diet', 'sex,bmi,diet'])
+        self.assertEqual(set(plan['method']), {'exhaustive'})
+        # same as the included samples of the run with this list
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['bmi', 'age'], [])
+        self.assertEqual(included.shape[0], 3)
+        empty = get_no_nan_plan(self.md, [], self.md_factors, self.nulls,
+                                base_mask, add_count)
+        self.assertEqual(empty['retained'].tolist(), [7])
+
+    def test_get_plan_suggestion(self):
+        plan = pd.DataFrame({'variables': [0, 1, 2], 'retained': [9, 6, 3],
+                             'method': ['greedy'] * 3,
+                             'no_nan': ['', 'a', 'a,b']})
+        self.assertEqual(get_plan_suggestion(plan, 5)['no_nan'], 'a')
+        self.assertEqual(get_plan_suggestion(plan, 3)['no_nan'], 'a,b')
+        self.assertIsNone(get_plan_suggestion(plan, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import check_criteria, apply_criteria
+from Xclusion_criteria.xclusion_outliers import (
+    get_outliers_params,
+    get_strata_variables,
+    has_outliers_criteria,
+    get_strata,
+    get_moments,
+    merge_moments,
+    get_strata_quantiles,
+    init_outliers_stats,
+    update_outliers_stats,
+    get_outliers_bounds,
+    get_table_bounds,
+    get_criteria_bounds,
+    get_outliers_mask
+)
+
+
+class TestOutliers(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'sex': ['female', 'male'] * 5 + [np.nan],
+            'bmi': [20., 21., 22., 23., 21., 22., 20., 24., 50., 60., np.nan],
+        }, index=pd.Index(['s%s' % x for x in range(11)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+
+    def test_get_outliers_params(self):
+        self.assertEqual(get_outliers_params(['iqr']), {
+            'method': 'iqr', 'numbers': [1.5], 'by': []})
+        self.assertEqual(get_outliers_params(['percentile', 5, 'sex', 'x']), {
+            'method': 'percentile', 'numbers': [5., 99.], 'by': ['sex', 'x']})
+        self.assertEqual(get_outliers_params(['zscore', '2.5', 'sex']), {
+            'method': 'zscore', 'numbers': [2.5], 'by': ['sex']})
+        for values in [[], ['mad'], ['zscore', 3, 4], ['zscore', -1],
+                       ['percentile', 90, 10], ['percentile', 1, 101]]:
+            self.assertIsNone(get_outliers_params(values))
+
+    def test_get_strata_variables(self):
+        self.assertEqual(get_strata_variables('7', ['iqr', 'sex']), ['sex'])
+        self.assertEqual(get_strata_variables('1', ['iqr', 'sex']), [])
+        self.assertEqual(get_strata_variables('7', ['mad']), [])
+
+    def test_has_outliers_criteria(self):
+        criteria = {'init': {('sex', '1'): ['male']}}
+        self.assertFalse(has_outliers_criteria(criteria))
+        criteria['predicates'] = {'lean': {('bmi', '7'): ['iqr']}}
+        self.assertTrue(has_outliers_criteria(criteria))
+
+    def test_get_strata(self):
+        self.assertIsNone(get_strata(self.md, []))
+        strata = get_strata(self.md, ['sex'])
+        self.assertEqual(strata[0], ('female',))
+        self.assertEqual(strata[-1], ('nan',))
+
+    def test_get_moments(self):
+        column = np.array([1., 3., np.nan, 2., 4., 9.])
+        codes = np.array([0, 0, 0, 1, 1, 1])
+        count, mean, m2 = get_moments(column, codes, 3)
+        self.assertEqual(count.tolist(), [2, 3, 0])
+        np.testing.assert_array_almost_equal(mean, [2, 5, 0])
+        np.testing.assert_array_almost_equal(m2, [2, 26, 0])
+
+    def test_merge_moments(self):
+        rng = np.random.RandomState(0)
+        column = rng.normal(10, 2, 1000)
+        codes = rng.randint(0, 3, 1000)
+        merged = tuple(np.zeros(3) for _ in range(3))
+        for chunk in np.array_split(np.arange(1000), 7):
+            merged = merge_moments(merged, get_moments(
+                column[chunk], codes[chunk], 3))
+        for moments, expected in zip(merged, get_moments(column, codes, 3)):
+            np.testing.assert_array_almost_equal(moments, expected)
+
+    def test_get_strata_quantiles(self):
+        rng = np.random.RandomState(0)
+        column = rng.normal(size=1000)
+        column[::10] = np.nan
+        codes = rng.randint(0, 4, 1000)
+        quantiles = get_strata_quantiles(column, codes, 5, [.01, .25, .9])
+        for code in range(4):
+            np.testing.assert_array_almost_equal(
+                quantiles[code], np.nanquantile(
+                    column[codes == code], [.01, .25, .9]))
+        self.assertTrue(np.isnan(quantiles[4]).all())
+
+    def test_update_outliers_stats(self):
+        # same bounds whether the values are read at once or in chunks
+        for values in [['zscore', 1, 'sex'], ['iqr', 1, 'sex'],
+                       ['percentile', 10, 90]]:
+            params = get_outliers_params(values)
+            stats = init_outliers_stats(params)
+            for start in range(0, 11, 3):
+                chunk = self.md.iloc[start:(start + 3)]
+                update_outliers_stats(stats, chunk['bmi'].values,
+                                      get_strata(chunk, params['by']))
+            bounds = get_outliers_bounds(stats)
+            expected = get_table_bounds(self.md, 'bmi', params)
+            if params['by']:
+                order = bounds['labels'].get_indexer(expected['labels'])
+                self.assertEqual(order.tolist(), [0, 1, 2])
+            for key in ['low', 'high']:
+                np.testing.assert_array_almost_equal(bounds[key],
+                                                     expected[key])
+
+    def test_get_outliers_bounds(self):
+        bounds = get_table_bounds(self.md, 'bmi', get_outliers_params(
+            ['iqr', 1.5, 'sex']))
+        self.assertEqual(bounds['labels'].tolist(), [
+            ('female',), ('male',), ('nan',)])
+        # female: 20, 22, 21, 20, 50 (quartiles 20 and 22)
+        np.testing.assert_array_almost_equal(bounds['low'][:2], [17, 19])
+        np.testing.assert_array_almost_equal(bounds['high'][:2], [25, 27])
+        # no values (or a single one) in the stratum: no bounds
+        self.assertTrue(np.isnan(bounds['low'][2]))
+        bounds = get_table_bounds(self.md, 'bmi', get_outliers_params(
+            ['zscore', 1]))
+        bmi = self.md['bmi'].dropna()
+        np.testing.assert_array_almost_equal(
+            bounds['high'], [bmi.mean() + bmi.std()])
+
+    def test_get_outliers_mask(self):
+        mask = get_outliers_mask(self.md, 'bmi', ['iqr', 1.5, 'sex'])
+        # the outlier of each sex removed, np.nan kept
+        self.assertEqual(np.flatnonzero(~mask).tolist(), [8, 9])
+        mask = get_outliers_mask(self.md, 'bmi', ['percentile', 0, 50])
+        self.assertEqual(mask.sum(), 7)
+        # bounds reused from another table, e.g. in a shard
+        md_factors = {'outliers': get_criteria_bounds(self.md, {
+            'init': {('bmi', '7'): ['iqr', 1.5, 'sex']}}, ['bmi'])}
+        mask = get_outliers_mask(self.md.iloc[8:], 'bmi',
+                                 ['iqr', 1.5, 'sex'], md_factors)
+        self.assertEqual(mask.tolist(), [False, False, True])
+
+    def test_apply_criteria(self):
+        messages = []
+        criteria = check_criteria({
+            'init': {'bmi,7': ['iqr', 1.5, 'sex'],
+                     'sex,7': ['zscore']},
+            'add': {'bmi,7': ['zscore', 1, 'foo']},
+            'filter': {'bmi,7': ['mad']}
+        }, self.md, self.nulls, messages)
+        self.assertEqual(list(criteria), ['init'])
+        self.assertEqual(messages[0], 'Strata variable(s) for variable bmi '
+                                      'not in metadata (skipped)\n - foo')
+        self.assertEqual(len(messages), 2)
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['bmi'], messages)
+        self.assertEqual(flowcharts['init'][1], [
+            'No_bmi_outliers', 9, 'bmi', 'iqr\n1.5\nsex', '7'])
+        self.assertEqual(messages[-1], 'Metadata variable sex is not '
+                                       'numerical (skipping)')
+        self.assertEqual(included.shape[0], 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
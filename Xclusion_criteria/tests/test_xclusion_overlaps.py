@@ -0,0 +1,87 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+
+from pandas.testing import assert_frame_equal
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criteria_masks)
+from Xclusion_criteria.xclusion_overlaps import (
+    get_failures_bits,
+    get_included_patterns,
+    get_overlaps,
+    write_overlaps,
+    read_overlaps
+)
+
+
+class TestOverlaps(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA', 'UK'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male',
+                    'female'],
+            'age': [25., 40., np.nan, 70., 33., 18., 45.],
+        }, index=pd.Index(['s%s' % x for x in range(7)], name='sample_name'))
+        criteria = check_criteria({
+            'init': {'country,1': ['USA', 'UK'], 'age,2': ['[18,50)']},
+            'add': {'sex,1': ['male']},
+            'filter': {'sex,1': ['female']}
+        }, self.md, ['missing', 'nan'], [])
+        self.criteria_masks = []
+        _, self.filter_mask, self.add_mask = get_criteria_masks(
+            self.md, criteria, ['age'], [],
+            criteria_masks=self.criteria_masks)
+
+    def test_get_failures_bits(self):
+        rng = np.random.RandomState(0)
+        criteria_masks = [('init', str(x), rng.rand(50) > 0.3)
+                          for x in range(19)]
+        obs = get_failures_bits(criteria_masks, 50)
+        exp = np.packbits(~np.stack([x[2] for x in criteria_masks], axis=1),
+                          axis=1)
+        np.testing.assert_array_equal(obs, exp)
+
+    def test_get_included_patterns(self):
+        patterns = np.array([[0, 0, 1, 0], [0, 0, 0, 1], [1, 0, 0, 0],
+                             [0, 0, 1, 1]], dtype=bool)
+        obs = get_included_patterns(patterns,
+                                    ['init', 'init', 'add', 'filter'])
+        self.assertEqual(obs.tolist(), [True, True, False, False])
+
+    def test_get_overlaps(self):
+        overlaps = get_overlaps(self.criteria_masks, self.md.shape[0])
+        self.assertEqual(overlaps.columns.tolist(), [
+            'init: country', 'init: Range_age', 'add: sex', 'filter: sex',
+            'failed', 'included', 'samples'])
+        self.assertEqual(overlaps['samples'].sum(), self.md.shape[0])
+        self.assertEqual(
+            overlaps.loc[overlaps['included'], 'samples'].sum(),
+            (self.filter_mask | self.add_mask).sum())
+        # s1, s5: males only failing "filter" (re-added by "add")
+        self.assertEqual(overlaps.iloc[0].tolist(),
+                         [0, 0, 0, 1, 1, True, 2])
+        # s0, s6: females only failing "add"
+        self.assertEqual(overlaps.iloc[1].tolist(),
+                         [0, 0, 1, 0, 1, True, 2])
+
+    def test_write_read_overlaps(self):
+        overlaps = get_overlaps(self.criteria_masks, self.md.shape[0])
+        with tempfile.TemporaryDirectory() as tmp:
+            write_overlaps(overlaps, '%s/overlaps.tsv' % tmp)
+            assert_frame_equal(read_overlaps('%s/overlaps.tsv' % tmp),
+                               overlaps, check_dtype=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
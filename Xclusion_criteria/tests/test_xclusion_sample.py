@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_sample import (
+    get_sampled_path,
+    check_sample,
+    get_proportional_quotas,
+    get_balanced_quotas,
+    get_groups,
+    get_sample_rows,
+    sample_samples
+)
+
+
+class TestSample(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.md = pd.DataFrame({
+            'country': ['USA'] * 60 + ['UK'] * 30 + ['Canada'] * 10,
+            'sex': (['female', 'male'] * 50)[:99] + [np.nan],
+            'bmi': rng.uniform(15, 40, 100),
+        }, index=pd.Index(['s%s' % x for x in range(100)],
+                          name='sample_name'))
+
+    def test_get_sampled_path(self):
+        self.assertEqual(get_sampled_path('out/in.tsv'),
+                         'out/in_sampled.tsv')
+
+    def test_check_sample(self):
+        messages = []
+        sample = check_sample({'by': ['country', 'foo'], 'size': '10',
+                               'weight': 'sex'}, self.md, ['bmi'], messages)
+        self.assertEqual(sample, {
+            'by': ['country'], 'weight': None, 'allocation': 'proportional',
+            'size': 10, 'per_group': None, 'seed': 12345})
+        self.assertEqual(len(messages), 2)
+        messages = []
+        self.assertIsNone(check_sample({'by': 'country'}, self.md, [],
+                                       messages))
+        self.assertIsNone(check_sample({'size': 5, 'allocation': 'equal'},
+                                       self.md, [], messages))
+        self.assertIsNone(check_sample({'per_group': 'x'}, self.md, [],
+                                       messages))
+        self.assertIsNone(check_sample({'size': -1}, self.md, [], messages))
+        self.assertEqual(len(messages), 4)
+
+    def test_get_proportional_quotas(self):
+        quotas = get_proportional_quotas(np.array([60, 30, 10, 0]), 15)
+        # the tied remainders (4.5 and 1.5) favour the first group
+        self.assertEqual(quotas.tolist(), [9, 5, 1, 0])
+        quotas = get_proportional_quotas(np.array([5, 3]), 10)
+        self.assertEqual(quotas.tolist(), [5, 3])
+
+    def test_get_balanced_quotas(self):
+        rng = np.random.RandomState(0)
+        quotas = get_balanced_quotas(np.array([60, 30, 10, 2]), 30, rng)
+        self.assertEqual(quotas.tolist(), [9, 9, 10, 2])
+        quotas = get_balanced_quotas(np.array([60, 30, 10, 2]), 31, rng)
+        self.assertEqual(quotas.tolist(), [10, 9, 10, 2])
+        quotas = get_balanced_quotas(np.array([60, 30]), 100, rng)
+        self.assertEqual(quotas.tolist(), [60, 30])
+
+    def test_get_groups(self):
+        groups = get_groups(self.md, ['country', 'sex'])
+        self.assertEqual(groups.max(), 6)
+        self.assertEqual(groups[-1], 6)
+        self.assertEqual(get_groups(self.md, []).tolist(), [0] * 100)
+
+    def test_get_sample_rows(self):
+        groups = np.array([0, 0, 0, 1, 1, 1, 1, 2])
+        keys = np.array([.1, .9, .5, .3, -np.inf, .8, .2, .4])
+        rows = get_sample_rows(groups, keys, np.array([2, 3, 0]))
+        self.assertEqual(rows.tolist(), [1, 2, 3, 5, 6])
+        # same rows as sorting all the keys per group
+        rng = np.random.RandomState(0)
+        groups = rng.randint(0, 20, 100000)
+        keys = rng.random_sample(100000)
+        quotas = rng.randint(0, 100, 20)
+        rows = get_sample_rows(groups, keys, quotas)
+        order = np.lexsort((-keys, groups))
+        ranks = np.arange(100000) - np.searchsorted(
+            groups[order], groups[order])
+        self.assertEqual(rows.tolist(), np.sort(
+            order[ranks < quotas[groups[order]]]).tolist())
+
+    def test_sample_samples(self):
+        sample = check_sample({'by': ['country'], 'per_group': 20},
+                              self.md, ['bmi'], [])
+        sampled, flowchart = sample_samples(self.md, sample)
+        self.assertEqual(sampled['country'].value_counts().to_dict(),
+                         {'USA': 20, 'UK': 20, 'Canada': 10})
+        self.assertTrue(sampled.index.isin(self.md.index).all())
+        self.assertEqual(flowchart, [
+            ['sample metadata', 100, None, None, None],
+            ['sampled', 50, 'country', 'proportional', '3 groups']])
+        # same samples for the same seed
+        sampled_bis, _ = sample_samples(self.md, sample)
+        self.assertEqual(sampled.index.tolist(), sampled_bis.index.tolist())
+        sample = check_sample({'size': 30, 'allocation': 'balanced',
+                               'by': ['country'], 'weight': 'bmi'},
+                              self.md, ['bmi'], [])
+        sampled, flowchart = sample_samples(self.md, sample)
+        self.assertEqual(sampled['country'].value_counts().to_dict(),
+                         {'USA': 10, 'UK': 10, 'Canada': 10})
+        self.assertEqual(flowchart[1],
+                         ['weight: bmi', 100, 'bmi', None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
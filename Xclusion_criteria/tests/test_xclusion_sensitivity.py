@@ -0,0 +1,81 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import copy
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criteria_masks)
+from Xclusion_criteria.xclusion_sensitivity import (
+    get_leave_one_out,
+    get_sensitivity
+)
+
+
+class TestSensitivity(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA', 'UK'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male',
+                    'female'],
+            'age': [25., 40., np.nan, 70., 33., 18., 45.],
+        }, index=pd.Index(['s%s' % x for x in range(7)], name='sample_name'))
+        self.criteria_dict = {
+            'init': {'country,1': ['USA', 'UK'], 'age,2': ['[18,50)']},
+            'add': {'sex,1': ['male']},
+            'filter': {'sex,1': ['female']},
+            'no_nan': ['sex']
+        }
+
+    def test_get_leave_one_out(self):
+        masks = [np.array([True, True, False, True]),
+                 np.array([True, False, True, True]),
+                 np.array([False, True, True, True])]
+        leave_one_out, all_mask = get_leave_one_out(masks, 4)
+        self.assertEqual([x.tolist() for x in leave_one_out], [
+            [False, False, True, True],
+            [False, True, False, True],
+            [True, False, False, True]])
+        self.assertEqual(all_mask.tolist(), [False, False, False, True])
+        leave_one_out, all_mask = get_leave_one_out([], 2)
+        self.assertEqual(all_mask.tolist(), [True, True])
+
+    def test_get_sensitivity(self):
+        criteria = check_criteria(self.criteria_dict, self.md,
+                                  ['missing', 'nan'], [])
+        criteria_masks = []
+        get_criteria_masks(self.md, criteria, ['age'], [],
+                           criteria_masks=criteria_masks)
+        sensitivity = get_sensitivity(criteria_masks, self.md.shape[0])
+        self.assertEqual(sensitivity['criterion'].tolist(), [
+            'country', 'Range_age', 'sex', 'No_sex', 'sex'])
+        self.assertEqual(sensitivity['alone'].tolist(), [5, 5, 3, 6, 3])
+        # same as applying the criteria without each criterion
+        without = []
+        for step, key in [('init', ('country', '1')),
+                          ('init', ('age', '2')),
+                          ('add', ('sex', '1')),
+                          ('no_nan', ('sex', '0')),
+                          ('filter', ('sex', '1'))]:
+            cur_criteria = copy.deepcopy(criteria)
+            del cur_criteria[step][key]
+            if not cur_criteria[step]:
+                del cur_criteria[step]
+            _, filter_mask, add_mask = get_criteria_masks(
+                self.md, cur_criteria, ['age'], [])
+            without.append(int((filter_mask | add_mask).sum()))
+        self.assertEqual(sensitivity['without'].tolist(), without)
+        self.assertEqual(sensitivity['gain'].tolist(),
+                         [x - 4 for x in without])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from pandas.testing import assert_frame_equal
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, apply_criteria, get_criteria_masks)
+from Xclusion_criteria.xclusion_shards import (
+    get_shards,
+    get_criteria_columns,
+    merge_flowcharts,
+    get_sharded_criteria_masks,
+    apply_sharded_criteria
+)
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA', 'UK'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male',
+                    'female'],
+            'age': [25., 40., np.nan, 70., 33., 18., 45.],
+            'other': ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        }, index=pd.Index(['s%s' % x for x in range(7)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+        self.criteria_dict = {
+            'init': {'country,0': ['NULLS', 'Canada'],
+                     'age,2': ['[18,50)']},
+            'add': {'country,1': ['UK']},
+            'filter': {'sex,3': ['prefix:fem', 'regex:^m.le$'],
+                       'expression': 'not young'},
+            'predicates': {'young': {'age,2': ['[18,20]']}},
+            'no_nan': ['sex']
+        }
+
+    def test_get_shards(self):
+        self.assertEqual(get_shards(7, 3), [(0, 2), (2, 4), (4, 7)])
+        self.assertEqual(get_shards(2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(get_shards(5, 1), [(0, 5)])
+        # the cuts do not split the rows of a group (-1: no group)
+        groups = np.array([-1, 0, 0, 0, 1, 1, 2])
+        self.assertEqual(get_shards(7, 3, groups), [(0, 1), (1, 4), (4, 7)])
+        self.assertEqual(get_shards(7, 2, groups), [(0, 1), (1, 7)])
+
+    def test_get_criteria_columns(self):
+        criteria = check_criteria(self.criteria_dict, self.md,
+                                  self.nulls, [])
+        self.assertEqual(get_criteria_columns(criteria, self.md),
+                         ['country', 'sex', 'age'])
+
+    def test_merge_flowcharts(self):
+        shards_flowcharts = [
+            {'init': [['init metadata', 3, None, None, None],
+                      ['No_x', 2, 'x', 'a', '0']]},
+            {'init': [['init metadata', 4, None, None, None],
+                      ['No_x', 1, 'x', 'a', '0']]}
+        ]
+        self.assertEqual(merge_flowcharts(shards_flowcharts), {
+            'init': [['init metadata', 7, None, None, None],
+                     ['No_x', 3, 'x', 'a', '0']]})
+
+    def test_apply_sharded_criteria(self):
+        messages = []
+        criteria = check_criteria(self.criteria_dict, self.md,
+                                  self.nulls, messages)
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['age'], messages)
+        for p_shards in [2, 3, 10]:
+            shards_messages = []
+            shards_flowcharts, shards_included = apply_sharded_criteria(
+                self.md, criteria, ['age'], shards_messages, p_shards)
+            self.assertEqual(shards_flowcharts, flowcharts)
+            self.assertEqual(shards_messages, messages)
+            assert_frame_equal(shards_included, included)
+
+    def test_apply_sharded_criteria_outliers(self):
+        # the bounds are computed on all the rows, not per shard
+        criteria = check_criteria({
+            'init': {'age,7': ['iqr', 0.5, 'sex']},
+            'filter': {'expression': 'typical',
+                       'country,1': ['USA', 'UK']},
+            'predicates': {'typical': {'age,7': ['percentile', 10, 90]}}
+        }, self.md, self.nulls, [])
+        self.assertEqual(get_criteria_columns(criteria, self.md),
+                         ['country', 'sex', 'age'])
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['age'], [])
+        for p_shards in [2, 3]:
+            shards_flowcharts, shards_included = apply_sharded_criteria(
+                self.md, criteria, ['age'], [], p_shards)
+            self.assertEqual(shards_flowcharts, flowcharts)
+            assert_frame_equal(shards_included, included)
+
+    def test_apply_sharded_criteria_hosts(self):
+        # the samples of a host are all in the same shard
+        criteria = check_criteria({
+            'init': {'country,0': ['Canada']},
+            'filter': {'sex,8': ['count >= 2', 'max(age) < 60']}
+        }, self.md, self.nulls, [])
+        self.assertEqual(get_criteria_columns(criteria, self.md),
+                         ['country', 'sex', 'age'])
+        flowcharts, included = apply_criteria(
+            self.md, criteria, ['age'], [])
+        self.assertEqual(included.index.tolist(), ['s1', 's2', 's5'])
+        for p_shards in [2, 3, 10]:
+            shards_flowcharts, shards_included = apply_sharded_criteria(
+                self.md, criteria, ['age'], [], p_shards)
+            self.assertEqual(shards_flowcharts, flowcharts)
+            assert_frame_equal(shards_included, included)
+
+    def test_get_sharded_criteria_masks(self):
+        # the masks of each criterion come back from the shards
+        for criteria_dict in [self.criteria_dict, {
+                'init': {'country,0': ['Canada']},
+                'filter': {'sex,8': ['count >= 2', 'max(age) < 60'],
+                           'age,2': ['[18,50)']}}]:
+            criteria = check_criteria(criteria_dict, self.md,
+                                      self.nulls, [])
+            criteria_masks = []
+            get_criteria_masks(self.md, criteria, ['age'], [],
+                               criteria_masks=criteria_masks)
+            for p_shards in [2, 3]:
+                shards_masks = []
+                get_sharded_criteria_masks(self.md, criteria, ['age'], [],
+                                           p_shards,
+                                           criteria_masks=shards_masks)
+                self.assertEqual([x[:2] for x in shards_masks],
+                                 [x[:2] for x in criteria_masks])
+                for (_, _, obs), (_, _, exp) in zip(shards_masks,
+                                                    criteria_masks):
+                    np.testing.assert_array_equal(obs, exp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import sqlite3
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+
+from pandas.testing import assert_frame_equal
+
+from Xclusion_criteria.xclusion_io import read_meta_pd
+from Xclusion_criteria.xclusion_dtypes import (
+    get_dtypes, split_variables_types, replace_tf)
+from Xclusion_criteria.xclusion_crits import check_criteria, apply_criteria
+from Xclusion_criteria.xclusion_sql import (
+    get_database,
+    get_sql_factors,
+    drop_sql_null_columns,
+    get_sql_types,
+    get_sql_criteria,
+    apply_sql_criteria,
+    get_sql_included,
+    write_sql_excluded,
+    get_sql_outliers_bounds
+)
+
+
+class TestSql(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male'],
+            'age': [25., 40., 'missing', 70., 33., 18.]
+        }, index=pd.Index(['s%s' % x for x in range(6)], name='sample_name'))
+        self.nulls = ['missing', 'nan']
+        self.criteria_dict = {
+            'init': {'country,0': ['NULLS', 'Canada'],
+                     'age,2': ['[18,50)']},
+            'add': {'country,1': ['UK']},
+            'filter': {'sex,3': ['prefix:fem', 'regex:^m.le$'],
+                       'expression': 'not uk'},
+            'predicates': {'uk': {'country,1': ['UK']}},
+            'no_nan': ['sex']
+        }
+        self.handle = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        con = sqlite3.connect(self.handle.name)
+        self.md.reset_index().to_sql('metadata', con, index=False)
+        con.close()
+
+    def tearDown(self):
+        self.handle.close()
+
+    def test_apply_sql_criteria(self):
+        messages = []
+        md = self.md.copy()
+        md['age'] = md['age'].replace('missing', np.nan).astype(float)
+        criteria = check_criteria(self.criteria_dict, md, self.nulls,
+                                  messages)
+        flowcharts, included = apply_criteria(md, criteria, ['age'], messages)
+
+        sql_messages = []
+        database = get_database(self.handle.name, 'metadata')
+        self.assertEqual(database['index'], 'sample_name')
+        self.assertEqual(database['columns'], ['country', 'sex', 'age'])
+        sql_criteria, md_factors, numerical = get_sql_criteria(
+            self.criteria_dict, database, self.nulls, sql_messages)
+        self.assertEqual(numerical, ['age'])
+        sql_flowcharts, conditions = apply_sql_criteria(
+            database, sql_criteria, numerical, sql_messages, md_factors)
+        self.assertEqual(sql_flowcharts, flowcharts)
+        self.assertEqual(sql_messages, messages)
+
+        sql_included = get_sql_included(database, conditions)
+        self.assertEqual(sql_included.index.tolist(),
+                         included.index.tolist())
+        with tempfile.NamedTemporaryFile(suffix='.tsv') as o_excluded:
+            n_excluded = write_sql_excluded(
+                database, conditions, o_excluded.name)
+            excluded = pd.read_csv(o_excluded.name, sep='\t', index_col=0)
+        self.assertEqual(n_excluded, 6 - included.shape[0])
+        self.assertEqual(sorted(excluded.index.tolist() +
+                                sql_included.index.tolist()),
+                         sorted(self.md.index.tolist()))
+
+    def test_apply_sql_criteria_outliers(self):
+        md = self.md.copy()
+        md['age'] = md['age'].replace('missing', np.nan).astype(float)
+        criteria_dict = {'init': {'age,7': ['percentile', 10, 90, 'sex']},
+                         'filter': {'age,7': ['zscore', 1]}}
+        criteria = check_criteria(criteria_dict, md, self.nulls, [])
+        flowcharts, included = apply_criteria(md, criteria, ['age'], [])
+        database = get_database(self.handle.name, 'metadata')
+        sql_criteria, md_factors, numerical = get_sql_criteria(
+            criteria_dict, database, self.nulls, [])
+        sql_flowcharts, conditions = apply_sql_criteria(
+            database, sql_criteria, numerical, [], md_factors)
+        self.assertEqual(sql_flowcharts, flowcharts)
+        self.assertEqual(get_sql_included(database, conditions).index.tolist(),
+                         included.index.tolist())
+        # the bounds are the same when the table is read in chunks
+        bounds = get_sql_outliers_bounds(
+            database, 'age', ['percentile', 10, 90, 'sex'], 2)
+        self.assertEqual(bounds['labels'].tolist(), [
+            ('female',), ('male',), ('missing',)])
+        np.testing.assert_array_almost_equal(bounds['low'], [29.5, 20.2, 33])
+
+    def test_get_sql_criteria_ids(self):
+        messages = []
+        database = get_database(self.handle.name, 'metadata')
+        criteria, _, _ = get_sql_criteria(
+            {'init': {'sample_name,5': ['ids.txt'], 'sex,1': ['male']},
+             'filter': {'sex,8': ['count >= 2']}},
+            database, self.nulls, messages)
+        self.assertEqual(criteria, {'init': {('sex', '1'): ['male']}})
+        self.assertEqual(messages, [
+            'IDs files criteria for variable sample_name are not '
+            'supported on a database (skipped)',
+            'Host criteria for variable sex are not supported on a '
+            'database (skipped)'])
+
+    def test_get_sql_types(self):
+        # same variables, dtypes and values as the metadata read with pandas
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = '%s/md.tsv' % tmp
+            with open(tsv, 'w') as o:
+                o.write('sample_name\tsite\tcountry\tage\tdog\tempty\tn\n'
+                        's0\tgut\tUSA\t25\tTrue\t\t1\n'
+                        's1\tgut\tUK\tmissing\tFalse\t\t2\n'
+                        's2\tgut\tUSA\t\t\t\t3\n')
+            metadata = read_meta_pd(tsv)
+            numerical, categorical = [], []
+            split_variables_types(get_dtypes(metadata, self.nulls),
+                                  numerical, categorical)
+            replace_tf(metadata, categorical)
+            db = '%s/md.sqlite' % tmp
+            con = sqlite3.connect(db)
+            pd.read_csv(tsv, sep='\t', dtype=str).to_sql(
+                'metadata', con, index=False)
+            con.close()
+            database = get_database(db, 'metadata')
+            md_factors = get_sql_factors(database, set(database['columns']))
+            drop_sql_null_columns(database, md_factors)
+            self.assertNotIn('empty', md_factors['positions'])
+            md_types = get_sql_types(database, md_factors, self.nulls)
+            self.assertEqual(md_types['numerical'], numerical)
+            self.assertEqual(md_types['categorical'], categorical)
+            included = get_sql_included(database, {
+                'filter': "country = 'USA'", 'add': None}, md_types)
+            assert_frame_equal(included, metadata.loc[['s0', 's2']])
+            self.assertEqual(included['dog'].fillna('').tolist(), ['Yes', ''])
+            database['con'].close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criteria_masks, get_included)
+from Xclusion_criteria.xclusion_factors import get_md_factors
+from Xclusion_criteria.xclusion_strata import (
+    get_strata_path,
+    get_strata_codes,
+    get_step_strata,
+    get_strata_flowchart
+)
+
+
+class TestStrata(unittest.TestCase):
+
+    def setUp(self):
+        self.md = pd.DataFrame({
+            'country': ['USA', 'UK', 'USA', np.nan, 'Canada', 'USA', 'UK'],
+            'sex': ['female', 'male', 'male', 'female', 'missing', 'male',
+                    'female'],
+            'age': [25., 40., np.nan, 70., 33., 18., 45.],
+        }, index=pd.Index(['s%s' % x for x in range(7)], name='sample_name'))
+        self.criteria = check_criteria({
+            'init': {'country,1': ['USA', 'UK'], 'age,2': ['[18,50)']},
+            'add': {'sex,1': ['male']},
+            'filter': {'sex,1': ['female']},
+            'no_nan': ['sex']
+        }, self.md, ['missing', 'nan'], [])
+
+    def test_get_strata_path(self):
+        self.assertEqual(get_strata_path('out/in.tsv', 'sex'),
+                         'out/in_flowchart_by_sex.tsv')
+
+    def test_get_strata_codes(self):
+        codes, strata = get_strata_codes(
+            'country', self.md, get_md_factors(self.md))
+        self.assertEqual(strata, ['USA', 'UK', 'Canada', 'nan'])
+        self.assertEqual(codes.tolist(), [0, 1, 0, 3, 2, 0, 1])
+
+    def test_get_step_strata(self):
+        masks = [np.array([True, True, False, True, False]),
+                 np.array([True, False, True, True, True])]
+        input_mask = np.array([True, True, True, False, True])
+        codes = np.array([0, 1, 0, 1, 1])
+        obs = get_step_strata(masks, input_mask, codes, 2)
+        self.assertEqual(obs.tolist(), [[2, 2], [1, 1], [1, 0]])
+
+    def test_get_strata_flowchart(self):
+        criteria_masks = []
+        flowcharts, filter_mask, add_mask = get_criteria_masks(
+            self.md, self.criteria, ['age'], [],
+            criteria_masks=criteria_masks)
+        get_included(self.md, flowcharts, filter_mask, add_mask, [])
+        codes, strata = get_strata_codes(
+            'sex', self.md, get_md_factors(self.md))
+        strata_pd = get_strata_flowchart(criteria_masks, codes, strata)
+        self.assertEqual(strata_pd.columns.tolist(), [
+            'step', 'criterion', 'female', 'male', 'missing'])
+        # same rows as the flowcharts and the strata sum to their counts
+        rows = [(step, row[0]) for step in flowcharts
+                for row in flowcharts[step]]
+        self.assertEqual(
+            list(zip(strata_pd['step'], strata_pd['criterion'])), rows)
+        self.assertEqual(
+            strata_pd[strata].sum(axis=1).tolist(),
+            [row[1] for step in flowcharts for row in flowcharts[step]])
+        # included: s0 and s6 (female), s1 and s5 (male re-added)
+        self.assertEqual(strata_pd.iloc[-1][strata].tolist(), [2, 2, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
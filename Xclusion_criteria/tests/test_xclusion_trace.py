@@ -0,0 +1,48 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import json
+import unittest
+import tempfile
+
+from Xclusion_criteria.xclusion_trace import (
+    get_trace,
+    trace_phase,
+    write_trace
+)
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_trace_phase(self):
+        self.assertIsNone(get_trace(None))
+        with trace_phase(None, 'nothing') as args:
+            args['rows_in'] = 1
+        self.assertEqual(args, {'rows_in': 1})
+
+        trace = get_trace('trace.json')
+        with trace_phase(trace, 'phase') as args:
+            args['rows_in'] = 10
+            args['rows_out'] = 5
+        events = [x for x in trace['traceEvents'] if x['ph'] == 'X']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['name'], 'phase')
+        self.assertEqual(events[0]['cat'], 'phase')
+        self.assertEqual(events[0]['args']['rows_in'], 10)
+        self.assertEqual(events[0]['args']['rows_out'], 5)
+        for key in ['wall_s', 'cpu_s', 'peak_rss_mb']:
+            self.assertIn(key, events[0]['args'])
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as handle:
+            write_trace(trace, handle.name)
+            written = json.load(open(handle.name))
+        self.assertEqual(written['traceEvents'], trace['traceEvents'])
+
+
+if __name__ == '__main__':
+    unittest.main()
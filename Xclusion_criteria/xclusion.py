@@ -6,12 +6,47 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import os
 import sys
+import pandas as pd
 import pkg_resources
 
-from Xclusion_criteria.xclusion_io import read_meta_pd, parse_plot_groups, fetch_data
-from Xclusion_criteria.xclusion_dtypes import get_dtypes, split_variables_types, check_num_cat_lists
-from Xclusion_criteria.xclusion_crits import get_criteria, apply_criteria
+from Xclusion_criteria.xclusion_io import read_meta_pd, read_i_criteria, parse_plot_groups, fetch_data
+from Xclusion_criteria.xclusion_dtypes import get_dtypes, split_variables_types, check_num_cat_lists, replace_tf
+from Xclusion_criteria.xclusion_crits import get_criteria, get_criteria_masks, get_included
+from Xclusion_criteria.xclusion_factors import get_md_factors, get_rows, get_counts
+from Xclusion_criteria.xclusion_trace import get_trace, trace_phase, write_trace
+from Xclusion_criteria.xclusion_arrow import check_arrow
+from Xclusion_criteria.xclusion_shards import get_sharded_criteria_masks
+from Xclusion_criteria.xclusion_hosts import has_hosts_criteria
+from Xclusion_criteria.xclusion_sensitivity import get_sensitivity
+from Xclusion_criteria.xclusion_overlaps import (
+    get_overlaps, write_overlaps, read_overlaps)
+from Xclusion_criteria.xclusion_strata import (
+    get_strata_path, get_strata_codes, get_strata_flowchart)
+from Xclusion_criteria.xclusion_sample import (
+    get_sampled_path, check_sample, sample_samples)
+from Xclusion_criteria.xclusion_match import (
+    check_scipy, get_matched_path, check_match, match_samples)
+from Xclusion_criteria.xclusion_no_nan import (
+    get_plan_masks, get_no_nan_candidates, get_no_nan_plan,
+    get_plan_suggestion)
+from Xclusion_criteria.xclusion_approx import (
+    get_approx_path, get_approx_flowchart_path, read_meta_sample,
+    get_approx_flowcharts)
+from Xclusion_criteria.xclusion_catalog import (
+    get_catalog, read_catalog, write_catalog, check_catalog,
+    get_catalog_criteria, estimate_flowcharts, get_estimate_accuracy)
+from Xclusion_criteria.xclusion_cache import (
+    get_cache_key, get_cache_outputs, restore_cache, unlink_outputs,
+    store_cache, evict_cache)
+from Xclusion_criteria.xclusion_incremental import (
+    get_md_flags, get_failed, get_state_masks, get_state, write_state,
+    run_incremental, append_outputs, read_included)
+from Xclusion_criteria.xclusion_sql import (
+    get_database, get_sql_factors, drop_sql_null_columns, get_sql_types,
+    get_sql_criteria, apply_sql_criteria, get_sql_included,
+    write_sql_excluded)
 from Xclusion_criteria.xclusion_plot import make_visualizations
 
 RESOURCES = pkg_resources.resource_filename('Xclusion_criteria', 'resources')
@@ -33,7 +68,27 @@ def xclusion_criteria(
         p_reads_filter: int,
         unique: bool,
         update: bool,
-        dim: bool) -> None:
+        dim: bool,
+        o_trace: str = None,
+        m_database: str = None,
+        p_table: str = 'metadata',
+        arrow: bool = False,
+        p_shards: int = 1,
+        p_cache_dir: str = None,
+        p_cache_days: float = 30,
+        p_cache_size: float = 1024,
+        force: bool = False,
+        p_state: str = None,
+        o_sensitivity: str = None,
+        o_overlaps: str = None,
+        overlaps_panel: bool = False,
+        stratify_by: tuple = (),
+        p_catalog: str = None,
+        estimate: bool = False,
+        approx: float = None,
+        o_no_nan_plan: str = None,
+        p_no_nan_target: int = None,
+        no_nan_candidates: tuple = ()) -> None:
     """Main script for running the inclusion/exclusion
      criteria-based filtering on a metadata table.
 
@@ -74,77 +129,259 @@ def xclusion_criteria(
     dim : bool
         [if --fetch] Whether to add the number of samples in the final
         biom file name before extension or not.
+    o_trace : str
+        Path to the output JSON file with the time, CPU, peak memory
+        and rows/columns counts of each phase and criterion.
+    m_database : str
+        Path to a SQLite (or DuckDB) database file with the metadata table,
+        on which to apply the criteria instead of the metadata file.
+    p_table : str
+        Name of the metadata table in the database.
+    arrow : bool
+        Whether to check the dtypes using Arrow kernels (needs pyarrow).
+    p_shards : int
+        Number of row shards of the metadata evaluated in parallel processes.
+    p_cache_dir : str
+        Folder of the run cache (no cache if None).
+    p_cache_days : float
+        Number of days after which an unused cache entry is removed.
+    p_cache_size : float
+        Maximum size of the cache (in megabytes).
+    force : bool
+        Whether to run even if the outputs are in the cache.
+    p_state : str
+        Path to the state file of the last run, to only apply the criteria
+        on the samples appended to the metadata since this run.
+    o_sensitivity : str
+        Path to the output table of the samples kept by each criterion
+        alone and of the included samples if it was dropped.
+    o_overlaps : str
+        Path to the output table of the number of samples per pattern
+        of failed criteria (Parquet if ".parquet" extension).
+    overlaps_panel : bool
+        Whether to add the most frequent patterns of failed criteria
+        below the flowchart in the visualization.
+    stratify_by : tuple
+        Metadata variables for which to count the samples of each
+        flowchart step per stratum (i.e. per value of the variable).
+    p_catalog : str
+        Path to the statistics catalog of the metadata columns.
+    estimate : bool
+        Whether to only estimate the samples counts from the catalog.
+    approx : float
+        Fraction of the metadata rows to sample, for approximate outputs
+        and flowchart counts (all the rows if None).
+    o_no_nan_plan : str
+        Path to the output table of the "no_nan" lists of candidate
+        variables retaining the most samples, per number of variables.
+    p_no_nan_target : int
+        Number of included samples to retain with the suggested list.
+    no_nan_candidates : tuple
+        Candidate variables for the "no_nan" list (all if empty).
     """
 
-    print('- read input metadata...', end=' ')
+    if arrow and not check_arrow():
+        print('The Arrow backend (--arrow) needs pyarrow\nExiting')
+        sys.exit(1)
+    if o_overlaps and o_overlaps.endswith('.parquet') and not check_arrow():
+        print('Writing the overlaps as Parquet needs pyarrow\nExiting')
+        sys.exit(1)
+    trace = get_trace(o_trace)
     nulls = [x.strip() for x in open('%s/nulls.txt' % RESOURCES).readlines()]
-    metadata = read_meta_pd(m_metadata_file)
-    messages = []
-    print('Done.')
 
-    # get yml content, i.e. all inclusion/exclusion criteria.
-    print('- get yml content, i.e. all inclusion/exclusion criteria...')
-    criteria = get_criteria(i_criteria, metadata, nulls, messages)
-    if not criteria:
-        print('No single criteria found: check input path / content\nExiting')
+    if estimate:
+        with trace_phase(trace, 'estimate'):
+            run_estimate(m_metadata_file, i_criteria, nulls, p_catalog)
+        write_trace(trace, o_trace)
+        return
+
+    # samples drawn and cases matched to controls among the included samples
+    criteria_dict = read_i_criteria(i_criteria) or {}
+    sample_dict = criteria_dict.get('sample')
+    match_dict = criteria_dict.get('match')
+    if match_dict and not check_scipy():
+        print('The matching step ("match" in the criteria) needs scipy\n'
+              'Exiting')
         sys.exit(1)
-    # show yml criteria file formatting errors
-    if messages:
-        print('Problems encountered during criteria parsing:')
-        for message in messages:
-            print(message)
-        messages = []
 
-    # infer dtypes
-    print('- infer dtypes...', end=' ')
-    dtypes = get_dtypes(metadata, nulls)
-    print('Done.')
+    if approx and m_database:
+        print('The approximate mode (--approx) is not used with a '
+              'database (-d)')
+        approx = None
+    if approx:
+        # the outputs of the sampled rows are marked as approximate
+        o_included, o_excluded, o_visualization = [get_approx_path(
+            x, approx) for x in [o_included, o_excluded, o_visualization]]
+        if fetch or p_state or p_catalog or o_sensitivity or o_overlaps \
+                or stratify_by or o_no_nan_plan:
+            print('The fetch, state, catalog, sensitivity, overlaps, strata '
+                  'and no_nan plan (--fetch, --p-state, --p-catalog, '
+                  '--o-sensitivity, --o-overlaps, --stratify-by, '
+                  '--o-no-nan-plan) are not made with --approx')
+        fetch, p_state, p_catalog = False, None, None
+        o_sensitivity, o_overlaps, stratify_by = None, None, ()
+        o_no_nan_plan = None
+        if sample_dict or match_dict:
+            print('The sampling and matching steps ("sample" and "match" '
+                  'in the criteria) are not made with --approx')
+        sample_dict, match_dict = None, None
 
-    # get the numerical and categorical metadata variables
-    numerical, categorical = [], []
-    print('- get the numerical and categorical metadata variables...', end=' ')
-    split_variables_types(dtypes, numerical, categorical)
-    print('Done.')
+    # the fetched data depend on Qiita, not only on the inputs,
+    # and the state of the run is not an output that can be restored
+    cache_key = None
+    if p_cache_dir and not fetch and not p_state:
+        outputs = get_cache_outputs(o_included, o_excluded, o_visualization)
+        if sample_dict:
+            outputs['sampled'] = get_sampled_path(o_included)
+        if match_dict:
+            outputs['matched'] = get_matched_path(o_included)
+        # the tables made from the criteria masks (not with a database)
+        if not m_database:
+            if o_sensitivity:
+                outputs['sensitivity'] = o_sensitivity
+            if o_overlaps:
+                outputs['overlaps'] = o_overlaps
+            for var in stratify_by:
+                outputs['strata_%s' % var] = get_strata_path(o_included, var)
+            if o_no_nan_plan:
+                outputs['no_nan_plan'] = o_no_nan_plan
+            if approx:
+                outputs['approx'] = get_approx_flowchart_path(o_included)
+        with trace_phase(trace, 'get_cache_key'):
+            cache_key = get_cache_key(
+                m_database or m_metadata_file, i_criteria, i_plot_groups,
+                nulls, {'database': bool(m_database), 'p_table': p_table,
+                        'outputs': sorted(outputs), 'p_random': p_random,
+                        'overlaps_panel': overlaps_panel, 'approx': approx,
+                        'p_no_nan_target': p_no_nan_target,
+                        'no_nan_candidates': no_nan_candidates})
+        if not os.path.isdir(p_cache_dir):
+            os.makedirs(p_cache_dir)
+        if not force:
+            print('- restore the outputs from the cache...', end=' ')
+            with trace_phase(trace, 'restore_cache'):
+                hit = restore_cache(p_cache_dir, cache_key, outputs)
+            if hit:
+                print('Done.')
+                evict_cache(p_cache_dir, p_cache_days, p_cache_size)
+                write_trace(trace, o_trace)
+                return
+            print('Not cached.')
+        unlink_outputs(outputs)
 
-    TF = {'False': 'No', 'false': 'No', False: 'No',
-          'True': 'Yes', 'true': 'Yes', True: 'No'}
-    metadata.replace(
-        dict((x, TF) for x in metadata.columns if
-             x in categorical and str(metadata[x].dtype) == 'object'),
-        inplace=True)
+    # estimate the counts from the last catalog, to compare after the run
+    catalog, estimates = None, None
+    if p_catalog and not m_database:
+        with trace_phase(trace, 'estimate'):
+            catalog = read_catalog(p_catalog)
+            if catalog is not None:
+                estimates = estimate_flowcharts(get_catalog_criteria(
+                    i_criteria, catalog, nulls, []), catalog)
 
-    # Apply filtering criteria to subset the metadata
-    # -> get filtering flowchart and metadata for criteria-included samples
-    print('- apply filtering criteria to subset the metadata...', end=' ')
-    flowcharts, included = apply_criteria(
-        metadata, criteria, numerical, messages)
+    # the fetched data depend on Qiita, not only on the metadata rows
+    state_outputs, incremental = None, None
+    if p_state and not fetch and not m_database:
+        state_outputs = {'included': o_included}
+        if o_excluded:
+            state_outputs['excluded'] = o_excluded
+        # these tables need the criteria masks of all the samples
+        if not o_sensitivity and not o_overlaps and not stratify_by \
+                and not o_no_nan_plan:
+            incremental = run_state_criteria(
+                m_metadata_file, i_criteria, nulls, state_outputs, p_state,
+                trace)
 
-    if messages:
-        print('Problems encountered during application of criteria:')
-        for message in messages:
-            print(message)
-    print('Done.')
+    if incremental:
+        metadata, md_factors = None, None
+        flowcharts, included, numerical, categorical = incremental
+    elif m_database:
+        if o_sensitivity or o_overlaps or stratify_by or o_no_nan_plan:
+            print('The sensitivity, overlaps, strata and no_nan plan tables '
+                  '(--o-sensitivity, --o-overlaps, --stratify-by, '
+                  '--o-no-nan-plan) are not made with a database (-d)')
+        metadata, md_factors = None, None
+        flowcharts, included, numerical, categorical = run_sql_criteria(
+            m_database, p_table, i_criteria, nulls, o_included, o_excluded,
+            trace)
+    else:
+        md_flags = {} if state_outputs else None
+        state_masks = {} if state_outputs else None
+        metadata, md_factors, flowcharts, included, numerical, categorical = \
+            run_criteria(m_metadata_file, i_criteria, nulls, o_included,
+                         o_excluded, trace, arrow, p_shards, md_flags,
+                         o_sensitivity, o_overlaps, stratify_by, approx,
+                         o_no_nan_plan, p_no_nan_target, no_nan_candidates,
+                         state_masks)
+        if state_outputs:
+            print('- write the state of the run...', end=' ')
+            with trace_phase(trace, 'write_state'):
+                write_state(p_state, get_state(
+                    m_metadata_file, metadata, md_factors, md_flags,
+                    i_criteria, nulls, numerical, categorical,
+                    state_outputs, state_masks))
+            print('Done.')
+        if p_catalog and not check_catalog(catalog, m_metadata_file):
+            print('- write the statistics catalog...', end=' ')
+            with trace_phase(trace, 'write_catalog') as args:
+                write_catalog(p_catalog, get_catalog(
+                    m_metadata_file, metadata, md_factors, numerical,
+                    categorical))
+                args['columns'] = metadata.shape[1]
+            print('Done.')
 
-    if included.shape[0]:
-        # write the metadata for criteria-included samples
-        print('- write the metadata for criteria-included samples...', end=' ')
-        included.reset_index().to_csv(o_included, index=False, sep='\t')
-        print('Done.')
+    if estimates is not None:
+        print('- accuracy of the estimated samples counts:')
+        accuracy = get_estimate_accuracy(estimates, flowcharts)
+        print(accuracy.to_string(index=False))
 
-    # write the metadata for criteria-excluded samples if requested
-    if o_excluded and included.shape[0]:
-        print('- write the metadata for criteria-excluded samples...', end=' ')
-        excluded = metadata.loc[
-            [x for x in metadata.index if x not in included.index],:
-        ].copy()
-        excluded.reset_index().to_csv(o_excluded, index=False, sep='\t')
-        print('Done.')
+    cohort = included
+    if sample_dict and included.shape[0]:
+        # write the samples drawn per group and add the sampling step
+        o_sampled = get_sampled_path(o_included)
+        print('- draw the samples per group...', end=' ')
+        messages = []
+        with trace_phase(trace, 'sample_samples') as args:
+            sample = check_sample(sample_dict, included, numerical, messages)
+            if sample:
+                cohort, flowcharts['sample'] = sample_samples(
+                    included, sample)
+                cohort.reset_index().to_csv(o_sampled, index=False, sep='\t')
+                args['rows_out'] = cohort.shape[0]
+            args['rows_in'] = included.shape[0]
+        print('Done.' if sample else 'Not sampled.')
+        show_messages(messages, 'Problems encountered during sampling:')
+        if sample:
+            print('  -> %s samples drawn: %s' % (cohort.shape[0], o_sampled))
+
+    if match_dict and cohort.shape[0]:
+        # write the cases matched to controls and add the matching step
+        o_matched = get_matched_path(o_included)
+        print('- match the cases to controls...', end=' ')
+        messages = []
+        with trace_phase(trace, 'match_samples') as args:
+            match = check_match(
+                match_dict, cohort, numerical, nulls, messages)
+            if match:
+                matched, flowcharts['match'] = match_samples(
+                    cohort, match, numerical, nulls, messages)
+                matched.reset_index().to_csv(
+                    o_matched, index=False, sep='\t')
+                args['rows_out'] = matched.shape[0]
+            args['rows_in'] = cohort.shape[0]
+        print('Done.' if match else 'Not matched.')
+        show_messages(messages, 'Problems encountered during matching:')
+        if match:
+            print('  -> %s cases matched (%s samples): %s' % (
+                flowcharts['match'][-2][1], matched.shape[0], o_matched))
 
     if fetch and included.shape[0]:
-        included = fetch_data(
-            o_included, flowcharts, o_metadata_file, o_biom_file,
-            p_redbiom_context, p_bloom_sequences, p_reads_filter, unique,
-            update, dim)
+        with trace_phase(trace, 'fetch_data') as args:
+            args['rows_in'] = included.shape[0]
+            included = fetch_data(
+                o_included, flowcharts, o_metadata_file, o_biom_file,
+                p_redbiom_context, p_bloom_sequences, p_reads_filter, unique,
+                update, dim)
+            args['rows_out'] = included.shape[0]
 
     # Check there's min 3 categorical and 2 numerical variables
     print('- check there are min 3 categorical and 2 numerical variables...')
@@ -155,9 +392,13 @@ def xclusion_criteria(
             print('  [numerical]', num, '(n=%s/%s)' % (
                 sum(included[num].isnull() == False), included.shape[0]))
         print()
+        # the fetched samples are not read from the metadata table
+        rows = None if fetch or metadata is None else get_rows(
+            included, metadata)
         for cat in sorted(categorical):
             if cat in included.columns:
-                cats_dict = included[cat].value_counts().to_dict()
+                cats_dict = get_counts(
+                    cat, included, metadata, md_factors, rows)
                 print('  [categorical]', cat, '(n=%s:' % len(cats_dict),
                       end=' ')
                 if len(cats_dict) > 10:
@@ -176,6 +417,513 @@ def xclusion_criteria(
     if not no_fig:
         # Build the three-panel criteria-based filtering figure
         print('- build the three-panel criteria-based filtering figure...')
-        make_visualizations(
-            included, plot_groups, o_visualization,
-            numerical, categorical, flowcharts, p_random, fetch)
+        with trace_phase(trace, 'make_visualizations') as args:
+            overlaps = None
+            if overlaps_panel and o_overlaps and os.path.isfile(o_overlaps):
+                overlaps = read_overlaps(o_overlaps)
+            strata = {}
+            for var in stratify_by:
+                o_strata = get_strata_path(o_included, var)
+                if os.path.isfile(o_strata):
+                    strata[var] = pd.read_csv(o_strata, sep='\t')
+            make_visualizations(
+                included, plot_groups, o_visualization,
+                numerical, categorical, flowcharts, p_random, fetch,
+                overlaps, strata)
+            args['rows_in'], args['columns'] = included.shape
+
+    if cache_key:
+        print('- store the outputs in the cache...', end=' ')
+        with trace_phase(trace, 'store_cache'):
+            store_cache(p_cache_dir, cache_key, outputs)
+            evict_cache(p_cache_dir, p_cache_days, p_cache_size)
+        print('Done.')
+
+    write_trace(trace, o_trace)
+
+
+def get_variables_types(metadata: pd.DataFrame, nulls: list,
+                        trace: dict, arrow: bool = False) -> tuple:
+    """Infer the dtypes of the metadata variables and split
+    them into the numerical and categorical variables.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    trace : dict
+        Trace events of the run.
+    arrow : bool
+        Whether to check the dtypes using Arrow kernels.
+
+    Returns
+    -------
+    numerical : list
+        Metadata variables that are numeric.
+    categorical : list
+        Metadata variables that are categorical.
+    """
+    # infer dtypes
+    print('- infer dtypes...', end=' ')
+    with trace_phase(trace, 'get_dtypes') as args:
+        dtypes = get_dtypes(metadata, nulls, arrow)
+        args['rows_in'], args['columns'] = metadata.shape
+    print('Done.')
+
+    # get the numerical and categorical metadata variables
+    numerical, categorical = [], []
+    print('- get the numerical and categorical metadata variables...', end=' ')
+    split_variables_types(dtypes, numerical, categorical)
+    print('Done.')
+
+    replace_tf(metadata, categorical)
+    return numerical, categorical
+
+
+def show_messages(messages: list, header: str) -> None:
+    """Print the problems encountered and empty the messages.
+
+    Parameters
+    ----------
+    messages : list
+        Message to print in case of error.
+    header : str
+        Problems context.
+    """
+    if messages:
+        print(header)
+        for message in messages:
+            print(message)
+        messages[:] = []
+
+
+def run_estimate(m_metadata_file: str, i_criteria: str, nulls: list,
+                 p_catalog: str) -> None:
+    """Estimate the samples counts of each step of the flowchart from the
+    statistics catalog of the metadata, without reading the table.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file on which the catalog was made.
+    i_criteria: str
+        Path to yml config file for the
+        different inclusion/exclusion criteria to apply.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    p_catalog : str
+        Path to the statistics catalog of the metadata columns.
+    """
+    print('- read the statistics catalog...', end=' ')
+    catalog = read_catalog(p_catalog)
+    if catalog is None:
+        print('No catalog (made by a run with --p-catalog)\nExiting')
+        sys.exit(1)
+    print('Done.')
+    if not os.path.isfile(m_metadata_file) or not check_catalog(
+            catalog, m_metadata_file):
+        print('[Warning] The metadata changed since the catalog was made')
+
+    messages = []
+    criteria = get_catalog_criteria(i_criteria, catalog, nulls, messages)
+    show_messages(messages, 'Problems encountered during criteria parsing:')
+    estimates = estimate_flowcharts(criteria, catalog)
+    print('- estimated samples counts (%s samples):' % catalog['rows'])
+    for step, flowchart in estimates.items():
+        for row in flowchart:
+            print('  [%s] %s: %s' % (step, row[0], row[1]))
+
+
+def run_state_criteria(m_metadata_file: str, i_criteria: str, nulls: list,
+                       outputs: dict, p_state: str, trace: dict) -> tuple:
+    """Apply the criteria only on the samples appended to the
+    metadata since the last run, if this run is still valid.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file on which to apply included/exclusion criteria.
+    i_criteria: str
+        Path to yml config file for the
+        different inclusion/exclusion criteria to apply.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    p_state : str
+        Path to the state file of the last run.
+    trace : dict
+        Trace events of the run.
+
+    Returns
+    -------
+    incremental : tuple
+        flowcharts, included, numerical and categorical
+        (None if the criteria must be applied on the full metadata).
+    """
+    messages = []
+    print('- check the state of the last run...', end=' ')
+    with trace_phase(trace, 'run_incremental') as args:
+        reason, flowcharts, state, tail_included, tail_excluded = \
+            run_incremental(m_metadata_file, i_criteria, nulls, outputs,
+                            p_state, messages)
+        if reason is None:
+            args['rows_in'] = tail_included.shape[0] + tail_excluded.shape[0]
+            args['rows_out'] = tail_included.shape[0]
+    if reason:
+        print('Full run (%s).' % reason)
+        return None
+    print('Done.')
+    show_messages(
+        messages, 'Problems encountered during application of criteria:')
+
+    print('- append the new samples to the outputs...', end=' ')
+    with trace_phase(trace, 'append_outputs'):
+        append_outputs(tail_included, tail_excluded, outputs, state)
+        write_state(p_state, state)
+    print('Done.')
+    included = read_included(outputs['included'], state)
+    return flowcharts, included, state['numerical'], state['categorical']
+
+
+def run_criteria(m_metadata_file: str, i_criteria: str, nulls: list,
+                 o_included: str, o_excluded: str, trace: dict,
+                 arrow: bool = False, p_shards: int = 1,
+                 md_flags: dict = None, o_sensitivity: str = None,
+                 o_overlaps: str = None, stratify_by: tuple = (),
+                 approx: float = None, o_no_nan_plan: str = None,
+                 p_no_nan_target: int = None,
+                 no_nan_candidates: tuple = (),
+                 state_masks: dict = None) -> tuple:
+    """Apply the criteria on the metadata table read with pandas and
+    write the metadata for the included and excluded samples.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file on which to apply included/exclusion criteria.
+    i_criteria: str
+        Path to yml config file for the
+        different inclusion/exclusion criteria to apply.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    o_included : str
+        Path to output metadata for the included samples only.
+    o_excluded : str
+        Path to output metadata for the excluded samples only.
+    trace : dict
+        Trace events of the run.
+    arrow : bool
+        Whether to check the dtypes using Arrow kernels.
+    p_shards : int
+        Number of row shards of the metadata evaluated in parallel processes.
+    md_flags : dict
+        Filled with the dtype and kinds of factors of the variables as
+        read, for the state of the run (not collected if None).
+    o_sensitivity : str
+        Path to the output table of the samples kept by each criterion
+        alone and of the included samples if it was dropped.
+    o_overlaps : str
+        Path to the output table of the number of samples per pattern
+        of failed criteria (Parquet if ".parquet" extension).
+    stratify_by : tuple
+        Metadata variables for which to count the samples of each
+        flowchart step per stratum (i.e. per value of the variable).
+    approx : float
+        Fraction of the metadata rows to sample (all the rows if None).
+    o_no_nan_plan : str
+        Path to the output table of the "no_nan" lists of candidate
+        variables retaining the most samples, per number of variables.
+    p_no_nan_target : int
+        Number of included samples to retain with the suggested list.
+    no_nan_candidates : tuple
+        Candidate variables for the "no_nan" list (all if empty).
+    state_masks : dict
+        Filled with the outcome of the criteria applied to the samples,
+        for the state of the run (not collected if None).
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Metadata table.
+    md_factors : dict
+        Per-column factors of the metadata table.
+    flowcharts : dict
+        Steps of the workflow with samples counts (simple representation).
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    numerical : list
+        Metadata variables that are numeric.
+    categorical : list
+        Metadata variables that are categorical.
+    """
+    print('- read input metadata...', end=' ')
+    with trace_phase(trace, 'read_meta_pd') as args:
+        if approx:
+            metadata, n_rows = read_meta_sample(m_metadata_file, approx)
+            args['rows_in'] = n_rows
+        else:
+            metadata = read_meta_pd(m_metadata_file)
+        args['rows_out'], args['columns'] = metadata.shape
+    messages = []
+    print('Done.')
+
+    if md_flags is not None:
+        md_flags.update(get_md_flags(metadata))
+    numerical, categorical = get_variables_types(
+        metadata, nulls, trace, arrow)
+
+    # per-column factors, collected once for the
+    # criteria parsing, the filtering and the summary
+    md_factors = get_md_factors(metadata)
+
+    # get yml content, i.e. all inclusion/exclusion criteria.
+    print('- get yml content, i.e. all inclusion/exclusion criteria...')
+    with trace_phase(trace, 'get_criteria') as args:
+        criteria = get_criteria(
+            i_criteria, metadata, nulls, messages, md_factors)
+        args['criteria'] = sum(len(criteria[x]) for x in criteria)
+    if not criteria:
+        print('No single criteria found: check input path / content\nExiting')
+        sys.exit(1)
+    if has_hosts_criteria(criteria):
+        # dropping or failing a criterion changes the samples of the hosts
+        if o_sensitivity or o_overlaps or o_no_nan_plan:
+            messages.append('The sensitivity, overlaps and no_nan plan tables '
+                            '(--o-sensitivity, --o-overlaps, --o-no-nan-plan)'
+                            ' are not made with host criteria (skipped)')
+            o_sensitivity, o_overlaps, o_no_nan_plan = None, None, None
+        if approx:
+            messages.append('[Warning] Host criteria aggregate the sampled '
+                            'rows only (biased counts with --approx)')
+    # show yml criteria file formatting errors
+    show_messages(messages, 'Problems encountered during criteria parsing:')
+
+    # Apply filtering criteria to subset the metadata
+    # -> get filtering flowchart and metadata for criteria-included samples
+    print('- apply filtering criteria to subset the metadata...', end=' ')
+    criteria_masks = None
+    if o_sensitivity or o_overlaps or stratify_by or o_no_nan_plan:
+        criteria_masks = []
+    failed = None
+    if state_masks is not None:
+        failed = get_failed(metadata.shape[0])
+    with trace_phase(trace, 'apply_criteria') as args:
+        if p_shards > 1:
+            flowcharts, filter_mask, add_mask = get_sharded_criteria_masks(
+                metadata, criteria, numerical, messages, p_shards, failed,
+                criteria_masks)
+            args['shards'] = p_shards
+        else:
+            flowcharts, filter_mask, add_mask = get_criteria_masks(
+                metadata, criteria, numerical, messages, md_factors, trace,
+                failed, criteria_masks)
+        if state_masks is not None:
+            state_masks.update(get_state_masks(
+                metadata, criteria, flowcharts, filter_mask, add_mask,
+                failed))
+        if 'init' in criteria:
+            print('init', metadata.shape)
+        included = get_included(
+            metadata, flowcharts, filter_mask, add_mask, messages)
+        args['rows_in'] = metadata.shape[0]
+        args['rows_out'] = included.shape[0]
+
+    show_messages(
+        messages, 'Problems encountered during application of criteria:')
+    print('Done.')
+
+    if approx:
+        # scale the counts of the sampled rows up to all the rows
+        flowcharts, approx_pd = get_approx_flowcharts(
+            flowcharts, metadata.shape[0], n_rows)
+        o_approx = get_approx_flowchart_path(o_included)
+        approx_pd.to_csv(o_approx, index=False, sep='\t')
+        print('- APPROXIMATE samples counts (%s of %s rows sampled, 95%% '
+              'confidence intervals):' % (metadata.shape[0], n_rows))
+        print(approx_pd.to_string(index=False))
+        print('  -> written: %s' % o_approx)
+
+    if o_sensitivity:
+        # write the samples kept by each criterion and without it
+        print('- write the sensitivity of the criteria...', end=' ')
+        with trace_phase(trace, 'get_sensitivity') as args:
+            sensitivity = get_sensitivity(criteria_masks, metadata.shape[0])
+            sensitivity.to_csv(o_sensitivity, index=False, sep='\t')
+            args['criteria'] = sensitivity.shape[0]
+        print('Done.')
+
+    if o_overlaps:
+        # write the number of samples per pattern of failed criteria
+        print('- write the overlaps of the failed criteria...', end=' ')
+        with trace_phase(trace, 'get_overlaps') as args:
+            overlaps = get_overlaps(criteria_masks, metadata.shape[0])
+            write_overlaps(overlaps, o_overlaps)
+            args['rows_in'] = metadata.shape[0]
+            args['rows_out'] = overlaps.shape[0]
+        print('Done.')
+
+    for var in stratify_by:
+        if var not in md_factors['positions']:
+            print(' --> variable "%s" not in the metadata (not '
+                  'stratified)' % var)
+            continue
+        # write the samples counts of the flowcharts per stratum
+        o_strata = get_strata_path(o_included, var)
+        print('- write the flowcharts per "%s" stratum...' % var, end=' ')
+        with trace_phase(trace, 'get_strata_flowchart') as args:
+            codes, strata = get_strata_codes(var, metadata, md_factors)
+            strata_pd = get_strata_flowchart(criteria_masks, codes, strata)
+            strata_pd.to_csv(o_strata, index=False, sep='\t')
+            args['rows_in'] = metadata.shape[0]
+            args['strata'] = len(strata)
+        print('Done: %s' % o_strata)
+
+    if o_no_nan_plan:
+        # write the "no_nan" lists retaining the most samples
+        print('- write the plan of the "no_nan" variables...', end=' ')
+        with trace_phase(trace, 'get_no_nan_plan') as args:
+            base_mask, add_count = get_plan_masks(
+                criteria_masks, metadata.shape[0])
+            candidates = get_no_nan_candidates(
+                metadata, no_nan_candidates, md_factors, nulls, base_mask,
+                messages)
+            plan = get_no_nan_plan(metadata, candidates, md_factors, nulls,
+                                   base_mask, add_count)
+            if p_no_nan_target is not None:
+                plan['meets_target'] = plan['retained'] >= p_no_nan_target
+            plan.to_csv(o_no_nan_plan, index=False, sep='\t')
+            args['rows_in'] = metadata.shape[0]
+            args['candidates'] = len(candidates)
+        print('Done.')
+        show_messages(messages, 'Problems encountered during the no_nan plan:')
+        if p_no_nan_target is not None:
+            suggestion = get_plan_suggestion(plan, p_no_nan_target)
+            if suggestion is None:
+                print('  -> no "no_nan" list retains %s samples' %
+                      p_no_nan_target)
+            else:
+                print('  -> suggested "no_nan" list (%s variables, %s '
+                      'samples retained): %s' % (
+                          suggestion['variables'], suggestion['retained'],
+                          suggestion['no_nan'] or 'none'))
+
+    if included.shape[0]:
+        # write the metadata for criteria-included samples
+        print('- write the metadata for criteria-included samples...', end=' ')
+        with trace_phase(trace, 'write_included') as args:
+            included.reset_index().to_csv(o_included, index=False, sep='\t')
+            args['rows_out'], args['columns'] = included.shape
+        print('Done.')
+
+    # write the metadata for criteria-excluded samples if requested
+    if o_excluded and included.shape[0]:
+        print('- write the metadata for criteria-excluded samples...', end=' ')
+        with trace_phase(trace, 'write_excluded') as args:
+            excluded = metadata.loc[
+                [x for x in metadata.index if x not in included.index],:
+            ].copy()
+            excluded.reset_index().to_csv(o_excluded, index=False, sep='\t')
+            args['rows_out'], args['columns'] = excluded.shape
+        print('Done.')
+    return metadata, md_factors, flowcharts, included, numerical, categorical
+
+
+def run_sql_criteria(m_database: str, p_table: str, i_criteria: str,
+                     nulls: list, o_included: str, o_excluded: str,
+                     trace: dict) -> tuple:
+    """Apply the criteria inside the database, fetch the
+    metadata for the included samples only and write
+    the metadata for the excluded samples by chunks.
+
+    Parameters
+    ----------
+    m_database : str
+        Path to a SQLite (or DuckDB) database file.
+    p_table : str
+        Name of the metadata table in the database.
+    i_criteria: str
+        Path to yml config file for the
+        different inclusion/exclusion criteria to apply.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    o_included : str
+        Path to output metadata for the included samples only.
+    o_excluded : str
+        Path to output metadata for the excluded samples only.
+    trace : dict
+        Trace events of the run.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simple representation).
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    numerical : list
+        Metadata variables that are numeric.
+    categorical : list
+        Metadata variables that are categorical.
+    """
+    print('- read input database table...', end=' ')
+    with trace_phase(trace, 'get_database') as args:
+        database = get_database(m_database, p_table)
+        args['columns'] = len(database['columns'])
+    messages = []
+    print('Done.')
+
+    # infer the dtypes on the whole table (not on the included samples),
+    # so that the outputs are those of the metadata read with pandas
+    print('- infer dtypes...', end=' ')
+    with trace_phase(trace, 'get_dtypes') as args:
+        md_factors = get_sql_factors(database, set(database['columns']))
+        drop_sql_null_columns(database, md_factors)
+        md_types = get_sql_types(database, md_factors, nulls)
+        args['columns'] = len(database['columns'])
+    numerical, categorical = md_types['numerical'], md_types['categorical']
+    print('Done.')
+
+    # get yml content, i.e. all inclusion/exclusion criteria.
+    print('- get yml content, i.e. all inclusion/exclusion criteria...')
+    with trace_phase(trace, 'get_criteria') as args:
+        criteria, md_factors, criteria_numerical = get_sql_criteria(
+            read_i_criteria(i_criteria), database, nulls, messages,
+            md_factors)
+        args['criteria'] = sum(len(criteria[x]) for x in criteria)
+    if not criteria:
+        print('No single criteria found: check input path / content\nExiting')
+        sys.exit(1)
+    show_messages(messages, 'Problems encountered during criteria parsing:')
+
+    # Apply filtering criteria inside the database
+    # -> get filtering flowchart and metadata for criteria-included samples
+    print('- apply filtering criteria to subset the metadata...', end=' ')
+    with trace_phase(trace, 'apply_criteria') as args:
+        flowcharts, conditions = apply_sql_criteria(
+            database, criteria, criteria_numerical, messages, md_factors)
+        included = get_sql_included(database, conditions, md_types)
+        args['rows_out'] = included.shape[0]
+    show_messages(
+        messages, 'Problems encountered during application of criteria:')
+    print('Done.')
+
+    if included.shape[0]:
+        # write the metadata for criteria-included samples
+        print('- write the metadata for criteria-included samples...', end=' ')
+        with trace_phase(trace, 'write_included') as args:
+            included.reset_index().to_csv(o_included, index=False, sep='\t')
+            args['rows_out'], args['columns'] = included.shape
+        print('Done.')
+
+    # write the metadata for criteria-excluded samples if requested
+    if o_excluded and included.shape[0]:
+        print('- write the metadata for criteria-excluded samples...', end=' ')
+        with trace_phase(trace, 'write_excluded') as args:
+            args['rows_out'] = write_sql_excluded(
+                database, conditions, o_excluded, md_types)
+        print('Done.')
+    database['con'].close()
+    return flowcharts, included, numerical, categorical
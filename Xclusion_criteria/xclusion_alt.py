@@ -10,13 +10,19 @@ import altair
 import pandas as pd
 
 
-def make_flowchart(flowcharts: dict):
+def make_flowchart(flowcharts: dict, strata: pd.DataFrame = None,
+                   var: str = None):
     """Build the flowchart figure.
 
     Parameters
     ----------
     flowcharts : dict
         Steps of the workflow with samples counts (simple representation).
+    strata : pd.DataFrame
+        Samples counts of the flowcharts rows per stratum (one line per
+        stratum instead of one line per step if not None).
+    var : str
+        Metadata variable defining the strata.
 
     Returns
     -------
@@ -26,7 +32,10 @@ def make_flowchart(flowcharts: dict):
     """
     print('   * make filtering figure... ', end='')
     flowcharts_pds = []
-    for step in ['init', 'add', 'filter', 'data']:
+    for step in ['init', 'add', 'filter', 'sample', 'match', 'data']:
+        # the strata are counted for the criteria steps only
+        if strata is not None and step not in set(strata['step']):
+            continue
         if step in flowcharts:
             flowchart_pd = pd.DataFrame(
                 flowcharts[step],
@@ -36,6 +45,16 @@ def make_flowchart(flowcharts: dict):
                 '%s (%s)' % (x, step) for x in flowchart_pd['criterion']]
             flowchart_pd['filter'] = '%s (%s steps)' % (
                 step, len(flowchart_pd.criterion.unique()))
+            if strata is not None:
+                # the rows of the step are in the flowchart order
+                step_strata = strata.loc[strata['step'] == step].drop(
+                    columns=['step', 'criterion']).reset_index(drop=True)
+                flowchart_pd = pd.concat([
+                    flowchart_pd.drop(columns=['samples']), step_strata
+                ], axis=1).melt(
+                    id_vars=['criterion', 'variable', 'values', 'indicator',
+                             'filter'],
+                    var_name='stratum', value_name='samples')
             flowcharts_pds.append(flowchart_pd)
     flowcharts_pd = pd.concat(flowcharts_pds, axis=0, sort=False)
     criterion_order = []
@@ -47,23 +66,83 @@ def make_flowchart(flowcharts: dict):
     # if len(criterion_order) >= 20:
     #     width = width + (width * ((len(criterion_order) - 30)/50))
     width = len(criterion_order) * 10
+    title = 'Samples selection progression'
+    color = 'filter'
+    tooltip = ['samples', 'variable', 'values', 'indicator']
+    if strata is not None:
+        title = '%s (per %s)' % (title, var)
+        color = altair.Color('stratum:N', title=var)
+        tooltip = ['stratum'] + tooltip
     # Selection progression figure (left panel)
     curve = altair.Chart(
         flowcharts_pd, width=width,
-        height=200, title='Samples selection progression'
+        height=200, title=title
     ).mark_line(
         point=True
     ).encode(
         x=altair.X('criterion', scale=altair.Scale(zero=False),
                    sort=criterion_order),
         y=altair.Y('samples', scale=altair.Scale(zero=False)),
-        color='filter',
-        tooltip=['samples', 'variable', 'values', 'indicator']
+        color=color,
+        tooltip=tooltip
     )
+    if strata is not None:
+        # one line per stratum and step
+        curve = curve.encode(detail='filter')
     print('Done')
     return curve
 
 
+def make_overlaps(overlaps: pd.DataFrame, top: int = 20):
+    """Build the UpSet-style figure of the most frequent
+    patterns of failed criteria.
+
+    Parameters
+    ----------
+    overlaps : pd.DataFrame
+        Number of samples per pattern of failed criteria.
+    top : int
+        Number of patterns to show.
+
+    Returns
+    -------
+    upset : altair figure
+        Altair bars (samples per pattern) and matrix (failed criteria).
+
+    """
+    print('   * make overlaps figure... ', end='')
+    criteria = [x for x in overlaps.columns if x not in [
+        'failed', 'included', 'samples']]
+    top_pd = overlaps.head(top).copy()
+    top_pd['pattern'] = ['#%s' % x for x in range(1, top_pd.shape[0] + 1)]
+    patterns_order = top_pd['pattern'].tolist()
+    width = max(len(patterns_order) * 15, 100)
+    bars = altair.Chart(
+        top_pd, width=width, height=150,
+        title='Samples per pattern of failed criteria'
+    ).mark_bar().encode(
+        x=altair.X('pattern:N', sort=patterns_order, axis=None),
+        y=altair.Y('samples:Q'),
+        color=altair.Color('included:N'),
+        tooltip=['pattern', 'samples', 'failed', 'included']
+    )
+    matrix_pd = top_pd.melt(
+        id_vars=['pattern'], value_vars=criteria,
+        var_name='criterion', value_name='fails')
+    matrix = altair.Chart(
+        matrix_pd, width=width, height=max(len(criteria) * 12, 50)
+    ).mark_circle(size=60).encode(
+        x=altair.X('pattern:N', sort=patterns_order),
+        y=altair.Y('criterion:N', sort=criteria),
+        color=altair.condition(
+            'datum.fails == 1', altair.value('black'),
+            altair.value('lightgray')),
+        tooltip=['pattern', 'criterion']
+    )
+    print('Done')
+    return bars & matrix
+
+
 def get_selectors(included_merged: pd.DataFrame):
     """Prepare the selector for the interactive panels.
 
@@ -0,0 +1,203 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import io
+import copy
+import numpy as np
+import pandas as pd
+from os.path import splitext
+
+from Xclusion_criteria.xclusion_io import get_meta_sep, set_meta_index
+
+# same sample of rows for the same fraction
+APPROX_SEED = 12345
+BLOCK_SIZE = 1 << 26
+
+
+def get_approx_path(path: str, approx: float) -> str:
+    """Mark an output path as made on a sample of the rows.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file.
+    approx : float
+        Fraction of the metadata rows sampled.
+
+    Returns
+    -------
+    approx_path : str
+        Path with the sampled fraction before the extension.
+    """
+    if not path:
+        return path
+    base, ext = splitext(path)
+    return '%s_approx%s%s' % (base, approx, ext)
+
+
+def get_approx_flowchart_path(o_included: str) -> str:
+    """Get the path to the approximate flowchart counts table,
+    next to the (approximate) metadata for the included samples."""
+    return '%s_flowchart.tsv' % splitext(o_included)[0]
+
+
+def sample_lines(lines: list, approx: float,
+                 rng: np.random.RandomState) -> tuple:
+    """Draw each line with probability equal to the fraction.
+
+    Parameters
+    ----------
+    lines : list
+        Lines of the metadata file (bytes).
+    approx : float
+        Fraction of the metadata rows to sample.
+    rng : np.random.RandomState
+        Random number generator.
+
+    Returns
+    -------
+    sampled : list
+        Sampled (non-empty) lines.
+    n_rows : int
+        Number of (non-empty) lines.
+    """
+    drawn = np.flatnonzero(rng.random_sample(len(lines)) < approx)
+    sampled = [lines[x] for x in drawn if lines[x].strip()]
+    n_rows = len(lines) - lines.count(b'') - lines.count(b'\r')
+    return sampled, n_rows
+
+
+def read_meta_sample(metadata_file: str, approx: float,
+                     seed: int = APPROX_SEED) -> tuple:
+    """Read a random sample of the metadata rows, streaming the file by
+    blocks and only parsing the sampled lines.
+
+    Parameters
+    ----------
+    metadata_file : str
+        Path to metadata file on which to apply included/exclusion criteria.
+    approx : float
+        Fraction of the metadata rows to sample.
+    seed : int
+        Seed of the random draws.
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Metadata table for the sampled rows.
+    n_rows : int
+        Number of rows in the metadata file.
+    """
+    sep, first_col = get_meta_sep(metadata_file)
+    rng = np.random.RandomState(seed)
+    sampled, n_rows = [], 0
+    with open(metadata_file, 'rb') as handle:
+        header = handle.readline()
+        rest = b''
+        while True:
+            block = handle.read(BLOCK_SIZE)
+            if not block:
+                break
+            lines = (rest + block).split(b'\n')
+            # the last line may be cut by the end of the block
+            rest = lines.pop()
+            cur_sampled, cur_rows = sample_lines(lines, approx, rng)
+            sampled.extend(cur_sampled)
+            n_rows += cur_rows
+        if rest.strip():
+            cur_sampled, cur_rows = sample_lines([rest], approx, rng)
+            sampled.extend(cur_sampled)
+            n_rows += cur_rows
+    text = header.rstrip(b'\r\n') + b'\n' + b'\n'.join(sampled) + b'\n'
+    meta_pd = pd.read_csv(io.BytesIO(text), header=0, sep=sep,
+                          dtype={first_col: str}, low_memory=False)
+    meta_pd = set_meta_index(meta_pd, first_col)
+    return meta_pd, n_rows
+
+
+def get_wilson_interval(successes: np.ndarray, trials: int,
+                        z: float = 1.96) -> tuple:
+    """Get the Wilson score interval of binomial proportions.
+
+    Parameters
+    ----------
+    successes : np.ndarray
+        Number of successes.
+    trials : int
+        Number of trials.
+    z : float
+        Quantile of the standard normal distribution (1.96: 95%).
+
+    Returns
+    -------
+    low : np.ndarray
+        Lower bounds of the proportions.
+    high : np.ndarray
+        Upper bounds of the proportions.
+    """
+    successes = np.asarray(successes, dtype=float)
+    if not trials:
+        return np.zeros(successes.shape), np.ones(successes.shape)
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (p + z ** 2 / (2 * trials)) / denominator
+    half = z * np.sqrt(p * (1 - p) / trials + z ** 2 / (
+            4 * trials ** 2)) / denominator
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+
+def get_approx_flowcharts(flowcharts: dict, n_sampled: int,
+                          n_rows: int) -> tuple:
+    """Scale the flowcharts counts of the sampled rows up to all the rows,
+    with their 95% confidence intervals.
+
+    Each interval is the Wilson interval of its row's count taken alone
+    as a binomial proportion of the sampled rows: the intervals of the
+    rows are not simultaneous, nor conditional on the previous steps.
+    The rows kept by all the sampled rows (e.g. "init metadata") are
+    known exactly: their estimate and interval are the number of rows.
+
+    Parameters
+    ----------
+    flowcharts : dict
+        Steps of the workflow with samples counts (of the sampled rows).
+    n_sampled : int
+        Number of sampled rows.
+    n_rows : int
+        Number of rows in the metadata file.
+
+    Returns
+    -------
+    approx_flowcharts : dict
+        Steps of the workflow with estimated samples counts.
+    approx_pd : pd.DataFrame
+        sampled     = Number of sampled rows.
+        estimate    = Estimated number of samples.
+        ci_low      = Lower bound of the 95% confidence interval.
+        ci_high     = Upper bound of the 95% confidence interval.
+    """
+    approx_flowcharts = copy.deepcopy(flowcharts)
+    rows = [[step, row[0], row[1]] for step, flowchart in flowcharts.items()
+            for row in flowchart]
+    approx_pd = pd.DataFrame(rows, columns=['step', 'criterion', 'sampled'])
+    sampled = approx_pd['sampled'].values
+    low, high = get_wilson_interval(sampled, n_sampled)
+    scale = n_rows / n_sampled if n_sampled else 0
+    # the rows kept by all the sampled rows are known exactly
+    exact = (sampled == n_sampled) & (n_sampled > 0)
+    approx_pd['estimate'] = np.where(
+        exact, n_rows, np.round(sampled * scale)).astype(int)
+    approx_pd['ci_low'] = np.where(
+        exact, n_rows, np.floor(low * n_rows)).astype(int)
+    approx_pd['ci_high'] = np.where(
+        exact, n_rows, np.ceil(high * n_rows)).astype(int)
+    estimates = iter(approx_pd['estimate'].tolist())
+    for step, flowchart in approx_flowcharts.items():
+        for row in flowchart:
+            row[1] = next(estimates)
+    return approx_flowcharts, approx_pd
@@ -0,0 +1,174 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+# floats as written in python (a subset of what float() accepts)
+FLOAT_REGEX = (r'^\s*[+-]?((\d(_?\d)*)(\.(\d(_?\d)*)?)?|\.\d(_?\d)*)'
+               r'([eE][+-]?\d(_?\d)*)?\s*$')
+
+
+def check_arrow() -> bool:
+    """Check that pyarrow is installed for the Arrow backend.
+
+    Returns
+    -------
+    boolean : bool
+        Whether pyarrow can be imported.
+    """
+    return pa is not None
+
+
+def get_arrow_array(factors: pd.Series):
+    """Convert a metadata column to an Arrow array (without copy for the
+    numerical columns), with the missing values as Arrow nulls.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+
+    Returns
+    -------
+    array : pa.Array
+        Values of the variable (None if the column mixes types that Arrow
+        cannot hold in a single array, e.g. strings and floats).
+    """
+    try:
+        array = pa.array(factors, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    return array
+
+
+def check_dtype_arrow(factors: pd.Series) -> list:
+    """Check variable's factors with Arrow kernels: only the distinct
+    values are checked, all at once for those written as floats.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+
+    Returns
+    -------
+    d_type : list
+        two-items list for the dtype status of the
+        current metadata variable (None if the column cannot
+        be converted to Arrow). Could be:
+            ['object', 'object'] : factors are strings
+            ['object', 'float']  : factors are float (or np.nan)
+            ['object', 'check']  : factors are float + "polluting" string
+    """
+    array = get_arrow_array(factors)
+    if array is None:
+        return None
+    d_type = ['object']
+    has_nan = array.null_count > 0
+    if pa.types.is_boolean(array.type):
+        d_type.append('float' if array.null_count == len(array) else 'object')
+        return d_type
+    if not pa.types.is_string(array.type) and \
+            not pa.types.is_large_string(array.type):
+        array = pc.cast(array, pa.string())
+    values = pc.unique(array.drop_null())
+    has_nan |= pc.any(pc.equal(values, 'nan')).as_py() or False
+    has_tf = pc.any(pc.is_in(values, value_set=pa.array(
+        ['True', 'False']))).as_py() or False
+    values = values.filter(pc.invert(pc.is_in(
+        values, value_set=pa.array(['nan', 'True', 'False']))))
+    is_float = pc.match_substring_regex(values, FLOAT_REGEX)
+    has_float = pc.any(is_float).as_py() or False
+    has_non_float = False
+    # only the few other values are checked one by one (e.g. "inf")
+    for val in values.filter(pc.invert(is_float)).to_pylist():
+        try:
+            float(val)
+            has_float = True
+        except ValueError:
+            has_non_float = True
+    # if factors contain at least one non-float
+    if has_non_float:
+        if has_float or has_nan:
+            d_type.append('check')
+        else:
+            d_type.append('object')
+    else:
+        if has_tf:
+            d_type.append('object')
+        else:
+            d_type.append('float')
+    return d_type
+
+
+def get_arrow_nulls_mask(factors: pd.Series, nulls: list) -> np.ndarray:
+    """Get the samples which value contains a null factor.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample's value contains a null factor (None if
+        the column cannot be converted to Arrow).
+    """
+    array = get_arrow_array(factors)
+    if array is None:
+        return None
+    if not pa.types.is_string(array.type) and \
+            not pa.types.is_large_string(array.type):
+        array = pc.cast(array, pa.string())
+    # the missing values are "nan" once converted to strings
+    mask = pc.match_substring_regex(
+        array.fill_null('nan'), '|'.join(nulls))
+    return mask.to_numpy(zero_copy_only=False)
+
+
+def get_arrow_floats(factors: pd.Series, nan_tf: np.ndarray) -> np.ndarray:
+    """Cast the values of a metadata variable to floats, with the
+    null factors as np.nan, and detect the values that are not floats.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+    nan_tf : np.ndarray
+        Whether each sample's value is a null factor.
+
+    Returns
+    -------
+    floats : np.ndarray
+        Values of the variable as floats (None if a value is not a float).
+    """
+    array = get_arrow_array(factors)
+    if array is None:
+        return None
+    if not pa.types.is_string(array.type) and \
+            not pa.types.is_large_string(array.type):
+        array = pc.cast(array, pa.string())
+    array = pc.if_else(pa.array(nan_tf), pa.scalar(None, pa.string()), array)
+    try:
+        floats = pc.cast(array, pa.float64())
+    except pa.ArrowInvalid:
+        return None
+    return floats.to_numpy(zero_copy_only=False)
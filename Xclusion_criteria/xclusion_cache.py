@@ -0,0 +1,325 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from os.path import isdir, isfile, getsize
+
+from Xclusion_criteria import __version__
+from Xclusion_criteria.xclusion_io import read_i_criteria
+
+
+def get_file_hash(path: str, chunk_size: int = 1048576) -> str:
+    """Hash the content of a file, read by chunks.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    chunk_size : int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    file_hash : str
+        SHA-256 of the file content (None if there is no file).
+    """
+    if not path or not isfile(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_ids_files(criteria_dict: dict) -> list:
+    """Get the IDs files used by the criteria, which content
+    is part of the inputs as much as the metadata's.
+
+    Parameters
+    ----------
+    criteria_dict : dict
+        Content of the yml criteria file.
+
+    Returns
+    -------
+    ids_files : list
+        Paths to the IDs files of the "5" and "6" criteria.
+    """
+    ids_files = []
+    steps = [criteria_dict.get(x) for x in ['init', 'add', 'filter']]
+    if isinstance(criteria_dict.get('predicates'), dict):
+        steps.extend(criteria_dict['predicates'].values())
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        for variable_index, values in step.items():
+            if str(variable_index).split(',')[-1] in ['5', '6'] and \
+                    isinstance(values, list):
+                ids_files.extend(str(x) for x in values)
+    return ids_files
+
+
+def get_cache_key(m_input: str, i_criteria: str, i_plot_groups: str,
+                  nulls: list, options: dict) -> str:
+    """Get the key of a run from everything that determines its outputs.
+
+    Parameters
+    ----------
+    m_input : str
+        Path to the metadata file (or database).
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    i_plot_groups : str
+        Path to yml config file for the different groups to visualize.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    options : dict
+        Command line options that change the outputs.
+
+    Returns
+    -------
+    cache_key : str
+        SHA-256 of the metadata content, the parsed criteria and plot
+        groups (so that formatting and comments do not matter), the IDs
+        files content, the nulls, the options and the package version.
+    """
+    criteria_dict = read_i_criteria(i_criteria) or {}
+    content = {
+        'metadata': get_file_hash(m_input),
+        'criteria': criteria_dict,
+        'ids': dict((x, get_file_hash(x)) for x in get_ids_files(
+            criteria_dict)),
+        'plot_groups': read_i_criteria(i_plot_groups),
+        'nulls': nulls,
+        'options': options,
+        'version': __version__
+    }
+    text = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_cache_outputs(o_included: str, o_excluded: str,
+                      o_visualization: str) -> dict:
+    """Get the outputs of the run to cache.
+
+    Parameters
+    ----------
+    o_included : str
+        Path to output metadata for the included samples only.
+    o_excluded : str
+        Path to output metadata for the excluded samples only.
+    o_visualization : str
+        Path to output visualization for the included samples only.
+
+    Returns
+    -------
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    """
+    outputs = {'included': o_included}
+    if o_excluded:
+        outputs['excluded'] = o_excluded
+    if o_visualization:
+        # as written by make_visualizations (one or the other)
+        if not o_visualization.endswith('.html'):
+            o_visualization = '%s.html' % o_visualization
+        outputs['visualization'] = o_visualization
+        outputs['visualization_empty'] = '%s_emptySelection.html' % (
+            o_visualization[:-len('.html')])
+    return outputs
+
+
+def link_file(source: str, destination: str) -> None:
+    """Hard-link a file (or copy it on another file system).
+
+    Parameters
+    ----------
+    source : str
+        Path to the existing file.
+    destination : str
+        Path to the new file (replaced if it exists).
+    """
+    if isfile(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def check_cache_entry(entry: str, cached: dict) -> bool:
+    """Check that the files of a cache entry are those that were stored.
+
+    Parameters
+    ----------
+    entry : str
+        Folder of the cache entry.
+    cached : dict
+        Key     = output name.
+        Value   = size and SHA-256 of the cached file.
+
+    Returns
+    -------
+    valid : bool
+        Whether all the cached files have their stored size and hash.
+    """
+    if not isinstance(cached, dict):
+        return False
+    for output, stored in cached.items():
+        path = '%s/%s' % (entry, output)
+        if not isfile(path) or getsize(path) != stored.get('size') or \
+                get_file_hash(path) != stored.get('sha256'):
+            return False
+    return True
+
+
+def restore_cache(p_cache_dir: str, cache_key: str, outputs: dict) -> bool:
+    """Restore the outputs of a previous run with the same key.
+
+    Parameters
+    ----------
+    p_cache_dir : str
+        Folder of the run cache.
+    cache_key : str
+        Key of the run.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+
+    Returns
+    -------
+    hit : bool
+        Whether the outputs were restored from the cache (an entry
+        which files changed since it was stored is removed).
+    """
+    entry = '%s/%s' % (p_cache_dir, cache_key)
+    manifest = '%s/manifest.json' % entry
+    if not isfile(manifest):
+        return False
+    try:
+        with open(manifest) as handle:
+            cached = json.load(handle)['outputs']
+    except (ValueError, KeyError, TypeError):
+        cached = None
+    if not check_cache_entry(entry, cached):
+        shutil.rmtree(entry, ignore_errors=True)
+        return False
+    for output in cached:
+        if output in outputs:
+            output_dir = os.path.dirname(outputs[output])
+            if output_dir and not isdir(output_dir):
+                os.makedirs(output_dir)
+            link_file('%s/%s' % (entry, output), outputs[output])
+    # the last use of an entry is its folder's time
+    os.utime(entry)
+    return True
+
+
+def unlink_outputs(outputs: dict) -> None:
+    """Remove the outputs that are hard links of cached files, so
+    that the run writes new files instead of changing the cache, and
+    the visualizations, so that only the one written by the run is cached.
+
+    Parameters
+    ----------
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    """
+    for name, output in outputs.items():
+        if isfile(output) and (name.startswith('visualization') or
+                               os.stat(output).st_nlink > 1):
+            os.remove(output)
+
+
+def store_cache(p_cache_dir: str, cache_key: str, outputs: dict) -> None:
+    """Copy the outputs of the run in the cache.
+
+    Parameters
+    ----------
+    p_cache_dir : str
+        Folder of the run cache.
+    cache_key : str
+        Key of the run.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    """
+    entry = '%s/%s' % (p_cache_dir, cache_key)
+    entry_tmp = '%s.%s.tmp' % (entry, os.getpid())
+    if isdir(entry_tmp):
+        shutil.rmtree(entry_tmp)
+    os.makedirs(entry_tmp)
+    cached = {}
+    for output, path in outputs.items():
+        # not all outputs are written, e.g. if no sample is included
+        if isfile(path):
+            cached_path = '%s/%s' % (entry_tmp, output)
+            shutil.copyfile(path, cached_path)
+            # the restored outputs are hard links: not to be rewritten
+            os.chmod(cached_path, 0o444)
+            cached[output] = {'size': getsize(cached_path),
+                              'sha256': get_file_hash(cached_path)}
+    with open('%s/manifest.json' % entry_tmp, 'w') as o:
+        json.dump({'outputs': cached, 'version': __version__}, o)
+    try:
+        if isdir(entry):
+            shutil.rmtree(entry)
+        # the entry appears complete or not at all
+        os.rename(entry_tmp, entry)
+    except OSError:
+        # a concurrent run stored the same entry in the meantime
+        shutil.rmtree(entry_tmp, ignore_errors=True)
+
+
+def get_entry_size(entry: str) -> int:
+    """Get the size of a cache entry in bytes."""
+    return sum(getsize('%s/%s' % (entry, x)) for x in os.listdir(entry))
+
+
+def evict_cache(p_cache_dir: str, p_cache_days: float,
+                p_cache_size: float) -> list:
+    """Remove the cache entries unused for too long, and then the
+    least recently used entries until the cache fits in its size.
+
+    Parameters
+    ----------
+    p_cache_dir : str
+        Folder of the run cache.
+    p_cache_days : float
+        Number of days after which an unused entry is removed.
+    p_cache_size : float
+        Maximum size of the cache (in megabytes).
+
+    Returns
+    -------
+    evicted : list
+        Keys of the removed entries.
+    """
+    entries = []
+    for cache_key in os.listdir(p_cache_dir):
+        entry = '%s/%s' % (p_cache_dir, cache_key)
+        if isdir(entry) and not cache_key.endswith('.tmp'):
+            entries.append((os.stat(entry).st_mtime, cache_key,
+                            get_entry_size(entry)))
+    evicted = []
+    now = time.time()
+    max_size = p_cache_size * 1024 ** 2
+    cache_size = sum(x[2] for x in entries)
+    for mtime, cache_key, size in sorted(entries):
+        if now - mtime > p_cache_days * 86400 or cache_size > max_size:
+            shutil.rmtree('%s/%s' % (p_cache_dir, cache_key))
+            cache_size -= size
+            evicted.append(cache_key)
+    return evicted
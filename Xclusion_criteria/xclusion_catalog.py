@@ -0,0 +1,517 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import ast
+import numpy as np
+import pandas as pd
+from os.path import isfile
+
+from Xclusion_criteria import __version__
+from Xclusion_criteria.xclusion_io import (
+    read_i_criteria, encode_json, decode_json)
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criterion_name, get_intervals, get_range_mask,
+    get_patterns_regex, get_patterns_hits, add_step_counts,
+    drop_ids_criteria)
+from Xclusion_criteria.xclusion_expr import parse_expression
+from Xclusion_criteria.xclusion_outliers import get_outliers_params
+
+# variables with more distinct values only keep the most frequent ones
+CATALOG_FACTORS = 10000
+CATALOG_TOP = 100
+CATALOG_QUANTILES = 101
+
+
+def get_file_stat(m_metadata_file: str) -> list:
+    """Get the size and modification time of the metadata file."""
+    stat = os.stat(m_metadata_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_column_stats(column: pd.Series, var_factors: dict = None) -> tuple:
+    """Get the frequencies of the values of a metadata variable.
+
+    Parameters
+    ----------
+    column : pd.Series
+        Values of the metadata variable.
+    var_factors : dict
+        Factors of the variable, if already collected for the criteria.
+
+    Returns
+    -------
+    counts : dict
+        Key     = value (the CATALOG_TOP most frequent values only if
+                  there are more than CATALOG_FACTORS distinct values).
+        Value   = number of samples.
+    nans : int
+        Number of samples with a missing value.
+    distinct : int
+        Number of distinct values.
+    """
+    if var_factors is not None:
+        counts = pd.Series(var_factors['counts'], dtype=int)
+        nans = var_factors['nans']
+    else:
+        counts = column.value_counts()
+        nans = int(column.isna().sum())
+    distinct = counts.size
+    if distinct > CATALOG_FACTORS:
+        counts = counts.nlargest(CATALOG_TOP)
+    return counts.to_dict(), nans, distinct
+
+
+def get_catalog(m_metadata_file: str, metadata: pd.DataFrame,
+                md_factors: dict, numerical: list,
+                categorical: list) -> dict:
+    """Collect the statistics of each column of the metadata table.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    metadata : pd.DataFrame
+        Metadata table (after the dtypes inference).
+    md_factors : dict
+        Per-column factors of the metadata table.
+    numerical : list
+        Metadata variables that are numeric.
+    categorical : list
+        Metadata variables that are categorical.
+
+    Returns
+    -------
+    catalog : dict
+        stat        = Size and modification time of the metadata file.
+        rows        = Number of samples.
+        factors     = Per-column value frequencies, missing values
+                      and number of distinct values.
+        quantiles   = Per-numerical column quantiles of the values (if
+                      the frequencies are not kept for all the values).
+    """
+    factors, quantiles = {}, {}
+    for var in metadata.columns:
+        column = metadata[var]
+        counts, nans, distinct = get_column_stats(
+            column, md_factors['factors'].get(var))
+        factors[var] = {'counts': counts, 'nans': nans,
+                        'distinct': distinct}
+        if var in numerical and distinct > len(counts):
+            values = column.to_numpy(dtype=float, na_value=np.nan)
+            quantiles[var] = np.nanquantile(
+                values, np.linspace(0, 1, CATALOG_QUANTILES)).tolist()
+    catalog = {
+        'version': __version__,
+        'stat': get_file_stat(m_metadata_file),
+        'rows': metadata.shape[0],
+        'index': metadata.index.name,
+        'columns': metadata.columns.tolist(),
+        'numerical': numerical,
+        'categorical': categorical,
+        'factors': factors,
+        'quantiles': quantiles
+    }
+    return catalog
+
+
+def read_catalog(p_catalog: str) -> dict:
+    """Read the statistics catalog (None if there is none).
+
+    The catalog file is JSON text (see encode_json), not a pickle.
+    """
+    if not p_catalog or not isfile(p_catalog):
+        return None
+    try:
+        with open(p_catalog) as handle:
+            catalog = decode_json(handle.read())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(catalog, dict) or catalog.get(
+            'version') != __version__:
+        return None
+    return catalog
+
+
+def write_catalog(p_catalog: str, catalog: dict) -> None:
+    """Write the statistics catalog (replacing the previous one at once)."""
+    p_catalog_tmp = '%s.%s.tmp' % (p_catalog, os.getpid())
+    with open(p_catalog_tmp, 'w') as o:
+        o.write(encode_json(catalog))
+    os.replace(p_catalog_tmp, p_catalog)
+
+
+def check_catalog(catalog: dict, m_metadata_file: str) -> bool:
+    """Check that the catalog was made on the current metadata file
+    (from its size and modification time, without reading it)."""
+    return catalog is not None and catalog['stat'] == get_file_stat(
+        m_metadata_file)
+
+
+def get_catalog_factors(catalog: dict) -> tuple:
+    """Get an empty metadata table and the per-column factors made from
+    the catalog, to check the criteria without the metadata table.
+
+    Parameters
+    ----------
+    catalog : dict
+        Statistics of the metadata columns.
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Metadata table without samples.
+    md_factors : dict
+        Per-column factors (no codes, as there are no samples).
+    """
+    metadata = pd.DataFrame(columns=catalog['columns'])
+    metadata.index.name = catalog['index']
+    md_factors = {
+        'positions': dict((col, pos) for pos, col in enumerate(
+            catalog['columns'])),
+        'factors': dict((var, {
+            'uniques': np.array(list(stats['counts']), dtype=object),
+            'counts': stats['counts'],
+            'nans': stats['nans'],
+        }) for var, stats in catalog['factors'].items())
+    }
+    return metadata, md_factors
+
+
+def get_catalog_criteria(i_criteria: str, catalog: dict, nulls: list,
+                         messages: list) -> dict:
+    """Check the criteria against the catalog instead of the metadata.
+
+    Parameters
+    ----------
+    i_criteria: str
+        Path to yml config file for the inclusion/exclusion criteria.
+    catalog : dict
+        Statistics of the metadata columns.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    criteria : dict
+        Full yml content, including all inclusion/exclusion criteria.
+    """
+    criteria_dict = drop_ids_criteria(
+        read_i_criteria(i_criteria), messages, 'not estimated')
+    metadata, md_factors = get_catalog_factors(catalog)
+    criteria = check_criteria(
+        criteria_dict, metadata, nulls, messages, md_factors)
+    return criteria
+
+
+def get_range_fraction(var: str, intervals: list, catalog: dict) -> float:
+    """Get the fraction of the samples in any of the intervals, from the
+    frequencies of the values or by interpolating their quantiles.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable in criteria.
+    intervals : list
+        (min, max, min included, max included) tuples.
+    catalog : dict
+        Statistics of the metadata columns.
+
+    Returns
+    -------
+    fraction : float
+        Estimated fraction of the samples in range.
+    """
+    stats = catalog['factors'][var]
+    if var not in catalog['quantiles']:
+        values = np.array(list(stats['counts']), dtype=float)
+        counts = np.array(list(stats['counts'].values()), dtype=float)
+        if not values.size:
+            return 0.
+        in_range = get_range_mask(values, intervals)
+        return counts[in_range].sum() / catalog['rows']
+    quantiles = np.array(catalog['quantiles'][var])
+    cdf = np.linspace(0, 1, quantiles.size)
+    fraction = 0.
+    for low, high, _, _ in intervals:
+        fraction += np.interp(high, quantiles, cdf) - np.interp(
+            low, quantiles, cdf)
+    non_nans = 1 - stats['nans'] / catalog['rows']
+    return min(fraction, 1.) * non_nans
+
+
+def get_criterion_fraction(var: str, index: str, values, catalog: dict,
+                           numerical: list) -> float:
+    """Get the fraction of the samples passing a criterion, from the
+    statistics of its variable.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable in criteria (or expression).
+    index : str
+        Numeric indicator.
+    values : list or dict
+        Metadata variables in criteria (or predicates of the expression).
+    catalog : dict
+        Statistics of the metadata columns.
+    numerical : list
+        Metadata variables that are numeric.
+
+    Returns
+    -------
+    fraction : float
+        Estimated fraction of the samples passing the criterion
+        (None if the criterion is not applied).
+    """
+    rows = catalog['rows']
+    if not rows:
+        return 0.
+    if index == 'expression':
+        return get_expression_fraction(
+            parse_expression(var), values, catalog, numerical)
+    stats = catalog['factors'][var]
+    if index in ['0', '1']:
+        count = sum(stats['counts'].get(x, 0) for x in set(values))
+        if index == '0':
+            if 'nan' in values:
+                count += stats['nans']
+            return 1 - count / rows
+        return count / rows
+    if index == '2':
+        if var not in numerical:
+            return None
+        intervals = get_intervals(values)
+        if all(low == -np.inf and high == np.inf
+               for low, high, _, _ in intervals):
+            return None
+        return get_range_fraction(var, intervals, catalog)
+    if index in ['3', '4']:
+        var_factors = {'uniques': list(stats['counts'])}
+        hits = get_patterns_hits(var_factors, get_patterns_regex(values))
+        count = sum(np.array(list(stats['counts'].values()))[hits])
+        if index == '4':
+            return 1 - count / rows
+        return count / rows
+    if index == '7':
+        if var not in numerical:
+            return None
+        return get_outliers_fraction(var, values, catalog)
+    return None
+
+
+def get_outliers_fraction(var: str, values: list, catalog: dict) -> float:
+    """Get the fraction of the samples that are not outliers, from the
+    frequencies of the values or their quantiles.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable in criteria.
+    values : list
+        Metadata variables in criteria.
+    catalog : dict
+        Statistics of the metadata columns.
+
+    Returns
+    -------
+    fraction : float
+        Estimated fraction of the samples that are not outliers
+        (None if the outliers are within strata).
+    """
+    params = get_outliers_params(values)
+    if params['by']:
+        return None
+    stats = catalog['factors'][var]
+    if var in catalog['quantiles']:
+        numbers = np.array(catalog['quantiles'][var])
+        weights = np.ones(numbers.size)
+    else:
+        numbers = np.array(list(stats['counts']), dtype=float)
+        weights = np.array(list(stats['counts'].values()), dtype=float)
+        order = np.argsort(numbers)
+        numbers, weights = numbers[order], weights[order]
+    if not numbers.size:
+        return 1.
+    number = params['numbers'][0]
+    if params['method'] == 'zscore':
+        mean = np.average(numbers, weights=weights)
+        std = np.sqrt(np.average((numbers - mean) ** 2, weights=weights))
+        low, high = mean - number * std, mean + number * std
+    else:
+        cdf = (np.cumsum(weights) - weights[0]) / max(
+            weights.sum() - weights[0], 1)
+        if params['method'] == 'iqr':
+            first, third = np.interp([.25, .75], cdf, numbers)
+            low = first - number * (third - first)
+            high = third + number * (third - first)
+        else:
+            low, high = np.interp([x / 100 for x in params['numbers']],
+                                  cdf, numbers)
+    # the missing values are not outliers
+    return get_range_fraction(var, [(low, high, True, True)], catalog) + \
+        stats['nans'] / catalog['rows']
+
+
+def get_expression_fraction(node, predicates: dict, catalog: dict,
+                            numerical: list) -> float:
+    """Get the fraction of the samples satisfying a boolean expression,
+    assuming that the predicates are independent.
+
+    Parameters
+    ----------
+    node : ast.AST
+        Node of the expression's syntax tree.
+    predicates : dict
+        Key     = predicate name.
+        Value   = criteria that must all be true for the predicate.
+    catalog : dict
+        Statistics of the metadata columns.
+    numerical : list
+        Metadata variables that are numeric.
+
+    Returns
+    -------
+    fraction : float
+        Estimated fraction of the samples satisfying the expression.
+    """
+    if isinstance(node, ast.Name):
+        fraction = 1.
+        for (var, index), values in predicates[node.id].items():
+            cur_fraction = get_criterion_fraction(
+                var, index, values, catalog, numerical)
+            if cur_fraction is not None:
+                fraction *= cur_fraction
+        return fraction
+    if isinstance(node, ast.UnaryOp):
+        return 1 - get_expression_fraction(
+            node.operand, predicates, catalog, numerical)
+    fractions = [get_expression_fraction(
+        value, predicates, catalog, numerical) for value in node.values]
+    if isinstance(node.op, ast.And):
+        return float(np.prod(fractions))
+    return 1 - float(np.prod([1 - x for x in fractions]))
+
+
+def estimate_step_criteria(criteria: dict, catalog: dict, numerical: list,
+                           flowcharts: dict, step: str,
+                           input_count: float) -> float:
+    """Estimate the samples remaining after each criterion of a step,
+    assuming that the criteria are independent.
+
+    Parameters
+    ----------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    catalog : dict
+        Statistics of the metadata columns.
+    numerical : list
+        Metadata variables that are numeric.
+    flowcharts : dict
+        Steps of the workflow with estimated samples counts.
+    step : str
+        The type of criterion to apply (init, filter, add, no_nan).
+    input_count : float
+        Estimated number of samples input to the step.
+
+    Returns
+    -------
+    cur_count : float
+        Estimated number of samples remaining after the step.
+    """
+    flowchart = []
+    cur_count = input_count
+    for (var, index), values in criteria[step].items():
+        fraction = get_criterion_fraction(
+            var, index, values, catalog, numerical)
+        if fraction is None:
+            continue
+        cur_count *= fraction
+        if not flowchart:
+            flowchart.append(['%s metadata' % step, round(input_count),
+                              None, None, None])
+        flowchart.append([get_criterion_name(var, index), round(cur_count),
+                          str(var), '\n'.join(map(str, values)), str(index)])
+    flowcharts[step] = flowchart
+    return cur_count
+
+
+def estimate_flowcharts(criteria: dict, catalog: dict) -> dict:
+    """Estimate the samples counts of each step of the flowchart from the
+    catalog, chaining the steps as in get_criteria_masks.
+
+    Parameters
+    ----------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    catalog : dict
+        Statistics of the metadata columns.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with estimated samples counts.
+    """
+    flowcharts = {}
+    numerical = catalog['numerical']
+    init_count = catalog['rows']
+    if 'init' in criteria:
+        init_count = estimate_step_criteria(
+            criteria, catalog, numerical, flowcharts, 'init', init_count)
+    add_count = 0
+    if 'add' in criteria:
+        add_count = estimate_step_criteria(
+            criteria, catalog, numerical, flowcharts, 'add', init_count)
+    nan_count = init_count
+    if 'no_nan' in criteria:
+        nan_count = estimate_step_criteria(
+            criteria, catalog, numerical, flowcharts, 'no_nan', init_count)
+    filter_count = nan_count
+    if 'filter' in criteria:
+        filter_count = estimate_step_criteria(
+            criteria, catalog, numerical, flowcharts, 'filter', nan_count)
+    # the "add" samples already included are the independent share
+    common_count = filter_count * add_count / init_count if init_count else 0
+    if round(add_count) and 'filter' in flowcharts:
+        add_step_counts(flowcharts, round(
+            filter_count + add_count - common_count), round(add_count),
+            round(common_count), [])
+    return flowcharts
+
+
+def get_estimate_accuracy(estimates: dict, flowcharts: dict) -> pd.DataFrame:
+    """Compare the estimated and actual samples counts of the flowcharts.
+
+    Parameters
+    ----------
+    estimates : dict
+        Steps of the workflow with estimated samples counts.
+    flowcharts : dict
+        Steps of the workflow with samples counts.
+
+    Returns
+    -------
+    accuracy : pd.DataFrame
+        estimate    = Estimated number of samples.
+        samples     = Actual number of samples.
+        error       = Relative error of the estimate (%).
+    """
+    def get_rows(flowchart_dict, column):
+        return pd.DataFrame(
+            [[step, row[0], row[1]] for step, flowchart in
+             flowchart_dict.items() for row in flowchart if step != 'data'],
+            columns=['step', 'criterion', column])
+    accuracy = get_rows(flowcharts, 'samples').merge(
+        get_rows(estimates, 'estimate'), on=['step', 'criterion'],
+        how='outer')[['step', 'criterion', 'estimate', 'samples']]
+    accuracy['error'] = (100 * (accuracy['estimate'] - accuracy['samples']) /
+                         accuracy['samples'].where(accuracy['samples'] > 0))
+    accuracy['error'] = accuracy['error'].round(1)
+    return accuracy
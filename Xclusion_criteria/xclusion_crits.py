@@ -6,12 +6,219 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import re
+import ast
+import numpy as np
 import pandas as pd
-from Xclusion_criteria.xclusion_io import read_i_criteria
+from os.path import isfile
+from Xclusion_criteria.xclusion_io import read_i_criteria, read_ids
+from Xclusion_criteria.xclusion_factors import (
+    get_md_factors, get_factors, get_factors_mask)
+from Xclusion_criteria.xclusion_expr import (
+    parse_expression, get_expression_names, get_expression_text, get_clauses)
+from Xclusion_criteria.xclusion_trace import trace_phase
+from Xclusion_criteria.xclusion_outliers import (
+    get_outliers_params, get_outliers_mask)
+from Xclusion_criteria.xclusion_hosts import (
+    get_hosts_conditions, get_hosts_variables, get_hosts_mask)
+
+# numeric indicators:
+#   0   remove the samples with the passed factors
+#   1   keep the samples with the passed factors
+#   2   keep the samples in the passed range(s)
+#   3   keep the samples matching any of the passed patterns
+#   4   remove the samples matching any of the passed patterns
+#   5   keep the samples which ID is in the passed file(s)
+#   6   remove the samples which ID is in the passed file(s)
+#   7   remove the outliers of the passed method (within strata)
+#   8   keep the samples which group (e.g. host) passes the conditions
+INDICATORS = ['0', '1', '2', '3', '4', '5', '6', '7', '8']
+# deepest nesting of the trie regex groups (the re module recurses on them)
+TRIE_DEPTH = 100
+
+
+def get_trie_regex(node: dict) -> str:
+    """Write the regex matching the words of a characters trie.
+
+    The trie is walked with a stack rather than by recursion, as
+    the words can be longer than the recursion limit.
+
+    Parameters
+    ----------
+    node : dict
+        Key     = next character ('' if a word ends here).
+        Value   = trie of the next characters.
+
+    Returns
+    -------
+    regex : str
+        Regex factoring the common prefixes of the words (None if its
+        groups would be nested deeper than the re module can compile).
+    """
+    # regex and groups nesting of each node, children first
+    regexes = {}
+    stack = [(node, None, None)]
+    while stack:
+        cur, chain, end = stack.pop()
+        if chain is None:
+            # the characters up to the next word end or branching
+            chain, end = [], cur
+            while '' not in end and len(end) == 1:
+                char = next(iter(end))
+                chain.append(re.escape(char))
+                end = end[char]
+            # a word ending here is enough to have a match
+            if '' in end:
+                regexes[id(cur)] = (''.join(chain), 0)
+            else:
+                stack.append((cur, chain, end))
+                stack.extend((end[char], None, None) for char in end)
+            continue
+        alternatives = ['%s%s' % (re.escape(char), regexes[id(end[char])][0])
+                        for char in sorted(end)]
+        depth = max(regexes[id(end[char])][1] for char in end) + 1
+        regexes[id(cur)] = ('%s(?:%s)' % (''.join(chain), '|'.join(
+            alternatives)), depth)
+    regex, depth = regexes[id(node)]
+    if depth > TRIE_DEPTH:
+        return None
+    return regex
+
+
+def get_patterns_regex(values: list) -> str:
+    """Combine all the patterns of a criterion into a single regex.
+
+    Each pattern can be:
+        - "prefix:<text>"       : the factor starts with <text>.
+        - "contains:<text>"     : the factor contains <text> (default).
+        - "regex:<regex>"       : the factor matches the regular expression.
+
+    The literal prefixes and substrings are compiled into a trie-shaped
+    regex, so that thousands of patterns are not tried one by one (or
+    into a plain alternation if the trie is too deep).
+
+    Parameters
+    ----------
+    values : list
+        Patterns in criteria.
+
+    Returns
+    -------
+    regex : str
+        Alternation of all the patterns.
+
+    Raises
+    ------
+    re.error
+        If there is no pattern or a pattern is empty (it would match
+        every value).
+    """
+    if not values:
+        raise re.error('no pattern')
+    patterns = {'prefix': {}, 'contains': {}}
+    words = {'prefix': [], 'contains': []}
+    regexes = []
+    for value in map(str, values):
+        kind, _, pattern = value.partition(':')
+        if kind not in ['regex', 'prefix', 'contains']:
+            kind, pattern = 'contains', value
+        if not pattern:
+            raise re.error('empty pattern "%s"' % value)
+        if kind == 'regex':
+            regexes.append('(?:%s)' % pattern)
+            continue
+        words[kind].append(pattern)
+        node = patterns[kind]
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    for kind, anchor in [('prefix', '^'), ('contains', '')]:
+        if not patterns[kind]:
+            continue
+        regex = get_trie_regex(patterns[kind])
+        if regex is None:
+            regex = '(?:%s)' % '|'.join(map(re.escape, words[kind]))
+        regexes.append('%s%s' % (anchor, regex))
+    return '|'.join(regexes)
+
+
+def get_patterns_hits(var_factors: dict, regex: str) -> np.ndarray:
+    """Match the patterns on the distinct values of a variable only.
+
+    Parameters
+    ----------
+    var_factors : dict
+        Factors of the metadata variable.
+    regex : str
+        Alternation of all the patterns.
+
+    Returns
+    -------
+    hits : np.ndarray
+        Whether each distinct value matches any pattern.
+    """
+    pattern = re.compile(regex)
+    uniques = var_factors['uniques']
+    hits = np.fromiter((pattern.search(str(x)) is not None for x in uniques),
+                       dtype=bool, count=len(uniques))
+    return hits
+
+
+
+def get_ids(values: list, md_factors: dict) -> set:
+    """Get the IDs in the passed files, each file being read only once.
+
+    Parameters
+    ----------
+    values : list
+        Paths to the files containing the IDs.
+    md_factors : dict
+        Per-column factors of the metadata table (also holding the IDs).
+
+    Returns
+    -------
+    ids : set
+        IDs in all the files.
+    """
+    ids_files = md_factors.setdefault('ids', {})
+    for ids_file in values:
+        if ids_file not in ids_files:
+            ids_files[ids_file] = read_ids(ids_file)
+    if len(values) == 1:
+        return ids_files[values[0]]
+    return set().union(*[ids_files[x] for x in values])
+
+
+def get_ids_mask(input_pd: pd.DataFrame, var: str, ids: set,
+                 md_factors: dict) -> np.ndarray:
+    """Get the samples which ID is in the passed IDs.
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata table.
+    var : str
+        Metadata variable with the IDs (or the index name, e.g. sample_name).
+    ids : set
+        IDs in the files.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample's ID is in the passed IDs.
+    """
+    if var not in md_factors['positions'] and var == input_pd.index.name:
+        return input_pd.index.astype(str).isin(ids)
+    var_factors = get_factors(var, input_pd, md_factors)
+    hits = pd.Index(var_factors['uniques']).astype(str).isin(ids)
+    return np.append(hits, False)[var_factors['codes']]
 
 
 def check_factors(var: str, index: str, values: list, nulls: list,
-                  metadata: pd.DataFrame, messages: list) -> tuple:
+                  metadata: pd.DataFrame, messages: list,
+                  md_factors: dict = None) -> tuple:
     """Checks that subset values for the
     current variable are in metadata.
 
@@ -29,6 +236,8 @@ def check_factors(var: str, index: str, values: list, nulls: list,
         Metadata table.
     messages : list
         Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
 
     Returns
     -------
@@ -42,10 +251,59 @@ def check_factors(var: str, index: str, values: list, nulls: list,
     boolean = False
     if index == '2':
         return boolean, values
+    if md_factors is None:
+        md_factors = get_md_factors(metadata)
+    if index == '7':
+        missing = [x for x in get_outliers_params(values)['by']
+                   if x not in md_factors['positions']]
+        if missing:
+            messages.append('Strata variable(s) for variable %s not in '
+                            'metadata (skipped)\n - %s' % (
+                                var, '\n - '.join(missing)))
+            boolean = True
+        return boolean, values
+    if index == '8':
+        missing = [x for x in get_hosts_variables(index, values)
+                   if x not in md_factors['positions']]
+        if missing:
+            messages.append('Aggregated variable(s) for variable %s not in '
+                            'metadata (skipped)\n - %s' % (
+                                var, '\n - '.join(missing)))
+            boolean = True
+        return boolean, values
+    if index in ['5', '6']:
+        missing = [str(x) for x in values if not isfile(str(x))]
+        if missing:
+            messages.append('IDs file(s) for variable %s not found (skipped)'
+                            '\n - %s' % (var, '\n - '.join(missing)))
+            return True, values
+        try:
+            ids = get_ids(values, md_factors)
+        except ImportError:
+            messages.append('Reading Parquet IDs file(s) needs pyarrow '
+                            '(%s skipped)' % var)
+            return True, values
+        if not get_ids_mask(metadata, var, ids, md_factors).any():
+            messages.append('IDs for variable %s not in table (skipped)' % var)
+            boolean = True
+        return boolean, values
+    var_factors = get_factors(var, metadata, md_factors)
+    if index in ['3', '4']:
+        try:
+            hits = get_patterns_hits(var_factors, get_patterns_regex(values))
+        except re.error as e:
+            messages.append('Patterns for variable %s are not valid: %s '
+                            '(skipped)' % (var, e))
+            return True, values
+        if not hits.any():
+            messages.append('Subset patterns for variable %s match no '
+                            'value in table (skipped)' % var)
+            boolean = True
+        return boolean, values
     else:
         values_set = set([x for x in values if x!='NULLS'])
-        md_factors = set(metadata[var])
-        common_vars = values_set & md_factors
+        common_vars = set([x for x in values_set
+                           if x in var_factors['counts']])
         if not len(common_vars):
             messages.append('Subset values for variable %s not in table (skipped)' % var)
             boolean = True
@@ -55,12 +313,94 @@ def check_factors(var: str, index: str, values: list, nulls: list,
                             ' - %s' % (var, '\n - '.join(values_out)))
         common_vars_list = sorted(common_vars)
         if 'NULLS' in values:
-            common_vars_list.extend(nulls)
+            # only the null factors that are in the metadata
+            common_vars_list.extend([
+                x for x in nulls if x in var_factors['counts'] or (
+                        x == 'nan' and var_factors['nans'])])
         return boolean, common_vars_list
 
 
+def get_bound(bound) -> float:
+    """Convert a range bound to a float.
+
+    Parameters
+    ----------
+    bound : str, int, float or None
+        Bound of a numerical range ("None" for no bound).
+
+    Returns
+    -------
+    bound_float : float
+        Bound as a float (None if there is no bound).
+
+    """
+    if bound is None or str(bound).strip() == 'None':
+        return None
+    return float(bound)
+
+
+def get_intervals(values: list) -> list:
+    """Parse the min-max values of a range criterion into intervals.
+
+    Three formats are accepted:
+        - ['18', 'None']            : min and max, both excluded.
+        - [[18.5, 25], [30, 40]]    : min-max pairs, both included.
+        - ['[18.5,25)', '(30,40]']  : interval notation, where "[" / "]"
+                                      include and "(" / ")" exclude.
+
+    Parameters
+    ----------
+    values : list
+        Min-max values in criteria.
+
+    Returns
+    -------
+    intervals : list
+        (min, max, min included, max included) tuples, with missing bounds
+        as -inf / +inf (None if the values could not be parsed).
+
+    """
+    intervals = []
+    try:
+        if all(not isinstance(x, list) and str(x)[:1] not in '[(' or
+               str(x) == 'None' for x in values):
+            # min and max values as two items
+            if len(values) != 2:
+                return None
+            intervals.append((get_bound(values[0]), get_bound(values[1]),
+                              False, False))
+        else:
+            for value in values:
+                if isinstance(value, list):
+                    # min-max pair with the bounds included
+                    if len(value) != 2:
+                        return None
+                    intervals.append((get_bound(value[0]),
+                                      get_bound(value[1]), True, True))
+                else:
+                    # interval notation, e.g. "[18.5,25)"
+                    value = str(value).strip()
+                    if value[:1] not in '[(' or value[-1:] not in '])':
+                        return None
+                    bounds = value[1:-1].split(',')
+                    if len(bounds) != 2:
+                        return None
+                    intervals.append((get_bound(bounds[0]),
+                                      get_bound(bounds[1]),
+                                      value[0] == '[', value[-1] == ']'))
+    except ValueError:
+        return None
+    intervals = [(-np.inf if low is None else low,
+                  np.inf if high is None else high,
+                  low_in, high_in) for low, high, low_in, high_in in intervals]
+    return intervals
+
+
 def check_index(index: str, values: list, messages: list) -> bool:
-    """Checks that min-max values are a two-items list.
+    """Checks that min-max values are a two-items
+    list or a list of min-max intervals, that outliers
+    values start with a known method, and that the
+    host conditions can be parsed.
 
     Parameters
     ----------
@@ -78,9 +418,19 @@ def check_index(index: str, values: list, messages: list) -> bool:
 
     """
     boolean = False
-    if index == '2' and len(values) != 2:
+    if index == '2' and get_intervals(values) is None:
         messages.append('For min-max subsetting, two-items list need: no min (or no max) should be "None"')
         boolean = True
+    elif index == '7' and get_outliers_params(values) is None:
+        messages.append('For outliers exclusion, the list needs "zscore", '
+                        '"iqr" or "percentile", its number(s) and the '
+                        'strata variables (if any)')
+        boolean = True
+    elif index == '8' and get_hosts_conditions(values) is None:
+        messages.append('For host criteria, the list needs conditions such '
+                        'as "count >= 3", "max(bmi) <= 30" or '
+                        '"first(collection_timestamp)"')
+        boolean = True
     return boolean
 
 
@@ -111,7 +461,7 @@ def check_islist(var: str, values, messages: list) -> bool:
 
 def check_numeric_indicator(var: str, index: str, messages: list) -> bool:
     """Checks that variable's numeric
-    indicator is "0", "1" or "2".
+    indicator is one of the INDICATORS.
 
     Parameters
     ----------
@@ -129,8 +479,10 @@ def check_numeric_indicator(var: str, index: str, messages: list) -> bool:
 
     """
     boolean = False
-    if index not in ['0', '1', '2']:
-        messages.append('Numeric indicator not "0", "1" or "2" (%s) (%s skipped)' % (index, var))
+    if index not in INDICATORS:
+        messages.append('Numeric indicator not %s or "%s" (%s) (%s skipped)' % (
+            ', '.join(['"%s"' % x for x in INDICATORS[:-1]]),
+            INDICATORS[-1], index, var))
         boolean = True
     return boolean
 
@@ -142,7 +494,7 @@ def check_var_in_md(var: str, columns: list, messages: list) -> bool:
     ----------
     var : str
         Metadata variable in criteria.
-    columns : list
+    columns : list or dict
         Metadata variables in table.
     messages : list
         Message to print in case of error.
@@ -167,7 +519,7 @@ def check_in_md(values: list, columns: list, criteria: dict,
     ----------
     values : list
         Metadata variables in criteria.
-    columns : list
+    columns : list or dict
         Metadata variables in table.
     criteria : dict
         Inclusion/exclusion criteria to apply.
@@ -213,9 +565,95 @@ def check_key(key: str, messages: list) -> bool:
     return boolean
 
 
+def check_expression(values, messages: list, criteria: dict,
+                     step: str) -> None:
+    """Check the boolean expression(s) over the named predicates and
+    collect each of their top-level "and" clauses as a criterion.
+
+    Parameters
+    ----------
+    values : str or list
+        Boolean expression(s) over the predicates names.
+    messages : list
+        Message to print in case of error.
+    criteria : dict
+        Fill the yml content, including all inclusion/exclusion criteria.
+    step : str
+        The type of criterion to apply (init, filter, add)
+
+    """
+    predicates = criteria.get('predicates', {})
+    if not isinstance(values, list):
+        values = [values]
+    for expression in values:
+        try:
+            node = parse_expression(expression)
+        except ValueError as e:
+            messages.append('Expression "%s" is %s (skipped)' % (
+                expression, e))
+            continue
+        names = get_expression_names(node)
+        missing = [x for x in names if x not in predicates]
+        if missing:
+            messages.append('Expression "%s" has undefined predicates: %s '
+                            '(skipped)' % (expression, ', '.join(missing)))
+            continue
+        for clause in get_clauses(node):
+            clause_predicates = dict((x, predicates[x]) for x in
+                                     get_expression_names(clause))
+            if step in criteria:
+                criteria[step][get_expression_text(clause), 'expression'] = \
+                    clause_predicates
+            else:
+                criteria[step] = {(get_expression_text(clause), 'expression'):
+                                  clause_predicates}
+
+
+def check_predicates(predicates: dict, metadata: pd.DataFrame,
+                     messages: list, criteria: dict, nulls: list,
+                     md_factors: dict) -> None:
+    """Check the criteria of each named predicate
+    to use in the boolean expressions.
+
+    Parameters
+    ----------
+    predicates : dict
+        Key     = predicate name.
+        Value   = criteria that must all be true for the predicate.
+    metadata : pd.DataFrame
+        Metadata table.
+    messages : list
+        Message to print in case of error.
+    criteria : dict
+        Fill the yml content, including all inclusion/exclusion criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    """
+    criteria['predicates'] = {}
+    for name, name_criteria in predicates.items():
+        if not str(name).isidentifier() or str(name) in [
+                'and', 'or', 'not', 'AND', 'OR', 'NOT']:
+            messages.append('Predicate name "%s" must be a single word '
+                            '(skipped)' % name)
+            continue
+        if not isinstance(name_criteria, dict):
+            messages.append('Predicate %s must have criteria (skipped)' % name)
+            continue
+        check_filtering_criteria(name_criteria, metadata, messages,
+                                 criteria['predicates'], nulls, name,
+                                 md_factors)
+        if name not in criteria['predicates']:
+            messages.append('Predicate %s has no valid criteria '
+                            '(skipped)' % name)
+
+
 def check_filtering_criteria(init_filter: dict, metadata: pd.DataFrame,
                              messages: list, criteria: dict,
-                             nulls: list, step: str) -> None:
+                             nulls: list, step: str,
+                             md_factors: dict) -> None:
     """Check the passed criteria and
     collect those that are properly formatted.
 
@@ -233,20 +671,34 @@ def check_filtering_criteria(init_filter: dict, metadata: pd.DataFrame,
         Factors to be interpreted as np.nan.
     step : str
         The type of criterion to apply (init, filter, add)
+    md_factors : dict
+        Per-column factors of the metadata table.
 
     """
     for variable_index, values in init_filter.items():
+        # Checks and splits the boolean expression(s) over predicates
+        if variable_index == 'expression':
+            check_expression(values, messages, criteria, step)
+            continue
         # Checks that criterion has a metadata variable
         # and a numeric separated by a comma (",").
         if check_key(variable_index, messages):
             continue
         variable, index = variable_index.split(',')
-        # Checks that variable is in the metadata.
-        if check_var_in_md(variable, list(metadata.columns), messages):
+        # Checks that variable is in the metadata (the
+        # IDs files can also be checked against the index)
+        if not (index in ['5', '6'] and variable == metadata.index.name) and \
+                check_var_in_md(variable, md_factors['positions'], messages):
             continue
-        # Checks that variable's numeric indicator is "0", "1" or "2"
+        # Checks that variable's numeric indicator is one of the INDICATORS
         if check_numeric_indicator(variable, index, messages):
             continue
+        # Checks that the host criteria are in a step (not in a predicate)
+        if index == '8' and step not in ['init', 'add', 'filter']:
+            messages.append('Host criteria for variable %s must be in the '
+                            '"init", "add" or "filter" step (skipped)' %
+                            variable)
+            continue
         # Checks that subsetting values are in a list
         if check_islist(variable, values, messages):
             continue
@@ -257,7 +709,7 @@ def check_filtering_criteria(init_filter: dict, metadata: pd.DataFrame,
             # Checks that subset values for the
             # current variable are in metadata
             boolean, common_values = check_factors(
-                variable, index, values, nulls, metadata, messages
+                variable, index, values, nulls, metadata, messages, md_factors
             )
             # this is true if the variable is not in the metadata
             if boolean:
@@ -269,8 +721,55 @@ def check_filtering_criteria(init_filter: dict, metadata: pd.DataFrame,
                 criteria[step] = {(variable, index): common_values}
 
 
+def drop_ids_criteria(criteria_dict: dict, messages: list,
+                      message: str) -> dict:
+    """Remove the IDs files and host criteria, for the runs that do not
+    have the samples (database, catalog). The criteria file content is
+    not modified.
+
+    Parameters
+    ----------
+    criteria_dict : dict
+        Content of the yml criteria file.
+    messages : list
+        Message to print in case of error.
+    message : str
+        Why the criteria are removed, e.g. "not supported on a database".
+
+    Returns
+    -------
+    criteria_dict : dict
+        Content of the yml criteria file without the "5", "6" and "8"
+        criteria.
+    """
+    def drop(step_criteria):
+        if not isinstance(step_criteria, dict):
+            return step_criteria
+        kept = {}
+        for variable_index, values in step_criteria.items():
+            index = str(variable_index).split(',')[-1].strip()
+            if index in ['5', '6', '8']:
+                messages.append('%s criteria for variable %s are %s '
+                                '(skipped)' % (
+                                    'Host' if index == '8' else 'IDs files',
+                                    str(variable_index).split(',')[0],
+                                    message))
+            else:
+                kept[variable_index] = values
+        return kept
+
+    criteria_dict = dict((step, drop(values) if step in [
+        'init', 'add', 'filter'] else values)
+                         for step, values in criteria_dict.items())
+    if isinstance(criteria_dict.get('predicates'), dict):
+        criteria_dict['predicates'] = dict(
+            (name, drop(values))
+            for name, values in criteria_dict['predicates'].items())
+    return criteria_dict
+
+
 def get_criteria(i_criteria: str, metadata: pd.DataFrame, nulls: list,
-                 messages: list) -> dict:
+                 messages: list, md_factors: dict = None) -> dict:
     """
     Collect the inclusion/exclusion criteria to
     apply based on the yaml file and superseded
@@ -287,6 +786,8 @@ def get_criteria(i_criteria: str, metadata: pd.DataFrame, nulls: list,
         Factors to be interpreted as np.nan.
     messages : list
         Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
 
     Returns
     -------
@@ -294,9 +795,44 @@ def get_criteria(i_criteria: str, metadata: pd.DataFrame, nulls: list,
         Full yml content, including all inclusion/exclusion criteria.
 
     """
-    criteria = {}
     # Read the yaml criteria file
     criteria_dict = read_i_criteria(i_criteria)
+    criteria = check_criteria(
+        criteria_dict, metadata, nulls, messages, md_factors)
+    return criteria
+
+
+def check_criteria(criteria_dict: dict, metadata: pd.DataFrame, nulls: list,
+                   messages: list, md_factors: dict = None) -> dict:
+    """Check the inclusion/exclusion criteria read from the
+    yaml file and collect those that are properly formatted.
+
+    Parameters
+    ----------
+    criteria_dict : dict
+        Content of the yml criteria file.
+    metadata : pd.DataFrame
+        Metadata table.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    Returns
+    -------
+    criteria : dict
+        Full yml content, including all inclusion/exclusion criteria.
+
+    """
+    if md_factors is None:
+        md_factors = get_md_factors(metadata)
+    criteria = {}
+    # the predicates used in expressions must be known first
+    if 'predicates' in criteria_dict:
+        check_predicates(criteria_dict['predicates'], metadata, messages,
+                         criteria, nulls, md_factors)
     # for each criteria application level and its criteria to apply
     for level, values in criteria_dict.items():
         # for the filtering / grafting criteria
@@ -309,14 +845,15 @@ def get_criteria(i_criteria: str, metadata: pd.DataFrame, nulls: list,
                 messages,
                 criteria,
                 nulls,
-                level
+                level,
+                md_factors
             )
         # for the must-be non-nan variables
         elif level == 'no_nan':
             # check that they are present in the metadata
             check_in_md(
                 values,
-                list(metadata.columns),
+                md_factors['positions'],
                 criteria,
                 messages,
                 nulls,
@@ -328,9 +865,156 @@ def get_criteria(i_criteria: str, metadata: pd.DataFrame, nulls: list,
     return criteria
 
 
-def do_filtering(input_pd: pd.DataFrame, var: str, index: str,
-                 values: list, numerical: list, messages: list) -> tuple:
+def get_sorted_column(column: np.ndarray, var: str,
+                      sorted_cache: dict) -> tuple:
+    """Get the argsort of a numerical column, computed only once per column.
+
+    Parameters
+    ----------
+    column : np.ndarray
+        Numerical values of the metadata variable.
+    var : str
+        Metadata variable in criteria.
+    sorted_cache : dict
+        Key     = Metadata variable.
+        Value   = argsort and sorted values of the variable (nan last).
+
+    Returns
+    -------
+    order : np.ndarray
+        Positions of the values in ascending order.
+    sorted_values : np.ndarray
+        Values in ascending order.
+
+    """
+    if var not in sorted_cache:
+        order = np.argsort(column, kind='stable')
+        sorted_cache[var] = (order, column[order])
+    return sorted_cache[var]
+
+
+def get_range_mask(column: np.ndarray, intervals: list,
+                   sorted_column: tuple = None) -> np.ndarray:
+    """Get the samples whose value falls in any of the intervals.
+
+    Parameters
+    ----------
+    column : np.ndarray
+        Numerical values of the metadata variable.
+    intervals : list
+        (min, max, min included, max included) tuples.
+    sorted_column : tuple
+        Argsort and sorted values of the column. If passed, each interval
+        is looked-up by binary search instead of scanning the column.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample is in range (np.nan never is).
+
     """
+    if sorted_column is not None:
+        order, sorted_values = sorted_column
+        mask = np.zeros(column.size, dtype=bool)
+        for low, high, low_in, high_in in intervals:
+            start = np.searchsorted(
+                sorted_values, low, side='left' if low_in else 'right')
+            end = np.searchsorted(
+                sorted_values, high, side='right' if high_in else 'left')
+            mask[order[start:end]] = True
+    else:
+        lows, highs, lows_in, highs_in = map(np.array, zip(*intervals))
+        values = column[:, None]
+        mask = (np.where(lows_in, values >= lows, values > lows) &
+                np.where(highs_in, values <= highs, values < highs)).any(axis=1)
+    return mask & ~np.isnan(column)
+
+
+def get_expression_mask(node, predicates: dict, input_pd: pd.DataFrame,
+                        numerical: list, messages: list,
+                        sorted_cache: dict, md_factors: dict) -> np.ndarray:
+    """Evaluate a boolean expression over the predicates masks,
+    computing each common sub-expression only once.
+
+    Parameters
+    ----------
+    node : ast.AST
+        Node of the expression's syntax tree.
+    predicates : dict
+        Key     = predicate name.
+        Value   = criteria that must all be true for the predicate.
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    sorted_cache : dict
+        Argsort of the numerical variables of input_pd (for range lookups).
+    md_factors : dict
+        Per-column factors of input_pd (also holding the expressions masks).
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample satisfies the expression.
+    """
+    masks = md_factors.setdefault('masks', {})
+    key = ast.dump(node)
+    if key not in masks:
+        if isinstance(node, ast.Name):
+            mask = np.ones(input_pd.shape[0], dtype=bool)
+            for (var, index), values in predicates[node.id].items():
+                _, boolean, var_mask = get_criterion_mask(
+                    input_pd, var, index, values, numerical, messages,
+                    sorted_cache, md_factors)
+                if not boolean:
+                    mask = mask & var_mask
+        elif isinstance(node, ast.UnaryOp):
+            mask = ~get_expression_mask(
+                node.operand, predicates, input_pd, numerical, messages,
+                sorted_cache, md_factors)
+        else:
+            sub_masks = [get_expression_mask(
+                value, predicates, input_pd, numerical, messages,
+                sorted_cache, md_factors) for value in node.values]
+            if isinstance(node.op, ast.And):
+                mask = np.logical_and.reduce(sub_masks)
+            else:
+                mask = np.logical_or.reduce(sub_masks)
+        masks[key] = mask
+    return masks[key]
+
+
+def get_criterion_name(var: str, index: str) -> str:
+    """Get the name of a criterion in the flowchart.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable in criteria (or expression).
+    index : str
+        Numeric indicator.
+
+    Returns
+    -------
+    cur_name : str
+        Name of the current selection step.
+    """
+    names = {
+        '0': 'No_%s', '1': '%s', '2': 'Range_%s', '3': 'Match_%s',
+        '4': 'No_match_%s', '5': 'In_%s_list', '6': 'Not_in_%s_list',
+        '7': 'No_%s_outliers', '8': 'Per_%s',
+        'expression': '%s'
+    }
+    return names[index] % var
+
+
+def get_criterion_mask(input_pd: pd.DataFrame, var: str, index: str,
+                       values: list, numerical: list, messages: list,
+                       sorted_cache: dict = None, md_factors: dict = None,
+                       input_mask: np.ndarray = None) -> tuple:
+    """Get the samples that pass the current criterion.
 
     Parameters
     ----------
@@ -346,6 +1030,12 @@ def do_filtering(input_pd: pd.DataFrame, var: str, index: str,
         Metadata variables that are numeric.
     messages : list
         Message to print in case of error.
+    sorted_cache : dict
+        Argsort of the numerical variables of input_pd (for range lookups).
+    md_factors : dict
+        Per-column factors of input_pd (for factors lookups).
+    input_mask : np.ndarray
+        Samples input to the step (aggregated by the host criteria).
 
     Returns
     -------
@@ -353,45 +1043,118 @@ def do_filtering(input_pd: pd.DataFrame, var: str, index: str,
         Name of the current selection step.
     boolean : bool
         Whether to keep the key/value or not.
-    included : pd.DataFrame
-        Metadata for the included samples only.
+    mask : np.ndarray
+        Whether each sample passes the criterion.
     """
-    cur_name = ''
-    boolean = False
-    included = input_pd.copy()
-    # filter based on the criteria, and report the
-    # delta and the number of samples left
+    mask = np.ones(input_pd.shape[0], dtype=bool)
     if index == '0':
-        cur_name = 'No_%s' % var
-        included = included.loc[~included[var].fillna('nan').isin(values)]
+        if md_factors is not None:
+            mask = ~get_factors_mask(get_factors(
+                var, input_pd, md_factors), values, 'nan' in values)
+        else:
+            mask = ~input_pd[var].fillna('nan').isin(values).values
     elif index == '1':
-        cur_name = var
-        included = included.loc[included[var].isin(values)]
+        if md_factors is not None:
+            mask = get_factors_mask(get_factors(
+                var, input_pd, md_factors), values, False)
+        else:
+            mask = input_pd[var].isin(values).values
     elif index == '2':
         if var not in numerical:
             messages.append(
                 'Metadata variable %s is not numerical (skipping)' % var)
-            return cur_name, True, included
-        crit_min, crit_max = values
-        if crit_min == 'None' and crit_max == 'None':
+            return '', True, mask
+        intervals = get_intervals(values)
+        if all(low == -np.inf and high == np.inf
+               for low, high, _, _ in intervals):
             messages.append(
                 '[Warning] Both numerical bounds for %s'
                 ' are "None" (skipping)' % var)
-            return cur_name, True, included
-        cur_name = 'Range_%s' % var
-        if crit_min != 'None':
-            included = included.loc[(included[var].fillna(
-                (float(crit_min) - 0.0001)) > float(crit_min))]
-        if crit_max != 'None':
-            included = included.loc[(included[var].fillna(
-                    (float(crit_max) + 0.0001)) < float(crit_max))
-            ]
+            return '', True, mask
+        column = input_pd[var].to_numpy(dtype=float, na_value=np.nan)
+        sorted_column = None
+        if sorted_cache is not None:
+            sorted_column = get_sorted_column(column, var, sorted_cache)
+        mask = get_range_mask(column, intervals, sorted_column)
+    elif index in ['3', '4']:
+        if md_factors is None:
+            md_factors = get_md_factors(input_pd)
+        var_factors = get_factors(var, input_pd, md_factors)
+        hits = get_patterns_hits(var_factors, get_patterns_regex(values))
+        # broadcast the matches to the samples (nan never matches)
+        mask = np.append(hits, False)[var_factors['codes']]
+        if index == '4':
+            mask = ~mask
+    elif index in ['5', '6']:
+        if md_factors is None:
+            md_factors = get_md_factors(input_pd)
+        mask = get_ids_mask(
+            input_pd, var, get_ids(values, md_factors), md_factors)
+        if index == '6':
+            mask = ~mask
+    elif index == '7':
+        if var not in numerical:
+            messages.append(
+                'Metadata variable %s is not numerical (skipping)' % var)
+            return '', True, mask
+        mask = get_outliers_mask(input_pd, var, values, md_factors)
+    elif index == '8':
+        mask = get_hosts_mask(input_pd, var, values, numerical, messages,
+                              md_factors, input_mask)
+    elif index == 'expression':
+        if md_factors is None:
+            md_factors = get_md_factors(input_pd)
+        mask = get_expression_mask(
+            parse_expression(var), values, input_pd, numerical, messages,
+            sorted_cache, md_factors)
+    return get_criterion_name(var, index), False, mask
+
+
+def do_filtering(input_pd: pd.DataFrame, var: str, index: str,
+                 values: list, numerical: list, messages: list) -> tuple:
+    """
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    var : str
+        Metadata variable in criteria.
+    index : str
+        Numeric indicator.
+    values : list
+        Metadata variables in criteria.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    cur_name : str
+        Name of the current selection step.
+    boolean : bool
+        Whether to keep the key/value or not.
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    """
+    # filter based on the criteria, and report the
+    # delta and the number of samples left
+    cur_name, boolean, mask = get_criterion_mask(
+        input_pd, var, index, values, numerical, messages)
+    if boolean:
+        return cur_name, boolean, input_pd.copy()
+    included = input_pd.loc[mask].copy()
     return cur_name, boolean, included
 
 
 def apply_step_criteria(metadata: pd.DataFrame, criteria: dict,
                         numerical: list, messages: list,
-                        flowcharts: dict, step: str) -> pd.DataFrame:
+                        flowcharts: dict, step: str,
+                        input_mask: np.ndarray, sorted_cache: dict,
+                        md_factors: dict, trace: dict = None,
+                        failed: dict = None,
+                        criteria_masks: list = None) -> np.ndarray:
     """Apply the filtering criteria for the current step.
     There are three possible steps for now:
         - init      initial filtering on the raw metadata.
@@ -412,27 +1175,57 @@ def apply_step_criteria(metadata: pd.DataFrame, criteria: dict,
         Steps of the workflow with samples counts (simpler representation).
     step : str
         The type of criterion to apply (init, filter, add)
+    input_mask : np.ndarray
+        Samples of the metadata that are input to the current step.
+    sorted_cache : dict
+        Argsort of the numerical variables (for range lookups).
+    md_factors : dict
+        Per-column factors of the metadata table.
+    trace : dict
+        Trace events of the run (for the time and memory of each criterion).
+    failed : dict
+        codes   = Position in the names of the first criterion that
+                  each sample fails (-1: none), filled in place.
+        names   = "step: criterion" names of the criteria.
+    criteria_masks : list
+        Filled with the step, name and mask of each criterion.
 
     Returns
     -------
-    included : pd.DataFrame
-        Metadata for the included samples only.
+    included_mask : np.ndarray
+        Samples of the metadata that are included after the current step.
     """
 
     flowchart = []
-    included = metadata.copy()
+    included_mask = input_mask.copy()
+    input_count = int(input_mask.sum())
+    cur_count = input_count
     first_step = True
     for (var, index), values in criteria[step].items():
 
-        cur_name, boolean, included = do_filtering(
-            included, var, index, values, numerical, messages)
+        with trace_phase(trace, '%s,%s (%s)' % (var, index, step),
+                         'criterion') as args:
+            args['rows_in'] = cur_count
+            cur_name, boolean, mask = get_criterion_mask(
+                metadata, var, index, values, numerical, messages,
+                sorted_cache, md_factors, input_mask)
+            if not boolean:
+                # the samples of the "add" step are not excluded by it
+                if failed is not None and step != 'add':
+                    failed['codes'][included_mask & ~mask] = len(
+                        failed['names'])
+                    failed['names'].append('%s: %s' % (step, cur_name))
+                if criteria_masks is not None:
+                    criteria_masks.append((step, cur_name, mask))
+                included_mask &= mask
+                cur_count = int(included_mask.sum())
+            args['rows_out'] = cur_count
         if boolean:
             continue
 
-        cur_count = included.shape[0]
         if first_step:
             flowchart.extend([
-                ['%s metadata' % step, metadata.shape[0], None, None, None],
+                ['%s metadata' % step, input_count, None, None, None],
                 [cur_name, cur_count, str(var),
                  '\n'.join(map(str, values)), str(index)]
             ])
@@ -441,11 +1234,13 @@ def apply_step_criteria(metadata: pd.DataFrame, criteria: dict,
             flowchart.append([cur_name, cur_count, str(var),
                               '\n'.join(map(str, values)), str(index)])
     flowcharts[step] = flowchart
-    return included
+    return included_mask
 
 
 def apply_criteria(metadata: pd.DataFrame, criteria: dict,
-                   numerical: list, messages: list) -> tuple:
+                   numerical: list, messages: list,
+                   md_factors: dict = None, trace: dict = None,
+                   criteria_masks: list = None) -> tuple:
     """Apply filtering criteria to subset the metadata.
 
     Parameters
@@ -458,6 +1253,12 @@ def apply_criteria(metadata: pd.DataFrame, criteria: dict,
         Metadata variables that are numeric.
     messages : list
         Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
+    trace : dict
+        Trace events of the run (for the time and memory of each criterion).
+    criteria_masks : list
+        Filled with the step, name and mask of each criterion.
 
     Returns
     -------
@@ -467,60 +1268,163 @@ def apply_criteria(metadata: pd.DataFrame, criteria: dict,
         Metadata for the included samples only.
 
     """
+    flowcharts, filter_mask, add_mask = get_criteria_masks(
+        metadata, criteria, numerical, messages, md_factors, trace,
+        criteria_masks=criteria_masks)
+    if 'init' in criteria:
+        print('init', metadata.shape)
+    included = get_included(
+        metadata, flowcharts, filter_mask, add_mask, messages)
+    return flowcharts, included
+
+
+def get_criteria_masks(metadata: pd.DataFrame, criteria: dict,
+                       numerical: list, messages: list,
+                       md_factors: dict = None, trace: dict = None,
+                       failed: dict = None,
+                       criteria_masks: list = None) -> tuple:
+    """Get the samples included by the steps of the criteria.
 
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
+    trace : dict
+        Trace events of the run (for the time and memory of each criterion).
+    failed : dict
+        codes   = Position in the names of the first criterion that
+                  each sample fails (-1: none), filled in place.
+        names   = "step: criterion" names of the criteria.
+    criteria_masks : list
+        Filled with the step, name and mask of each criterion.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    filter_mask : np.ndarray
+        Samples included after the "init", "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples to be re-added by the "add" step.
+    """
+
+    if md_factors is None:
+        md_factors = get_md_factors(metadata)
     flowcharts = {}
+    # all criteria are evaluated on the full metadata and each
+    # step is a mask of the samples it includes, so that the
+    # sorted numerical columns are computed once for all steps
+    sorted_cache = {}
+    all_mask = np.ones(metadata.shape[0], dtype=bool)
     # Perform initial filtering on the raw metadata
-    # -> init_included = initially included samples
+    # -> init_mask = initially included samples
     if 'init' in criteria:
-        init_included = apply_step_criteria(
-            metadata, criteria, numerical, messages, flowcharts, 'init')
-        print('init', metadata.shape)
+        init_mask = apply_step_criteria(
+            metadata, criteria, numerical, messages, flowcharts, 'init',
+            all_mask, sorted_cache, md_factors, trace, failed,
+            criteria_masks)
     else:
-        init_included = metadata.copy()
+        init_mask = all_mask
 
     # Perform a selection based on the initially included samples
-    # -> add_included = keep samples to be re-added later
+    # -> add_mask = keep samples to be re-added later
     if 'add' in criteria:
-        add_included = apply_step_criteria(
-            init_included, criteria, numerical, messages, flowcharts, 'add')
+        add_mask = apply_step_criteria(
+            metadata, criteria, numerical, messages, flowcharts, 'add',
+            init_mask, sorted_cache, md_factors, trace, failed,
+            criteria_masks)
     else:
-        add_included = pd.DataFrame()
+        add_mask = np.zeros(metadata.shape[0], dtype=bool)
 
     if 'no_nan' in criteria:
-        nan_included = apply_step_criteria(
-            init_included, criteria, numerical, messages, flowcharts, 'no_nan')
+        nan_mask = apply_step_criteria(
+            metadata, criteria, numerical, messages, flowcharts, 'no_nan',
+            init_mask, sorted_cache, md_factors, trace, failed,
+            criteria_masks)
     else:
-        nan_included = init_included.copy()
+        nan_mask = init_mask
 
     # Perform another filtering on the initially included samples
-    # -> filter_included = finally included samples
+    # -> filter_mask = finally included samples
     if 'filter' in criteria:
-        filter_included = apply_step_criteria(
-            nan_included, criteria, numerical, messages, flowcharts, 'filter')
+        filter_mask = apply_step_criteria(
+            metadata, criteria, numerical, messages, flowcharts, 'filter',
+            nan_mask, sorted_cache, md_factors, trace, failed,
+            criteria_masks)
     else:
-        filter_included = nan_included.copy()
-
-    # if there were samples to be re-added later
-    if add_included.shape[0]:
-        # only get the samples not already in finally included samples
-        common_sams = set(filter_included.index) & set(add_included.index)
-        added_sams = set(add_included.index) ^ common_sams
-        if common_sams:
+        filter_mask = nan_mask
+    return flowcharts, filter_mask, add_mask
+
+
+def get_included(metadata: pd.DataFrame, flowcharts: dict,
+                 filter_mask: np.ndarray, add_mask: np.ndarray,
+                 messages: list) -> pd.DataFrame:
+    """Get the metadata for the finally included samples
+    and the samples re-added by the "add" step.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    filter_mask : np.ndarray
+        Samples included after the "init", "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples to be re-added by the "add" step.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    """
+    # the re-added samples are those of the "add" step not
+    # already included: no sample is duplicated in the output
+    included_mask = filter_mask | add_mask
+    add_step_counts(flowcharts, int(included_mask.sum()),
+                    int(add_mask.sum()), int((filter_mask & add_mask).sum()),
+                    messages)
+    included = metadata.loc[included_mask].copy()
+    return included
+
+
+def add_step_counts(flowcharts: dict, included_count: int, add_count: int,
+                    common_count: int, messages: list) -> None:
+    """Add the re-added samples of the "add" step to the flowchart.
+
+    Parameters
+    ----------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    included_count : int
+        Number of samples included or re-added.
+    add_count : int
+        Number of samples of the "add" step.
+    common_count : int
+        Number of samples of the "add" step that were already included.
+    messages : list
+        Message to print in case of error.
+    """
+    if add_count:
+        if common_count:
             messages.append(
                 '%s samples not removed by criteria of "init"/"filter" steps re-added by '
-                'criteria of "add" step (not to worry: duplicates are dropped).' % len(common_sams)
+                'criteria of "add" step (not to worry: duplicates are dropped).' % common_count
             )
-        # add the samples add_included samples to the filter_included samples
-        included = pd.concat([filter_included, add_included], axis=0, sort=False)
-
-        # in
-        flowcharts['filter'].append([
+        flowcharts.setdefault('filter', []).append([
             '"add" samples',
-            included.shape[0],
-            'adding %s samples' % len(added_sams),
+            included_count,
+            'adding %s samples' % (add_count - common_count),
             '(see "add" criteria)',
             None
         ])
-    else:
-        included = filter_included.copy()
-    return flowcharts, included
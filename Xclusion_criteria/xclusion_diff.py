@@ -0,0 +1,205 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import sys
+import copy
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_io import get_meta_sep
+from Xclusion_criteria.xclusion_crits import add_step_counts
+from Xclusion_criteria.xclusion_incremental import is_state_file, read_state
+
+
+def read_run(i_run: str) -> dict:
+    """Read the outcome of a run, from its state file (--p-state)
+    or from its metadata table of the included samples (-in).
+
+    Parameters
+    ----------
+    i_run : str
+        Path to the state file or to the included samples metadata.
+
+    Returns
+    -------
+    run : dict
+        samples     = Samples names.
+        included    = Whether each sample is included.
+        codes       = Position of the first criterion each sample fails
+                      in the names (-1: none; None for a metadata table).
+        names       = "step: criterion" names of the criteria.
+        flowcharts  = Steps of the workflow with samples counts
+                      (None for a metadata table).
+    """
+    # the state files are npz archives, not text tables
+    state = read_state(i_run) if is_state_file(i_run) else None
+    if state is not None:
+        flowcharts = copy.deepcopy(state['flowcharts'])
+        counts = state['counts']
+        add_step_counts(flowcharts, counts['filter'] + counts['add'] -
+                        counts['common'], counts['add'], counts['common'], [])
+        run = dict(state['masks'], flowcharts=flowcharts)
+    else:
+        # only the samples names are needed
+        sep, _ = get_meta_sep(i_run)
+        samples = pd.read_csv(i_run, sep=sep, usecols=[0], dtype=str,
+                              low_memory=False).iloc[:, 0].to_numpy()
+        run = {'samples': samples,
+               'included': np.ones(samples.size, dtype=bool),
+               'codes': None, 'names': [], 'flowcharts': None}
+    return run
+
+
+def get_run_failed(run: dict, samples: np.ndarray) -> np.ndarray:
+    """Get the first criterion the passed samples fail in a run.
+
+    Parameters
+    ----------
+    run : dict
+        Outcome of the run.
+    samples : np.ndarray
+        Samples names.
+
+    Returns
+    -------
+    failed : np.ndarray
+        "step: criterion" name for each sample ("" if it fails no
+        criterion, "not in metadata" if it was not in the run,
+        None if the run does not have the per-sample outcome).
+    """
+    if run['codes'] is None:
+        return np.full(samples.size, None, dtype=object)
+    rows = pd.Index(run['samples']).get_indexer(samples)
+    names = np.array(run['names'] + ['', 'not in metadata'], dtype=object)
+    codes = np.where(rows < 0, len(run['names']) + 1, run['codes'][rows])
+    # the code of the samples failing no criterion (-1) picks the ''
+    codes[codes < 0] = len(run['names'])
+    return names[codes]
+
+
+def get_samples_diff(run_a: dict, run_b: dict) -> pd.DataFrame:
+    """Get the samples that entered or left the cohort between two runs.
+
+    Parameters
+    ----------
+    run_a : dict
+        Outcome of the first run.
+    run_b : dict
+        Outcome of the second run.
+
+    Returns
+    -------
+    samples_diff : pd.DataFrame
+        Samples added to or removed from the included samples, with the
+        first criterion they fail in each run (if known).
+    """
+    included_a = pd.Index(run_a['samples'][run_a['included']])
+    included_b = pd.Index(run_b['samples'][run_b['included']])
+    # hash set lookups rather than pairwise comparisons
+    added = included_b[~included_b.isin(included_a)].to_numpy()
+    removed = included_a[~included_a.isin(included_b)].to_numpy()
+    samples = np.concatenate([added, removed])
+    samples_diff = pd.DataFrame({
+        'sample_name': samples,
+        'change': ['added'] * added.size + ['removed'] * removed.size,
+        'criterion_a': get_run_failed(run_a, samples),
+        'criterion_b': get_run_failed(run_b, samples)
+    })
+    # the samples re-added by the "add" step are included anyway
+    samples_diff.loc[:added.size - 1, 'criterion_b'] = ''
+    samples_diff.loc[added.size:, 'criterion_a'] = ''
+    return samples_diff
+
+
+def get_flowcharts_diff(flowcharts_a: dict,
+                        flowcharts_b: dict) -> pd.DataFrame:
+    """Get the per-step samples counts deltas between two runs.
+
+    Parameters
+    ----------
+    flowcharts_a : dict
+        Steps of the workflow with samples counts of the first run.
+    flowcharts_b : dict
+        Steps of the workflow with samples counts of the second run.
+
+    Returns
+    -------
+    flowcharts_diff : pd.DataFrame
+        Samples count of each step in both runs and their difference
+        (steps of the second run first, then those only in the first).
+        The steps are matched on their criterion, variable, values and
+        indicator, so that a criterion with other values is another step.
+    """
+    def get_key(step: str, row: list) -> tuple:
+        # the rows without indicator are the step totals and the
+        # re-added samples (which variable is their number)
+        if row[4] is None:
+            return step, row[0], None, None, None
+        return (step, row[0]) + tuple(row[2:5])
+
+    rows = {}
+    for col, flowcharts in [('count_a', flowcharts_a),
+                            ('count_b', flowcharts_b)]:
+        for step, flowchart in flowcharts.items():
+            for row in flowchart:
+                rows.setdefault(get_key(step, row), {})[col] = row[1]
+    keys = [get_key(step, row) for step, flowchart in flowcharts_b.items()
+            for row in flowchart]
+    keys_b = set(keys)
+    keys.extend(x for x in rows if x not in keys_b)
+    flowcharts_diff = pd.DataFrame(
+        [list(key) + [rows[key].get('count_a'), rows[key].get('count_b')]
+         for key in keys],
+        columns=['step', 'criterion', 'variable', 'values', 'indicator',
+                 'count_a', 'count_b'])
+    for col in ['count_a', 'count_b']:
+        flowcharts_diff[col] = flowcharts_diff[col].astype('Int64')
+    flowcharts_diff['delta'] = flowcharts_diff['count_b'] - \
+        flowcharts_diff['count_a']
+    return flowcharts_diff
+
+
+def xclusion_diff(i_run_a: str, i_run_b: str, o_samples_diff: str,
+                  o_flowcharts_diff: str) -> None:
+    """Compare the included samples and the flowcharts of two runs.
+
+    Parameters
+    ----------
+    i_run_a : str
+        State file (--p-state) or included samples metadata (-in)
+        of the first run.
+    i_run_b : str
+        State file (--p-state) or included samples metadata (-in)
+        of the second run.
+    o_samples_diff : str
+        Path to the output table of the added and removed samples.
+    o_flowcharts_diff : str
+        Path to the output table of the per-step count deltas.
+    """
+    print('- read the runs...', end=' ')
+    run_a, run_b = read_run(i_run_a), read_run(i_run_b)
+    print('Done.')
+
+    print('- get the added and removed samples...', end=' ')
+    samples_diff = get_samples_diff(run_a, run_b)
+    samples_diff.to_csv(o_samples_diff, index=False, sep='\t')
+    print('Done.')
+    counts = samples_diff['change'].value_counts()
+    print('  added: %s' % counts.get('added', 0))
+    print('  removed: %s' % counts.get('removed', 0))
+
+    if o_flowcharts_diff:
+        if run_a['flowcharts'] is None or run_b['flowcharts'] is None:
+            print('The per-step deltas need the state files of both runs '
+                  '(--p-state)\nExiting')
+            sys.exit(1)
+        print('- get the per-step samples counts deltas...', end=' ')
+        flowcharts_diff = get_flowcharts_diff(
+            run_a['flowcharts'], run_b['flowcharts'])
+        flowcharts_diff.to_csv(o_flowcharts_diff, index=False, sep='\t')
+        print('Done.')
@@ -9,8 +9,39 @@
 import numpy as np
 import pandas as pd
 
+from Xclusion_criteria.xclusion_arrow import (
+    check_dtype_arrow, get_arrow_nulls_mask, get_arrow_floats)
 
-def get_dtypes_final(md: pd.DataFrame, nulls: list, dtypes_init: dict) -> dict:
+
+def get_check_floats(factors: pd.Series, nulls: list) -> pd.Series:
+    """Convert the factors of a variable to floats, with
+    the factors containing a null factor as np.nan.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    floats : pd.Series
+        Factors as floats (None if a factor is not a float).
+    """
+    nan_tf = pd.Series(factors.astype(str)).str.contains('|'.join(nulls))
+    factors[nan_tf] = np.nan
+    for val in factors.unique().tolist():
+        if str(val) != 'nan':
+            try:
+                float(val)
+            except ValueError:
+                return None
+    return factors.astype('float64')
+
+
+def get_dtypes_final(md: pd.DataFrame, nulls: list, dtypes_init: dict,
+                     arrow: bool = False) -> dict:
     """Refine the inference of the current variables' dtypes.
 
     Parameters
@@ -29,6 +60,8 @@ def get_dtypes_final(md: pd.DataFrame, nulls: list, dtypes_init: dict) -> dict:
                 ['object', 'object'] : factors are strings
                 ['object', 'float']  : factors are float (or np.nan)
                 ['object', 'check']  : factors are float + "polluting" string
+    arrow : bool
+        Whether to find the null factors using Arrow kernels.
 
     Returns
     -------
@@ -41,31 +74,34 @@ def get_dtypes_final(md: pd.DataFrame, nulls: list, dtypes_init: dict) -> dict:
     for variable, dtypes in dtypes_init.items():
         if dtypes[-1] == 'check':
             factors = md[variable].copy()
-            nan_tf = pd.Series(factors.astype(str)).str.contains('|'.join(nulls))
-            factors[nan_tf] = np.nan
-            for val in factors.unique().tolist():
-                if str(val) != 'nan':
-                    try:
-                        float(val)
-                    except ValueError:
-                        dtypes_final[variable] = 'object'
-                        break
+            if arrow:
+                nan_tf = get_arrow_nulls_mask(factors, nulls)
+                if nan_tf is not None:
+                    floats = get_arrow_floats(factors, nan_tf)
+                    if floats is not None:
+                        dtypes_final[variable] = 'float'
+                        md[variable] = floats
+                        continue
+            floats = get_check_floats(factors, nulls)
+            if floats is None:
+                dtypes_final[variable] = 'object'
             else:
                 dtypes_final[variable] = 'float'
-                md[variable] = factors
-                md[variable] = md[variable].astype('float64')
+                md[variable] = floats
         else:
             dtypes_final[variable] = dtypes[-1]
     return dtypes_final
 
 
-def get_dtypes_init(md: pd.DataFrame) -> dict:
+def get_dtypes_init(md: pd.DataFrame, arrow: bool = False) -> dict:
     """Infer the variable's dtypes of each column.
 
     Parameters
     ----------
     md : pd.DataFrame
         Current metadata table.
+    arrow : bool
+        Whether to check the factors using Arrow kernels.
 
     Returns
     -------
@@ -91,12 +127,17 @@ def get_dtypes_init(md: pd.DataFrame) -> dict:
         else:
             # Check variable's factors for stronger inference
             # print(md[variable])
-            dtypes_init[variable] = check_dtype_object(md[variable])
+            d_type = None
+            if arrow:
+                d_type = check_dtype_arrow(md[variable])
+            if d_type is None:
+                d_type = check_dtype_object(md[variable])
+            dtypes_init[variable] = d_type
     return dtypes_init
 
 
-def check_dtype_object(factors: pd.Series) -> list:
-    """Check variable's factors.
+def get_dtype_flags(factors: pd.Series) -> dict:
+    """Get the kinds of factors of a variable.
 
     Parameters
     ----------
@@ -105,47 +146,81 @@ def check_dtype_object(factors: pd.Series) -> list:
 
     Returns
     -------
-    d_type : str
-        two-items list for the dtype status of the
-        current metadata variable. Could be:
-            ['object', 'object'] : factors are strings
-            ['object', 'float']  : factors are float (or np.nan)
-            ['object', 'check']  : factors are float + "polluting" string
-
+    flags : dict
+        nan         = whether there are np.nan.
+        tf          = whether there are "True" or "False".
+        float       = whether there are floats.
+        non_float   = whether there are other factors.
     """
-    d_type = ['object']
-    has_nan = False
-    has_float = False
-    has_non_float = False
-    has_tf = False
+    flags = {'nan': False, 'tf': False, 'float': False, 'non_float': False}
     # for the unique factors of the current variable
     for val in set(map(str, factors.tolist())):
         if val == 'nan':
-            has_nan = True # if np.nan in the factors
+            flags['nan'] = True # if np.nan in the factors
         elif val in ['True', 'False']:
-            has_tf = True  # if np.nan in the factors
+            flags['tf'] = True  # if np.nan in the factors
         else:
             # check if the non-np.nan values are float
             try:
                 float(val)
-                has_float = True
+                flags['float'] = True
             except ValueError:
-                has_non_float = True
+                flags['non_float'] = True
+    return flags
+
+
+def get_flags_dtype(flags: dict) -> list:
+    """Get the dtype status of a variable from the kinds of its factors.
+
+    Parameters
+    ----------
+    flags : dict
+        Whether there are np.nan, "True"/"False", floats or other factors.
+
+    Returns
+    -------
+    d_type : str
+        two-items list for the dtype status of the
+        current metadata variable (see check_dtype_object).
+    """
+    d_type = ['object']
     # if factors contain at least one non-float
-    if has_non_float:
-        if has_float or has_nan:
+    if flags['non_float']:
+        if flags['float'] or flags['nan']:
             d_type.append('check')
         else:
             d_type.append('object')
     else:
-        if has_tf:
+        if flags['tf']:
             d_type.append('object')
         else:
             d_type.append('float')
     return d_type
 
 
-def get_dtypes(metadata: pd.DataFrame, nulls: list) -> dict:
+def check_dtype_object(factors: pd.Series) -> list:
+    """Check variable's factors.
+
+    Parameters
+    ----------
+    factors : pd.Series
+        Factors of the current metadata variable.
+
+    Returns
+    -------
+    d_type : str
+        two-items list for the dtype status of the
+        current metadata variable. Could be:
+            ['object', 'object'] : factors are strings
+            ['object', 'float']  : factors are float (or np.nan)
+            ['object', 'check']  : factors are float + "polluting" string
+
+    """
+    return get_flags_dtype(get_dtype_flags(factors))
+
+
+def get_dtypes(metadata: pd.DataFrame, nulls: list,
+               arrow: bool = False) -> dict:
     """Get the dtypes of each column of the metadata table.
 
     Parameters
@@ -154,6 +229,8 @@ def get_dtypes(metadata: pd.DataFrame, nulls: list) -> dict:
         Metadata table.
     nulls : list
         Factors to be interpreted as np.nan.
+    arrow : bool
+        Whether to check the factors using Arrow kernels.
 
     Returns
     -------
@@ -163,9 +240,9 @@ def get_dtypes(metadata: pd.DataFrame, nulls: list) -> dict:
 
     """
     # Infer the variable's dtypes of each column
-    dtypes_init = get_dtypes_init(metadata)
+    dtypes_init = get_dtypes_init(metadata, arrow)
     # Refine the inference of the current variables' dtypes
-    dtypes = get_dtypes_final(metadata, nulls, dtypes_init)
+    dtypes = get_dtypes_final(metadata, nulls, dtypes_init, arrow)
     return dtypes
 
 
@@ -193,6 +270,24 @@ def split_variables_types(dtypes: dict, numerical: list,
             numerical.append(var)
 
 
+def replace_tf(metadata: pd.DataFrame, categorical: list) -> None:
+    """Replace the True/False factors of the categorical variables by Yes/No.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    categorical : list
+        Metadata variables that are categorical.
+    """
+    TF = {'False': 'No', 'false': 'No', False: 'No',
+          'True': 'Yes', 'true': 'Yes', True: 'Yes'}
+    metadata.replace(
+        dict((x, TF) for x in metadata.columns if
+             x in categorical and str(metadata[x].dtype) == 'object'),
+        inplace=True)
+
+
 def check_num_cat_lists(plot_groups: dict, numerical: list,
                         categorical: list) -> tuple:
     """Check there's min 3 categorical and 2 numerical variables.
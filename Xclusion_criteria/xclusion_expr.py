@@ -0,0 +1,118 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import re
+import ast
+
+
+def parse_expression(expression: str):
+    """Parse a boolean expression over named predicates, e.g.
+    "(ibd or ibs) and not antibiotics" (or with "AND", "OR", "NOT").
+
+    Parameters
+    ----------
+    expression : str
+        Boolean expression.
+
+    Returns
+    -------
+    node : ast.AST
+        Root node of the expression's syntax tree.
+
+    Raises
+    ------
+    ValueError
+        If the expression is not only made of and / or / not and names.
+    """
+    expression = re.sub(r'\b(AND|OR|NOT)\b',
+                        lambda x: x.group(1).lower(), str(expression))
+    try:
+        node = ast.parse(expression.strip(), mode='eval').body
+    except SyntaxError:
+        raise ValueError('not a valid boolean expression')
+    for sub_node in ast.walk(node):
+        if not isinstance(sub_node, (ast.BoolOp, ast.And, ast.Or, ast.UnaryOp,
+                                     ast.Not, ast.Name, ast.Load)):
+            raise ValueError('only "and", "or", "not" and predicate '
+                             'names are allowed')
+        if isinstance(sub_node, ast.UnaryOp) and not isinstance(
+                sub_node.op, ast.Not):
+            raise ValueError('only "and", "or", "not" and predicate '
+                             'names are allowed')
+    return node
+
+
+def get_expression_names(node) -> list:
+    """Get the predicate names used in an expression.
+
+    Parameters
+    ----------
+    node : ast.AST
+        Node of the expression's syntax tree.
+
+    Returns
+    -------
+    names : list
+        Predicate names, in order of appearance.
+    """
+    if isinstance(node, ast.Name):
+        return [node.id]
+    names = []
+    sub_nodes = [node.operand] if isinstance(node, ast.UnaryOp) else node.values
+    for sub_node in sub_nodes:
+        for name in get_expression_names(sub_node):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def get_expression_text(node) -> str:
+    """Write an expression back, in a normalized form.
+
+    Parameters
+    ----------
+    node : ast.AST
+        Node of the expression's syntax tree.
+
+    Returns
+    -------
+    text : str
+        Expression.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.UnaryOp):
+        text = get_expression_text(node.operand)
+        if isinstance(node.operand, ast.BoolOp):
+            text = '(%s)' % text
+        return 'not %s' % text
+    texts = []
+    for value in node.values:
+        text = get_expression_text(value)
+        if isinstance(value, ast.BoolOp):
+            text = '(%s)' % text
+        texts.append(text)
+    return (' and ' if isinstance(node.op, ast.And) else ' or ').join(texts)
+
+
+def get_clauses(node) -> list:
+    """Split an expression into its top-level "and" clauses.
+
+    Parameters
+    ----------
+    node : ast.AST
+        Root node of the expression's syntax tree.
+
+    Returns
+    -------
+    clauses : list
+        Nodes of the clauses that must all be true.
+    """
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return node.values
+    return [node]
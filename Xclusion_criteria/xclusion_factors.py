@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+
+def get_md_factors(metadata: pd.DataFrame) -> dict:
+    """Initialize the per-column factors of the metadata table.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+
+    Returns
+    -------
+    md_factors : dict
+        positions   = Key: metadata variable, Value: column position.
+        factors     = Key: metadata variable, Value: factors of the
+                      variable (filled the first time it is needed).
+    """
+    md_factors = {
+        'positions': dict((col, pos) for pos, col in enumerate(
+            metadata.columns)),
+        'factors': {}
+    }
+    return md_factors
+
+
+def get_factors(var: str, metadata: pd.DataFrame, md_factors: dict) -> dict:
+    """Get the distinct values of a metadata variable,
+    which column is scanned only the first time.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable.
+    metadata : pd.DataFrame
+        Metadata table.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    Returns
+    -------
+    var_factors : dict
+        codes   = Position of each sample's value in the uniques (-1: nan).
+        uniques = Distinct values of the variable.
+        counts  = Key: distinct value, Value: number of samples.
+        nans    = Number of samples with a missing value.
+    """
+    if var not in md_factors['factors']:
+        column = metadata.iloc[:, md_factors['positions'][var]]
+        codes, uniques = pd.factorize(column)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        md_factors['factors'][var] = {
+            'codes': codes,
+            'uniques': uniques,
+            'counts': dict(zip(uniques.tolist(), counts.tolist())),
+            'nans': int((codes < 0).sum())
+        }
+    return md_factors['factors'][var]
+
+
+def get_factors_mask(var_factors: dict, values: list,
+                     nan_value: bool) -> np.ndarray:
+    """Get the samples which value is in the passed values,
+    matching the distinct values only and not every sample.
+
+    Parameters
+    ----------
+    var_factors : dict
+        Factors of the metadata variable.
+    values : list
+        Values to match.
+    nan_value : bool
+        Whether the samples with a missing value match or not.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample's value is in the passed values.
+    """
+    hits = pd.Index(var_factors['uniques']).isin(values)
+    # the code of the missing values (-1) picks the last item
+    return np.append(hits, nan_value)[var_factors['codes']]
+
+
+def get_rows(included: pd.DataFrame, metadata: pd.DataFrame) -> np.ndarray:
+    """Get the positions of the included samples in the metadata table.
+
+    Parameters
+    ----------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    metadata : pd.DataFrame
+        Metadata table.
+
+    Returns
+    -------
+    rows : np.ndarray
+        Rows of the included samples in the metadata table (None if some
+        samples are not in the metadata, e.g. after fetching the data).
+    """
+    if not metadata.index.is_unique:
+        return None
+    rows = metadata.index.get_indexer(included.index)
+    if (rows < 0).any():
+        return None
+    return rows
+
+
+def get_counts(var: str, included: pd.DataFrame, metadata: pd.DataFrame,
+               md_factors: dict, rows: np.ndarray) -> dict:
+    """Count the samples per factor of a variable for the included samples.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable.
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    metadata : pd.DataFrame
+        Metadata table.
+    md_factors : dict
+        Per-column factors of the metadata table.
+    rows : np.ndarray
+        Rows of the included samples in the metadata table.
+
+    Returns
+    -------
+    counts : dict
+        Key     = factor.
+        Value   = number of included samples (decreasing order).
+    """
+    if rows is None or var not in md_factors['positions']:
+        return included[var].value_counts().to_dict()
+    var_factors = get_factors(var, metadata, md_factors)
+    codes = var_factors['codes'][rows]
+    counts = np.bincount(codes[codes >= 0],
+                         minlength=len(var_factors['uniques']))
+    order = np.argsort(-counts, kind='stable')
+    counts_dict = dict((var_factors['uniques'][x], int(counts[x]))
+                       for x in order if counts[x])
+    return counts_dict
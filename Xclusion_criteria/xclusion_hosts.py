@@ -0,0 +1,242 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import re
+import operator
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_factors import get_md_factors, get_factors
+
+# aggregates of the samples of each group (host):
+#   count           number of samples (or of values of the variable)
+#   nunique         number of distinct values of the variable
+#   min, max,
+#   mean, sum       of the values of the numerical variable
+#   first, last     sample with the lowest / highest value of the variable
+HOSTS_AGGREGATES = ['count', 'nunique', 'min', 'max', 'mean', 'sum',
+                    'first', 'last']
+HOSTS_OPERATORS = {'>=': operator.ge, '<=': operator.le, '==': operator.eq,
+                   '!=': operator.ne, '>': operator.gt, '<': operator.lt}
+HOSTS_REGEX = re.compile(
+    r'^\s*(%s)\s*(?:\(\s*([^()]*?)\s*\))?\s*(?:(%s)\s*(\S+))?\s*$' % (
+        '|'.join(HOSTS_AGGREGATES),
+        '|'.join(sorted(HOSTS_OPERATORS, key=len, reverse=True))))
+
+
+def get_host_condition(value) -> tuple:
+    """Parse a condition on the samples of each group, e.g. "count >= 3",
+    "max(bmi) <= 30" or "first(collection_timestamp)".
+
+    Parameters
+    ----------
+    value : str
+        Condition of a host criterion.
+
+    Returns
+    -------
+    condition : tuple
+        Aggregate, variable (None for the count of samples), comparison
+        operator and number (None for "first" and "last").
+        (None if the condition could not be parsed).
+    """
+    match = HOSTS_REGEX.match(str(value))
+    if not match:
+        return None
+    aggregate, variable, op, number = match.groups()
+    if aggregate in ['first', 'last']:
+        if not variable or op:
+            return None
+        return aggregate, variable, None, None
+    if not op or not (variable or aggregate == 'count'):
+        return None
+    try:
+        number = float(number)
+    except ValueError:
+        return None
+    return aggregate, variable or None, op, number
+
+
+def get_hosts_conditions(values: list) -> list:
+    """Parse the conditions of a host criterion (all must be true).
+
+    Parameters
+    ----------
+    values : list
+        Metadata variables in criteria.
+
+    Returns
+    -------
+    conditions : list
+        Parsed conditions (None if one could not be parsed).
+    """
+    conditions = [get_host_condition(value) for value in values]
+    if not conditions or None in conditions:
+        return None
+    return conditions
+
+
+def get_hosts_variables(index: str, values: list) -> list:
+    """Get the variables aggregated by a criterion (none if not hosts)."""
+    if index != '8':
+        return []
+    conditions = get_hosts_conditions(values) or []
+    return sorted(set(x[1] for x in conditions if x[1]))
+
+
+def has_hosts_criteria(criteria: dict) -> bool:
+    """Whether some criteria depend on the other samples of each host.
+
+    Parameters
+    ----------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+
+    Returns
+    -------
+    boolean : bool
+        Whether there is a host criterion in a step.
+    """
+    steps = [criteria.get(x) or {} for x in ['init', 'add', 'filter']]
+    return any(index == '8' for step in steps for _, index in step)
+
+
+def get_hosts_groupings(criteria: dict) -> list:
+    """Get the grouping variables of the host criteria."""
+    steps = [criteria.get(x) or {} for x in ['init', 'add', 'filter']]
+    return sorted(set(var for step in steps for var, index in step
+                      if index == '8'))
+
+
+def get_sort_codes(column: pd.Series, numerical: bool) -> np.ndarray:
+    """Get values that sort the samples by a variable (np.nan if missing),
+    in lexicographic order for a categorical variable (e.g. ISO dates).
+
+    Parameters
+    ----------
+    column : pd.Series
+        Values of the variable.
+    numerical : bool
+        Whether the variable is numerical.
+
+    Returns
+    -------
+    codes : np.ndarray
+        Sortable value of each sample.
+    """
+    if numerical:
+        return pd.to_numeric(column, errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan)
+    codes, _ = pd.factorize(column, sort=True)
+    codes = codes.astype(float)
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def get_condition_mask(input_pd: pd.DataFrame, groups: np.ndarray,
+                       rows: np.ndarray, condition: tuple,
+                       numerical: list) -> np.ndarray:
+    """Get the samples of the groups passing a condition, aggregating
+    the samples of each group with a group-by transform (which
+    broadcasts the aggregate of each group back to its samples).
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    groups : np.ndarray
+        Group of each of the rows (no missing group).
+    rows : np.ndarray
+        Rows of the samples to aggregate.
+    condition : tuple
+        Aggregate, variable, comparison operator and number.
+    numerical : list
+        Metadata variables that are numeric.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each of the rows passes the condition.
+    """
+    aggregate, variable, op, number = condition
+    if variable is None:
+        values = pd.Series(np.ones(rows.size))
+    elif aggregate in ['min', 'max', 'mean', 'sum']:
+        values = pd.Series(pd.to_numeric(
+            input_pd[variable].iloc[rows], errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan))
+    elif aggregate in ['first', 'last']:
+        values = pd.Series(get_sort_codes(
+            input_pd[variable].iloc[rows], variable in numerical))
+    else:
+        values = pd.Series(input_pd[variable].iloc[rows].values)
+    if aggregate in ['first', 'last']:
+        # one sample per group: the first in table order for ties
+        has = np.flatnonzero(values.notna().values)
+        keys = values.values[has]
+        order = has[np.lexsort((keys if aggregate == 'first' else -keys,
+                                groups[has]))]
+        firsts = np.ones(order.size, dtype=bool)
+        firsts[1:] = groups[order][1:] != groups[order][:-1]
+        mask = np.zeros(rows.size, dtype=bool)
+        mask[order[firsts]] = True
+        return mask
+    aggregated = values.groupby(groups, sort=False).transform(
+        aggregate).to_numpy(dtype=float, na_value=np.nan)
+    # the groups without values have no aggregate (np.nan never passes)
+    return HOSTS_OPERATORS[op](aggregated, number) & ~np.isnan(aggregated)
+
+
+def get_hosts_mask(input_pd: pd.DataFrame, var: str, values: list,
+                   numerical: list, messages: list, md_factors: dict = None,
+                   input_mask: np.ndarray = None) -> np.ndarray:
+    """Get the samples which group (e.g. host) passes all the conditions,
+    the groups being made of the samples input to the step only.
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    var : str
+        Metadata variable grouping the samples.
+    values : list
+        Conditions on the samples of each group.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of input_pd (for the groups codes).
+    input_mask : np.ndarray
+        Samples input to the step (all if None).
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample's group passes the conditions (the samples
+        without group, or not input to the step, never pass).
+    """
+    if md_factors is None:
+        md_factors = get_md_factors(input_pd)
+    codes = get_factors(var, input_pd, md_factors)['codes']
+    passed = codes >= 0
+    if input_mask is not None:
+        passed &= input_mask
+    rows = np.flatnonzero(passed)
+    rows_mask = np.ones(rows.size, dtype=bool)
+    for condition in get_hosts_conditions(values):
+        if condition[0] in ['min', 'max', 'mean', 'sum'] and \
+                condition[1] not in numerical:
+            messages.append('Metadata variable %s is not numerical (%s '
+                            'condition skipped)' % (condition[1], var))
+            continue
+        rows_mask &= get_condition_mask(
+            input_pd, codes[rows], rows, condition, numerical)
+    mask = np.zeros(input_pd.shape[0], dtype=bool)
+    mask[rows[rows_mask]] = True
+    return mask
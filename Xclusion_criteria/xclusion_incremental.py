@@ -0,0 +1,676 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import io
+import os
+import copy
+import hashlib
+import zipfile
+import numpy as np
+import pandas as pd
+from os.path import isfile, getsize
+
+from Xclusion_criteria import __version__
+from Xclusion_criteria.xclusion_io import (
+    read_i_criteria, get_meta_sep, set_meta_index, encode_json, decode_json)
+from Xclusion_criteria.xclusion_dtypes import (
+    get_dtype_flags, get_flags_dtype, get_check_floats, replace_tf)
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criteria_masks, add_step_counts)
+from Xclusion_criteria.xclusion_factors import get_factors
+from Xclusion_criteria.xclusion_cache import get_cache_key
+from Xclusion_criteria.xclusion_sql import get_criteria_variables
+from Xclusion_criteria.xclusion_shards import merge_flowcharts
+from Xclusion_criteria.xclusion_outliers import has_outliers_criteria
+from Xclusion_criteria.xclusion_hosts import has_hosts_criteria
+
+# the per-sample arrays of the state, stored as npz arrays (not as JSON)
+STATE_ARRAYS = ['samples', 'included', 'codes']
+STATE_MAGIC = b'PK\x03\x04'
+
+
+def get_md_flags(metadata: pd.DataFrame) -> dict:
+    """Get the dtype and the kinds of factors of the variables as read,
+    i.e. what the dtypes inference of the whole table depends on.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table (before the dtypes inference).
+
+    Returns
+    -------
+    md_flags : dict
+        Key     = metadata variable.
+        Value   = dtype: pandas dtype as read.
+                  flags: kinds of factors (None for the first variable,
+                         which has no inferred dtype, or for numbers).
+    """
+    md_flags = {}
+    for pos, variable in enumerate(metadata.columns):
+        dtype = str(metadata[variable].dtype)
+        flags = None
+        if pos and not dtype.startswith(('int', 'float')):
+            flags = get_dtype_flags(metadata[variable])
+        md_flags[variable] = {'dtype': dtype, 'flags': flags}
+    return md_flags
+
+
+def get_prefix_hash(m_metadata_file: str, offset: int,
+                    chunk_size: int = 1048576) -> tuple:
+    """Hash the first bytes of the metadata file.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    offset : int
+        Number of bytes to hash.
+    chunk_size : int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    sha : hashlib._Hash
+        SHA-256 of the first bytes (to be continued on the next bytes).
+    last : bytes
+        Last byte hashed.
+    """
+    sha = hashlib.sha256()
+    last = b''
+    with open(m_metadata_file, 'rb') as handle:
+        while offset > 0:
+            chunk = handle.read(min(chunk_size, offset))
+            if not chunk:
+                break
+            sha.update(chunk)
+            offset -= len(chunk)
+            last = chunk[-1:]
+    return sha, last
+
+
+def get_criteria_key(i_criteria: str, nulls: list, outputs: dict) -> str:
+    """Get the key of the criteria of a run (and of the IDs files they use).
+
+    Parameters
+    ----------
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+
+    Returns
+    -------
+    criteria_key : str
+        SHA-256 of everything but the metadata that determines the outputs.
+    """
+    return get_cache_key(None, i_criteria, None, nulls, {'outputs': outputs})
+
+
+def get_outputs_sizes(outputs: dict) -> dict:
+    """Get the size of the output files (None if not written)."""
+    return dict((output, getsize(path) if isfile(path) else None)
+                for output, path in outputs.items())
+
+
+def uses_index_ids(criteria_dict: dict, index: str) -> bool:
+    """Whether an IDs files criterion is on the samples names."""
+    steps = [criteria_dict.get(x) for x in ['init', 'add', 'filter']]
+    if isinstance(criteria_dict.get('predicates'), dict):
+        steps.extend(criteria_dict['predicates'].values())
+    for step in steps:
+        if isinstance(step, dict) and any(
+                str(x) in ['%s,5' % index, '%s,6' % index] for x in step):
+            return True
+    return False
+
+
+def get_samples_masks(metadata: pd.DataFrame, criteria: dict,
+                      numerical: list, messages: list,
+                      md_factors: dict = None) -> tuple:
+    """Get the masks of the criteria steps and the per-sample
+    outcome of the run (which a later run can be compared to).
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (without the "add" row).
+    filter_mask : np.ndarray
+        Samples included after the "init", "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples to be re-added by the "add" step.
+    masks : dict
+        samples     = Samples names.
+        included    = Whether each sample is included.
+        codes       = Position of the first criterion each sample fails
+                      in the names (-1: none).
+        names       = "step: criterion" names of the criteria.
+    """
+    failed = get_failed(metadata.shape[0])
+    flowcharts, filter_mask, add_mask = get_criteria_masks(
+        metadata, criteria, numerical, messages, md_factors, failed=failed)
+    masks = get_state_masks(metadata, criteria, flowcharts, filter_mask,
+                            add_mask, failed)['masks']
+    return flowcharts, filter_mask, add_mask, masks
+
+
+def get_failed(n_rows: int) -> dict:
+    """Get the first failed criterion of the samples, to be filled
+    when the criteria are applied (none failed yet)."""
+    return {'codes': np.full(n_rows, -1, dtype=np.int32), 'names': []}
+
+
+def get_state_masks(metadata: pd.DataFrame, criteria: dict,
+                    flowcharts: dict, filter_mask: np.ndarray,
+                    add_mask: np.ndarray, failed: dict) -> dict:
+    """Get the outcome of the criteria applied to the samples, as
+    collected while they are applied, for the state of the run.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria applied.
+    flowcharts : dict
+        Steps of the workflow with samples counts (without the "add" row).
+    filter_mask : np.ndarray
+        Samples included after the "init", "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples to be re-added by the "add" step.
+    failed : dict
+        codes   = Position in the names of the first criterion that
+                  each sample fails (-1: none).
+        names   = "step: criterion" names of the criteria.
+
+    Returns
+    -------
+    state_masks : dict
+        criteria    = Inclusion/exclusion criteria applied.
+        flowcharts  = Steps of the workflow (without the "add" row).
+        masks       = Samples names, whether they are included, and
+                      first failed criterion.
+        counts      = Number of samples of the "filter" and "add" steps
+                      and of both.
+    """
+    masks = {
+        'samples': metadata.index.to_numpy(dtype=object),
+        'included': filter_mask | add_mask,
+        'codes': failed['codes'],
+        'names': failed['names']
+    }
+    state_masks = {
+        'criteria': criteria,
+        'flowcharts': copy.deepcopy(flowcharts),
+        'masks': masks,
+        'counts': {'filter': int(filter_mask.sum()),
+                   'add': int(add_mask.sum()),
+                   'common': int((filter_mask & add_mask).sum())}
+    }
+    return state_masks
+
+
+def get_state(m_metadata_file: str, metadata: pd.DataFrame,
+              md_factors: dict, md_flags: dict, i_criteria: str,
+              nulls: list, numerical: list, categorical: list,
+              outputs: dict, state_masks: dict) -> dict:
+    """Collect what the next run needs to only evaluate appended samples.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    metadata : pd.DataFrame
+        Metadata table (after the dtypes inference).
+    md_factors : dict
+        Per-column factors of the metadata table.
+    md_flags : dict
+        Dtype and kinds of factors of the variables as read.
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    numerical : list
+        Metadata variables that are numeric.
+    categorical : list
+        Metadata variables that are categorical.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    state_masks : dict
+        Outcome of the criteria applied by the run (see get_state_masks).
+
+    Returns
+    -------
+    state : dict
+        State of the run.
+    """
+    criteria_dict = read_i_criteria(i_criteria)
+    factors = {}
+    for var in get_criteria_variables(criteria_dict):
+        if var in md_factors['positions']:
+            var_factors = get_factors(var, metadata, md_factors)
+            factors[var] = {'counts': dict(var_factors['counts']),
+                            'nans': var_factors['nans']}
+    sha, last = get_prefix_hash(m_metadata_file, getsize(m_metadata_file))
+    state = {
+        'version': __version__,
+        'key': get_criteria_key(i_criteria, nulls, outputs),
+        'offset': getsize(m_metadata_file),
+        'hash': sha.hexdigest(),
+        'newline': last == b'\n',
+        'columns': metadata.columns.tolist(),
+        'flags': md_flags,
+        'numerical': numerical,
+        'categorical': categorical,
+        'criteria': state_masks['criteria'],
+        'factors': factors,
+        'index_ids': uses_index_ids(criteria_dict, metadata.index.name),
+        'masks': state_masks['masks'],
+        'flowcharts': state_masks['flowcharts'],
+        'counts': state_masks['counts'],
+        'outputs': outputs,
+        'sizes': get_outputs_sizes(outputs)
+    }
+    return state
+
+
+def is_state_file(p_state: str) -> bool:
+    """Whether a file is a state file (an npz archive: a zip file)."""
+    with open(p_state, 'rb') as handle:
+        return handle.read(len(STATE_MAGIC)) == STATE_MAGIC
+
+
+def read_state(p_state: str) -> dict:
+    """Read the state of the last run (None if there is none).
+
+    The state file is an npz archive of the per-sample arrays and of
+    the rest of the state as JSON text, loaded without pickles.
+    """
+    if not p_state or not isfile(p_state) or not is_state_file(p_state):
+        return None
+    try:
+        with np.load(p_state, allow_pickle=False) as npz:
+            state = decode_json(str(npz['state']))
+            for mask in STATE_ARRAYS:
+                state['masks'][mask] = npz[mask]
+    except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile):
+        return None
+    state['masks']['samples'] = state['masks']['samples'].astype(object)
+    return state
+
+
+def write_state(p_state: str, state: dict) -> None:
+    """Write the state of the run (replacing the previous one at once)."""
+    masks = state['masks']
+    arrays = {'samples': np.asarray(masks['samples'], dtype=str),
+              'included': np.asarray(masks['included'], dtype=bool),
+              'codes': np.asarray(masks['codes'], dtype=np.int32)}
+    content = dict(state, masks=dict(
+        (x, y) for x, y in masks.items() if x not in STATE_ARRAYS))
+    p_state_tmp = '%s.%s.tmp' % (p_state, os.getpid())
+    # written in a handle so that no ".npz" extension is added
+    with open(p_state_tmp, 'wb') as o:
+        np.savez(o, state=np.array(encode_json(content)), **arrays)
+    os.replace(p_state_tmp, p_state)
+
+
+def check_state(state: dict, m_metadata_file: str, i_criteria: str,
+                nulls: list, outputs: dict) -> tuple:
+    """Check that the last run is the start of the current one.
+
+    Parameters
+    ----------
+    state : dict
+        State of the last run.
+    m_metadata_file : str
+        Path to metadata file.
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+
+    Returns
+    -------
+    reason : str
+        Why a full run is needed (None if it is not).
+    sha : hashlib._Hash
+        SHA-256 of the metadata file processed by the last run.
+    """
+    if state is None:
+        return 'no state of a previous run', None
+    if state['version'] != __version__:
+        return 'new version', None
+    if state['key'] != get_criteria_key(i_criteria, nulls, outputs):
+        return 'criteria or outputs changed', None
+    if state['sizes'] != get_outputs_sizes(outputs):
+        return 'outputs changed', None
+    if getsize(m_metadata_file) < state['offset'] or not state['newline']:
+        return 'metadata rows changed', None
+    sha, _ = get_prefix_hash(m_metadata_file, state['offset'])
+    if sha.hexdigest() != state['hash']:
+        return 'metadata rows changed', None
+    return None, sha
+
+
+def read_meta_tail(m_metadata_file: str, state: dict) -> pd.DataFrame:
+    """Read the samples appended to the metadata since the last run,
+    with the same dtypes as in the whole table.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    state : dict
+        State of the last run.
+
+    Returns
+    -------
+    tail : pd.DataFrame
+        Metadata of the new samples.
+    tail_bytes : bytes
+        Content of the file for the new samples.
+    """
+    sep, first_col = get_meta_sep(m_metadata_file)
+    with open(m_metadata_file, 'rb') as handle:
+        header = handle.readline()
+        handle.seek(state['offset'])
+        tail_bytes = handle.read()
+    # the columns as in the file, and once renamed
+    names = pd.read_csv(io.BytesIO(header), sep=sep, nrows=0).columns
+    renamed = set_meta_index(pd.DataFrame(columns=names), first_col).columns
+    # parsed as in read_meta_pd (e.g. True/False as booleans)
+    tail = pd.read_csv(io.BytesIO(header + tail_bytes), header=0, sep=sep,
+                       dtype={first_col: str}, low_memory=False)
+    # but the strings columns hold strings (e.g. "1", not the number 1)
+    as_str = [name for name, variable in zip(
+        [x for x in names if x != first_col], renamed)
+              if state['flags'].get(variable, {}).get('dtype') == 'object'
+              and str(tail[name].dtype) not in ['object', 'bool']]
+    if as_str:
+        tail[as_str] = pd.read_csv(
+            io.BytesIO(header + tail_bytes), header=0, sep=sep,
+            usecols=as_str, dtype=str, low_memory=False)[as_str]
+    tail = set_meta_index(tail, first_col)
+    return tail, tail_bytes
+
+
+def get_tail_dtypes(tail: pd.DataFrame, state: dict, nulls: list) -> tuple:
+    """Apply the dtypes of the whole table to the new samples, unless
+    these samples change the dtype of a variable.
+
+    Parameters
+    ----------
+    tail : pd.DataFrame
+        Metadata of the new samples.
+    state : dict
+        State of the last run.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    reason : str
+        Why a full run is needed (None if it is not).
+    md_flags : dict
+        Dtype and kinds of factors of the variables in the whole table.
+    """
+    columns = state['columns']
+    filled = tail.columns[tail.notna().any().values]
+    new_columns = [x for x in filled if x not in columns]
+    if new_columns:
+        return 'new variables: %s' % ', '.join(map(str, new_columns)), None
+    md_flags = {}
+    for variable in columns:
+        dtype = state['flags'][variable]['dtype']
+        flags = state['flags'][variable]['flags']
+        if not tail.shape[0]:
+            tail[variable] = tail[variable].astype(dtype)
+        tail_dtype = str(tail[variable].dtype)
+        if tail_dtype != dtype:
+            if dtype.startswith('float') and tail_dtype.startswith('int'):
+                tail[variable] = tail[variable].astype(dtype)
+            elif dtype != 'object':
+                return 'dtype of %s changed' % variable, None
+            else:
+                # e.g. booleans, then replaced as in the whole table
+                tail[variable] = tail[variable].astype(object)
+        if flags is not None:
+            tail_flags = get_dtype_flags(tail[variable])
+            md_flags_dtype = dict((x, flags[x] or tail_flags[x])
+                                  for x in flags)
+            d_type = get_flags_dtype(md_flags_dtype)
+            if d_type != get_flags_dtype(flags):
+                return 'dtype of %s changed' % variable, None
+            if d_type[-1] == 'check' and variable in state['numerical']:
+                floats = get_check_floats(tail[variable].copy(), nulls)
+                if floats is None:
+                    return 'dtype of %s changed' % variable, None
+                tail[variable] = floats
+            flags = md_flags_dtype
+        md_flags[variable] = {'dtype': dtype, 'flags': flags}
+    tail.drop(columns=[x for x in tail.columns if x not in columns],
+              inplace=True)
+    replace_tf(tail, state['categorical'])
+    return None, md_flags
+
+
+def get_merged_factors(tail: pd.DataFrame, state: dict) -> dict:
+    """Add the factors of the new samples to those of the last run.
+
+    Parameters
+    ----------
+    tail : pd.DataFrame
+        Metadata of the new samples.
+    state : dict
+        State of the last run.
+
+    Returns
+    -------
+    md_factors : dict
+        Per-column factors of the whole metadata table for the variables
+        of the criteria, which codes are the distinct values positions.
+    """
+    md_factors = {
+        'positions': dict((col, pos) for pos, col in enumerate(
+            state['columns'])),
+        'factors': {}
+    }
+    tail_factors = {'positions': dict((col, pos) for pos, col in enumerate(
+        tail.columns)), 'factors': {}}
+    for var, var_factors in state['factors'].items():
+        counts = dict(var_factors['counts'])
+        tail_var_factors = get_factors(var, tail, tail_factors)
+        for value, count in tail_var_factors['counts'].items():
+            counts[value] = counts.get(value, 0) + count
+        md_factors['factors'][var] = {
+            'codes': np.arange(len(counts)),
+            'uniques': pd.Index(list(counts)),
+            'counts': counts,
+            'nans': var_factors['nans'] + tail_var_factors['nans']
+        }
+    return md_factors
+
+
+def run_incremental(m_metadata_file: str, i_criteria: str, nulls: list,
+                    outputs: dict, p_state: str, messages: list) -> tuple:
+    """Apply the criteria only on the samples appended to the metadata
+    since the last run, and add them to the outputs of the last run.
+
+    Parameters
+    ----------
+    m_metadata_file : str
+        Path to metadata file.
+    i_criteria : str
+        Path to yml config file for the inclusion/exclusion criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    p_state : str
+        Path to the state file of the last run.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    reason : str
+        Why a full run is needed (None if it is not).
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    state : dict
+        State of the run.
+    tail_included : pd.DataFrame
+        Metadata of the new samples that are included.
+    tail_excluded : pd.DataFrame
+        Metadata of the new samples that are excluded.
+    """
+    state = read_state(p_state)
+    reason, sha = check_state(state, m_metadata_file, i_criteria,
+                              nulls, outputs)
+    if reason:
+        return reason, None, None, None, None
+    # the new samples can move the bounds of the outliers of all samples
+    if has_outliers_criteria(state['criteria']):
+        return 'outliers criteria', None, None, None, None
+    # and the new samples of a host can change its earlier samples
+    if has_hosts_criteria(state['criteria']):
+        return 'host criteria', None, None, None, None
+
+    tail, tail_bytes = read_meta_tail(m_metadata_file, state)
+    reason, md_flags = get_tail_dtypes(tail, state, nulls)
+    if reason:
+        return reason, None, None, None, None
+
+    # the criteria are checked against the factors of the whole table
+    md_factors = get_merged_factors(tail, state)
+    samples = tail.index
+    if state['index_ids']:
+        samples = pd.Index(state['masks']['samples']).append(tail.index)
+    index_pd = pd.DataFrame(index=pd.Index(samples, name=tail.index.name))
+    criteria = check_criteria(read_i_criteria(i_criteria), index_pd, nulls,
+                              messages, md_factors)
+    if criteria != state['criteria']:
+        return 'criteria checks changed', None, None, None, None
+
+    tail_flowcharts, filter_mask, add_mask, tail_masks = get_samples_masks(
+        tail, criteria, state['numerical'], messages)
+    if tail_masks['names'] != state['masks']['names']:
+        return 'criteria checks changed', None, None, None, None
+    counts = {'filter': state['counts']['filter'] + int(filter_mask.sum()),
+              'add': state['counts']['add'] + int(add_mask.sum()),
+              'common': state['counts']['common'] + int(
+                  (filter_mask & add_mask).sum())}
+    included_count = counts['filter'] + counts['add'] - counts['common']
+    previous_count = state['counts']['filter'] + state['counts']['add'] - \
+        state['counts']['common']
+    # the outputs are not written when no sample is included
+    if included_count and not previous_count:
+        return 'no sample included by the last run', None, None, None, None
+
+    sha.update(tail_bytes)
+    new_state = dict(state)
+    new_state.update({
+        'offset': state['offset'] + len(tail_bytes),
+        'hash': sha.hexdigest(),
+        'newline': tail_bytes.endswith(b'\n') if tail_bytes else state[
+            'newline'],
+        'flags': md_flags,
+        'factors': dict((x, {'counts': y['counts'], 'nans': y['nans']})
+                        for x, y in md_factors['factors'].items()),
+        'masks': dict(state['masks'], **dict(
+            (x, np.concatenate([state['masks'][x], tail_masks[x]]))
+            for x in ['samples', 'included', 'codes'])),
+        'flowcharts': merge_flowcharts([state['flowcharts'],
+                                        tail_flowcharts]),
+        'counts': counts
+    })
+    flowcharts = copy.deepcopy(new_state['flowcharts'])
+    add_step_counts(flowcharts, included_count, counts['add'],
+                    counts['common'], messages)
+    included_mask = filter_mask | add_mask
+    return (None, flowcharts, new_state, tail.loc[included_mask].copy(),
+            tail.loc[~included_mask].copy())
+
+
+def append_outputs(tail_included: pd.DataFrame, tail_excluded: pd.DataFrame,
+                   outputs: dict, state: dict) -> None:
+    """Append the new samples to the outputs of the last run.
+
+    Parameters
+    ----------
+    tail_included : pd.DataFrame
+        Metadata of the new samples that are included.
+    tail_excluded : pd.DataFrame
+        Metadata of the new samples that are excluded.
+    outputs : dict
+        Key     = output name.
+        Value   = path to the output file.
+    state : dict
+        State of the run (updated with the outputs sizes).
+    """
+    counts = state['counts']
+    if counts['filter'] + counts['add'] - counts['common']:
+        for output, tail_output in [('included', tail_included),
+                                    ('excluded', tail_excluded)]:
+            if output in outputs:
+                tail_output.reset_index().to_csv(
+                    outputs[output], index=False, sep='\t', header=False,
+                    mode='a')
+    state['sizes'] = get_outputs_sizes(outputs)
+
+
+def read_included(o_included: str, state: dict) -> pd.DataFrame:
+    """Read the metadata of all the included samples, with the
+    same dtypes as in the whole metadata table.
+
+    Parameters
+    ----------
+    o_included : str
+        Path to output metadata for the included samples only.
+    state : dict
+        State of the run.
+
+    Returns
+    -------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    """
+    counts = state['counts']
+    if not counts['filter'] + counts['add'] - counts['common']:
+        return pd.DataFrame(columns=state['columns'], index=pd.Index(
+            [], name='sample_name'))
+    dtype = {'sample_name': str}
+    for variable, flags in state['flags'].items():
+        # the converted variables are floats in the output
+        if flags['dtype'] == 'object' and variable not in state['numerical']:
+            dtype[variable] = str
+    included = pd.read_csv(o_included, sep='\t', dtype=dtype,
+                           low_memory=False)
+    included = included.set_index(included.columns[0])
+    return included
@@ -7,8 +7,11 @@
 # ----------------------------------------------------------------------------
 
 import sys
+import gzip
+import json
 import yaml
 import subprocess
+import numpy as np
 from os.path import splitext
 
 # import something for reading qiime2 metadata
@@ -37,9 +40,98 @@ def read_i_criteria(i_criteria: str) -> dict:
     return parsed_criteria
 
 
-def read_meta_pd(metadata_file: str) -> pd.DataFrame:
+def encode_json(content) -> str:
+    """Write the content of a state or catalog file as JSON text, keeping
+    the tuples and the dicts which keys are not strings (as tagged lists).
+
+    Parameters
+    ----------
+    content
+        Dicts, lists, tuples, strings, numbers, booleans and None.
+
+    Returns
+    -------
+    text : str
+        JSON text of the content.
     """
-    Read metadata with first column as index.
+    def encode(value):
+        if isinstance(value, tuple):
+            return {'__tuple__': [encode(x) for x in value]}
+        if isinstance(value, list):
+            return [encode(x) for x in value]
+        if isinstance(value, dict):
+            if all(isinstance(x, str) for x in value):
+                return dict((x, encode(y)) for x, y in value.items())
+            return {'__items__': [[encode(x), encode(y)]
+                                  for x, y in value.items()]}
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+    return json.dumps(encode(content))
+
+
+def decode_json(text: str):
+    """Read the content of a state or catalog file written by encode_json.
+
+    Parameters
+    ----------
+    text : str
+        JSON text of the content.
+
+    Returns
+    -------
+    content
+        Dicts, lists, tuples, strings, numbers, booleans and None.
+    """
+    def decode(value: dict):
+        if list(value) == ['__tuple__']:
+            return tuple(value['__tuple__'])
+        if list(value) == ['__items__']:
+            return dict((x, y) for x, y in value['__items__'])
+        return value
+    return json.loads(text, object_hook=decode)
+
+
+def read_ids(ids_file: str) -> set:
+    """Stream-read the sample (or host) IDs of a file into a set.
+
+    The file can be:
+        - plain text    : one ID per line (first field if tab-separated).
+        - gzipped text  : same, with a ".gz" extension.
+        - Parquet       : IDs in the first column, ".parquet" extension.
+
+    Parameters
+    ----------
+    ids_file : str
+        Path to the file containing the IDs.
+
+    Returns
+    -------
+    ids : set
+        IDs in the file.
+    """
+    ids = set()
+    if ids_file.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(ids_file)
+        first_col = parquet.schema_arrow.names[0]
+        for batch in parquet.iter_batches(columns=[first_col]):
+            ids.update(map(str, batch.column(0).to_pylist()))
+    else:
+        if ids_file.endswith('.gz'):
+            handle = gzip.open(ids_file, 'rt')
+        else:
+            handle = open(ids_file)
+        with handle:
+            for line in handle:
+                sample = line.split('\t', 1)[0].strip()
+                if sample and not sample.startswith('#'):
+                    ids.add(sample)
+    return ids
+
+
+def get_meta_sep(metadata_file: str) -> tuple:
+    """Get the separator and the first column name of the metadata file.
 
     Parameters
     ----------
@@ -48,8 +140,10 @@ def read_meta_pd(metadata_file: str) -> pd.DataFrame:
 
     Returns
     -------
-    metadata : pd.DataFrame
-        Metadata table.
+    sep : str
+        Columns separator.
+    first_col : str
+        Name of the first column (sample IDs).
     """
     with open(metadata_file) as f:
         for line in f:
@@ -63,13 +157,50 @@ def read_meta_pd(metadata_file: str) -> pd.DataFrame:
     else:
         print('no separator found among: "<tab>", ",", ";"\nExiting')
         sys.exit(1)
-    meta_pd = pd.read_csv(metadata_file, header=0, sep=sep,
-                          dtype={first_col: str}, low_memory=False)
+    return sep, first_col
+
+
+def set_meta_index(meta_pd: pd.DataFrame, first_col: str) -> pd.DataFrame:
+    """Rename the first column to sample_name and set it as index.
+
+    Parameters
+    ----------
+    meta_pd : pd.DataFrame
+        Metadata table as read.
+    first_col : str
+        Name of the first column (sample IDs).
+
+    Returns
+    -------
+    meta_pd : pd.DataFrame
+        Metadata table indexed by sample_name.
+    """
     cols = meta_pd.columns
     if cols[0] != 'sample_name' and 'sample_name' in set(cols[1:]):
         meta_pd.rename(columns={'sample_name': 'sample_name_old'}, inplace=True)
     meta_pd.rename(columns={first_col: 'sample_name'}, inplace=True)
     meta_pd.set_index('sample_name', inplace=True)
+    return meta_pd
+
+
+def read_meta_pd(metadata_file: str) -> pd.DataFrame:
+    """
+    Read metadata with first column as index.
+
+    Parameters
+    ----------
+    metadata_file : str
+        Path to metadata file on which to apply included/exclusion criteria.
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Metadata table.
+    """
+    sep, first_col = get_meta_sep(metadata_file)
+    meta_pd = pd.read_csv(metadata_file, header=0, sep=sep,
+                          dtype={first_col: str}, low_memory=False)
+    meta_pd = set_meta_index(meta_pd, first_col)
     # remove NaN only columns
     meta_pd = meta_pd.loc[:, ~meta_pd.isna().all()]
     # remove duplicate columns
@@ -0,0 +1,311 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from os.path import splitext
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria, get_criteria_masks)
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def check_scipy() -> bool:
+    """Check that scipy is installed for the matching step.
+
+    Returns
+    -------
+    boolean : bool
+        Whether scipy can be imported.
+    """
+    return cKDTree is not None
+
+
+def get_matched_path(o_included: str) -> str:
+    """Get the path to the metadata of the matched cases and controls,
+    next to the metadata for the included samples."""
+    return '%s_matched.tsv' % splitext(o_included)[0]
+
+
+def check_match(match_dict: dict, included: pd.DataFrame, numerical: list,
+                nulls: list, messages: list) -> dict:
+    """Check the "match" section of the yaml criteria file.
+
+    Parameters
+    ----------
+    match_dict : dict
+        cases   = Criteria of the cases among the included samples
+                  (the other included samples are the controls).
+        exact   = Categorical variables on which to match exactly.
+        nearest = Numerical variables on which to match the nearest.
+        ratio   = Number of controls per case (default: 1).
+        caliper = Maximum distance between a case and its controls, in
+                  standard deviations of the numerical variables.
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    numerical : list
+        Metadata variables that are numeric.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    match : dict
+        Checked "match" section (None if it cannot be applied).
+    """
+    if not isinstance(match_dict, dict) or not isinstance(
+            match_dict.get('cases'), dict):
+        messages.append('The "match" section needs the criteria of the '
+                        '"cases" (no matching)')
+        return None
+    cases = check_criteria({'init': match_dict['cases']}, included, nulls,
+                           messages)
+    if not cases:
+        messages.append('No valid criteria for the "cases" (no matching)')
+        return None
+    match = {'cases': cases, 'exact': [], 'nearest': []}
+    for key in ['exact', 'nearest']:
+        variables = match_dict.get(key) or []
+        if not isinstance(variables, list):
+            variables = [variables]
+        for var in variables:
+            if var not in included.columns:
+                messages.append('Variable %s not in metadata (not '
+                                'matched)' % var)
+            elif key == 'nearest' and var not in numerical:
+                messages.append('Metadata variable %s is not numerical '
+                                '(not matched)' % var)
+            else:
+                match[key].append(var)
+    if not match['exact'] and not match['nearest']:
+        messages.append('No "exact" or "nearest" variable to match on '
+                        '(no matching)')
+        return None
+    try:
+        match['ratio'] = int(match_dict.get('ratio', 1))
+        caliper = match_dict.get('caliper')
+        match['caliper'] = np.inf if caliper is None else float(caliper)
+    except (TypeError, ValueError):
+        messages.append('The "ratio" and "caliper" must be numbers '
+                        '(no matching)')
+        return None
+    if match['ratio'] < 1 or match['caliper'] <= 0:
+        messages.append('The "ratio" must be >= 1 and the "caliper" > 0 '
+                        '(no matching)')
+        return None
+    return match
+
+
+def get_match_pairs(case_x: np.ndarray, control_x: np.ndarray, ratio: int,
+                    caliper: float) -> tuple:
+    """Match each case to its nearest controls (without replacement).
+
+    In rounds, each case proposes its nearest unmatched control and a
+    control proposed by several cases goes to the closest one. The
+    controls of a spatial index cannot be removed once matched: the cases
+    which nearest controls are all matched are queried again with twice
+    as many neighbours.
+
+    Parameters
+    ----------
+    case_x : np.ndarray
+        Standardized numerical variables of the cases.
+    control_x : np.ndarray
+        Standardized numerical variables of the controls.
+    ratio : int
+        Number of controls per case.
+    caliper : float
+        Maximum distance between a case and its controls.
+
+    Returns
+    -------
+    case_pos : np.ndarray
+        Positions of the cases of each pair.
+    control_pos : np.ndarray
+        Positions of the controls of each pair.
+    distance : np.ndarray
+        Distance between the case and the control of each pair.
+    """
+    n_controls = control_x.shape[0]
+    pairs = [(np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))]
+    if not n_controls:
+        return pairs[0]
+    tree = cKDTree(control_x)
+    taken = np.zeros(n_controls + 1, dtype=bool)
+    # the missing neighbours have the index n_controls
+    taken[n_controls] = True
+    # number of neighbours to query for each case
+    case_k = np.ones(case_x.shape[0], dtype=int)
+    kept = np.arange(case_x.shape[0])
+    for _ in range(ratio):
+        pending, matched = kept, [pairs[0][0]]
+        while pending.size:
+            proposals, further = [], []
+            pending_k = case_k[pending]
+            for cur_k in np.unique(pending_k):
+                cur_cases = pending[pending_k == cur_k]
+                dist, idx = tree.query(case_x[cur_cases], k=cur_k,
+                                       distance_upper_bound=caliper)
+                dist = dist.reshape(cur_cases.size, -1)
+                idx = idx.reshape(cur_cases.size, -1)
+                available = ~taken[idx]
+                has = available.any(axis=1)
+                first = available.argmax(axis=1)[has]
+                proposals.append((cur_cases[has], idx[has, first],
+                                  dist[has, first]))
+                # all the neighbours matched, but more within the caliper
+                if cur_k < n_controls:
+                    more = cur_cases[~has & (idx[:, -1] < n_controls)]
+                    case_k[more] = min(cur_k * 2, n_controls)
+                    further.append(more)
+            cases, controls, dists = [
+                np.concatenate(x) for x in zip(*proposals)]
+            # the closest case gets the control proposed by several cases
+            order = np.lexsort((cases, dists))
+            _, firsts = np.unique(controls[order], return_index=True)
+            winners = np.zeros(order.size, dtype=bool)
+            winners[order[firsts]] = True
+            taken[controls[winners]] = True
+            pairs.append((cases[winners], controls[winners], dists[winners]))
+            matched.append(cases[winners])
+            pending = np.concatenate([cases[~winners]] + further)
+        kept = np.sort(np.concatenate(matched))
+    case_pos, control_pos, distance = [np.concatenate(x) for x in zip(*pairs)]
+    return case_pos, control_pos, distance
+
+
+def get_match_columns(included: pd.DataFrame, match: dict,
+                      nulls: list) -> tuple:
+    """Get the samples with values for all the matching variables, their
+    exact matching stratum and standardized numerical variables.
+
+    Parameters
+    ----------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    match : dict
+        Checked "match" section.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    complete : np.ndarray
+        Whether each sample has values for all the matching variables.
+    strata : np.ndarray
+        Exact matching stratum of each complete sample.
+    x : np.ndarray
+        Standardized numerical variables of each complete sample (one
+        column of zeros if exact matching only).
+    """
+    complete = np.ones(included.shape[0], dtype=bool)
+    for var in match['exact']:
+        complete &= ~included[var].isin(nulls).values
+        if 'nan' in nulls:
+            complete &= included[var].notna().values
+    columns = []
+    for var in match['nearest']:
+        column = pd.to_numeric(included[var], errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan)
+        complete &= ~np.isnan(column)
+        columns.append(column)
+    if match['exact']:
+        strata = included.loc[complete, match['exact']].groupby(
+            match['exact'], sort=False).ngroup().values
+    else:
+        strata = np.zeros(complete.sum(), dtype=int)
+    if columns:
+        x = np.column_stack(columns)[complete]
+        std = x.std(axis=0)
+        x = (x - x.mean(axis=0)) / np.where(std > 0, std, 1)
+    else:
+        x = np.zeros((complete.sum(), 1))
+    return complete, strata, x
+
+
+def match_samples(included: pd.DataFrame, match: dict, numerical: list,
+                  nulls: list, messages: list) -> tuple:
+    """Match the cases of the included samples to controls, exactly on
+    the categorical variables and to the nearest on the numerical ones.
+
+    Parameters
+    ----------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    match : dict
+        Checked "match" section.
+    numerical : list
+        Metadata variables that are numeric.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    matched : pd.DataFrame
+        Metadata for the matched cases and controls, with the case of
+        each sample ("match_id"), its role ("match_role") and its distance
+        to the case ("match_distance").
+    flowchart : list
+        Samples counts of the matching step.
+    """
+    cases_flowcharts, cases_mask, _ = get_criteria_masks(
+        included, match['cases'], numerical, messages)
+    complete, strata, x = get_match_columns(included, match, nulls)
+    rows = np.flatnonzero(complete)
+    is_case = cases_mask[rows]
+    # one spatial index of the controls per exact matching stratum
+    order = np.argsort(strata, kind='stable')
+    bounds = np.flatnonzero(np.diff(strata[order])) + 1
+    case_rows, control_rows, distances = [], [], []
+    for stratum in np.split(order, bounds):
+        cases = stratum[is_case[stratum]]
+        controls = stratum[~is_case[stratum]]
+        if not cases.size or not controls.size:
+            continue
+        case_pos, control_pos, distance = get_match_pairs(
+            x[cases], x[controls], match['ratio'], match['caliper'])
+        case_rows.append(rows[cases[case_pos]])
+        control_rows.append(rows[controls[control_pos]])
+        distances.append(distance)
+    if case_rows:
+        case_rows, control_rows, distances = [np.concatenate(x) for x in [
+            case_rows, control_rows, distances]]
+    else:
+        case_rows, control_rows, distances = [], [], []
+    matched_cases = np.unique(case_rows).astype(int)
+    # each case followed by its controls (closest first)
+    groups = np.concatenate([matched_cases, case_rows]).astype(int)
+    positions = np.concatenate([matched_cases, control_rows]).astype(int)
+    roles = np.array(['case'] * matched_cases.size +
+                     ['control'] * len(control_rows))
+    dists = np.concatenate([np.zeros(matched_cases.size), distances])
+    sort = np.lexsort((dists, roles != 'case', groups))
+    matched = included.iloc[positions[sort]].copy()
+    matched['match_id'] = included.index[groups[sort]]
+    matched['match_role'] = roles[sort]
+    matched['match_distance'] = dists[sort].round(6)
+
+    flowchart = [['match metadata', included.shape[0], None, None, None]]
+    for row in cases_flowcharts['init'][1:]:
+        flowchart.append(['cases: %s' % row[0]] + row[1:])
+    variables = '\n'.join(match['exact'] + match['nearest'])
+    flowchart.extend([
+        ['complete cases', int(is_case.sum()), variables, None, None],
+        ['matched cases', int(matched_cases.size), variables,
+         '1:%s' % match['ratio'], None],
+        ['matched samples', int(matched.shape[0]), variables,
+         '1:%s' % match['ratio'], None]])
+    return matched, flowchart
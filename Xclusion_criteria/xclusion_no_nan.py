@@ -0,0 +1,290 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_factors import get_factors_mask
+from Xclusion_criteria.xclusion_overlaps import (
+    get_failures_bits, get_bits_patterns)
+
+# above, the subsets are not all evaluated (greedy path instead)
+MAX_EXHAUSTIVE = 20
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)
+
+
+def get_plan_masks(criteria_masks: list, n_rows: int) -> tuple:
+    """Get the samples that the "no_nan" variables can still remove,
+    i.e. included by all the other criteria and not re-added by "add".
+
+    Parameters
+    ----------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    n_rows : int
+        Number of samples.
+
+    Returns
+    -------
+    base_mask : np.ndarray
+        Samples passing the "init" and "filter" criteria, not re-added.
+    add_count : int
+        Number of samples re-added by the "add" step.
+    """
+    init_mask = np.ones(n_rows, dtype=bool)
+    filter_mask = np.ones(n_rows, dtype=bool)
+    add_mask = None
+    for step, _, mask in criteria_masks:
+        if step == 'init':
+            init_mask &= mask
+        elif step == 'filter':
+            filter_mask &= mask
+        elif step == 'add':
+            add_mask = mask.copy() if add_mask is None else add_mask & mask
+    if add_mask is None:
+        add_mask = np.zeros(n_rows, dtype=bool)
+    add_mask &= init_mask
+    base_mask = init_mask & filter_mask & ~add_mask
+    return base_mask, int(add_mask.sum())
+
+
+def get_nulls_mask(var: str, metadata: pd.DataFrame, md_factors: dict,
+                   nulls: list, base_mask: np.ndarray) -> np.ndarray:
+    """Get the samples with a missing value for a variable, as for the
+    "no_nan" criteria (any factor in nulls.txt, incl. "nan" for np.nan).
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable.
+    metadata : pd.DataFrame
+        Metadata table.
+    md_factors : dict
+        Per-column factors of the metadata table (used if already known,
+        not filled for the hundreds of candidate variables).
+    nulls : list
+        Factors to be interpreted as np.nan.
+    base_mask : np.ndarray
+        Samples that the "no_nan" variables can still remove.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether the value of each of these samples is missing.
+    """
+    nan_value = 'nan' in nulls
+    if var in md_factors['factors']:
+        var_factors = md_factors['factors'][var]
+        return get_factors_mask({'uniques': var_factors['uniques'],
+                                 'codes': var_factors['codes'][base_mask]},
+                                nulls, nan_value)
+    # only the samples that can still be removed are compared
+    column = metadata.iloc[base_mask, md_factors['positions'][var]]
+    mask = column.isin(nulls).values
+    if nan_value:
+        mask |= column.isna().values
+    return mask
+
+
+def get_no_nan_candidates(metadata: pd.DataFrame, candidates: tuple,
+                          md_factors: dict, nulls: list,
+                          base_mask: np.ndarray, messages: list) -> list:
+    """Get the candidate variables for the "no_nan" list: those passed
+    and in the metadata, or all the variables missing for some samples.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    candidates : tuple
+        Candidate variables passed (all the variables if empty).
+    md_factors : dict
+        Per-column factors of the metadata table.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    base_mask : np.ndarray
+        Samples that the "no_nan" variables can still remove.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    no_nan_candidates : list
+        Candidate variables for the "no_nan" list.
+    """
+    if candidates:
+        no_nan_candidates = []
+        for var in candidates:
+            if var not in md_factors['positions']:
+                messages.append('Metadata variable %s not in the metadata '
+                                '(not a "no_nan" candidate)' % var)
+            elif var not in no_nan_candidates:
+                no_nan_candidates.append(var)
+        return no_nan_candidates
+    return [var for var in metadata.columns if get_nulls_mask(
+        var, metadata, md_factors, nulls, base_mask).any()]
+
+
+def get_popcounts(values: np.ndarray) -> np.ndarray:
+    """Count the set bits of each integer (one lookup per byte)."""
+    values = np.ascontiguousarray(values, dtype='<u4')
+    return POPCOUNT[values.view(np.uint8).reshape(-1, 4)].sum(axis=1)
+
+
+def get_exhaustive_plan(patterns: np.ndarray, weights: np.ndarray,
+                        candidates: list) -> list:
+    """Get the "no_nan" list retaining the most samples for each number
+    of variables, evaluating all the subsets of candidate variables.
+
+    The retained samples of a subset are those which nulls are all in
+    its complement: these sums over the subsets of each complement are
+    made for all the subsets at once (k passes over the 2^k subsets).
+
+    Parameters
+    ----------
+    patterns : np.ndarray
+        Whether the samples of each distinct pattern miss each candidate.
+    weights : np.ndarray
+        Number of samples per pattern.
+    candidates : list
+        Candidate variables.
+
+    Returns
+    -------
+    plan : list
+        Number of variables, retained samples and variables.
+    """
+    n_cands = len(candidates)
+    codes = patterns.astype(np.int64) @ (1 << np.arange(n_cands))
+    sums = np.bincount(codes, weights=weights, minlength=1 << n_cands)
+    for pos in range(n_cands):
+        sums = sums.reshape(-1, 2, 1 << pos)
+        sums[:, 1, :] += sums[:, 0, :]
+    sums = sums.reshape(-1)
+    subsets = np.arange(1 << n_cands)
+    retained = sums[((1 << n_cands) - 1) ^ subsets]
+    sizes = get_popcounts(subsets)
+    plan = []
+    for size in range(n_cands + 1):
+        cur_subsets = np.flatnonzero(sizes == size)
+        best = cur_subsets[np.argmax(retained[cur_subsets])]
+        plan.append((size, int(round(retained[best])), [
+            candidates[x] for x in range(n_cands) if best >> x & 1]))
+    return plan
+
+
+def get_greedy_plan(bits: np.ndarray, weights: np.ndarray,
+                    candidates: list) -> list:
+    """Get the "no_nan" lists adding, one at a time, the candidate
+    variable that removes the fewest of the retained samples.
+
+    The number of retained samples missing each candidate is updated by
+    the patterns removed at each step only (each pattern is removed once).
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        Distinct patterns of missing candidates (packed bits).
+    weights : np.ndarray
+        Number of samples per pattern.
+    candidates : list
+        Candidate variables.
+
+    Returns
+    -------
+    plan : list
+        Number of variables, retained samples and variables.
+    """
+    n_cands = len(candidates)
+    weights = weights.astype(np.int64)
+    missing = np.zeros(n_cands, dtype=np.int64)
+    for start in range(0, bits.shape[0], 65536):
+        missing += weights[start:start + 65536] @ np.unpackbits(
+            bits[start:start + 65536], axis=1, count=n_cands).astype(np.int64)
+    retained_mask = np.ones(bits.shape[0], dtype=bool)
+    retained = int(weights.sum())
+    plan = [(0, retained, [])]
+    chosen = []
+    remaining = np.ones(n_cands, dtype=bool)
+    for size in range(1, n_cands + 1):
+        pos = int(np.argmin(np.where(remaining, missing, np.iinfo(
+            np.int64).max)))
+        remaining[pos] = False
+        chosen.append(candidates[pos])
+        removed = retained_mask & (
+            (bits[:, pos // 8] >> np.uint8(7 - pos % 8)) & 1).astype(bool)
+        if removed.any():
+            missing -= weights[removed] @ np.unpackbits(
+                bits[removed], axis=1, count=n_cands).astype(np.int64)
+            retained_mask &= ~removed
+            retained -= int(weights[removed].sum())
+        plan.append((size, retained, list(chosen)))
+    return plan
+
+
+def get_no_nan_plan(metadata: pd.DataFrame, candidates: list,
+                    md_factors: dict, nulls: list, base_mask: np.ndarray,
+                    add_count: int) -> pd.DataFrame:
+    """Get the "no_nan" lists of candidate variables that retain the most
+    samples, for each number of variables.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    candidates : list
+        Candidate variables for the "no_nan" list.
+    md_factors : dict
+        Per-column factors of the metadata table.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    base_mask : np.ndarray
+        Samples that the "no_nan" variables can still remove.
+    add_count : int
+        Number of samples re-added by the "add" step.
+
+    Returns
+    -------
+    plan : pd.DataFrame
+        variables   = Number of variables in the "no_nan" list.
+        retained    = Number of included samples with this list.
+        method      = "exhaustive" (best list) or "greedy" (path).
+        no_nan      = Variables of the "no_nan" list.
+    """
+    if not candidates:
+        return pd.DataFrame({'variables': [0],
+                             'retained': [int(base_mask.sum()) + add_count],
+                             'method': ['exhaustive'], 'no_nan': ['']})
+    # one bit per candidate variable that each sample misses
+    bits = get_failures_bits([
+        (None, var, ~get_nulls_mask(var, metadata, md_factors, nulls,
+                                    base_mask))
+        for var in candidates], int(base_mask.sum()))
+    bits, weights = get_bits_patterns(bits)
+    if len(candidates) <= MAX_EXHAUSTIVE:
+        method = 'exhaustive'
+        patterns = np.unpackbits(
+            bits, axis=1, count=len(candidates)).astype(bool)
+        rows = get_exhaustive_plan(patterns, weights, candidates)
+    else:
+        method = 'greedy'
+        rows = get_greedy_plan(bits, weights, candidates)
+    plan = pd.DataFrame([
+        [size, retained + add_count, method, ','.join(variables)]
+        for size, retained, variables in rows],
+        columns=['variables', 'retained', 'method', 'no_nan'])
+    return plan
+
+
+def get_plan_suggestion(plan: pd.DataFrame, target: int) -> pd.Series:
+    """Get the longest "no_nan" list retaining at least the target number
+    of samples (None if none does)."""
+    meets = plan.loc[plan['retained'] >= target]
+    if not meets.shape[0]:
+        return None
+    return meets.iloc[-1]
@@ -0,0 +1,418 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+# outliers methods and the defaults of their numbers:
+#   zscore      more than this many standard deviations from the mean
+#   iqr         more than this many interquartile ranges below the first
+#               quartile or above the third quartile (Tukey's fences)
+#   percentile  below the first or above the second percentile
+OUTLIERS_METHODS = {'zscore': [3.], 'iqr': [1.5], 'percentile': [1., 99.]}
+
+
+def get_outliers_params(values: list) -> dict:
+    """Parse the values of an outliers criterion: the method, then its
+    numbers (defaults if none), then the strata variables (if any).
+
+    Parameters
+    ----------
+    values : list
+        Metadata variables in criteria, e.g. ['iqr', 1.5, 'sex'].
+
+    Returns
+    -------
+    params : dict
+        method  = "zscore", "iqr" or "percentile".
+        numbers = Numbers of the method.
+        by      = Variables which values define the strata.
+        (None if the values could not be parsed).
+    """
+    if not values or str(values[0]) not in OUTLIERS_METHODS:
+        return None
+    method = str(values[0])
+    numbers, by = [], []
+    for value in values[1:]:
+        try:
+            if by or isinstance(value, (bool, list, dict)):
+                raise ValueError
+            numbers.append(float(value))
+        except (TypeError, ValueError):
+            by.append(str(value))
+    defaults = OUTLIERS_METHODS[method]
+    if len(numbers) > len(defaults):
+        return None
+    numbers.extend(defaults[len(numbers):])
+    if method == 'percentile':
+        if not 0 <= numbers[0] < numbers[1] <= 100:
+            return None
+    elif not numbers[0] > 0:
+        return None
+    return {'method': method, 'numbers': numbers, 'by': by}
+
+
+def get_strata_variables(index: str, values: list) -> list:
+    """Get the strata variables of a criterion (none if not outliers)."""
+    if index != '7':
+        return []
+    params = get_outliers_params(values)
+    return params['by'] if params else []
+
+
+def has_outliers_criteria(criteria: dict) -> bool:
+    """Whether some criteria compare the samples to all the others.
+
+    Parameters
+    ----------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+
+    Returns
+    -------
+    boolean : bool
+        Whether there is an outliers criterion in a step or predicate.
+    """
+    steps = [criteria.get(x) or {} for x in ['init', 'add', 'filter']]
+    steps.extend((criteria.get('predicates') or {}).values())
+    return any(index == '7' for step in steps for _, index in step)
+
+
+def get_strata(input_pd: pd.DataFrame, by: list) -> pd.MultiIndex:
+    """Get the stratum of each sample, as the values of the strata
+    variables as text (the missing values are a stratum).
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    by : list
+        Variables which values define the strata.
+
+    Returns
+    -------
+    strata : pd.MultiIndex
+        Stratum of each sample (None if there are no strata).
+    """
+    if not by:
+        return None
+    return pd.MultiIndex.from_arrays(
+        [input_pd[var].astype(str).values for var in by], names=by)
+
+
+def get_moments(column: np.ndarray, codes: np.ndarray,
+                n_strata: int) -> tuple:
+    """Get the count, mean and sum of squared deviations of the
+    values of each stratum (np.nan not counted).
+
+    Parameters
+    ----------
+    column : np.ndarray
+        Numerical values.
+    codes : np.ndarray
+        Stratum of each value.
+    n_strata : int
+        Number of strata.
+
+    Returns
+    -------
+    moments : tuple
+        Count, mean and sum of squared deviations per stratum.
+    """
+    numbers = ~np.isnan(column)
+    column, codes = column[numbers], codes[numbers]
+    count = np.bincount(codes, minlength=n_strata).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, column, minlength=n_strata) / count
+    mean[count == 0] = 0.
+    m2 = np.bincount(codes, (column - mean[codes]) ** 2, minlength=n_strata)
+    return count, mean, m2
+
+
+def merge_moments(moments: tuple, chunk_moments: tuple) -> tuple:
+    """Merge the moments of the values of a chunk into those of the
+    previous chunks (Chan et al.'s parallel variance).
+
+    Parameters
+    ----------
+    moments : tuple
+        Count, mean and sum of squared deviations per stratum so far.
+    chunk_moments : tuple
+        Count, mean and sum of squared deviations per stratum of the chunk.
+
+    Returns
+    -------
+    moments : tuple
+        Count, mean and sum of squared deviations per stratum.
+    """
+    count_a, mean_a, m2_a = moments
+    count_b, mean_b, m2_b = chunk_moments
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(count > 0, count_b / count, 0.)
+    mean = mean_a + delta * weight
+    m2 = m2_a + m2_b + delta ** 2 * count_a * weight
+    return count, mean, m2
+
+
+def get_strata_quantiles(column: np.ndarray, codes: np.ndarray,
+                         n_strata: int, quantiles: list) -> np.ndarray:
+    """Get the quantiles of the values of each stratum, all the strata
+    sorted at once (linear interpolation, as numpy.quantile).
+
+    Parameters
+    ----------
+    column : np.ndarray
+        Numerical values.
+    codes : np.ndarray
+        Stratum of each value.
+    n_strata : int
+        Number of strata.
+    quantiles : list
+        Quantiles to get (between 0 and 1).
+
+    Returns
+    -------
+    values : np.ndarray
+        Quantiles (columns) of each stratum (rows), np.nan if no value.
+    """
+    numbers = ~np.isnan(column)
+    column, codes = column[numbers], codes[numbers]
+    order = np.lexsort((column, codes))
+    sorted_values = column[order]
+    counts = np.bincount(codes, minlength=n_strata)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    positions = starts[:, None] + np.array(quantiles)[None, :] * (
+            counts[:, None] - 1)
+    values = np.full(positions.shape, np.nan)
+    has = counts > 0
+    if not has.any():
+        return values
+    positions = positions[has]
+    low = np.floor(positions).astype(int)
+    high = np.minimum(low + 1, (starts + counts - 1)[has][:, None])
+    fraction = positions - low
+    values[has] = sorted_values[low] + fraction * (
+            sorted_values[high] - sorted_values[low])
+    return values
+
+
+def init_outliers_stats(params: dict) -> dict:
+    """Start the statistics of the values of an outliers criterion.
+
+    Parameters
+    ----------
+    params : dict
+        Parsed values of the outliers criterion.
+
+    Returns
+    -------
+    stats : dict
+        params  = Parsed values of the outliers criterion.
+        labels  = Strata met so far (None if there are no strata).
+        moments = Count, mean and sum of squared deviations per stratum.
+        values  = Numbers and their stratum, per chunk (quantiles only).
+    """
+    n_strata = 0 if params['by'] else 1
+    return {'params': params, 'labels': None,
+            'moments': tuple(np.zeros(n_strata) for _ in range(3)),
+            'values': []}
+
+
+def update_outliers_stats(stats: dict, column: np.ndarray,
+                          strata: pd.MultiIndex) -> None:
+    """Add a chunk of values to the statistics of an outliers criterion.
+
+    The moments of the chunk are merged into those of the previous chunks,
+    so that the z-scores only need a single pass over the chunks. The
+    quantiles keep the numbers (without the missing values) and their
+    stratum code, which are sorted once at the end.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics of the values of the previous chunks.
+    column : np.ndarray
+        Numerical values of the chunk.
+    strata : pd.MultiIndex
+        Stratum of each value of the chunk (None if there are no strata).
+    """
+    if strata is None:
+        codes = np.zeros(column.size, dtype=int)
+    else:
+        chunk_codes, chunk_labels = strata.factorize()
+        if stats['labels'] is None:
+            stats['labels'] = chunk_labels
+        else:
+            new = chunk_labels[stats['labels'].get_indexer(chunk_labels) < 0]
+            stats['labels'] = stats['labels'].append(new)
+        codes = stats['labels'].get_indexer(chunk_labels)[chunk_codes]
+    n_strata = 1 if stats['labels'] is None else len(stats['labels'])
+    if stats['params']['method'] == 'zscore':
+        moments = [np.append(x, np.zeros(n_strata - x.size))
+                   for x in stats['moments']]
+        stats['moments'] = merge_moments(
+            moments, get_moments(column, codes, n_strata))
+    else:
+        numbers = ~np.isnan(column)
+        stats['values'].append((column[numbers], codes[numbers]))
+
+
+def get_outliers_bounds(stats: dict) -> dict:
+    """Get the lowest and highest values that are not outliers, per stratum.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics of the values of all the chunks.
+
+    Returns
+    -------
+    bounds : dict
+        labels  = Strata (None if there are no strata).
+        low     = Lowest value of each stratum that is not an outlier.
+        high    = Highest value of each stratum that is not an outlier
+                  (np.nan if the stratum has no bounds).
+    """
+    params = stats['params']
+    n_strata = 1 if stats['labels'] is None else len(stats['labels'])
+    number = params['numbers'][0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if params['method'] == 'zscore':
+            count, mean, m2 = stats['moments']
+            std = np.sqrt(m2 / (count - 1))
+            low, high = mean - number * std, mean + number * std
+        else:
+            if stats['values']:
+                column, codes = [np.concatenate(x) for x in zip(
+                    *stats['values'])]
+            else:
+                column, codes = np.zeros(0), np.zeros(0, dtype=int)
+            if params['method'] == 'iqr':
+                quartiles = get_strata_quantiles(
+                    column, codes, n_strata, [.25, .75])
+                iqr = quartiles[:, 1] - quartiles[:, 0]
+                low = quartiles[:, 0] - number * iqr
+                high = quartiles[:, 1] + number * iqr
+            else:
+                low, high = get_strata_quantiles(
+                    column, codes, n_strata,
+                    [x / 100 for x in params['numbers']]).T
+    return {'labels': stats['labels'], 'low': low, 'high': high}
+
+
+def get_numerical_column(input_pd: pd.DataFrame, var: str) -> np.ndarray:
+    """Get the values of a numerical variable as floats (np.nan if null)."""
+    return pd.to_numeric(input_pd[var], errors='coerce').to_numpy(
+        dtype=float, na_value=np.nan)
+
+
+def get_table_bounds(input_pd: pd.DataFrame, var: str,
+                     params: dict) -> dict:
+    """Get the bounds of an outliers criterion from all the samples of
+    a table (in one chunk).
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    var : str
+        Metadata variable in criteria.
+    params : dict
+        Parsed values of the outliers criterion.
+
+    Returns
+    -------
+    bounds : dict
+        Lowest and highest values that are not outliers, per stratum.
+    """
+    stats = init_outliers_stats(params)
+    update_outliers_stats(stats, get_numerical_column(input_pd, var),
+                          get_strata(input_pd, params['by']))
+    return get_outliers_bounds(stats)
+
+
+def get_bounds_key(var: str, values: list) -> tuple:
+    """Get the key of the bounds of an outliers criterion."""
+    return var, tuple(map(str, values))
+
+
+def get_criteria_bounds(metadata: pd.DataFrame, criteria: dict,
+                        numerical: list) -> dict:
+    """Get the bounds of all the outliers criteria from the samples of
+    the full metadata table, e.g. before the rows are split into shards.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+
+    Returns
+    -------
+    outliers : dict
+        Key     = Variable and values of the outliers criterion.
+        Value   = Lowest and highest values that are not outliers.
+    """
+    outliers = {}
+    steps = [criteria.get(x) or {} for x in ['init', 'add', 'filter']]
+    steps.extend((criteria.get('predicates') or {}).values())
+    for step in steps:
+        for (var, index), values in step.items():
+            if index == '7' and var in numerical:
+                outliers[get_bounds_key(var, values)] = get_table_bounds(
+                    metadata, var, get_outliers_params(values))
+    return outliers
+
+
+def get_outliers_mask(input_pd: pd.DataFrame, var: str, values: list,
+                      md_factors: dict = None) -> np.ndarray:
+    """Get the samples that are not outliers for a numerical variable,
+    within their stratum (the missing values are not outliers).
+
+    Parameters
+    ----------
+    input_pd : pd.DataFrame
+        Metadata with all current to filter.
+    var : str
+        Metadata variable in criteria.
+    values : list
+        Metadata variables in criteria.
+    md_factors : dict
+        Per-column factors of input_pd (also holding the bounds
+        of the outliers criteria, if computed on another table).
+
+    Returns
+    -------
+    mask : np.ndarray
+        Whether each sample is not an outlier.
+    """
+    params = get_outliers_params(values)
+    outliers = {}
+    if md_factors is not None:
+        outliers = md_factors.setdefault('outliers', {})
+    column = get_numerical_column(input_pd, var)
+    strata = get_strata(input_pd, params['by'])
+    key = get_bounds_key(var, values)
+    if key not in outliers:
+        stats = init_outliers_stats(params)
+        update_outliers_stats(stats, column, strata)
+        outliers[key] = get_outliers_bounds(stats)
+    bounds = outliers[key]
+    if bounds['labels'] is None:
+        codes = np.zeros(column.size, dtype=int)
+    else:
+        codes = bounds['labels'].get_indexer(strata)
+    # the strata not in the bounds have no outliers
+    low = np.append(bounds['low'], np.nan)[codes]
+    high = np.append(bounds['high'], np.nan)[codes]
+    return ~((column < low) | (column > high))
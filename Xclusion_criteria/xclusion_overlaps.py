@@ -0,0 +1,161 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+
+def get_failures_bits(criteria_masks: list, n_rows: int) -> np.ndarray:
+    """Pack the criteria that each sample fails into bits, one criterion
+    at a time (the samples x criteria matrix is never built).
+
+    Parameters
+    ----------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    n_rows : int
+        Number of samples.
+
+    Returns
+    -------
+    bits : np.ndarray
+        One row of bytes per sample, in which the bit of each criterion
+        is set if the sample fails it (as in np.packbits(..., axis=1)).
+    """
+    bits = np.zeros((n_rows, (len(criteria_masks) + 7) // 8), dtype=np.uint8)
+    for pos, (_, _, mask) in enumerate(criteria_masks):
+        failed = ~np.asarray(mask, dtype=bool)
+        bits[:, pos // 8] |= failed.view(np.uint8) << np.uint8(7 - pos % 8)
+    return bits
+
+
+def get_bits_masks(bits: np.ndarray, steps_names: list) -> list:
+    """Unpack the bits of the failed criteria back into the criteria
+    masks, one criterion at a time (the inverse of get_failures_bits).
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        One row of bytes per sample (see get_failures_bits).
+    steps_names : list
+        Step and name of each criterion (in the flowchart order).
+
+    Returns
+    -------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    """
+    criteria_masks = []
+    for pos, (step, name) in enumerate(steps_names):
+        failed = (bits[:, pos // 8] >> np.uint8(7 - pos % 8)) & np.uint8(1)
+        criteria_masks.append((step, name, failed == 0))
+    return criteria_masks
+
+
+def get_bits_patterns(bits: np.ndarray) -> tuple:
+    """Count the samples per distinct row of bits.
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        One row of bytes per sample.
+
+    Returns
+    -------
+    uniques : np.ndarray
+        Distinct rows of bytes (sorted).
+    counts : np.ndarray
+        Number of samples with each distinct row.
+    """
+    # each row of bytes is a single value, compared at once
+    keys = np.ascontiguousarray(bits).view('V%s' % bits.shape[1]).ravel()
+    uniques, counts = np.unique(keys, return_counts=True)
+    return uniques.view(np.uint8).reshape(-1, bits.shape[1]), counts
+
+
+def get_included_patterns(patterns: np.ndarray, steps: list) -> np.ndarray:
+    """Get whether the samples failing each pattern of criteria are
+    included, i.e. fail no "init", "no_nan" and "filter" criterion,
+    or fail no "init" criterion and no criterion of the "add" step.
+
+    Parameters
+    ----------
+    patterns : np.ndarray
+        Whether each pattern fails each criterion.
+    steps : list
+        Step of each criterion.
+
+    Returns
+    -------
+    included : np.ndarray
+        Whether the samples of each pattern are included.
+    """
+    steps = np.array(steps)
+    included = ~patterns[:, steps != 'add'].any(axis=1)
+    if (steps == 'add').any():
+        included |= ~patterns[:, np.isin(steps, ['init', 'add'])].any(axis=1)
+    return included
+
+
+def get_overlaps(criteria_masks: list, n_rows: int) -> pd.DataFrame:
+    """Count the samples per pattern of failed criteria (UpSet-style).
+
+    Parameters
+    ----------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    n_rows : int
+        Number of samples.
+
+    Returns
+    -------
+    overlaps : pd.DataFrame
+        One row per pattern of failed criteria (1: failed), with the
+        number of failed criteria, whether the samples are included
+        and the number of samples (decreasing order).
+    """
+    if not criteria_masks:
+        return pd.DataFrame({'failed': [0], 'included': [True],
+                             'samples': [n_rows]})
+    bits = get_failures_bits(criteria_masks, n_rows)
+    uniques, counts = get_bits_patterns(bits)
+    patterns = np.unpackbits(
+        uniques, axis=1, count=len(criteria_masks)).astype(bool)
+    names = ['%s: %s' % (step, name) for step, name, _ in criteria_masks]
+    overlaps = pd.DataFrame(patterns.astype(np.uint8), columns=names)
+    overlaps['failed'] = patterns.sum(axis=1)
+    overlaps['included'] = get_included_patterns(
+        patterns, [x[0] for x in criteria_masks])
+    overlaps['samples'] = counts
+    order = np.lexsort((overlaps['failed'].values, -counts))
+    overlaps = overlaps.iloc[order].reset_index(drop=True)
+    return overlaps
+
+
+def write_overlaps(overlaps: pd.DataFrame, o_overlaps: str) -> None:
+    """Write the overlaps table, as Parquet if the file has the
+    ".parquet" extension (needs pyarrow) or as TSV otherwise.
+
+    Parameters
+    ----------
+    overlaps : pd.DataFrame
+        Number of samples per pattern of failed criteria.
+    o_overlaps : str
+        Path to the output table.
+    """
+    if o_overlaps.endswith('.parquet'):
+        overlaps.to_parquet(o_overlaps, index=False)
+    else:
+        overlaps.to_csv(o_overlaps, index=False, sep='\t')
+
+
+def read_overlaps(o_overlaps: str) -> pd.DataFrame:
+    """Read the overlaps table written by write_overlaps."""
+    if o_overlaps.endswith('.parquet'):
+        return pd.read_parquet(o_overlaps)
+    return pd.read_csv(o_overlaps, sep='\t')
@@ -15,6 +15,7 @@ from os.path import dirname, isdir, splitext
 
 from Xclusion_criteria.xclusion_alt import (
     make_flowchart,
+    make_overlaps,
     get_selectors,
     make_scatter,
     make_barplot,
@@ -27,7 +28,9 @@ RESOURCES = pkg_resources.resource_filename('Xclusion_criteria', 'resources')
 def make_visualizations(included: pd.DataFrame, plot_groups: dict,
                         o_visualization: str, numerical: list,
                         categorical: list, flowcharts: dict,
-                        p_random: int, fetch: bool) -> None:
+                        p_random: int, fetch: bool,
+                        overlaps: pd.DataFrame = None,
+                        strata: dict = None) -> None:
     """Build the three-panel criteria-based filtering figure.
 
     Parameters
@@ -48,6 +51,11 @@ def make_visualizations(included: pd.DataFrame, plot_groups: dict,
         Whether to reduce visualization to 100 random samples or not.
     fetch : bool
         Whether to fetch the samples on redbiom or not.
+    overlaps : pd.DataFrame
+        Number of samples per pattern of failed criteria (no panel if None).
+    strata : dict
+        Key     = metadata variable.
+        Value   = samples counts of the flowcharts rows per stratum.
     """
 
     numerical = [x for x in numerical if x in included.columns]
@@ -71,7 +79,7 @@ def make_visualizations(included: pd.DataFrame, plot_groups: dict,
 
     print('Start making the chart (html) figure')
     make_user_chart(included_num, included_cat, flowcharts,
-                    o_visualization, p_random)
+                    o_visualization, p_random, overlaps, strata)
 
 
 def get_included_num(nc: str, num_cat: list, included: pd.DataFrame,
@@ -230,7 +238,9 @@ def make_user_chart(included_num: pd.DataFrame,
                     included_cat: pd.DataFrame,
                     flowcharts: dict,
                     o_visualization: str,
-                    p_random: int) -> None:
+                    p_random: int,
+                    overlaps: pd.DataFrame = None,
+                    strata: dict = None) -> None:
     """Build the figure.
 
     Parameters
@@ -247,10 +257,23 @@ def make_user_chart(included_num: pd.DataFrame,
         Path to output visualization for the included samples only.
     p_random : int
         Whether to reduce visualization to a number random samples or not.
+    overlaps : pd.DataFrame
+        Number of samples per pattern of failed criteria (no panel if None).
+    strata : dict
+        Key     = metadata variable.
+        Value   = samples counts of the flowcharts rows per stratum.
 
     """
 
     flowchart = make_flowchart(flowcharts)
+    if strata:
+        # one stratified flowchart per variable below the flowchart
+        for var, var_strata in strata.items():
+            flowchart = flowchart & make_flowchart(
+                flowcharts, var_strata, var)
+    if overlaps is not None:
+        # the failed criteria overlaps below the flowchart
+        flowchart = flowchart & make_overlaps(overlaps)
     if included_num.shape[0]:
         # melt the table to get pairwise combinations
         # of numeric variables' values
@@ -293,7 +316,6 @@ def make_user_chart(included_num: pd.DataFrame,
 
             # make redundant factor unique
             included_merged = add_unique_categorical(included_merged)
-            included_merged.to_csv('/Users/franck/projects/test.tsv')
 
             dropdown_x, dropdown_y, brush = get_selectors(included_merged)
             scatter = make_scatter(
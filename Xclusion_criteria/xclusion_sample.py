@@ -0,0 +1,268 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from os.path import splitext
+
+# same samples for the same criteria and metadata
+SAMPLE_SEED = 12345
+# buckets of the random keys (and number of keys for their edges)
+MAX_BUCKETS = 1024
+EDGES_SAMPLE = 65536
+
+
+def get_sampled_path(o_included: str) -> str:
+    """Get the path to the metadata of the sampled samples,
+    next to the metadata for the included samples."""
+    return '%s_sampled.tsv' % splitext(o_included)[0]
+
+
+def check_sample(sample_dict: dict, included: pd.DataFrame,
+                 numerical: list, messages: list) -> dict:
+    """Check the "sample" section of the yaml criteria file.
+
+    Parameters
+    ----------
+    sample_dict : dict
+        by          = Variables defining the groups (one group if none).
+        size        = Number of samples to draw in total.
+        per_group   = Maximum number of samples to draw per group.
+        allocation  = "proportional" (to the group sizes, default) or
+                      "balanced" (same number per group) for the size.
+        weight      = Numerical variable weighting the draws.
+        seed        = Seed of the random draws.
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+
+    Returns
+    -------
+    sample : dict
+        Checked "sample" section (None if it cannot be applied).
+    """
+    if not isinstance(sample_dict, dict):
+        messages.append('The "sample" section must have keys (no sampling)')
+        return None
+    sample = {'by': [], 'weight': None}
+    by = sample_dict.get('by') or []
+    for var in by if isinstance(by, list) else [by]:
+        if var not in included.columns:
+            messages.append('Variable %s not in metadata (not a sampling '
+                            'group)' % var)
+        else:
+            sample['by'].append(var)
+    weight = sample_dict.get('weight')
+    if weight is not None:
+        if weight not in included.columns or weight not in numerical:
+            messages.append('Metadata variable %s is not numerical (no '
+                            'sampling weights)' % weight)
+        else:
+            sample['weight'] = weight
+    sample['allocation'] = sample_dict.get('allocation', 'proportional')
+    if sample['allocation'] not in ['proportional', 'balanced']:
+        messages.append('The "allocation" must be "proportional" or '
+                        '"balanced" (no sampling)')
+        return None
+    try:
+        for key in ['size', 'per_group']:
+            value = sample_dict.get(key)
+            sample[key] = None if value is None else int(value)
+        sample['seed'] = int(sample_dict.get('seed', SAMPLE_SEED))
+    except (TypeError, ValueError):
+        messages.append('The "size", "per_group" and "seed" must be '
+                        'integers (no sampling)')
+        return None
+    if sample['size'] is None and sample['per_group'] is None:
+        messages.append('The "sample" section needs a "size" or a '
+                        '"per_group" number of samples (no sampling)')
+        return None
+    if min(x for x in [sample['size'], sample['per_group']]
+           if x is not None) < 0:
+        messages.append('The "size" and "per_group" must be >= 0 '
+                        '(no sampling)')
+        return None
+    return sample
+
+
+def get_proportional_quotas(counts: np.ndarray, size: int) -> np.ndarray:
+    """Allocate a number of samples to the groups in proportion to their
+    sizes (largest remainders).
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Number of samples of each group.
+    size : int
+        Number of samples to allocate.
+
+    Returns
+    -------
+    quotas : np.ndarray
+        Number of samples allocated to each group.
+    """
+    total = counts.sum()
+    if size >= total:
+        return counts.copy()
+    exact = counts * size / total
+    quotas = np.floor(exact).astype(int)
+    left = size - quotas.sum()
+    # the fractional parts are > 0 (i.e. below the counts) for these
+    quotas[np.argsort(quotas - exact, kind='stable')[:left]] += 1
+    return quotas
+
+
+def get_balanced_quotas(counts: np.ndarray, size: int,
+                        rng: np.random.RandomState) -> np.ndarray:
+    """Allocate a number of samples equally to the groups, the groups
+    smaller than their share giving all their samples.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Number of samples of each group.
+    size : int
+        Number of samples to allocate.
+    rng : np.random.RandomState
+        Random number generator (for the groups getting one more sample).
+
+    Returns
+    -------
+    quotas : np.ndarray
+        Number of samples allocated to each group.
+    """
+    if size >= counts.sum():
+        return counts.copy()
+    # largest share per group that does not exceed the size
+    sorted_counts = np.sort(counts)
+    below = np.concatenate([[0], np.cumsum(sorted_counts)[:-1]])
+    totals = below + sorted_counts * np.arange(counts.size, 0, -1)
+    pos = np.searchsorted(totals, size, side='right')
+    share = (size - below[pos]) // (counts.size - pos)
+    quotas = np.minimum(counts, share)
+    left = size - quotas.sum()
+    larger = rng.permutation(np.flatnonzero(counts > share))
+    quotas[larger[:left]] += 1
+    return quotas
+
+
+def get_groups(included: pd.DataFrame, by: list) -> np.ndarray:
+    """Get the group of each sample (the missing values are a group)."""
+    if not by:
+        return np.zeros(included.shape[0], dtype=int)
+    return included.groupby(by, sort=False, dropna=False).ngroup().values
+
+
+def get_sample_rows(groups: np.ndarray, keys: np.ndarray,
+                    quotas: np.ndarray) -> np.ndarray:
+    """Get the rows with the largest random keys of each group, up to the
+    quota of each group.
+
+    The keys are counted per group in buckets of their quantiles: the rows
+    of the buckets above the one reaching the quota of their group are all
+    drawn, and only the rows of this boundary bucket are sorted.
+
+    Parameters
+    ----------
+    groups : np.ndarray
+        Group of each row.
+    keys : np.ndarray
+        Random key of each row (-np.inf: never drawn).
+    quotas : np.ndarray
+        Number of rows to draw per group.
+
+    Returns
+    -------
+    rows : np.ndarray
+        Drawn rows (in their original order).
+    """
+    drawable = keys > -np.inf
+    if not drawable.any():
+        return np.zeros(0, dtype=int)
+    # the bucket edges are the quantiles of a subset of the random keys
+    n_buckets = int(np.clip(4 * groups.size // quotas.size, 1, MAX_BUCKETS))
+    edges = np.unique(np.quantile(
+        keys[drawable][::max(1, drawable.sum() // EDGES_SAMPLE)],
+        np.linspace(0, 1, n_buckets + 1)[1:-1]))
+    n_buckets = edges.size + 1
+    buckets = np.searchsorted(edges, keys, side='right')
+    counts = np.bincount(groups[drawable] * n_buckets + buckets[drawable],
+                         minlength=quotas.size * n_buckets).reshape(
+        quotas.size, n_buckets)
+    # number of rows of each group in the buckets above each bucket
+    above = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1] - counts
+    crossed = (above < quotas[:, None]) & (
+            above + counts >= quotas[:, None])
+    boundary = np.where(crossed.any(axis=1), crossed.argmax(axis=1),
+                        n_buckets)
+    row_boundary = boundary[groups]
+    drawn = drawable & (buckets > row_boundary)
+    border = np.flatnonzero(drawable & (buckets == row_boundary))
+    # the quota left for the boundary bucket of each group
+    left = quotas - above[np.arange(quotas.size),
+                          np.minimum(boundary, n_buckets - 1)]
+    order = border[np.lexsort((-keys[border], groups[border]))]
+    sorted_groups = groups[order]
+    starts = np.searchsorted(sorted_groups, np.arange(quotas.size))
+    ranks = np.arange(order.size) - starts[sorted_groups]
+    drawn[order[ranks < left[sorted_groups]]] = True
+    return np.flatnonzero(drawn)
+
+
+def sample_samples(included: pd.DataFrame, sample: dict) -> tuple:
+    """Draw a random subset of the included samples per group, with the
+    probability of each sample proportional to its weight if any.
+
+    Parameters
+    ----------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    sample : dict
+        Checked "sample" section.
+
+    Returns
+    -------
+    sampled : pd.DataFrame
+        Metadata for the sampled samples.
+    flowchart : list
+        Samples counts of the sampling step.
+    """
+    rng = np.random.RandomState(sample['seed'])
+    groups = get_groups(included, sample['by'])
+    keys = rng.random_sample(included.shape[0])
+    flowchart = [['sample metadata', included.shape[0], None, None, None]]
+    if sample['weight']:
+        weights = pd.to_numeric(included[sample['weight']],
+                                errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan)
+        drawable = weights > 0
+        # weighted sampling without replacement (Efraimidis-Spirakis)
+        keys = np.full(included.shape[0], -np.inf)
+        keys[drawable] = np.log(rng.random_sample(
+            drawable.sum())) / weights[drawable]
+        flowchart.append(['weight: %s' % sample['weight'],
+                          int(drawable.sum()), sample['weight'], None, None])
+    n_groups = groups.max() + 1 if groups.size else 0
+    counts = np.bincount(groups[keys > -np.inf], minlength=n_groups)
+    if sample['per_group'] is not None:
+        counts = np.minimum(counts, sample['per_group'])
+    quotas = counts
+    if sample['size'] is not None:
+        if sample['allocation'] == 'balanced':
+            quotas = get_balanced_quotas(counts, sample['size'], rng)
+        else:
+            quotas = get_proportional_quotas(counts, sample['size'])
+    rows = get_sample_rows(groups, keys, quotas)
+    sampled = included.iloc[rows]
+    flowchart.append([
+        'sampled', sampled.shape[0], '\n'.join(sample['by']) or None,
+        sample['allocation'], '%s groups' % n_groups])
+    return sampled, flowchart
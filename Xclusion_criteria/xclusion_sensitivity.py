@@ -0,0 +1,101 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+
+def get_leave_one_out(masks: list, n_rows: int) -> tuple:
+    """Get the AND of all the masks but one, for each mask, from the
+    prefix and suffix AND products (2k operations instead of k^2).
+
+    Parameters
+    ----------
+    masks : list
+        Samples passing each criterion.
+    n_rows : int
+        Number of samples.
+
+    Returns
+    -------
+    leave_one_out : list
+        Samples passing all the criteria but the one at this position.
+    all_mask : np.ndarray
+        Samples passing all the criteria.
+    """
+    prefix = [np.ones(n_rows, dtype=bool)]
+    for mask in masks:
+        prefix.append(prefix[-1] & mask)
+    suffix = [np.ones(n_rows, dtype=bool)]
+    for mask in masks[::-1]:
+        suffix.append(suffix[-1] & mask)
+    suffix = suffix[::-1]
+    leave_one_out = [prefix[x] & suffix[x + 1] for x in range(len(masks))]
+    return leave_one_out, prefix[-1]
+
+
+def get_sensitivity(criteria_masks: list, n_rows: int) -> pd.DataFrame:
+    """Get the number of samples that each criterion keeps on its own and
+    the number of included samples if each criterion was dropped.
+
+    The "init", "no_nan" and "filter" criteria are all ANDed into the
+    finally included samples, while the "add" criteria are ANDed with
+    the "init" criteria into the re-added samples (see apply_criteria).
+
+    Parameters
+    ----------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    n_rows : int
+        Number of samples.
+
+    Returns
+    -------
+    sensitivity : pd.DataFrame
+        alone       = Samples passing the criterion.
+        without     = Included samples if the criterion was dropped.
+        gain        = Samples gained by dropping the criterion.
+    """
+    steps = [x[0] for x in criteria_masks]
+    filter_pos = [x for x, step in enumerate(steps) if step != 'add']
+    init_pos = [x for x, step in enumerate(steps) if step == 'init']
+    add_pos = [x for x, step in enumerate(steps) if step == 'add']
+
+    filter_loo, filter_mask = get_leave_one_out(
+        [criteria_masks[x][2] for x in filter_pos], n_rows)
+    init_loo, init_mask = get_leave_one_out(
+        [criteria_masks[x][2] for x in init_pos], n_rows)
+    add_loo, add_all_mask = get_leave_one_out(
+        [criteria_masks[x][2] for x in add_pos], n_rows)
+    if add_pos:
+        add_mask = init_mask & add_all_mask
+    else:
+        add_mask = np.zeros(n_rows, dtype=bool)
+    included_count = int((filter_mask | add_mask).sum())
+
+    without = {}
+    for rank, pos in enumerate(filter_pos):
+        cur_add_mask = add_mask
+        # dropping an "init" criterion also widens the "add" step
+        if pos in init_pos and add_pos:
+            cur_add_mask = init_loo[init_pos.index(pos)] & add_all_mask
+        without[pos] = int((filter_loo[rank] | cur_add_mask).sum())
+    for rank, pos in enumerate(add_pos):
+        # without its last criterion, there is no "add" step
+        if len(add_pos) == 1:
+            without[pos] = int(filter_mask.sum())
+        else:
+            without[pos] = int(
+                (filter_mask | (init_mask & add_loo[rank])).sum())
+
+    sensitivity = pd.DataFrame(
+        [[step, name, int(mask.sum()), without[pos],
+          without[pos] - included_count]
+         for pos, (step, name, mask) in enumerate(criteria_masks)],
+        columns=['step', 'criterion', 'alone', 'without', 'gain'])
+    return sensitivity
@@ -0,0 +1,299 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from Xclusion_criteria.xclusion_crits import get_criteria_masks, get_included
+from Xclusion_criteria.xclusion_factors import get_md_factors
+from Xclusion_criteria.xclusion_outliers import (
+    get_strata_variables, get_criteria_bounds)
+from Xclusion_criteria.xclusion_hosts import (
+    get_hosts_variables, get_hosts_groupings)
+from Xclusion_criteria.xclusion_overlaps import (
+    get_failures_bits, get_bits_masks)
+
+
+def get_shards(n_rows: int, p_shards: int, groups: np.ndarray = None) -> list:
+    """Split the rows of the metadata table into contiguous shards.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of samples in the metadata table.
+    p_shards : int
+        Number of shards (at most one per sample).
+    groups : np.ndarray
+        Sorted group of each row (-1: no group), which rows must all be
+        in the same shard.
+
+    Returns
+    -------
+    shards : list
+        (start, end) rows of each shard.
+    """
+    bounds = np.linspace(0, n_rows, max(1, min(p_shards, n_rows)) + 1)
+    bounds = bounds.astype(int)
+    if groups is not None and n_rows:
+        # each bound moved back to the first row of its group
+        cuts = bounds[1:-1]
+        grouped = groups[cuts] >= 0
+        cuts[grouped] = np.searchsorted(groups, groups[cuts[grouped]])
+        bounds = np.unique(np.concatenate([[0], cuts, [n_rows]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def get_criteria_columns(criteria: dict, metadata: pd.DataFrame) -> list:
+    """Get the metadata variables used by the criteria, so that
+    only these columns are sent to the worker processes.
+
+    Parameters
+    ----------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    metadata : pd.DataFrame
+        Metadata table.
+
+    Returns
+    -------
+    columns : list
+        Metadata variables used by the criteria (in the metadata order).
+    """
+    variables = set()
+    for step, step_criteria in criteria.items():
+        if step == 'predicates':
+            continue
+        for (var, index), values in step_criteria.items():
+            if index == 'expression':
+                for predicate in values.values():
+                    for (x, x_index), x_values in predicate.items():
+                        variables.add(x)
+                        variables.update(get_strata_variables(
+                            x_index, x_values))
+            else:
+                variables.add(var)
+                variables.update(get_strata_variables(index, values))
+                variables.update(get_hosts_variables(index, values))
+    return [x for x in metadata.columns if x in variables]
+
+
+def apply_shard_criteria(shard: pd.DataFrame, criteria: dict,
+                         numerical: list, outliers: dict,
+                         with_failed: bool = False,
+                         with_masks: bool = False) -> tuple:
+    """Apply the filtering criteria on a shard of the metadata
+    (run in a worker process).
+
+    Parameters
+    ----------
+    shard : pd.DataFrame
+        Rows of the metadata table (criteria variables only).
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    outliers : dict
+        Bounds of the outliers criteria, from the full metadata table.
+    with_failed : bool
+        Whether to get the first criterion failed by each sample.
+    with_masks : bool
+        Whether to get the mask of each criterion.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with the samples counts of the shard.
+    filter_mask : np.ndarray
+        Samples of the shard included after the "init",
+        "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples of the shard to be re-added by the "add" step.
+    messages : list
+        Message to print in case of error.
+    failed : dict
+        First criterion failed by the samples of the shard (None if
+        not requested).
+    masks : tuple
+        Step and name of each criterion, and the criteria failed by the
+        samples of the shard packed into bits (None if not requested).
+    """
+    messages = []
+    md_factors = get_md_factors(shard)
+    md_factors['outliers'] = outliers
+    failed, criteria_masks, masks = None, None, None
+    if with_failed:
+        failed = {'codes': np.full(shard.shape[0], -1, dtype=np.int32),
+                  'names': []}
+    if with_masks:
+        criteria_masks = []
+    flowcharts, filter_mask, add_mask = get_criteria_masks(
+        shard, criteria, numerical, messages, md_factors, failed=failed,
+        criteria_masks=criteria_masks)
+    if with_masks:
+        # 1 bit per criterion and sample, for a small transfer
+        masks = ([x[:2] for x in criteria_masks],
+                 get_failures_bits(criteria_masks, shard.shape[0]))
+    return flowcharts, filter_mask, add_mask, messages, failed, masks
+
+
+def merge_flowcharts(shards_flowcharts: list) -> dict:
+    """Sum the per-step samples counts of the shards.
+
+    Parameters
+    ----------
+    shards_flowcharts : list
+        Flowcharts of each shard, which all have the same steps since
+        the criteria are checked against the full metadata table.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    """
+    flowcharts = {}
+    for step, flowchart in shards_flowcharts[0].items():
+        flowcharts[step] = []
+        for row, cur_row in enumerate(flowchart):
+            cur_row = list(cur_row)
+            cur_row[1] = sum(x[step][row][1] for x in shards_flowcharts)
+            flowcharts[step].append(cur_row)
+    return flowcharts
+
+
+def get_sharded_criteria_masks(metadata: pd.DataFrame, criteria: dict,
+                               numerical: list, messages: list,
+                               p_shards: int, failed: dict = None,
+                               criteria_masks: list = None) -> tuple:
+    """Get the samples included by the steps of the criteria, with the
+    rows split into shards that are evaluated in parallel processes.
+
+    The criteria are row-local: each worker returns the masks of its
+    rows for the steps and the per-step counts, which are added up.
+    Only the bounds of the outliers criteria need all the rows: they
+    are computed beforehand and sent to the workers. For the host
+    criteria, the rows are ordered by host so that all the samples of
+    each host are in the same shard.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    p_shards : int
+        Number of shards (and worker processes).
+    failed : dict
+        codes   = Position in the names of the first criterion that
+                  each sample fails (-1: none), filled in place.
+        names   = "step: criterion" names of the criteria.
+    criteria_masks : list
+        Filled with the step, name and mask of each criterion.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    filter_mask : np.ndarray
+        Samples included after the "init", "no_nan" and "filter" steps.
+    add_mask : np.ndarray
+        Samples to be re-added by the "add" step.
+    """
+    columns = get_criteria_columns(criteria, metadata)
+    order, groups = None, None
+    groupings = get_hosts_groupings(criteria)
+    if len(groupings) > 1:
+        messages.append('[Warning] Host criteria grouping by several '
+                        'variables (%s): applied without shards' %
+                        ', '.join(groupings))
+        p_shards = 1
+    elif groupings:
+        codes, _ = pd.factorize(metadata[groupings[0]])
+        order = np.argsort(codes, kind='stable')
+        groups = codes[order]
+    shards = [slice(start, end) if order is None else order[start:end]
+              for start, end in get_shards(
+                  metadata.shape[0], p_shards, groups)]
+    outliers = get_criteria_bounds(metadata, criteria, numerical)
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(
+            apply_shard_criteria, metadata.iloc[rows][columns],
+            criteria, numerical, outliers, failed is not None,
+            criteria_masks is not None) for rows in shards]
+        results = [future.result() for future in futures]
+
+    shards_flowcharts, filter_masks, add_masks, shards_messages, \
+        shards_failed, shards_masks = zip(*results)
+    # the same problems are encountered in every shard
+    for shard_messages in shards_messages:
+        for message in shard_messages:
+            if message not in messages:
+                messages.append(message)
+    flowcharts = merge_flowcharts(shards_flowcharts)
+    filter_mask, add_mask = [np.concatenate(x) for x in [
+        filter_masks, add_masks]]
+    if failed is not None:
+        # the same criteria are applied in every shard
+        failed['codes'][:] = np.concatenate([x['codes'] for x in
+                                             shards_failed])
+        failed['names'][:] = shards_failed[0]['names']
+    bits = None
+    if criteria_masks is not None:
+        bits = np.concatenate([x[1] for x in shards_masks])
+    if order is not None:
+        # back to the rows order of the metadata
+        reorder = np.argsort(order)
+        filter_mask, add_mask = [x[reorder] for x in [filter_mask, add_mask]]
+        if failed is not None:
+            failed['codes'][:] = failed['codes'][reorder]
+        if bits is not None:
+            bits = bits[reorder]
+    if bits is not None:
+        criteria_masks.extend(get_bits_masks(bits, shards_masks[0][0]))
+    return flowcharts, filter_mask, add_mask
+
+
+def apply_sharded_criteria(metadata: pd.DataFrame, criteria: dict,
+                           numerical: list, messages: list,
+                           p_shards: int) -> tuple:
+    """Apply filtering criteria to subset the metadata, with the rows
+    split into shards that are evaluated in parallel processes.
+    The "add" step's union is then made on the full metadata table,
+    as in a single-process run.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    p_shards : int
+        Number of shards (and worker processes).
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    """
+    flowcharts, filter_mask, add_mask = get_sharded_criteria_masks(
+        metadata, criteria, numerical, messages, p_shards)
+    if 'init' in criteria:
+        print('init', metadata.shape)
+    included = get_included(
+        metadata, flowcharts, filter_mask, add_mask, messages)
+    return flowcharts, included
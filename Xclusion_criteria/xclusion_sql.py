@@ -0,0 +1,851 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import ast
+import sys
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from Xclusion_criteria.xclusion_crits import (
+    check_criteria,
+    drop_ids_criteria,
+    get_criterion_name,
+    get_intervals,
+    get_patterns_regex,
+    get_patterns_hits
+)
+from Xclusion_criteria.xclusion_expr import parse_expression
+from Xclusion_criteria.xclusion_dtypes import get_check_floats, replace_tf
+from Xclusion_criteria.xclusion_outliers import (
+    get_outliers_params,
+    init_outliers_stats,
+    update_outliers_stats,
+    get_outliers_bounds,
+    get_bounds_key
+)
+
+
+def get_database(m_database: str, p_table: str) -> dict:
+    """Connect to the SQLite (or DuckDB) database file.
+
+    Parameters
+    ----------
+    m_database : str
+        Path to the database file (".duckdb" or ".ddb" for DuckDB).
+    p_table : str
+        Name of the metadata table in the database.
+
+    Returns
+    -------
+    database : dict
+        con     = Connection to the database.
+        engine  = "sqlite" or "duckdb".
+        table   = Quoted name of the metadata table.
+        index   = Column of the samples names (first column).
+        columns = Metadata variables (other columns).
+    """
+    if m_database.endswith(('.duckdb', '.ddb')):
+        try:
+            import duckdb
+        except ImportError:
+            print('Reading a DuckDB database needs duckdb\nExiting')
+            sys.exit(1)
+        con = duckdb.connect(m_database, read_only=True)
+        engine = 'duckdb'
+    else:
+        con = sqlite3.connect(m_database)
+        engine = 'sqlite'
+    database = {'con': con, 'engine': engine, 'table': quote_name(p_table)}
+    try:
+        columns = get_query_columns(
+            database, 'SELECT * FROM %s LIMIT 0' % database['table'])
+    except Exception as e:
+        print('Could not read table "%s" in %s: %s\nExiting' % (
+            p_table, m_database, e))
+        sys.exit(1)
+    database['index'] = columns[0]
+    database['columns'] = columns[1:]
+    return database
+
+
+def quote_name(name: str) -> str:
+    """Quote a table or column name for SQL."""
+    return '"%s"' % str(name).replace('"', '""')
+
+
+def quote_value(value) -> str:
+    """Write a factor as an SQL literal."""
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(float(value)) if isinstance(
+            value, (float, np.floating)) else str(int(value))
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def get_query_columns(database: dict, query: str) -> list:
+    """Get the names of the columns returned by a query."""
+    cursor = database['con'].cursor()
+    cursor.execute(query)
+    columns = [x[0] for x in cursor.description]
+    cursor.close()
+    return columns
+
+
+def get_query_rows(database: dict, query: str) -> list:
+    """Get all the rows returned by a query."""
+    cursor = database['con'].cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def get_query_chunks(database: dict, query: str, chunk_size: int = 100000):
+    """Yield the rows returned by a query, as tables of chunk_size rows.
+
+    Yields
+    ------
+    chunk : pd.DataFrame
+        Rows returned by the query.
+    """
+    cursor = database['con'].cursor()
+    cursor.execute(query)
+    columns = [x[0] for x in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = pd.DataFrame.from_records(rows, columns=columns)
+        # SQL NULL as np.nan, as in the tables read by pandas
+        yield chunk.fillna(value=np.nan)
+    cursor.close()
+
+
+def get_criteria_variables(criteria_dict: dict) -> set:
+    """Get the metadata variables used by the criteria.
+
+    Parameters
+    ----------
+    criteria_dict : dict
+        Content of the yml criteria file.
+
+    Returns
+    -------
+    variables : set
+        Metadata variables used in "init", "add", "filter" or the predicates.
+    """
+    variables = set()
+    steps = [criteria_dict.get(x) for x in ['init', 'add', 'filter']]
+    if isinstance(criteria_dict.get('predicates'), dict):
+        steps.extend(criteria_dict['predicates'].values())
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        for variable_index in step:
+            if str(variable_index).count(',') == 1:
+                variables.add(str(variable_index).split(',')[0])
+    return variables
+
+
+def get_sql_factors(database: dict, variables: set) -> dict:
+    """Get the per-column factors of the variables used by the
+    criteria, each counted by the database engine (GROUP BY).
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    variables : set
+        Metadata variables used by the criteria.
+
+    Returns
+    -------
+    md_factors : dict
+        positions   = Key: metadata variable, Value: column position.
+        factors     = Key: metadata variable, Value: factors of the
+                      variable (without the per-sample codes).
+    """
+    md_factors = {
+        'positions': dict((col, pos) for pos, col in enumerate(
+            database['columns'])),
+        'factors': {}
+    }
+    for var in sorted(variables & set(database['columns'])):
+        rows = get_query_rows(database, 'SELECT %s, COUNT(*) FROM %s '
+                                        'GROUP BY %s' % (
+            quote_name(var), database['table'], quote_name(var)))
+        counts = dict((x, int(y)) for x, y in rows if x is not None)
+        md_factors['factors'][var] = {
+            'codes': None,
+            'uniques': pd.Index(list(counts), dtype=object),
+            'counts': counts,
+            'nans': sum(int(y) for x, y in rows if x is None)
+        }
+    return md_factors
+
+
+def get_sql_numerical(md_factors: dict, nulls: list) -> list:
+    """Get the variables used by the criteria that are numerical, i.e.
+    which factors are all floats or null values (as for get_dtypes).
+
+    Parameters
+    ----------
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    numerical : list
+        Metadata variables that are numeric.
+    """
+    numerical = []
+    for var, var_factors in md_factors['factors'].items():
+        for factor in var_factors['counts']:
+            if isinstance(factor, bool) or str(factor) in ['True', 'False']:
+                break
+            try:
+                float(factor)
+            except ValueError:
+                if not any(null in str(factor) for null in nulls):
+                    break
+        else:
+            numerical.append(var)
+    return numerical
+
+
+def drop_sql_null_columns(database: dict, md_factors: dict) -> None:
+    """Remove the columns without values, as read_meta_pd does.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    md_factors : dict
+        Per-column factors of all the variables of the database.
+    """
+    database['columns'] = [x for x in database['columns']
+                           if md_factors['factors'][x]['counts']]
+    md_factors['positions'] = dict(
+        (col, pos) for pos, col in enumerate(database['columns']))
+    md_factors['factors'] = dict((x, md_factors['factors'][x])
+                                 for x in database['columns'])
+
+
+def get_sql_types(database: dict, md_factors: dict, nulls: list) -> dict:
+    """Get the dtypes of the variables as in the metadata read with
+    pandas (read_meta_pd then get_dtypes), from their factors counted
+    on the whole database table.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    md_factors : dict
+        Per-column factors of all the variables of the database.
+    nulls : list
+        Factors to be interpreted as np.nan.
+
+    Returns
+    -------
+    md_types : dict
+        dtypes      = Key: metadata variable, Value: pandas dtype.
+        nulls       = Factors to be interpreted as np.nan.
+        numerical   = Metadata variables that are numeric.
+        categorical = Metadata variables that are categorical.
+    """
+    sql_numerical = get_sql_numerical(md_factors, nulls)
+    dtypes = {}
+    for var in database['columns']:
+        var_factors = md_factors['factors'][var]
+        factors = list(var_factors['counts'])
+        if var in sql_numerical:
+            # integers only if no missing values, as with pandas
+            dtypes[var] = 'float64'
+            if not var_factors['nans'] and all(
+                    isinstance(x, (int, np.integer)) or
+                    (isinstance(x, str) and x.strip().lstrip('+-').isdigit())
+                    for x in factors):
+                dtypes[var] = 'int64'
+        elif not var_factors['nans'] and all(
+                isinstance(x, (bool, np.bool_)) or
+                str(x).lower() in ['true', 'false'] for x in factors):
+            dtypes[var] = 'bool'
+        else:
+            dtypes[var] = 'object'
+    # as in get_dtypes_init, the first variable is not typed
+    numerical = [x for x in database['columns'][1:] if x in sql_numerical]
+    categorical = [x for x in database['columns'][1:]
+                   if x not in sql_numerical]
+    return {'dtypes': dtypes, 'nulls': nulls, 'numerical': numerical,
+            'categorical': categorical}
+
+
+def set_sql_types(chunk: pd.DataFrame, md_types: dict) -> pd.DataFrame:
+    """Convert the rows fetched from the database to the dtypes of the
+    metadata read with pandas, with the True/False factors replaced.
+
+    Parameters
+    ----------
+    chunk : pd.DataFrame
+        Rows returned by a query.
+    md_types : dict
+        Dtypes and numerical and categorical variables of the database.
+
+    Returns
+    -------
+    chunk : pd.DataFrame
+        Rows with the dtypes of the metadata read with pandas.
+    """
+    for var, dtype in md_types['dtypes'].items():
+        if dtype in ['int64', 'float64']:
+            floats = get_check_floats(chunk[var].copy(), md_types['nulls'])
+            chunk[var] = floats.astype(dtype)
+        elif dtype == 'bool':
+            chunk[var] = chunk[var].astype(str).str.lower() == 'true'
+        else:
+            chunk[var] = chunk[var].astype(object)
+    replace_tf(chunk, md_types['categorical'])
+    return chunk
+
+
+def get_sql_in(column: str, values: list) -> str:
+    """Write the SQL condition for the column value to be in the values."""
+    if not values:
+        return '0 = 1'
+    return '%s IN (%s)' % (column, ', '.join(map(quote_value, values)))
+
+
+def get_sql_safe(condition: str) -> str:
+    """Make a condition that is never NULL, so that it can be negated."""
+    return '(CASE WHEN %s THEN 1 ELSE 0 END = 1)' % condition
+
+
+def get_sql_condition(database: dict, var: str, index: str, values: list,
+                      numerical: list, messages: list, md_factors: dict,
+                      predicates: dict = None) -> str:
+    """Write the SQL condition that the samples pass for a criterion.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    var : str
+        Metadata variable in criteria (or expression).
+    index : str
+        Numeric indicator.
+    values : list
+        Metadata variables in criteria (or predicates for the expressions).
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+    predicates : dict
+        Checked criteria of the predicates used in the expressions.
+
+    Returns
+    -------
+    condition : str
+        SQL condition (None if the criterion is skipped).
+    """
+    if index == 'expression':
+        return get_sql_expression(
+            database, parse_expression(var), predicates,
+            numerical, messages, md_factors)
+    column = quote_name(var)
+    if index in ['0', '1']:
+        factors = [x for x in values if x != 'nan']
+        if index == '1':
+            condition = '%s IS NOT NULL AND %s' % (
+                column, get_sql_in(column, factors))
+        elif 'nan' in values:
+            condition = '%s IS NOT NULL AND NOT %s' % (
+                column, get_sql_in(column, factors))
+        else:
+            condition = '%s IS NULL OR NOT %s' % (
+                column, get_sql_in(column, factors))
+    elif index == '2':
+        if var not in numerical:
+            messages.append(
+                'Metadata variable %s is not numerical (skipping)' % var)
+            return None
+        intervals = get_intervals(values)
+        if all(low == -np.inf and high == np.inf
+               for low, high, _, _ in intervals):
+            messages.append(
+                '[Warning] Both numerical bounds for %s'
+                ' are "None" (skipping)' % var)
+            return None
+        number = get_sql_number(database, column)
+        ranges = []
+        for low, high, low_in, high_in in intervals:
+            bounds = []
+            if low != -np.inf:
+                bounds.append('%s %s %r' % (number, '>=' if low_in else '>',
+                                            float(low)))
+            if high != np.inf:
+                bounds.append('%s %s %r' % (number, '<=' if high_in else '<',
+                                            float(high)))
+            ranges.append('(%s)' % ' AND '.join(bounds or ['1 = 1']))
+        # the null values of a numerical variable are never in range
+        condition = '%s IS NOT NULL AND NOT %s AND (%s)' % (
+            column, get_sql_in(column, get_not_numbers(md_factors, var)),
+            ' OR '.join(ranges))
+    elif index in ['3', '4']:
+        # the patterns are matched on the distinct values only
+        var_factors = md_factors['factors'][var]
+        hits = get_patterns_hits(var_factors, get_patterns_regex(values))
+        matches = var_factors['uniques'][hits].tolist()
+        condition = '%s IS NOT NULL AND %s' % (
+            column, get_sql_in(column, matches))
+        if index == '4':
+            condition = 'NOT %s' % get_sql_safe(condition)
+    elif index == '7':
+        if var not in numerical:
+            messages.append(
+                'Metadata variable %s is not numerical (skipping)' % var)
+            return None
+        outliers = md_factors.setdefault('outliers', {})
+        key = get_bounds_key(var, values)
+        if key not in outliers:
+            outliers[key] = get_sql_outliers_bounds(database, var, values)
+        # the null values of a numerical variable are never outliers
+        condition = 'NOT %s' % get_sql_safe(
+            '%s IS NOT NULL AND NOT %s AND %s' % (
+                column, get_sql_in(column, get_not_numbers(md_factors, var)),
+                get_sql_outliers(database, column, outliers[key])))
+    else:
+        return None
+    return get_sql_safe(condition)
+
+
+def get_sql_number(database: dict, column: str) -> str:
+    """Write the SQL value of a column as a number."""
+    if database['engine'] == 'duckdb':
+        return 'TRY_CAST(%s AS DOUBLE)' % column
+    return 'CAST(%s AS REAL)' % column
+
+
+def get_sql_text(database: dict, column: str) -> str:
+    """Write the SQL value of a column as text."""
+    if database['engine'] == 'duckdb':
+        return 'CAST(%s AS VARCHAR)' % column
+    return 'CAST(%s AS TEXT)' % column
+
+
+def get_not_numbers(md_factors: dict, var: str) -> list:
+    """Get the factors of a numerical variable that are null values."""
+    not_numbers = []
+    for factor in md_factors['factors'][var]['counts']:
+        try:
+            float(factor)
+        except ValueError:
+            not_numbers.append(factor)
+    return not_numbers
+
+
+def get_sql_outliers_bounds(database: dict, var: str, values: list,
+                            chunk_size: int = 100000) -> dict:
+    """Get the bounds of an outliers criterion in a single pass over
+    the variable (and strata variables) read from the database in chunks.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    var : str
+        Metadata variable in criteria.
+    values : list
+        Metadata variables in criteria.
+    chunk_size : int
+        Number of rows read at once.
+
+    Returns
+    -------
+    bounds : dict
+        Lowest and highest values that are not outliers, per stratum
+        (the strata as the text of the strata variables, "nan" if NULL).
+    """
+    params = get_outliers_params(values)
+    # the strata values as text, as the database writes them
+    columns = [quote_name(var)] + [get_sql_text(
+        database, quote_name(x)) for x in params['by']]
+    stats = init_outliers_stats(params)
+    for chunk in get_query_chunks(database, 'SELECT %s FROM %s' % (
+            ', '.join(columns), database['table']), chunk_size):
+        column = pd.to_numeric(chunk.iloc[:, 0], errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan)
+        strata = None
+        if params['by']:
+            strata = pd.MultiIndex.from_arrays(
+                [chunk.iloc[:, pos].astype(str).values
+                 for pos in range(1, chunk.shape[1])], names=params['by'])
+        update_outliers_stats(stats, column, strata)
+    bounds = get_outliers_bounds(stats)
+    bounds['by'] = params['by']
+    return bounds
+
+
+def get_sql_outliers(database: dict, column: str, bounds: dict) -> str:
+    """Write the SQL condition for the column value to be an outlier
+    of its stratum.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    column : str
+        Quoted metadata variable in criteria.
+    bounds : dict
+        Lowest and highest values that are not outliers, per stratum.
+
+    Returns
+    -------
+    condition : str
+        SQL condition.
+    """
+    number = get_sql_number(database, column)
+    labels = bounds['labels']
+    if labels is None:
+        labels = [()]
+    strata = []
+    for label, low, high in zip(labels, bounds['low'], bounds['high']):
+        if np.isnan(low) or np.isnan(high):
+            continue
+        condition = ['(%s < %r OR %s > %r)' % (
+            number, float(low), number, float(high))]
+        for var, value in zip(bounds['by'], label):
+            if value == 'nan':
+                condition.append('%s IS NULL' % quote_name(var))
+            else:
+                condition.append('%s = %s' % (get_sql_text(
+                    database, quote_name(var)), quote_value(value)))
+        strata.append('(%s)' % ' AND '.join(condition))
+    return '(%s)' % ' OR '.join(strata or ['0 = 1'])
+
+
+def get_sql_expression(database: dict, node, predicates: dict,
+                       numerical: list, messages: list,
+                       md_factors: dict) -> str:
+    """Write the SQL condition of a boolean expression over predicates.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    node : ast.AST
+        Node of the expression's syntax tree.
+    predicates : dict
+        Key     = predicate name.
+        Value   = criteria that must all be true for the predicate.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+
+    Returns
+    -------
+    condition : str
+        SQL condition.
+    """
+    if isinstance(node, ast.Name):
+        conditions = []
+        for (var, index), values in predicates[node.id].items():
+            condition = get_sql_condition(
+                database, var, index, values, numerical,
+                messages, md_factors)
+            if condition is not None:
+                conditions.append(condition)
+        return '(%s)' % ' AND '.join(conditions or ['1 = 1'])
+    if isinstance(node, ast.UnaryOp):
+        return '(NOT %s)' % get_sql_expression(
+            database, node.operand, predicates, numerical,
+            messages, md_factors)
+    operator = ' AND ' if isinstance(node.op, ast.And) else ' OR '
+    return '(%s)' % operator.join(get_sql_expression(
+        database, value, predicates, numerical, messages, md_factors)
+                                  for value in node.values)
+
+
+def apply_sql_step_criteria(database: dict, criteria: dict,
+                            numerical: list, messages: list,
+                            flowcharts: dict, step: str,
+                            input_condition: str, md_factors: dict) -> str:
+    """Count the samples passing the successive criteria of
+    the current step, in a single query to the database.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    step : str
+        The type of criterion to apply (init, filter, add, no_nan).
+    input_condition : str
+        SQL condition of the samples that are input to the current step.
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+
+    Returns
+    -------
+    included_condition : str
+        SQL condition of the samples included after the current step.
+    """
+    names, conditions = [], []
+    for (var, index), values in criteria[step].items():
+        condition = get_sql_condition(
+            database, var, index, values, numerical, messages,
+            md_factors, criteria.get('predicates'))
+        if condition is None:
+            continue
+        names.append((get_criterion_name(var, index), var, index, values))
+        conditions.append(condition)
+
+    # the count after each criterion is the count of the samples
+    # passing this criterion and all the previous ones
+    counts = ['COUNT(*)']
+    for idx in range(len(conditions)):
+        counts.append('SUM(CASE WHEN %s THEN 1 ELSE 0 END)' % ' AND '.join(
+            conditions[:(idx + 1)]))
+    counts = [int(x or 0) for x in get_query_rows(
+        database, 'SELECT %s FROM %s WHERE %s' % (
+            ', '.join(counts), database['table'], input_condition))[0]]
+
+    flowchart = []
+    if conditions:
+        flowchart.append(['%s metadata' % step, counts[0], None, None, None])
+    for (cur_name, var, index, values), count in zip(names, counts[1:]):
+        flowchart.append([cur_name, count, str(var),
+                          '\n'.join(map(str, values)), str(index)])
+    flowcharts[step] = flowchart
+    included_condition = ' AND '.join([input_condition] + conditions)
+    return '(%s)' % included_condition
+
+
+def apply_sql_criteria(database: dict, criteria: dict, numerical: list,
+                       messages: list, md_factors: dict) -> tuple:
+    """Apply filtering criteria inside the database, in one query per step.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    numerical : list
+        Metadata variables that are numeric.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+
+    Returns
+    -------
+    flowcharts : dict
+        Steps of the workflow with samples counts (simpler representation).
+    conditions : dict
+        filter  = SQL condition of the finally included samples.
+        add     = SQL condition of the samples re-added (None if no "add").
+    """
+    flowcharts = {}
+    init_condition = '1 = 1'
+    if 'init' in criteria:
+        init_condition = apply_sql_step_criteria(
+            database, criteria, numerical, messages, flowcharts, 'init',
+            init_condition, md_factors)
+
+    add_condition = None
+    if 'add' in criteria:
+        add_condition = apply_sql_step_criteria(
+            database, criteria, numerical, messages, flowcharts, 'add',
+            init_condition, md_factors)
+
+    nan_condition = init_condition
+    if 'no_nan' in criteria:
+        nan_condition = apply_sql_step_criteria(
+            database, criteria, numerical, messages, flowcharts, 'no_nan',
+            init_condition, md_factors)
+
+    filter_condition = nan_condition
+    if 'filter' in criteria:
+        filter_condition = apply_sql_step_criteria(
+            database, criteria, numerical, messages, flowcharts, 'filter',
+            nan_condition, md_factors)
+
+    if add_condition is not None:
+        included_count, add_count, common_count = [
+            int(x or 0) for x in get_query_rows(
+                database, 'SELECT SUM(CASE WHEN %s OR %s THEN 1 ELSE 0 END), '
+                          'SUM(CASE WHEN %s THEN 1 ELSE 0 END), '
+                          'SUM(CASE WHEN %s AND %s THEN 1 ELSE 0 END) '
+                          'FROM %s' % (
+                    filter_condition, add_condition, add_condition,
+                    filter_condition, add_condition, database['table']))[0]]
+    if add_condition is not None and add_count:
+        if common_count:
+            messages.append(
+                '%s samples not removed by criteria of "init"/"filter" steps re-added by '
+                'criteria of "add" step (not to worry: duplicates are dropped).' % common_count
+            )
+        flowcharts.setdefault('filter', []).append([
+            '"add" samples',
+            included_count,
+            'adding %s samples' % (add_count - common_count),
+            '(see "add" criteria)',
+            None
+        ])
+    else:
+        add_condition = None
+    conditions = {'filter': filter_condition, 'add': add_condition}
+    return flowcharts, conditions
+
+
+def get_sql_query(database: dict, condition: str) -> str:
+    """Write the query selecting the samples passing a condition."""
+    return 'SELECT %s FROM %s WHERE %s' % (
+        ', '.join(quote_name(x) for x in [database['index']] + database[
+            'columns']), database['table'], condition)
+
+
+def get_sql_included_condition(conditions: dict) -> str:
+    """Write the condition of the finally included or re-added samples.
+
+    Parameters
+    ----------
+    conditions : dict
+        SQL conditions of the finally included and of the re-added samples.
+
+    Returns
+    -------
+    condition : str
+        SQL condition of the included samples (each sample only once).
+    """
+    condition = get_sql_safe(conditions['filter'])
+    if conditions['add'] is not None:
+        condition = '%s OR %s' % (condition, get_sql_safe(conditions['add']))
+    return condition
+
+
+def get_sql_included(database: dict, conditions: dict,
+                     md_types: dict = None) -> pd.DataFrame:
+    """Fetch the metadata of the included samples only.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    conditions : dict
+        SQL conditions of the finally included and of the re-added samples.
+    md_types : dict
+        Dtypes of the variables (the fetched types if None).
+
+    Returns
+    -------
+    included : pd.DataFrame
+        Metadata for the included samples only.
+    """
+    query = get_sql_query(database, get_sql_included_condition(conditions))
+    chunks = list(get_query_chunks(database, query))
+    if chunks:
+        included = pd.concat(chunks)
+    else:
+        included = pd.DataFrame(columns=[database['index']] + database[
+            'columns'])
+    if md_types is not None:
+        included = set_sql_types(included, md_types)
+    included[database['index']] = included[database['index']].astype(str)
+    included = included.rename(
+        columns={database['index']: 'sample_name'}).set_index('sample_name')
+    return included
+
+
+def write_sql_excluded(database: dict, conditions: dict, o_excluded: str,
+                       md_types: dict = None) -> int:
+    """Write the metadata for the excluded samples, by chunks of samples.
+
+    Parameters
+    ----------
+    database : dict
+        Connection and metadata table of the database.
+    conditions : dict
+        SQL conditions of the finally included and of the re-added samples.
+    o_excluded : str
+        Path to output metadata for the excluded samples only.
+    md_types : dict
+        Dtypes of the variables (the fetched types if None).
+
+    Returns
+    -------
+    n_excluded : int
+        Number of excluded samples.
+    """
+    n_excluded = 0
+    query = get_sql_query(database, 'NOT (%s)' % get_sql_included_condition(
+        conditions))
+    for chunk in get_query_chunks(database, query):
+        if md_types is not None:
+            chunk = set_sql_types(chunk, md_types)
+        chunk = chunk.rename(columns={database['index']: 'sample_name'})
+        chunk.to_csv(o_excluded, index=False, sep='\t',
+                     mode='a' if n_excluded else 'w', header=not n_excluded)
+        n_excluded += chunk.shape[0]
+    return n_excluded
+
+
+def get_sql_criteria(criteria_dict: dict, database: dict, nulls: list,
+                     messages: list, md_factors: dict = None) -> tuple:
+    """Check the criteria against the factors counted in the database.
+
+    Parameters
+    ----------
+    criteria_dict : dict
+        Content of the yml criteria file.
+    database : dict
+        Connection and metadata table of the database.
+    nulls : list
+        Factors to be interpreted as np.nan.
+    messages : list
+        Message to print in case of error.
+    md_factors : dict
+        Per-column factors already counted (those of the variables used
+        by the criteria are counted if None).
+
+    Returns
+    -------
+    criteria : dict
+        Inclusion/exclusion criteria to apply.
+    md_factors : dict
+        Per-column factors of the variables used by the criteria.
+    numerical : list
+        Variables used by the criteria that are numeric.
+    """
+    criteria_dict = drop_ids_criteria(
+        criteria_dict, messages, 'not supported on a database')
+    if md_factors is None:
+        md_factors = get_sql_factors(
+            database, get_criteria_variables(criteria_dict))
+    # the samples names are not a metadata variable in the database
+    index_pd = pd.DataFrame(index=pd.Index([], name=database['index']))
+    criteria = check_criteria(
+        criteria_dict, index_pd, nulls, messages, md_factors)
+    numerical = get_sql_numerical(md_factors, nulls)
+    return criteria, md_factors, numerical
@@ -0,0 +1,165 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from os.path import splitext
+
+from Xclusion_criteria.xclusion_factors import get_factors
+
+
+def get_strata_path(o_included: str, var: str) -> str:
+    """Get the path to the stratified flowchart table of a variable,
+    next to the metadata for the included samples.
+
+    Parameters
+    ----------
+    o_included : str
+        Path to output metadata for the included samples only.
+    var : str
+        Metadata variable defining the strata.
+
+    Returns
+    -------
+    o_strata : str
+        Path to the stratified flowchart table.
+    """
+    return '%s_flowchart_by_%s.tsv' % (splitext(o_included)[0], var)
+
+
+def get_strata_codes(var: str, metadata: pd.DataFrame,
+                     md_factors: dict) -> tuple:
+    """Get the stratum of each sample, i.e. its value for the variable.
+
+    Parameters
+    ----------
+    var : str
+        Metadata variable defining the strata.
+    metadata : pd.DataFrame
+        Metadata table.
+    md_factors : dict
+        Per-column factors of the metadata table.
+
+    Returns
+    -------
+    codes : np.ndarray
+        Position of each sample's stratum in the strata.
+    strata : list
+        Names of the strata (the missing values are the last stratum).
+    """
+    var_factors = get_factors(var, metadata, md_factors)
+    strata = [str(x) for x in var_factors['uniques']]
+    codes = var_factors['codes'].copy()
+    if var_factors['nans']:
+        codes[codes < 0] = len(strata)
+        strata.append('nan')
+    return codes, strata
+
+
+def get_step_strata(masks: list, input_mask: np.ndarray, codes: np.ndarray,
+                    n_strata: int) -> np.ndarray:
+    """Count the samples of each stratum input to a step and remaining
+    after each of its criteria, in a single group-by.
+
+    Each sample is counted in all the rows of the step's flowchart before
+    the first criterion that it fails: the samples are grouped by this
+    depth and stratum, and the counts are cumulated from the last row.
+
+    Parameters
+    ----------
+    masks : list
+        Samples passing each criterion of the step.
+    input_mask : np.ndarray
+        Samples input to the step.
+    codes : np.ndarray
+        Position of each sample's stratum in the strata.
+    n_strata : int
+        Number of strata.
+
+    Returns
+    -------
+    counts : np.ndarray
+        Number of samples per stratum (columns) input to the step
+        (first row) and remaining after each criterion (next rows).
+    """
+    depth = np.full(input_mask.size, len(masks), dtype=np.int32)
+    for pos in range(len(masks) - 1, -1, -1):
+        depth[~masks[pos]] = pos
+    keys = depth[input_mask].astype(np.int64) * n_strata + codes[input_mask]
+    counts = np.bincount(
+        keys, minlength=(len(masks) + 1) * n_strata).reshape(-1, n_strata)
+    return counts[::-1].cumsum(axis=0)[::-1]
+
+
+def get_strata_flowchart(criteria_masks: list, codes: np.ndarray,
+                         strata: list) -> pd.DataFrame:
+    """Get the flowchart counts of each step per stratum.
+
+    The steps are chained as in get_criteria_masks: "add" and "no_nan"
+    apply on the samples included by "init", and "filter" on those
+    remaining after "no_nan", to which the "add" samples are re-added.
+
+    Parameters
+    ----------
+    criteria_masks : list
+        Step, name and mask of each criterion (in the flowchart order).
+    codes : np.ndarray
+        Position of each sample's stratum in the strata.
+    strata : list
+        Names of the strata.
+
+    Returns
+    -------
+    strata_pd : pd.DataFrame
+        One row per row of the flowcharts (step, criterion) and one
+        column per stratum, with its number of samples.
+    """
+    steps = {}
+    for step, name, mask in criteria_masks:
+        steps.setdefault(step, []).append((name, mask))
+
+    rows, counts = [], []
+    all_mask = np.ones(codes.size, dtype=bool)
+    step_masks = {}
+    for step in ['init', 'add', 'no_nan', 'filter']:
+        if step not in steps:
+            continue
+        if step == 'init':
+            input_mask = all_mask
+        elif step == 'filter':
+            input_mask = step_masks.get(
+                'no_nan', step_masks.get('init', all_mask))
+        else:
+            input_mask = step_masks.get('init', all_mask)
+        names, masks = zip(*steps[step])
+        step_counts = get_step_strata(
+            list(masks), input_mask, codes, len(strata))
+        step_mask = input_mask.copy()
+        for mask in masks:
+            step_mask &= mask
+        step_masks[step] = step_mask
+        rows.extend([(step, '%s metadata' % step)] +
+                    [(step, name) for name in names])
+        counts.append(step_counts)
+
+    # as in add_step_counts, only if samples are re-added
+    if 'add' in step_masks and step_masks['add'].any():
+        filter_mask = step_masks.get('filter', step_masks.get(
+            'no_nan', step_masks.get('init', all_mask)))
+        included_mask = filter_mask | step_masks['add']
+        rows.append(('filter', '"add" samples'))
+        counts.append(np.bincount(
+            codes[included_mask], minlength=len(strata))[None, :])
+
+    strata_pd = pd.DataFrame(rows, columns=['step', 'criterion'])
+    if counts:
+        counts_pd = pd.DataFrame(np.vstack(counts), columns=strata)
+    else:
+        counts_pd = pd.DataFrame(columns=strata, dtype=int)
+    strata_pd = pd.concat([strata_pd, counts_pd], axis=1)
+    return strata_pd
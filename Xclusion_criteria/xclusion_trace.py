@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_trace(o_trace: str) -> dict:
+    """Initialize the performance trace of the run.
+
+    Parameters
+    ----------
+    o_trace : str
+        Path to the output trace file (no trace if None).
+
+    Returns
+    -------
+    trace : dict
+        Trace events (Chrome trace format) and start time of the run,
+        or None if no trace is requested.
+    """
+    if not o_trace:
+        return None
+    trace = {
+        'traceEvents': [],
+        'displayTimeUnit': 'ms',
+        'start': time.perf_counter()
+    }
+    return trace
+
+
+def get_peak_rss() -> float:
+    """Get the peak resident set size of the process.
+
+    Returns
+    -------
+    peak_rss : float
+        Peak RSS in megabytes (None if it cannot be measured).
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on MacOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return round(peak_rss / 1024 ** 2, 3)
+    return round(peak_rss / 1024, 3)
+
+
+@contextmanager
+def trace_phase(trace: dict, name: str, category: str = 'phase'):
+    """Record the wall time, CPU time and peak memory of a phase, as
+    well as the rows/columns counts filled in the yielded dict.
+
+    Parameters
+    ----------
+    trace : dict
+        Trace events of the run (nothing is recorded if None).
+    name : str
+        Name of the phase (e.g. the function or criterion).
+    category : str
+        Type of phase, e.g. "phase" or "criterion".
+
+    Yields
+    ------
+    args : dict
+        To fill with the phase's counts (e.g. rows_in, rows_out, columns).
+    """
+    args = {}
+    if trace is None:
+        yield args
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    yield args
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    args.update({
+        'wall_s': round(wall, 6),
+        'cpu_s': round(cpu, 6),
+        'peak_rss_mb': get_peak_rss()
+    })
+    timestamp = (wall_start - trace['start']) * 1e6
+    trace['traceEvents'].append({
+        'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(),
+        'tid': 0, 'ts': round(timestamp, 3), 'dur': round(wall * 1e6, 3),
+        'args': args
+    })
+    if args['peak_rss_mb'] is not None:
+        trace['traceEvents'].append({
+            'name': 'peak RSS (MB)', 'ph': 'C', 'pid': os.getpid(),
+            'ts': round(timestamp + wall * 1e6, 3),
+            'args': {'peak_rss_mb': args['peak_rss_mb']}
+        })
+
+
+def write_trace(trace: dict, o_trace: str) -> None:
+    """Write the trace events in a JSON file that can be
+    opened in chrome://tracing or https://ui.perfetto.dev.
+
+    Parameters
+    ----------
+    trace : dict
+        Trace events of the run.
+    o_trace : str
+        Path to the output trace file.
+    """
+    if trace is None:
+        return
+    with open(o_trace, 'w') as o:
+        json.dump({'traceEvents': trace['traceEvents'],
+                   'displayTimeUnit': trace['displayTimeUnit']}, o, indent=1)
@@ -36,7 +36,8 @@ with open("Xclusion_criteria/__init__.py", "rb") as f:
     hit = _version_re.search(f.read().decode("utf-8")).group(1)
     version = str(ast.literal_eval(hit))
 
-standalone = ['Xclusion_criteria=Xclusion_criteria.scripts._standalone_xclusion:standalone_xclusion']
+standalone = ['Xclusion_criteria=Xclusion_criteria.scripts._standalone_xclusion:standalone_xclusion',
+              'Xclusion_diff=Xclusion_criteria.scripts._standalone_diff:standalone_diff']
 
 setup(
     name="Xclusion_criteria",
@@ -65,7 +66,8 @@ setup(
     classifiers=classifiers,
     package_data={'Xclusion_criteria': ['resources/nulls.txt',
                                         'resources/template.chart.json',
-                                        'resources/template.text.html']},
+                                        'resources/template.text.html',
+                                        'benchmarks/memory_budgets.yml']},
     entry_points={'console_scripts': standalone},
     python_requires='>=3.6',
 )